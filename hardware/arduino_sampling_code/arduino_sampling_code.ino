@@ -28,11 +28,22 @@
  * This code also responds to commands to configure which analog pins will
  * be sampled (or not)/
  *
+ * For captures longer than fit in memory, this code can instead stream the
+ * samples back in blocks while it carries on sampling (the 'C' command). Each
+ * block is preceded by a sequence number and the local time at which sampling
+ * of the block started, so the receiver can spot any gaps.
+ *
+ * The recorded data can be run-length encoded for the transfer back, if the client
+ * asks for this (the 'E' command). Most of the data is usually identical from one
+ * millisecond to the next (a dark screen, or silence) so this can shrink it a lot.
+ *
  * This code also responds to a command to perform a simple clock synchronisation
  * similar to NTP request-response. When the command is received, the Arduino
  * immediately sends back the Arduino clock time (read from the micros()
  * function), so the sender of the original command can match that up with their
- * own local clock; taking into account the round-trip time.
+ * own local clock; taking into account the round-trip time. It responds to
+ * this command while sampling too (but ignores any other commands until sampling
+ * has finished), so the sender can track any drift between the clocks.
  *
  */
 
@@ -93,6 +104,20 @@ int nMilliBlks;
 #define BLKSIZE_PER_PIN 2
 #define NINETY_KB (90 * 1024)
 
+/* when streaming, the number of 1 millisecond periods in each block sent,
+ * and the sequence number that marks the final record
+ */
+#define STREAM_BLOCK_MILLIS 100
+#define STREAM_END ((unsigned int)(0xffffffff))
+
+/* encodings for the bulk transfer, chosen with the 'E' command
+ */
+#define ENCODING_RAW 0
+#define ENCODING_RLE 1
+#define RLE_MAX_RUN 128
+
+int transferEncoding = ENCODING_RAW;
+
 /* here's our sample buffer, consisting of a sequence of 2-byte blocks ...
  * One block will hold the high and low values found while continuously sampling
  * a pin over a one millisecond period.  One pin's block is stored in ascending char addresses
@@ -117,6 +142,9 @@ void writeUInt(unsigned int x);
 void flashLed(int n);
 void measureUART();
 void prepareToCapture();
+void streamCapture(unsigned int nBlocks);
+void doRleTransfer();
+int rleEncode(int send);
 
 /* ---------------------------------------------------------------------
    arduino code entry points
@@ -159,6 +187,7 @@ void loop() {
   int idx;
   int rcvTime;
   int nSecs;
+  unsigned int nBlocks;
     while (1) {
       if (SerialUSB.available()) {
         /* respond to any command immediately with a local time measurement */
@@ -186,6 +215,18 @@ void loop() {
         case 'T':
         	/* timing command .. handled at top of loop */
            	break;    
+        case 'E':
+            transferEncoding = getCaptureTime();
+            if (transferEncoding != ENCODING_RAW && transferEncoding != ENCODING_RLE) {
+                transferEncoding = ENCODING_RAW;
+            }
+            writeInt(transferEncoding);
+            break;
+        case 'C':
+            nBlocks = getCaptureTime() << 8;
+            nBlocks |= getCaptureTime();
+            streamCapture(nBlocks);
+            break;
         }
        SerialUSB.flush();
      }
@@ -275,6 +316,13 @@ void capture() {
            findHiLo(period);
            now = micros();
         }
+        /* respond to any timing command, once per period */
+        if (SerialUSB.available()) {
+            if (SerialUSB.read() == 'T') {
+                writeInt(micros());
+                SerialUSB.flush();
+            }
+        }
         startOfCurrentPeriod = startOfNextPeriod;
         startOfNextPeriod = startOfCurrentPeriod + 1000;
     }
@@ -287,6 +335,105 @@ void capture() {
  }
 
 
+/**
+ * Sample the ports chosen by client, in the same way as capture(), but send the
+ * samples back in blocks of STREAM_BLOCK_MILLIS periods while sampling continues.
+ *
+ * Two block buffers are used (at the start of rawData): while one is being filled,
+ * the other is sent a byte at a time in between samples. Each block is preceded by
+ * its sequence number and the time at which sampling of it started. If the previous block
+ * has not been completely sent by the time the next one has been filled, sampling
+ * pauses until it has. The next block then starts late, which the client can see from
+ * its start time.
+ *
+ * Streaming stops after nBlocks blocks, or (if nBlocks is zero) when the 'X' command
+ * is received. The final record has sequence number STREAM_END, followed by the time
+ * sampling finished and the number of blocks sent.
+ *
+ * @param nBlocks number of blocks to stream, or 0 to stream until told to stop
+**/
+void streamCapture(unsigned int nBlocks) {
+
+    nActivePorts = setupActivePortsMapping();
+    if (nActivePorts == 0) {
+        reportFailure();
+        return;
+    }
+    writeInt(nActivePorts);
+    writeInt(STREAM_BLOCK_MILLIS);
+    SerialUSB.flush();
+
+    int blkBytes = STREAM_BLOCK_MILLIS * nActivePorts * BLKSIZE_PER_PIN;
+    unsigned char* filling = rawData;
+    unsigned char* sending = rawData + blkBytes;
+    unsigned char* swap;
+    int nToSend = 0;
+    int nSent = 0;
+    unsigned int seq = 0;
+    int stopRequested = 0;
+
+    /* the stream buffers are only a small part of rawData, so use nMilliBlks to initialise just those */
+    nMilliBlks = STREAM_BLOCK_MILLIS;
+
+    unsigned int startOfNextPeriod = micros();
+
+    while (!stopRequested && (nBlocks == 0 || seq < nBlocks)) {
+        unsigned int blockStart = startOfNextPeriod;
+        unsigned char* save = rawData;
+
+        rawData = filling;
+        initLoHi();
+        for (int period=0; period < STREAM_BLOCK_MILLIS; period++) {
+            startOfNextPeriod = startOfNextPeriod + 1000;
+            unsigned int now = micros();
+            while (((startOfNextPeriod - now) & UINT_32_MAX) < UINT_32_NEG) {
+                findHiLo(period);
+                if (nSent < nToSend) {
+                    SerialUSB.write(sending[nSent++]);
+                }
+                now = micros();
+            }
+        }
+        rawData = save;
+
+        /* finish sending the previous block, if we didn't manage to in between samples */
+        while (nSent < nToSend) {
+            SerialUSB.write(sending[nSent++]);
+        }
+        writeUInt(seq);
+        writeUInt(blockStart);
+        swap = filling;
+        filling = sending;
+        sending = swap;
+        nToSend = blkBytes;
+        nSent = 0;
+        seq++;
+
+        /* if we fell behind by a whole period or more, restart the schedule from now */
+        unsigned int lateBy = (micros() - startOfNextPeriod) & UINT_32_MAX;
+        if (lateBy < UINT_32_NEG && lateBy >= 1000) {
+            startOfNextPeriod += lateBy;
+        }
+
+        while (SerialUSB.available()) {
+            if (SerialUSB.read() == 'X') {
+                stopRequested = 1;
+            }
+        }
+    }
+
+    while (nSent < nToSend) {
+        SerialUSB.write(sending[nSent++]);
+    }
+    writeUInt(STREAM_END);
+    writeUInt(micros());
+    writeUInt(seq);
+    SerialUSB.flush();
+
+    doinit();
+}
+
+
 /**
  * initialise entire raw data area.
 **/
@@ -355,10 +502,14 @@ int setupActivePortsMapping() {
  * send samples back to client
 **/
 void doBulkTransfer() {
-    int nbytes = nMilliBlks * nActivePorts * BLKSIZE_PER_PIN;
-    writeUInt(nbytes);
-    for (int i=0; i < nbytes; i++) {
-        SerialUSB.write(rawData[i]);
+    if (transferEncoding == ENCODING_RLE) {
+        doRleTransfer();
+    } else {
+        int nbytes = nMilliBlks * nActivePorts * BLKSIZE_PER_PIN;
+        writeUInt(nbytes);
+        for (int i=0; i < nbytes; i++) {
+            SerialUSB.write(rawData[i]);
+        }
     }
     SerialUSB.flush();
     
@@ -368,6 +519,78 @@ void doBulkTransfer() {
  }
 
 
+/**
+ * send samples back to client, run-length encoded. First the number of encoded bytes is sent,
+ * then the size of a millisecond block, then the encoded bytes.
+**/
+void doRleTransfer() {
+    writeUInt(rleEncode(0));
+    writeUInt(nActivePorts * BLKSIZE_PER_PIN);
+    rleEncode(1);
+}
+
+/**
+ * return non zero if millisecond blocks a and b hold the same values
+**/
+int sameBlock(int a, int b) {
+    int blkSize = nActivePorts * BLKSIZE_PER_PIN;
+    return memcmp(rawData + a * blkSize, rawData + b * blkSize, blkSize) == 0;
+}
+
+/**
+ * write millisecond blocks first to (last - 1) to the client
+**/
+void writeBlocks(int first, int last) {
+    int blkSize = nActivePorts * BLKSIZE_PER_PIN;
+    for (int i = first * blkSize; i < last * blkSize; i++) {
+        SerialUSB.write(rawData[i]);
+    }
+}
+
+/**
+ * run-length encode the sample data. The data is a sequence of runs of millisecond blocks.
+ * Each run starts with a header byte:
+ *   0x80 + (n-1) ... the following block is repeated n times
+ *   (n-1)        ... the following n blocks are included as they are
+ * where n is 1 to RLE_MAX_RUN.
+ *
+ * @param send if zero, just work out the length of the encoded data. Otherwise send it to the client.
+ * @return the number of bytes of encoded data
+**/
+int rleEncode(int send) {
+    int blkSize = nActivePorts * BLKSIZE_PER_PIN;
+    int nbytes = 0;
+    int i = 0;
+    while (i < nMilliBlks) {
+        int r = 1;
+        while (i + r < nMilliBlks && r < RLE_MAX_RUN && sameBlock(i, i + r)) {
+            r++;
+        }
+        if (r >= 2) {
+            if (send) {
+                SerialUSB.write(0x80 | (r - 1));
+                writeBlocks(i, i + 1);
+            }
+            nbytes += 1 + blkSize;
+            i += r;
+        } else {
+            /* run of blocks up to (but not including) the next one that starts a repeat */
+            int j = i + 1;
+            while (j < nMilliBlks && j - i < RLE_MAX_RUN && !(j + 1 < nMilliBlks && sameBlock(j, j + 1))) {
+                j++;
+            }
+            if (send) {
+                SerialUSB.write(j - i - 1);
+                writeBlocks(i, j);
+            }
+            nbytes += 1 + (j - i) * blkSize;
+            i = j;
+        }
+    }
+    return nbytes;
+}
+
+
 /* ---------------------------------------------------------------------
    Serial data writing
    ---------------------------------------------------------------------
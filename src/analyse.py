@@ -55,6 +55,14 @@ If the pattern for the time differences is sloping, this indicates wall clock dr
 
 """
 
+import instrumentation
+
+
+class DubiousInput(Exception):
+
+    def __init__(self, value):
+        super(DubiousInput, self).__init__(value)
+
 
 
 def variance(dataset):
@@ -148,10 +156,12 @@ def correlate(expected, observed):
     # now look for the set of observed timings against each
     # possible starting point.  Each loop traversal, observed[0] will be compared against
     # expected[where]. observed[1] against expected[where+1]
-    for where in range(0, lastPossible + 1):
-        variance, diffsAndErrors = varianceInTimesWithObservedComparedAgainstExpectedAtIndex(where, expected, observed)
-        timeDifferencesAndErrorsAtIndices.append(diffsAndErrors)
-        varianceAtEachIndex.append((variance, where))
+    with instrumentation.span("analyse.correlate"):
+        for where in range(0, lastPossible + 1):
+            variance, diffsAndErrors = varianceInTimesWithObservedComparedAgainstExpectedAtIndex(where, expected, observed)
+            timeDifferencesAndErrorsAtIndices.append(diffsAndErrors)
+            varianceAtEachIndex.append((variance, where))
+    instrumentation.count("analyse.offsetsScanned", lastPossible + 1)
         
     (lowestVariance, index) = min(varianceAtEachIndex)
     return (index, timeDifferencesAndErrorsAtIndices)
@@ -189,6 +199,33 @@ def doComparison(test, startSyncTime, tickRate):
 
 
 
+def compareChannel(channel, videoStartTicks, tickRate):
+    """\
+    Compare the observed and expected times for one pin (see :func:`doComparison`), with the results
+    normalised to be in units of seconds since the start of the test video sequence.
+
+    :param channel: dict with keys "observed" (list of tuples of (observed time (sync time line units), error bound))
+        and "expected" (list of expected times, in seconds)
+    :param videoStartTicks: the sync time line value at the start of the test video sequence
+    :param tickRate: the number of ticks per second for the sync time line
+
+    :returns tuple (index into expected times at which the strongest correlation is found,
+        list of expected times in seconds, list of (diff, err) in seconds for the best match)
+    :raise DubiousInput: if there are more observed times than expected times, or no observed times at all
+    """
+    if len(channel["observed"]) > len(channel["expected"]) or len(channel["observed"]) == 0:
+        raise DubiousInput("poor data or no data")
+
+    test = (channel["observed"], channel["expected"])
+    matchIndex, expected, diffsAndErrors = doComparison(test, videoStartTicks, tickRate)
+
+    expectedSecs = [ (e - videoStartTicks) / tickRate for e in expected ]
+    diffsAndErrorsSecs = [ (d / tickRate, e / tickRate) for (d, e) in diffsAndErrors ]
+    return (matchIndex, expectedSecs, diffsAndErrorsSecs)
+
+
+
+
 
 def runDetection(detector, channels, dueStartTimeUsecs, dueFinishTimeUsecs):
     """\
@@ -219,7 +256,10 @@ def runDetection(detector, channels, dueStartTimeUsecs, dueFinishTimeUsecs):
         else:
             func = detector.samplesToFlashTimings
         eventDuration = channel["eventDuration"]
-        timings.append({"pinName": channel["pinName"], "observed": func(channel["min"], channel["max"], dueStartTimeUsecs, dueFinishTimeUsecs, eventDuration)})
+        with instrumentation.span("analyse.runDetection"):
+            observed = func(channel["min"], channel["max"], dueStartTimeUsecs, dueFinishTimeUsecs, eventDuration)
+        instrumentation.count("analyse.samplesProcessed", len(channel["min"]))
+        timings.append({"pinName": channel["pinName"], "observed": observed})
     return timings
 
 
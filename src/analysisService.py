@@ -0,0 +1,505 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+An HTTP service that analyses captures, so that test rigs only need to capture,
+while the analysis is done on a shared server.
+
+A capture is submitted as a session file (as saved with the `--saveSession` option
+of the testers, see :mod:`sessionFile`), which holds the samples and the clock
+synchronisation data. The expected timings are either those stored in the session,
+or are read from metadata files (as written by the test sequence generator) in the
+service's metadata directory, referred to by name. Metadata files are cached between jobs.
+
+Each submission becomes a job, which waits in a bounded queue until one of a pool
+of worker processes is free to run detection and comparison. If the queue is full,
+the submission is refused, and should be retried later.
+
+HTTP endpoints:
+
+* `POST /jobs` ... submit a session file as the body of the request. Query parameters are optional:
+  `toleranceMillis` (do a pass/fail test against this tolerance) and `light0`, `light1`, `audio0`, `audio1`
+  (the name of the metadata file giving the expected timings for that pin). Responds 202 with the job
+  (see :meth:`AnalysisService.submit`), 400 if the request is not valid, or 503 if the queue is full.
+* `GET /jobs` ... list all jobs, without their results
+* `GET /jobs/<id>` ... the status of a job, and its result once it has finished (404 if there is no such job)
+* `GET /status` ... the state of the queue, the workers and the metadata cache
+
+All responses are JSON. The result of a job is a JSON object with keys "channels" (a list of results per pin,
+see :func:`analyseSessionFile`) and "passed" (None if no tolerance test was requested, otherwise whether
+all pins passed).
+
+Requires 'cherrypy' (for the HTTP endpoints) and 'numpy' (for reading session files).
+
+
+Usage
+-----
+
+.. code-block:: bash
+
+    $ python src/analysisService.py --metadataDir metadata --workers 4 --port 7682
+
+    $ curl --data-binary @session.zip -H "Content-Type: application/zip" \\
+           "http://localhost:7682/jobs?toleranceMillis=10&light0=metadata.json"
+    $ curl http://localhost:7682/jobs/1
+
+Or from python, without the HTTP endpoints:
+
+.. code-block:: python
+
+    service = AnalysisService(workers=4, metadataDir="metadata")
+    job = service.submit(open("session.zip", "rb").read(), { "LIGHT_0" : "metadata.json" }, toleranceSecs=0.01)
+    ...
+    print(service.job(job["id"])["result"])
+    service.close()
+
+"""
+
+import collections
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+
+import headless
+import lazyImport
+
+cherrypy = lazyImport.LazyModule("cherrypy", package="cherrypy")
+
+
+DEFAULT_PORT = 7682
+DEFAULT_MAX_QUEUED = 16
+DEFAULT_MAX_CACHED_METADATA = 32
+DEFAULT_MAX_FINISHED_JOBS = 1000
+DEFAULT_MAX_BODY_MB = 256
+
+# query parameters naming the metadata file for each pin (as for the options of the testers)
+PIN_PARAMETERS = {
+    "light0" : "LIGHT_0",
+    "light1" : "LIGHT_1",
+    "audio0" : "AUDIO_0",
+    "audio1" : "AUDIO_1",
+}
+
+
+
+class QueueFull(Exception):
+
+    def __init__(self, value):
+        super(QueueFull, self).__init__(value)
+
+
+
+class MetadataCache(object):
+
+    def __init__(self, directory, maxEntries=DEFAULT_MAX_CACHED_METADATA):
+        """\
+        Cache of the expected timings read from metadata files. A file is read again if it changes.
+        Can be used from any thread.
+
+        :param directory: the directory metadata files are read from, or None if there is none
+        :param maxEntries: the number of files to keep. The least recently used is discarded first.
+        """
+        super(MetadataCache, self).__init__()
+        self.directory = directory
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def get(self, name):
+        """\
+        :param name: the name of a metadata file in the directory
+        :returns: dict with keys "eventCentreTimes", "approxBeepDurationSecs" and "approxFlashDurationSecs"
+        :raises ValueError: if there is no metadata directory, the name is not that of a file in it, or the file
+            cannot be read or is not metadata
+        """
+        if self.directory is None:
+            raise ValueError("No metadata directory, so metadata file "+repr(name)+" cannot be used.")
+        if not name or os.path.basename(name) != name or name.startswith("."):
+            raise ValueError("Not a valid metadata file name: "+repr(name))
+        filename = os.path.join(self.directory, name)
+        try:
+            modified = os.stat(filename).st_mtime
+        except OSError:
+            raise ValueError("No such metadata file: "+repr(name))
+
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[0] == modified:
+                self._entries.move_to_end(name)
+                self.hits += 1
+                return entry[1]
+
+        try:
+            with open(filename) as f:
+                contents = json.load(f)
+            metadata = dict( (key, contents[key]) for key in [ "eventCentreTimes", "approxBeepDurationSecs", "approxFlashDurationSecs" ] )
+        except (IOError, ValueError, KeyError, TypeError) as e:
+            raise ValueError("Could not read metadata file "+repr(name)+": "+str(e))
+
+        with self._lock:
+            self.misses += 1
+            self._entries[name] = (modified, metadata)
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(last=False)
+        return metadata
+
+
+    def snapshot(self):
+        """\
+        :returns: dict with keys "entries", "maxEntries", "hits" and "misses"
+        """
+        with self._lock:
+            return { "entries" : len(self._entries), "maxEntries" : self.maxEntries, "hits" : self.hits, "misses" : self.misses }
+
+
+
+def analyseSessionFile(filename, pinMetadata=None, toleranceSecs=None):
+    """\
+    Run detection and comparison for a session file. This is what the worker processes run for each job.
+
+    :param filename: name of the session file
+    :param pinMetadata: None, or dict mapping pin names to metadata (see :meth:`MetadataCache.get`) to take the
+        expected timings from, instead of those stored in the session
+    :param toleranceSecs: None, or a tolerance (in seconds) to test against
+    :returns: dict with keys "channels" and "passed". Each channel is either a summary (see
+        :func:`headless.summariseChannel`) with the addition of "matchIndex" and "observed" (list of [time, errorBound]
+        of each flash/beep detected, in ticks of the sync timeline), or a dict with keys "pinName" and "error".
+    """
+    # only imported when needed, because it needs numpy
+    import sessionFile
+
+    session = sessionFile.loadSession(filename)
+    header = session.header
+    for entry in header["channels"]:
+        metadata = (pinMetadata or {}).get(entry["pinName"])
+        if metadata is not None:
+            header["expectedTimings"][entry["pinName"]] = metadata["eventCentreTimes"]
+            header["eventDurations"][entry["pinName"]] = metadata["approxBeepDurationSecs" if entry["isAudio"] else "approxFlashDurationSecs"]
+
+    missing = [ entry["pinName"] for entry in header["channels"] if entry["pinName"] not in header["expectedTimings"] ]
+    if missing:
+        raise ValueError("No expected timings for: "+", ".join(missing)+". Name a metadata file for each.")
+
+    channels = []
+    for result in session.compare():
+        if "error" in result:
+            channels.append({ "pinName" : result["pinName"], "error" : result["error"] })
+            continue
+        summary = headless.summariseChannel(result["pinName"], result["matchIndex"], result["expectedSecs"], result["diffsAndErrors"], toleranceSecs)
+        summary["matchIndex"] = result["matchIndex"]
+        summary["observed"] = [ [t, err] for t, err in result["observed"] ]
+        channels.append(summary)
+    return { "channels" : channels, "passed" : headless.overallPassed(channels, toleranceSecs) }
+
+
+
+class AnalysisService(object):
+
+    def __init__(self, workers=None, maxQueued=DEFAULT_MAX_QUEUED, metadataDir=None, maxCachedMetadata=DEFAULT_MAX_CACHED_METADATA, \
+                 maxFinishedJobs=DEFAULT_MAX_FINISHED_JOBS):
+        """\
+        Queues analysis jobs and runs them on a pool of worker processes. Can be used from any thread.
+
+        :param workers: number of worker processes, None for one per CPU, or 0 to run jobs in this process
+            (one at a time, which is only useful for testing)
+        :param maxQueued: number of jobs that can wait for a worker. Further jobs are refused until one starts.
+        :param metadataDir: None, or the directory that metadata files named in jobs are read from
+        :param maxCachedMetadata: see :class:`MetadataCache`
+        :param maxFinishedJobs: number of finished jobs to keep the results of. The oldest are discarded first.
+        """
+        super(AnalysisService, self).__init__()
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.workers = workers
+        self.maxQueued = maxQueued
+        self.maxFinishedJobs = maxFinishedJobs
+        self.metadataCache = MetadataCache(metadataDir, maxCachedMetadata)
+
+        self._lock = threading.Lock()
+        self._jobs = collections.OrderedDict()
+        self._finished = collections.deque()
+        self._nextId = 1
+        self._counts = { "submitted" : 0, "refused" : 0, "done" : 0, "failed" : 0 }
+        self._queue = queue.Queue(maxQueued)
+        self._dir = tempfile.mkdtemp(prefix="analysisService")
+        self._pool = multiprocessing.Pool(workers) if workers > 0 else None
+
+        self._threads = []
+        for i in range(0, max(1, workers)):
+            thread = threading.Thread(target=self._dispatch, name="analysisService-%d" % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+
+    def submit(self, sessionData, pinMetadataNames=None, toleranceSecs=None):
+        """\
+        Queue a job to analyse a session file.
+
+        :param sessionData: the contents of the session file (bytes)
+        :param pinMetadataNames: None, or dict mapping pin names to the names of metadata files in the metadata directory,
+            to take the expected timings from instead of those stored in the session
+        :param toleranceSecs: None, or a tolerance (in seconds) to test against
+        :returns: the job (see :meth:`job`)
+        :raises ValueError: if a metadata file cannot be read
+        :raises QueueFull: if there are already as many jobs waiting as the queue can hold
+        """
+        pinMetadata = dict( (pinName, self.metadataCache.get(name)) for pinName, name in (pinMetadataNames or {}).items() )
+
+        with self._lock:
+            jobId = self._nextId
+            self._nextId += 1
+        filename = os.path.join(self._dir, "%d.zip" % jobId)
+        with open(filename, "wb") as f:
+            f.write(sessionData)
+
+        job = {
+            "id" : jobId,
+            "status" : "queued",
+            "submitted" : time.time(),
+            "started" : None,
+            "finished" : None,
+            "toleranceSecs" : toleranceSecs,
+            "metadata" : dict(pinMetadataNames or {}),
+            "result" : None,
+            "error" : None,
+        }
+        with self._lock:
+            try:
+                self._queue.put_nowait((job, filename, pinMetadata))
+            except queue.Full:
+                self._counts["refused"] += 1
+                os.remove(filename)
+                raise QueueFull("Too many jobs are waiting (%d). Try again later." % self.maxQueued)
+            self._jobs[jobId] = job
+            self._counts["submitted"] += 1
+            return dict(job)
+
+
+    def job(self, jobId):
+        """\
+        :returns: None if there is no such job, otherwise a dict describing it, with keys "id", "status" ("queued",
+            "running", "done" or "failed"), "submitted", "started", "finished" (see :func:`time.time`, or None),
+            "toleranceSecs", "metadata" (the metadata file names given for each pin), "result" (see
+            :func:`analyseSessionFile`, once done) and "error" (why it failed, or None)
+        """
+        with self._lock:
+            job = self._jobs.get(jobId)
+            return None if job is None else dict(job)
+
+
+    def jobs(self):
+        """\
+        :returns: list of all jobs (see :meth:`job`), oldest first, without their results
+        """
+        with self._lock:
+            return [ dict(job, result=None) for job in self._jobs.values() ]
+
+
+    def status(self):
+        """\
+        :returns: dict with keys "workers", "maxQueued", "queued", "running", counts of jobs "submitted", "refused",
+            "done" and "failed", and "metadataCache" (see :meth:`MetadataCache.snapshot`)
+        """
+        with self._lock:
+            status = dict(self._counts)
+            status["workers"] = self.workers
+            status["maxQueued"] = self.maxQueued
+            status["queued"] = sum(1 for job in self._jobs.values() if job["status"] == "queued")
+            status["running"] = sum(1 for job in self._jobs.values() if job["status"] == "running")
+        status["metadataCache"] = self.metadataCache.snapshot()
+        return status
+
+
+    def wait(self, jobId, timeoutSecs=None):
+        """\
+        Wait for a job to finish.
+
+        :returns: the job (see :meth:`job`), or None if there is no such job
+        """
+        timeout = None if timeoutSecs is None else time.time() + timeoutSecs
+        while True:
+            job = self.job(jobId)
+            if job is None or job["status"] in ("done", "failed") or (timeout is not None and time.time() >= timeout):
+                return job
+            time.sleep(0.01)
+
+
+    def close(self):
+        """\
+        Stop the worker processes. Jobs that have not finished are abandoned.
+        """
+        for thread in self._threads:
+            self._queue.put(None)
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+
+    def _dispatch(self):
+        # runs on each dispatching thread: takes the next job off the queue and waits while a worker runs it
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            job, filename, pinMetadata = item
+            with self._lock:
+                job["status"] = "running"
+                job["started"] = time.time()
+            try:
+                args = (filename, pinMetadata, job["toleranceSecs"])
+                if self._pool is None:
+                    result = analyseSessionFile(*args)
+                else:
+                    result = self._pool.apply(analyseSessionFile, args)
+                status, error = "done", None
+            except Exception as e:
+                result, status, error = None, "failed", "%s: %s" % (type(e).__name__, e)
+            finally:
+                if os.path.exists(filename):
+                    os.remove(filename)
+
+            with self._lock:
+                job["status"] = status
+                job["result"] = result
+                job["error"] = error
+                job["finished"] = time.time()
+                self._counts[status] += 1
+                self._finished.append(job["id"])
+                while len(self._finished) > self.maxFinishedJobs:
+                    del self._jobs[self._finished.popleft()]
+
+
+
+class HttpRoot(object):
+
+    def __init__(self, service):
+        """\
+        The HTTP endpoints (see module documentation), to be mounted in cherrypy (see :func:`serve`).
+
+        :param service: the :class:`AnalysisService`
+        """
+        super(HttpRoot, self).__init__()
+        self.service = service
+
+
+    def _json(self, value, status=200):
+        cherrypy.response.status = status
+        cherrypy.response.headers["Content-Type"] = "application/json"
+        return json.dumps(value).encode("utf-8")
+
+
+    def jobs(self, jobId=None, **params):
+        method = cherrypy.request.method
+        if jobId is None and method == "POST":
+            return self._submit(params)
+        if method != "GET":
+            return self._json({ "error" : "Method not allowed" }, 405)
+        if jobId is None:
+            return self._json(self.service.jobs())
+        try:
+            job = self.service.job(int(jobId))
+        except ValueError:
+            job = None
+        if job is None:
+            return self._json({ "error" : "No such job" }, 404)
+        return self._json(job)
+    jobs.exposed = True
+
+
+    def status(self):
+        return self._json(self.service.status())
+    status.exposed = True
+
+
+    def _submit(self, params):
+        try:
+            unknown = set(params.keys()) - set(PIN_PARAMETERS.keys()) - set([ "toleranceMillis" ])
+            if unknown:
+                raise ValueError("Unrecognised parameters: "+", ".join(sorted(unknown)))
+            toleranceSecs = None
+            if "toleranceMillis" in params:
+                toleranceSecs = float(params["toleranceMillis"]) / 1000.0
+            pinMetadataNames = dict( (PIN_PARAMETERS[key], value) for key, value in params.items() if key in PIN_PARAMETERS )
+            job = self.service.submit(cherrypy.request.body.read(), pinMetadataNames, toleranceSecs)
+        except ValueError as e:
+            return self._json({ "error" : str(e) }, 400)
+        except QueueFull as e:
+            cherrypy.response.headers["Retry-After"] = "5"
+            return self._json({ "error" : str(e) }, 503)
+        cherrypy.response.headers["Location"] = "/jobs/%d" % job["id"]
+        return self._json(job, 202)
+
+
+
+def serve(service, host="0.0.0.0", port=DEFAULT_PORT, maxBodyMB=DEFAULT_MAX_BODY_MB):
+    """\
+    Start serving the HTTP endpoints with cherrypy (non blocking).
+
+    :param service: the :class:`AnalysisService`
+    :param host: address to listen on
+    :param port: port number to listen on
+    :param maxBodyMB: the largest session file that can be submitted, in megabytes
+    """
+    cherrypy.config.update({
+        "server.socket_host" : host,
+        "server.socket_port" : port,
+        "server.max_request_body_size" : int(maxBodyMB * 1024 * 1024),
+        "engine.autoreload.on" : False,
+    })
+    # leave the body of POST requests for the handler to read, as the session file
+    cherrypy.tree.mount(HttpRoot(service), "/", config={ "/jobs" : { "request.process_request_body" : False } })
+    cherrypy.engine.start()
+
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run an HTTP service that analyses session files (as saved with the --saveSession option of the testers).")
+    parser.add_argument("--host", dest="host", type=str, default="0.0.0.0", help="Address to listen on (default=0.0.0.0)")
+    parser.add_argument("--port", dest="port", type=int, default=DEFAULT_PORT, help="Port to listen on (default="+str(DEFAULT_PORT)+")")
+    parser.add_argument("--workers", dest="workers", type=int, default=None, help="Number of worker processes (default=one per CPU)")
+    parser.add_argument("--maxQueued", dest="maxQueued", type=int, default=DEFAULT_MAX_QUEUED, help="Number of jobs that can wait for a worker before further jobs are refused (default="+str(DEFAULT_MAX_QUEUED)+")")
+    parser.add_argument("--metadataDir", dest="metadataDir", type=str, default=None, help="Directory of metadata files (as written by the test sequence generator) that jobs can name to take expected timings from")
+    parser.add_argument("--maxCachedMetadata", dest="maxCachedMetadata", type=int, default=DEFAULT_MAX_CACHED_METADATA, help="Number of metadata files to cache (default="+str(DEFAULT_MAX_CACHED_METADATA)+")")
+    parser.add_argument("--maxFinishedJobs", dest="maxFinishedJobs", type=int, default=DEFAULT_MAX_FINISHED_JOBS, help="Number of finished jobs to keep the results of (default="+str(DEFAULT_MAX_FINISHED_JOBS)+")")
+    parser.add_argument("--maxBodyMB", dest="maxBodyMB", type=float, default=DEFAULT_MAX_BODY_MB, help="Largest session file that can be submitted, in megabytes (default="+str(DEFAULT_MAX_BODY_MB)+")")
+    args = parser.parse_args()
+
+    if args.workers is not None and args.workers < 1:
+        parser.error("Number of workers must be at least 1.")
+    if args.maxQueued < 1:
+        parser.error("Maximum number of queued jobs must be at least 1.")
+
+    service = AnalysisService(args.workers, args.maxQueued, args.metadataDir, args.maxCachedMetadata, args.maxFinishedJobs)
+    try:
+        serve(service, args.host, args.port, args.maxBodyMB)
+        print("Analysis service listening on http://%s:%d/ with %d workers" % (args.host, args.port, service.workers))
+        cherrypy.engine.block()
+    finally:
+        service.close()
@@ -35,6 +35,24 @@ The following functions are then used to control the Arduino:
 * :func:`prepareToCapture`       ... query the arduino to find out how much data will be captured
 * :func:`capture`                ... initiate sampling of the enabled input pins
 * :func:`bulkTransfer`           ... retrieve captured data
+* :func:`syncBurst`              ... burst of clock sync round trips, keeping the best one
+* :func:`captureWithSyncPings`   ... alternative to :func:`capture` that also does clock sync round trips during sampling
+
+For captures longer than the Arduino can buffer, the Arduino can instead stream
+the samples while it continues sampling:
+
+* :func:`startStreaming`         ... start sampling the enabled input pins and streaming the samples
+* :func:`readStreamRecord`       ... retrieve the next block of samples
+* :func:`stopStreaming`          ... ask the arduino to stop streaming
+
+Most of the captured data is usually the same from one millisecond to the
+next (a dark screen or silence). To transfer it faster, the arduino can
+run-length encode it. Use :func:`setTransferEncoding` to switch this on.
+Decoding requires 'numpy'.
+
+Talking to the Arduino requires 'pyserial'. It (and numpy) are only imported when
+first needed (see :mod:`lazyImport`), so the constants and decoding functions in this
+module can be used without pyserial installed.
 
 Once you have finished communicating with the Arduino, just close the file
 handle.
@@ -47,6 +65,17 @@ It is this process that makes it possible to translate the time the arduino
 reports that it started and finished sampling into a time relevant to the
 PC running this python code.
 
+A single round trip is at the mercy of USB scheduling jitter, which inflates
+the error bounds of the measurement. :func:`syncBurst` sends several timing
+requests back to back and keeps the one with the lowest round-trip time (in
+the same way that NTP filters its samples).
+
+Reading a :mod:`dvbcss.clock` clock involves a chain of python method calls,
+and when that happens inside the timed part of a round trip, it adds to the
+measured round-trip time. Functions that take a `perfCounter` argument can
+instead timestamp the serial I/O with :func:`time.perf_counter_ns` and convert
+those timestamps to clock ticks afterwards (see :func:`correlatePerfCounter`).
+
 
 
 Internals
@@ -59,6 +88,9 @@ give the Arduino a particular command.
 * CMD_CAPTURE
 * CMD_PREPARE_TO_CAPTURE
 * CMD_TIMEONLY
+* CMD_STREAM
+* CMD_STOP_STREAM
+* CMD_SET_ENCODING
 
 Various functions in this module will parse bytes received via the file handle
 appropriate to the particular command used. Some functions will also send
@@ -69,15 +101,15 @@ the command. See individual documentation for each.
 """
 
 import re
-import sys
+import time
+from time import perf_counter_ns
 
-try:
-    import serial
-    import serial.tools.list_ports
-except ImportError:
-    sys.stderr.write("Needs pyserial library. Install with PIP, e.g.:\n\n")
-    sys.stderr.write("    sudo pip install pyserial\n\n")
-    sys.exit(1)
+import instrumentation
+import lazyImport
+
+numpy = lazyImport.optional("numpy")
+
+serial = lazyImport.LazyModule("serial", submodules=["serial.tools.list_ports"], package="pyserial")
 
 
 
@@ -95,6 +127,9 @@ CMD_BULK = "B"
 CMD_CAPTURE = "S"
 CMD_PREPARE_TO_CAPTURE = "4"
 CMD_TIMEONLY = "T"
+CMD_STREAM = "C"
+CMD_STOP_STREAM = "X"
+CMD_SET_ENCODING = "E"
 CMDS_ENABLE_PIN = [ '0', '1', '2', '3' ]
 
 # ----- ARDUINO INFORMATION ---------------------------------------------------
@@ -103,6 +138,23 @@ CMDS_ENABLE_PIN = [ '0', '1', '2', '3' ]
 BLK_SIZE_PER_PIN = 2
 NINETY_KB = (90 * 1024)
 
+# do not send clock sync round trips during a capture when it is due to finish within this many seconds,
+# so replies are not confused with the reply from the capture command
+SYNC_PING_MARGIN_SECS = 0.5
+
+# number of attempts made at reading the clock between two perf counter readings, when correlating them
+PERF_COUNTER_CORRELATION_ATTEMPTS = 3
+
+# default number of clock sync round trips made immediately before and after a capture (see :func:`syncBurst`)
+SYNC_BURST_SIZE = 10
+
+# sequence number marking the final record when streaming
+STREAM_END = 0xffffffff
+
+# encodings for the bulk transfer of sample data
+ENCODING_RAW = 0
+ENCODING_RLE = 1
+
 # -----------------------------------------------------------------------------
 
 def checkCaptureTimeAchievable(captureTimeSecs, nPinsRequested):
@@ -127,6 +179,18 @@ def checkCaptureTimeAchievable(captureTimeSecs, nPinsRequested):
     return -1
 
 
+def decodeInt(data):
+    """\
+    Decode a 4 byte integer sent by the Arduino
+
+    :param data: the 4 bytes received
+
+    :returns value: 32-bit unsigned integer (most significant byte first)
+    """
+    n=bytearray(data)
+    return (n[0]<<24) + (n[1]<<16) + (n[2]<<8) + n[3]
+
+
 def getInt(f):
     """\
     Read a 4 byte integer sent by the Arduino
@@ -135,9 +199,7 @@ def getInt(f):
 
     :returns value: 32-bit unsigned integer (read as 4 bytes, most significant byte first)
     """
-    n=f.read(4)
-    v = (ord(n[0])<<24) + (ord(n[1])<<16) + (ord(n[2])<<8) + ord(n[3])
-    return v
+    return decodeInt(f.read(4))
 
 
 def getIntWithTime(f, clock):
@@ -151,11 +213,69 @@ def getIntWithTime(f, clock):
     """
     n=f.read(4)
     t4 = clock.ticks
-    v = (ord(n[0])<<24) + (ord(n[1])<<16) + (ord(n[2])<<8) + ord(n[3])
-    return v, t4
+    return decodeInt(n), t4
+
+
+def correlatePerfCounter(clock):
+    """\
+    Correlate the performance counter (:func:`time.perf_counter_ns`) with a clock.
+
+    The clock is read between two readings of the performance counter, and the midpoint
+    of those is taken as the performance counter time at which the clock was read. This is repeated
+    :data:`PERF_COUNTER_CORRELATION_ATTEMPTS` times, keeping the attempt that took the least time.
+
+    :param clock: a :class:`dvbcss.clock` clock object. If it has no `tickRate`, nanosecond ticks are assumed.
+
+    :returns tuple (perfNanos, ticks, tickRate): a performance counter time, the clock tick value at that time,
+        and the tick rate of the clock. Pass this to :func:`perfCounterToTicks`.
+    """
+    best = None
+    for i in range(0, PERF_COUNTER_CORRELATION_ATTEMPTS):
+        before = perf_counter_ns()
+        ticks = clock.ticks
+        after = perf_counter_ns()
+        if best is None or after - before < best[0]:
+            best = (after - before, (before + after) // 2, ticks)
+    return best[1], best[2], getattr(clock, "tickRate", 1000000000)
+
+
+def perfCounterToTicks(perfNanos, correlation):
+    """\
+    Convert a performance counter time to clock ticks.
+
+    :param perfNanos: a value returned by :func:`time.perf_counter_ns`
+    :param correlation: (perfNanos, ticks, tickRate) as returned by :func:`correlatePerfCounter`
+
+    :returns: the corresponding tick value of the clock that the correlation was made with
+    """
+    correlationPerfNanos, correlationTicks, tickRate = correlation
+    return correlationTicks + (perfNanos - correlationPerfNanos) * tickRate // 1000000000
+
+
+def timeRoundTripWithPerfCounter(f, cmdBytes):
+    """\
+    Send a command to the Arduino and time the round trip using the performance counter.
+
+    Only the write and the read of the 4 byte reply happen between the two readings of the performance counter.
+
+    :param f: file handle for the serial connection to the Arduino Due
+    :param cmdBytes: the command, already encoded as bytes
+
+    :returns [t1,t2,t3,t4]: as for :func:`writeCmdAndTimeRoundTrip`, except that t1 and t4 are performance counter
+        times (see :func:`perfCounterToTicks`)
+    """
+    write = f.write
+    read = f.read
+    now = perf_counter_ns
+    t1 = now()
+    write(cmdBytes)
+    n = read(4)
+    t4 = now()
+    arduinoArrivalTime = decodeInt(n) * 1000
+    return [t1, arduinoArrivalTime, arduinoArrivalTime, t4]
 
 
-def writeCmdAndTimeRoundTrip(f, clock, cmd, captureTime=None):
+def writeCmdAndTimeRoundTrip(f, clock, cmd, captureTime=None, perfCounter=False):
     """\
     Send a command byte to the Arduino, and return a 4-tuple reflecting local
     and arduino times measured for round trip.
@@ -165,6 +285,8 @@ def writeCmdAndTimeRoundTrip(f, clock, cmd, captureTime=None):
     :param cmd: The command to send to the Arduino.
     :param captureTime: if this is the command to prepare for capture, then here is the time in seconds
         otherwise this is None
+    :param perfCounter: if True, the round trip is timed using the performance counter, and the clock is only
+        read afterwards, to convert the times to clock ticks (see :func:`correlatePerfCounter`)
 
     We measure the value of clock.tick just prior to sending the command byte.
     The Arduino measures its local time (using its micros() function) as soon as data is available on
@@ -182,34 +304,101 @@ def writeCmdAndTimeRoundTrip(f, clock, cmd, captureTime=None):
 
     All returned Ardinio time values are in units of nanoseconds. The clock object times are in units of ticks of that clock.
     """
-    t1 = clock.ticks
     if captureTime is not None:
         # concatenate and send as one string to reduce wait for the value of capture time on arduino
         cmd = cmd + chr(captureTime)
-    f.write(cmd)
+    if perfCounter:
+        timeData = timeRoundTripWithPerfCounter(f, cmd.encode("latin-1"))
+        correlation = correlatePerfCounter(clock)
+        timeData[0] = perfCounterToTicks(timeData[0], correlation)
+        timeData[3] = perfCounterToTicks(timeData[3], correlation)
+        return timeData
+    t1 = clock.ticks
+    f.write(cmd.encode("latin-1"))
     arduinoArrivalTime, t4 = getIntWithTime(f, clock)
     # convert to nanosecs
     arduinoArrivalTime *= 1000
     return [t1, arduinoArrivalTime, arduinoArrivalTime, t4]
 
 
+def roundTripTime(timeData):
+    """\
+    Calculate the round-trip time of a clock sync request-response exchange.
+
+    :param timeData: (t1,t2,t3,t4) as returned by :func:`writeCmdAndTimeRoundTrip`
+
+    :returns: the round trip time, excluding time spent on the Arduino. Assumes
+        the clock object has the same units (nanoseconds) as the Arduino times.
+    """
+    t1, t2, t3, t4 = timeData
+    return (t4 - t1) - (t3 - t2)
+
+
+def alignWrap(timeData, referenceTimeData):
+    """\
+    Adjust the Arduino times in round-trip timing data for any wrapping of the
+    Arduino clock, so that they are as close as possible to the Arduino times
+    in some other round-trip timing data.
+
+    :param timeData: (t1,t2,t3,t4) to be adjusted
+    :param referenceTimeData: (t1,t2,t3,t4) taken at around the same time (e.g. within the same capture)
+
+    :returns: [t1,t2,t3,t4] with t2 and t3 shifted by a whole number of wraps of the Arduino clock
+    """
+    WRAP = 1000 * (2 ** 32)
+    t1, t2, t3, t4 = timeData
+    shift = int(round(float(referenceTimeData[1] - t2) / WRAP)) * WRAP
+    return [t1, t2 + shift, t3 + shift, t4]
+
+
 # -----------------------------------------------------------------------------
 # FUNCTIONS INTENDED FOR USE BY CODE USING THIS MODULE
 # -----------------------------------------------------------------------------
 
 
-def connect():
+def connect(url=None):
     """\
     Connect to Arduino via serial and return a file handle for communicating with it.
 
+    :param url: None to search for an Arduino Due connected via USB. Otherwise
+        a serial port device name or pyserial URL (e.g. "socket://localhost:5555"
+        for an emulated Arduino, see :mod:`arduinoEmulator`)
+
     :returns: file handle for the serial connection
 
     :raises RuntimeError: if unable to detect a connected Arduino Due
     """
+    if url is not None:
+        return serial.serial_for_url(url, 115200, timeout=60)
+
+    f = serial.Serial(findArduinoPort(), 115200, timeout=60)
+    return f
+
+
+def findArduinoPorts():
+    """\
+    Find the serial ports of all Arduino Dues connected via their "native" USB port.
+
+    :returns: list of serial port device names, in the order they are enumerated (may be empty)
+    """
+    ports = []
     for (COMMS_CHANNEL, NAME, deviceId) in serial.tools.list_ports.comports():
         if re.match(r"^\s*USB VID:PID=0*2341:0*3e\b", deviceId, re.I):
-            f = serial.Serial(COMMS_CHANNEL, 115200, timeout=60)
-            return f
+            ports.append(COMMS_CHANNEL)
+    return ports
+
+
+def findArduinoPort():
+    """\
+    Find the serial port of an Arduino Due connected via its "native" USB port.
+
+    :returns: the serial port device name
+
+    :raises RuntimeError: if unable to detect a connected Arduino Due
+    """
+    ports = findArduinoPorts()
+    if ports:
+        return ports[0]
     raise RuntimeError("Could not locate arduino serial port connection. Arduino not plugged in? Or plugged into wrong serial port on the arduino?")
 
 
@@ -277,7 +466,7 @@ def samplePinDuringCapture(f, pin, clock):
 
 
 
-def capture(f, clock):
+def capture(f, clock, perfCounter=False):
     """\
     Instruct the arduino to start capturing sample data.
 
@@ -288,6 +477,7 @@ def capture(f, clock):
 
     :param f: file handle for the serial connection to the Arduino Due
     :param clock: a :class:`dvbcss.clock` clock object
+    :param perfCounter: if True, time the round trips using the performance counter (see :func:`writeCmdAndTimeRoundTrip`)
 
 
 
@@ -326,18 +516,76 @@ def capture(f, clock):
     See :func:`writeAndTimeRoundTrip` for details of the meaning of the returned round-trip timing data
     """
 
-    timeDataPre = writeCmdAndTimeRoundTrip(f, clock, CMD_CAPTURE)
+    with instrumentation.span("arduino.capture"):
+        timeDataPre = writeCmdAndTimeRoundTrip(f, clock, CMD_CAPTURE, perfCounter=perfCounter)
 
-    # retrieve the times the Arduino says it started and finished sampling
-    # and normalise to nanoseconds (from microseconds)
-    dueStartBoundary = getInt(f) * 1000
-    dueFinished = getInt(f) * 1000
+        # retrieve the times the Arduino says it started and finished sampling
+        # and normalise to nanoseconds (from microseconds)
+        dueStartBoundary = getInt(f) * 1000
+        dueFinished = getInt(f) * 1000
 
-    # retrieve the count of the number of millisecond blocks the Arduino says it sampled
-    nMilliBlocks = getInt(f)
-    timeDataPost = writeCmdAndTimeRoundTrip(f, clock, CMD_TIMEONLY)
+        # retrieve the count of the number of millisecond blocks the Arduino says it sampled
+        nMilliBlocks = getInt(f)
+        timeDataPost = writeCmdAndTimeRoundTrip(f, clock, CMD_TIMEONLY, perfCounter=perfCounter)
+
+    return unwrapCaptureTimes(dueStartBoundary, dueFinished, nMilliBlocks, timeDataPre, timeDataPost)
 
-    # watch out for any wrapping of the arduino clock ... unlikely but possible
+
+def captureWithSyncPings(f, clock, nMilliBlocks, intervalSecs, perfCounter=False):
+    """\
+    Instruct the arduino to start capturing sample data, in the same way as :func:`capture`,
+    but also perform clock sync request-response exchanges periodically while it is sampling.
+
+    These let the drift of the Arduino clock during a long capture be tracked
+    (see :class:`detect.BeepFlashDetector`). Needs the version of the arduino sampling code that
+    responds to the timing command during sampling.
+
+    :param f: file handle for the serial connection to the Arduino Due
+    :param clock: a :class:`dvbcss.clock` clock object
+    :param nMilliBlocks: the number of millisecond blocks that will be captured (as returned by :func:`prepareToCapture`)
+    :param intervalSecs: the interval (in seconds) between exchanges
+    :param perfCounter: if True, time the round trips using the performance counter (see :func:`writeCmdAndTimeRoundTrip`)
+
+    No exchanges are made in the last :data:`SYNC_PING_MARGIN_SECS` seconds of the capture.
+
+    :returns tuple (startTime, finishTime, nMilliblocks, preStartTimingData, postFinshTimingData, midTimingDatas)
+
+    The first five items are as returned by :func:`capture`. The last is a list of
+    round-trip timing data (t1,t2,t3,t4), one for each exchange made during sampling.
+    """
+    with instrumentation.span("arduino.capture"):
+        timeDataPre = writeCmdAndTimeRoundTrip(f, clock, CMD_CAPTURE, perfCounter=perfCounter)
+
+        start = time.time()
+        lastPing = start + nMilliBlocks / 1000.0 - SYNC_PING_MARGIN_SECS
+        nextPing = start + intervalSecs
+        timeDataMid = []
+        while nextPing <= lastPing:
+            time.sleep(max(0, nextPing - time.time()))
+            timeDataMid.append(writeCmdAndTimeRoundTrip(f, clock, CMD_TIMEONLY, perfCounter=perfCounter))
+            nextPing += intervalSecs
+
+        dueStartBoundary = getInt(f) * 1000
+        dueFinished = getInt(f) * 1000
+        nMilliBlocks = getInt(f)
+        timeDataPost = writeCmdAndTimeRoundTrip(f, clock, CMD_TIMEONLY, perfCounter=perfCounter)
+
+    dueStartBoundary, dueFinished, nMilliBlocks, timeDataPre, timeDataPost = \
+        unwrapCaptureTimes(dueStartBoundary, dueFinished, nMilliBlocks, timeDataPre, timeDataPost)
+    reference = [ None, dueStartBoundary, dueStartBoundary, None ]
+    timeDataMid = [ alignWrap(timeData, reference) for timeData in timeDataMid ]
+
+    return dueStartBoundary, dueFinished, nMilliBlocks, timeDataPre, timeDataPost, timeDataMid
+
+
+def unwrapCaptureTimes(dueStartBoundary, dueFinished, nMilliBlocks, timeDataPre, timeDataPost):
+    """\
+    Adjust the Arduino times reported around a capture for any wrapping of the arduino clock
+    (unlikely but possible).
+
+    Takes, and returns, a tuple in the form returned by :func:`capture`.
+    The round-trip timing data lists are modified in place.
+    """
     if timeDataPre[2] < timeDataPre[1]:
         timeDataPre[2] += (1000 * (2 ** 32))
 
@@ -357,29 +605,259 @@ def capture(f, clock):
 
 
 
-def bulkTransfer(f, clock):
+def syncBurst(f, clock, count, perfCounter=False):
+    """\
+    Perform a burst of clock sync request-response exchanges with the Arduino
+    and return the one with the lowest round-trip time.
+
+    :param f: file handle for the serial connection to the Arduino Due
+    :param clock: a :class:`dvbcss.clock` clock object (with nanosecond ticks)
+    :param count: the number of :data:`CMD_TIMEONLY` round trips to make (at least 1)
+    :param perfCounter: if True, time the round trips using the performance counter. The clock is only read
+        once the burst is complete, to convert the times to clock ticks (see :func:`correlatePerfCounter`)
+
+    The timing requests are sent back to back. The exchange with the lowest
+    round-trip time is the one least affected by USB scheduling delays, and
+    therefore gives the tightest error bound when used to correlate the
+    Arduino clock with the wall clock (see :func:`detect.calcAcWcCorrelationAndDispersion`).
+
+    :returns tuple (bestTimingData, rttStats)
+
+    The return tuple contains:
+    * the round-trip timing data (t1,t2,t3,t4) with the lowest round-trip time
+    * a dict summarising the round-trip times seen, with keys "count", "min", "mean" and "max"
+
+    See :func:`writeAndTimeRoundTrip` for details of the meaning of the returned round-trip timing data
+    """
+    if count < 1:
+        raise ValueError("Sync burst must consist of at least one round trip.")
+
+    with instrumentation.span("arduino.syncBurst"):
+        if perfCounter:
+            cmdBytes = CMD_TIMEONLY.encode("latin-1")
+            timeDatas = [ timeRoundTripWithPerfCounter(f, cmdBytes) for i in range(0, count) ]
+            correlation = correlatePerfCounter(clock)
+            for timeData in timeDatas:
+                timeData[0] = perfCounterToTicks(timeData[0], correlation)
+                timeData[3] = perfCounterToTicks(timeData[3], correlation)
+        else:
+            timeDatas = [ writeCmdAndTimeRoundTrip(f, clock, CMD_TIMEONLY) for i in range(0, count) ]
+
+    return lowestRoundTrip(timeDatas)
+
+
+def lowestRoundTrip(timeDatas):
+    """\
+    Pick the round trip with the lowest round-trip time from a burst, and summarise the round-trip times.
+
+    :param timeDatas: list of round-trip timing data (t1,t2,t3,t4), at least one
+    :returns tuple (bestTimingData, rttStats), as returned by :func:`syncBurst`
+    """
+    best = None
+    bestRtt = None
+    rtts = []
+    for timeData in timeDatas:
+        rtt = roundTripTime(timeData)
+        rtts.append(rtt)
+        if best is None or rtt < bestRtt:
+            best, bestRtt = timeData, rtt
+
+    rttStats = {
+        "count" : len(rtts),
+        "min"   : min(rtts),
+        "mean"  : sum(rtts) / float(len(rtts)),
+        "max"   : max(rtts),
+    }
+    return best, rttStats
+
+
+def checkEncodingSupported(encoding):
+    """\
+    :param encoding: :data:`ENCODING_RAW` or :data:`ENCODING_RLE`
+    :raises RuntimeError: if run-length encoding is requested but numpy (needed to decode it) is not installed
+    """
+    if encoding == ENCODING_RLE and numpy is None:
+        raise RuntimeError("Needs numpy library to decode run-length encoded transfers. Install with PIP, e.g.: pip install numpy")
+
+
+def setTransferEncoding(f, clock, encoding):
+    """\
+    Choose how the Arduino encodes the sample data for subsequent bulk transfers.
+
+    Needs the version of the arduino sampling code that supports the set encoding command.
+
+    :param f: file handle for the serial connection to the Arduino Due
+    :param clock: a :class:`dvbcss.clock` clock object
+    :param encoding: :data:`ENCODING_RAW` or :data:`ENCODING_RLE`
+
+    :returns tuple (encoding, timingData) where encoding is the encoding the arduino will now use
+        (it may reject an encoding it does not support, and use :data:`ENCODING_RAW` instead)
+
+    :raises RuntimeError: if run-length encoding is requested but numpy (needed to decode it) is not installed
+
+    See :func:`writeAndTimeRoundTrip` for details of the meaning of the returned round-trip timing data
+    """
+    checkEncodingSupported(encoding)
+    timeData = writeCmdAndTimeRoundTrip(f, clock, CMD_SET_ENCODING, encoding)
+    return getInt(f), timeData
+
+
+def rleDecode(encoded, blkSize):
+    """\
+    Expand run-length encoded sample data back into the raw format (as returned by :func:`bulkTransfer`).
+
+    The encoded data is a sequence of runs of millisecond blocks (of blkSize bytes each). Each run starts
+    with a header byte:
+    * 0x80 + (n-1) ... the following block is repeated n times (n = 1 to 128)
+    * (n-1)        ... the following n blocks are included literally (n = 1 to 128)
+
+    :param encoded: the encoded bytes
+    :param blkSize: the number of bytes in one millisecond block (2 per active pin)
+
+    :returns: bytes of the decoded sample data
+    """
+    encoded = numpy.frombuffer(bytes(encoded), dtype=numpy.uint8)
+
+    # walk the run headers, noting where the block data of each run starts and its length
+    runStarts = []
+    runLengths = []
+    runRepeats = []
+    i = 0
+    while i < len(encoded):
+        header = int(encoded[i])
+        n = (header & 0x7f) + 1
+        runStarts.append(i + 1)
+        if header & 0x80:
+            runLengths.append(1)
+            runRepeats.append(n)
+        else:
+            runLengths.append(n)
+            runRepeats.append(1)
+        i += 1 + runLengths[-1] * blkSize
+    if i != len(encoded):
+        raise ValueError("Truncated run-length encoded data")
+    if not runStarts:
+        return b""
+
+    runStarts = numpy.array(runStarts)
+    runLengths = numpy.array(runLengths)
+    runRepeats = numpy.array(runRepeats)
+
+    # offset of every distinct block in the encoded data, and how many times each is repeated
+    firstOfRun = numpy.repeat(numpy.cumsum(runLengths) - runLengths, runLengths)
+    blockStarts = numpy.repeat(runStarts, runLengths) + (numpy.arange(runLengths.sum()) - firstOfRun) * blkSize
+    repeats = numpy.repeat(runRepeats, runLengths)
+
+    blocks = encoded[blockStarts[:, numpy.newaxis] + numpy.arange(blkSize)]
+    return numpy.repeat(blocks, repeats, axis=0).tobytes()
+
+
+def bulkTransfer(f, clock, encoding=ENCODING_RAW):
     """\
     Request the Arduino send the captured sample data blocks and return them.
 
     :param f: file handle for the serial connection to the Arduino Due
     :param clock: a :class:`dvbcss.clock` clock object
+    :param encoding: the encoding the arduino was told to use by :func:`setTransferEncoding`
 
     The arduino transfers the microsecond blocks it's created during the most
     recent call to :func:`capture`. The data is formatted as a single string
-    containing the raw bytes of sample data.
+    containing the raw bytes of sample data. If the data was run-length
+    encoded for transfer, it is decoded (see :func:`rleDecode`).
 
     :returns tuple (numSamples, (rawSampleData, timingData))
 
     See :func:`writeAndTimeRoundTrip` for details of the meaning of the returned round-trip timing data
 
     """
-    timeData = writeCmdAndTimeRoundTrip(f, clock, CMD_BULK)
-    n = getInt(f)
-    samples = f.read(n)
+    with instrumentation.span("arduino.bulkTransfer"):
+        timeData = writeCmdAndTimeRoundTrip(f, clock, CMD_BULK)
+        n = getInt(f)
+        if encoding == ENCODING_RLE:
+            blkSize = getInt(f)
+            samples = rleDecode(f.read(n), blkSize)
+        else:
+            samples = f.read(n)
+    instrumentation.count("arduino.bytesTransferred", n)
     return samples, timeData
 
 
 
+def startStreaming(f, clock, nBlocks=0):
+    """\
+    Instruct the arduino to start sampling the enabled pins and stream the samples back
+    as it goes, in blocks covering a fixed number of milliseconds.
+
+    Unlike :func:`capture`, the length of the capture is not limited by the memory of the Arduino,
+    and :func:`prepareToCapture` does not need to be called first.
+
+    :param f: file handle for the serial connection to the Arduino Due
+    :param clock: a :class:`dvbcss.clock` clock object
+    :param nBlocks: number of blocks to stream (up to 65535), or 0 to stream until :func:`stopStreaming` is called
+
+    Read the blocks using :func:`readStreamRecord`, until it returns the final record.
+
+    The enabled pins are cleared once streaming has finished, as they are after :func:`bulkTransfer`.
+
+    :returns tuple (nActivePorts, blockMillis, timingData)
+
+    The return tuple contains:
+    * the number of analogue pins that will be read (0 means there's a problem, and nothing will be streamed)
+    * the number of millisecond blocks (see :func:`capture`) in each streamed block
+    * round-trip timing data
+
+    See :func:`writeAndTimeRoundTrip` for details of the meaning of the returned round-trip timing data
+    """
+    if nBlocks < 0 or nBlocks > 0xffff:
+        raise ValueError("Number of blocks to stream must be between 0 and 65535")
+    cmd = CMD_STREAM + chr(nBlocks >> 8) + chr(nBlocks & 0xff)
+    timeData = writeCmdAndTimeRoundTrip(f, clock, cmd)
+    nActivePorts = getInt(f)
+    blockMillis = getInt(f)
+    return nActivePorts, blockMillis, timeData
+
+
+def stopStreaming(f):
+    """\
+    Ask the arduino to stop streaming. It finishes the block it is sampling, then sends the final record.
+
+    The arduino does not reply with a timestamp to this command.
+
+    :param f: file handle for the serial connection to the Arduino Due
+    """
+    f.write(CMD_STOP_STREAM.encode("latin-1"))
+
+
+def readStreamRecord(f, nActivePorts, blockMillis):
+    """\
+    Read the next record streamed by the arduino after :func:`startStreaming`.
+
+    :param f: file handle for the serial connection to the Arduino Due
+    :param nActivePorts: the number of pins being sampled (as returned by :func:`startStreaming`)
+    :param blockMillis: the number of milliseconds in each block (as returned by :func:`startStreaming`)
+
+    :returns tuple (seq, arduinoTime, samples)
+
+    For a block of samples, the tuple contains:
+    * the sequence number of the block (counting from zero)
+    * the Arduino clock time (in nanoseconds, not adjusted for wrapping) when sampling of the block began
+    * the raw sample data, formatted as for :func:`bulkTransfer`
+
+    The final record has sequence number :data:`STREAM_END`. For this, the tuple contains:
+    * :data:`STREAM_END`
+    * the Arduino clock time (in nanoseconds, not adjusted for wrapping) when sampling finished
+    * the number of blocks that were streamed
+    """
+    seq = getInt(f)
+    arduinoTime = getInt(f) * 1000
+    if seq == STREAM_END:
+        return seq, arduinoTime, getInt(f)
+    samples = f.read(blockMillis * nActivePorts * BLK_SIZE_PER_PIN)
+    instrumentation.count("arduino.bytesTransferred", len(samples))
+    return seq, arduinoTime, samples
+
+
+
 if __name__=="__main__":
     print("This is a library of functions for communicating with the arduino")
     print("for timing reference-point calibration for video and audio.")
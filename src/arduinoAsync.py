@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+asyncio version of the functions in :mod:`arduino` for controlling the Arduino Due.
+
+The functions in :mod:`arduino` block the calling thread until the Arduino
+responds - which, for :func:`arduino.capture`, is the whole sampling period.
+The :class:`AsyncArduino` client does the same job using non-blocking streams,
+so one event loop can drive several Arduinos (and other work, such as time
+synchronisation and uploading results) at once without a thread per device.
+
+Requires 'pyserial-asyncio' for connecting to an Arduino via a serial port.
+It is not needed for connecting to an emulated Arduino via a `socket://` URL
+(see :mod:`arduinoEmulator`).
+
+
+Usage
+-----
+
+.. code-block:: python
+
+    async def measure(url, clock):
+        device = await AsyncArduino.connect(url)
+        await device.samplePinDuringCapture(0, clock)
+        nActivePorts, nMilliBlocks, timeData = await device.prepareToCapture(clock, 10)
+        captureInfo = await device.capture(clock)
+        samples, timeData = await device.bulkTransfer(clock)
+        device.close()
+
+    await asyncio.gather(measure(url1, clock), measure(url2, clock))
+
+All methods return the same values as the corresponding functions in :mod:`arduino`.
+
+Timing
+------
+
+The clock is read as soon as the task waiting for a response from the Arduino
+resumes. If other tasks keep the event loop busy, that is later than the
+response actually arrived, and the round-trip time (and hence the error bound)
+is inflated. :meth:`AsyncArduino.syncBurst` keeps the lowest round-trip time
+exchange, which mitigates this.
+
+Captures, bulk transfers and sync bursts are timed, and the bytes transferred
+counted, under the same names as for :mod:`arduino` (see :mod:`instrumentation`).
+When several Arduinos capture at once, their spans overlap, so the total time
+recorded can be longer than the time that actually passed.
+
+"""
+
+import asyncio
+import re
+
+import arduino
+import instrumentation
+import lazyImport
+
+serial_asyncio = lazyImport.optional("serial_asyncio")
+
+
+
+class AsyncArduino(object):
+
+    def __init__(self, reader, writer):
+        """\
+        Client for an Arduino Due running the sampling code, using asyncio streams.
+
+        Use :meth:`connect` to create one.
+
+        Commands are sent one at a time: if several tasks use the same object
+        at once, then each waits its turn.
+
+        :param reader: :class:`asyncio.StreamReader` for data from the Arduino
+        :param writer: :class:`asyncio.StreamWriter` for data to the Arduino
+        """
+        super(AsyncArduino, self).__init__()
+        self.reader = reader
+        self.writer = writer
+        self.lock = asyncio.Lock()
+
+
+    @classmethod
+    async def connect(cls, url=None):
+        """\
+        Connect to an Arduino.
+
+        :param url: None to search for an Arduino Due connected via USB. Otherwise
+            a serial port device name, or "socket://host:port" URL (e.g. of an emulated Arduino)
+
+        :returns: :class:`AsyncArduino` object
+
+        :raises RuntimeError: if unable to detect a connected Arduino Due, or pyserial-asyncio is needed but not installed
+        """
+        match = re.match(r"^socket://([^:/]+):([0-9]+)", url or "")
+        if match:
+            reader, writer = await asyncio.open_connection(match.group(1), int(match.group(2)))
+        else:
+            if serial_asyncio is None:
+                raise RuntimeError("Needs pyserial-asyncio library to connect to a serial port. Install with PIP, e.g.: pip install pyserial-asyncio")
+            if url is None:
+                url = arduino.findArduinoPort()
+            reader, writer = await serial_asyncio.open_serial_connection(url=url, baudrate=115200)
+        return cls(reader, writer)
+
+
+    def close(self):
+        self.writer.close()
+
+
+    async def _getInt(self):
+        return arduino.decodeInt(await self.reader.readexactly(4))
+
+
+    async def _writeCmdAndTimeRoundTrip(self, clock, cmd, captureTime=None):
+        """\
+        Equivalent of :func:`arduino.writeCmdAndTimeRoundTrip`. Caller must hold the lock.
+        """
+        if captureTime is not None:
+            cmd = cmd + chr(captureTime)
+        data = cmd.encode("latin-1")
+        t1 = clock.ticks
+        self.writer.write(data)
+        n = await self.reader.readexactly(4)
+        t4 = clock.ticks
+        arduinoArrivalTime = arduino.decodeInt(n) * 1000
+        return [t1, arduinoArrivalTime, arduinoArrivalTime, t4]
+
+
+    async def _timeRoundTripWithPerfCounter(self, data):
+        """\
+        Equivalent of :func:`arduino.timeRoundTripWithPerfCounter`. Caller must hold the lock.
+        """
+        write = self.writer.write
+        now = arduino.perf_counter_ns
+        t1 = now()
+        write(data)
+        n = await self.reader.readexactly(4)
+        t4 = now()
+        arduinoArrivalTime = arduino.decodeInt(n) * 1000
+        return [t1, arduinoArrivalTime, arduinoArrivalTime, t4]
+
+
+    async def samplePinDuringCapture(self, pin, clock):
+        """\
+        See :func:`arduino.samplePinDuringCapture`
+        """
+        async with self.lock:
+            return await self._writeCmdAndTimeRoundTrip(clock, arduino.CMDS_ENABLE_PIN[pin])
+
+
+    async def prepareToCapture(self, clock, captureSecs):
+        """\
+        See :func:`arduino.prepareToCapture`
+        """
+        async with self.lock:
+            timeData = await self._writeCmdAndTimeRoundTrip(clock, arduino.CMD_PREPARE_TO_CAPTURE, captureSecs)
+            nActivePorts = await self._getInt()
+            nMilliBlocks = await self._getInt()
+            return nActivePorts, nMilliBlocks, timeData
+
+
+    async def capture(self, clock):
+        """\
+        See :func:`arduino.capture`. Other tasks can run while the Arduino is sampling.
+        """
+        async with self.lock:
+            with instrumentation.span("arduino.capture"):
+                timeDataPre = await self._writeCmdAndTimeRoundTrip(clock, arduino.CMD_CAPTURE)
+
+                # normalise to nanoseconds (from microseconds)
+                dueStartBoundary = (await self._getInt()) * 1000
+                dueFinished = (await self._getInt()) * 1000
+                nMilliBlocks = await self._getInt()
+
+                timeDataPost = await self._writeCmdAndTimeRoundTrip(clock, arduino.CMD_TIMEONLY)
+
+        return arduino.unwrapCaptureTimes(dueStartBoundary, dueFinished, nMilliBlocks, timeDataPre, timeDataPost)
+
+
+    async def setTransferEncoding(self, clock, encoding):
+        """\
+        See :func:`arduino.setTransferEncoding`
+        """
+        arduino.checkEncodingSupported(encoding)
+        async with self.lock:
+            timeData = await self._writeCmdAndTimeRoundTrip(clock, arduino.CMD_SET_ENCODING, encoding)
+            return (await self._getInt()), timeData
+
+
+    async def bulkTransfer(self, clock, encoding=arduino.ENCODING_RAW):
+        """\
+        See :func:`arduino.bulkTransfer`
+        """
+        async with self.lock:
+            with instrumentation.span("arduino.bulkTransfer"):
+                timeData = await self._writeCmdAndTimeRoundTrip(clock, arduino.CMD_BULK)
+                n = await self._getInt()
+                if encoding == arduino.ENCODING_RLE:
+                    blkSize = await self._getInt()
+                    samples = arduino.rleDecode(await self.reader.readexactly(n), blkSize)
+                else:
+                    samples = await self.reader.readexactly(n)
+        instrumentation.count("arduino.bytesTransferred", n)
+        return samples, timeData
+
+
+    async def syncBurst(self, clock, count):
+        """\
+        See :func:`arduino.syncBurst`. The round trips are always timed using the performance counter.
+        """
+        if count < 1:
+            raise ValueError("Sync burst must consist of at least one round trip.")
+
+        async with self.lock:
+            with instrumentation.span("arduino.syncBurst"):
+                data = arduino.CMD_TIMEONLY.encode("latin-1")
+                timeDatas = []
+                for i in range(0, count):
+                    timeDatas.append(await self._timeRoundTripWithPerfCounter(data))
+
+        correlation = arduino.correlatePerfCounter(clock)
+        for timeData in timeDatas:
+            timeData[0] = arduino.perfCounterToTicks(timeData[0], correlation)
+            timeData[3] = arduino.perfCounterToTicks(timeData[3], correlation)
+
+        return arduino.lowestRoundTrip(timeDatas)
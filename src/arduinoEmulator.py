@@ -0,0 +1,612 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Software emulation of the Arduino Due running the sampling code in the
+"hardware" directory of this project.
+
+This makes it possible to run the capture, detect and analyse pipeline
+end-to-end without the measurement hardware, e.g. for regression testing
+and benchmarking.
+
+The emulator speaks the same byte protocol as `arduino_sampling_code.ino`
+(commands '0' to '3', '4', 'S', 'B', 'T', the streaming commands 'C' and 'X'
+and the transfer encoding command 'E'). It can be reached over a TCP
+socket (using pyserial's `socket://` URL handler) or, on POSIX systems, via a
+pseudo-terminal that looks just like a serial port.
+
+The light and audio inputs are synthesised from the JSON metadata written by
+the test sequence generator, as if a device was playing the test sequence
+(in a loop) starting at a given time. The emulated device can be early or
+late by a fixed offset, the emulated Arduino clock can drift, the sample data
+can be noisy and the USB link can add latency.
+
+
+Usage
+-----
+
+From the command line:
+
+    $ python arduinoEmulator.py --light0 metadata.json --audio0 metadata.json --offsetMillis 12
+
+This prints a URL that can be passed to the testers via their `--arduino`
+option, or to :func:`arduino.connect`.
+
+From code:
+
+.. code-block:: python
+
+    emulator = ArduinoEmulator({ 0 : flashMetadata, 1 : beepMetadata }, offsetSecs=0.012)
+    server = EmulatorSocketServer(emulator)
+    server.start()
+
+    f = arduino.connect(server.url)
+    ...
+    server.stop()
+
+"""
+
+import bisect
+import os
+import random
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+
+
+# the 'analog' pins corresponding to the pin enable commands '0' to '3'
+# commands '1' and '3' enable audio inputs. '0' and '2' enable light sensors.
+AUDIO_INPUTS = [ False, True, False, True ]
+
+N_INPUTS = 4
+BLKSIZE_PER_PIN = 2
+NINETY_KB = (90 * 1024)
+STREAM_BLOCK_MILLIS = 100
+STREAM_END = 0xffffffff
+ENCODING_RAW = 0
+ENCODING_RLE = 1
+
+# sample levels (8 bit) for the synthesised signals
+DARK_LEVEL = 20
+BRIGHT_LEVEL = 220
+SILENCE_LEVEL = 128
+TONE_AMPLITUDE = 100
+
+
+def synthesiseSamples(metadata, isAudio, mediaTimes, offsetSecs=0.0, noise=0, rand=None):
+    """\
+    Synthesise the high and low sample values the Arduino would record for one
+    input while a device plays the test sequence described by some metadata.
+
+    :param metadata: dict of test sequence metadata, as written by the test sequence generator.
+        Must contain "eventCentreTimes" and "approxBeepDurationSecs" or "approxFlashDurationSecs".
+        If it contains "durationSecs" then the test sequence is assumed to loop.
+    :param isAudio: True if this is an audio input, False if it is a light sensor
+    :param mediaTimes: iterable of times (in seconds, on the timeline of the test sequence)
+        of the start of each millisecond sample period
+    :param offsetSecs: how early (positive) or late (negative) the device is presenting
+    :param noise: amplitude of random noise to add to each sample value (0 = none)
+    :param rand: :class:`random.Random` object to use for noise, or None to use a new one.
+
+    :returns: tuple (hiSamples, loSamples) of lists of sample values (0-255)
+    """
+    if rand is None:
+        rand = random.Random()
+
+    if isAudio:
+        duration = metadata["approxBeepDurationSecs"]
+    else:
+        duration = metadata["approxFlashDurationSecs"]
+    loopSecs = metadata.get("durationSecs", None)
+
+    # event start and end times, adjusted so they occur early or late
+    starts = [ t - offsetSecs - duration / 2.0 for t in metadata["eventCentreTimes"] ]
+    ends = [ t - offsetSecs + duration / 2.0 for t in metadata["eventCentreTimes"] ]
+
+    hiSamples = []
+    loSamples = []
+    for tStart in mediaTimes:
+        if loopSecs:
+            tStart = tStart % loopSecs
+        tEnd = tStart + 0.001
+
+        # find most recent event to start before end of this sample period
+        i = bisect.bisect_left(starts, tEnd) - 1
+        if i >= 0 and ends[i] > tStart:
+            # fully covered or only partially covered by the event?
+            full = starts[i] <= tStart and ends[i] >= tEnd
+        else:
+            full = None
+
+        if isAudio:
+            if full is None:
+                hi, lo = SILENCE_LEVEL, SILENCE_LEVEL
+            else:
+                hi, lo = SILENCE_LEVEL + TONE_AMPLITUDE, SILENCE_LEVEL - TONE_AMPLITUDE
+        else:
+            if full is None:
+                hi, lo = DARK_LEVEL, DARK_LEVEL
+            elif full:
+                hi, lo = BRIGHT_LEVEL, BRIGHT_LEVEL
+            else:
+                hi, lo = BRIGHT_LEVEL, DARK_LEVEL
+
+        if noise:
+            n1 = rand.randint(-noise, noise)
+            n2 = rand.randint(-noise, noise)
+            hi, lo = max(hi + n1, lo + n2), min(hi + n1, lo + n2)
+
+        hiSamples.append(min(255, max(0, hi)))
+        loSamples.append(min(255, max(0, lo)))
+
+    return hiSamples, loSamples
+
+
+
+def rleEncode(data, blkSize):
+    """\
+    Run-length encode sample data in the same way as the firmware does. See :func:`arduino.rleDecode`.
+
+    :param data: raw sample data
+    :param blkSize: number of bytes in one millisecond block
+    :returns: bytes of encoded data
+    """
+    blocks = [ bytes(data[i:i+blkSize]) for i in range(0, len(data), blkSize) ]
+    n = len(blocks)
+    encoded = bytearray()
+    i = 0
+    while i < n:
+        r = 1
+        while i + r < n and r < 128 and blocks[i + r] == blocks[i]:
+            r += 1
+        if r >= 2:
+            encoded.append(0x80 | (r - 1))
+            encoded += blocks[i]
+            i += r
+        else:
+            # literal run, up to (but not including) the next block that starts a repeat
+            j = i + 1
+            while j < n and j - i < 128 and not (j + 1 < n and blocks[j] == blocks[j + 1]):
+                j += 1
+            encoded.append(j - i - 1)
+            for block in blocks[i:j]:
+                encoded += block
+            i = j
+    return bytes(encoded)
+
+
+
+class ArduinoEmulator(object):
+
+    def __init__(self, pinMetadata, offsetSecs=0.0, driftPpm=0.0, noise=0, usbLatencySecs=0.0, usbJitterSecs=0.0, videoStartTime=None, timeFunc=time.time, seed=None):
+        """\
+        Emulates the Arduino Due sampling code.
+
+        :param pinMetadata: dict mapping pin enable command number (0 to 3) to the test sequence metadata
+            (as loaded from the JSON written by the test sequence generator) for what that input observes.
+            Inputs without an entry observe darkness/silence.
+        :param offsetSecs: how early (positive) or late (negative) the emulated device presents the flashes and beeps
+        :param driftPpm: how fast (positive) or slow (negative) the emulated Arduino clock runs, in parts per million
+        :param noise: amplitude of random noise added to sample values (0 = none)
+        :param usbLatencySecs: delay added in each direction for every command sent over USB
+        :param usbJitterSecs: mean of an additional random (exponentially distributed) delay added in each direction
+        :param videoStartTime: time (according to `timeFunc`) at which the emulated device started playing
+            the test sequence. If None, then it is the time this object is created.
+        :param timeFunc: function returning the current time in seconds.
+        :param seed: seed for the random number generator used for noise and jitter.
+        """
+        super(ArduinoEmulator, self).__init__()
+        self.pinMetadata = pinMetadata
+        self.offsetSecs = offsetSecs
+        self.driftPpm = driftPpm
+        self.noise = noise
+        self.usbLatencySecs = usbLatencySecs
+        self.usbJitterSecs = usbJitterSecs
+        self.timeFunc = timeFunc
+        self.rand = random.Random(seed)
+
+        self.epoch = timeFunc()
+        if videoStartTime is None:
+            videoStartTime = self.epoch
+        self.videoStartTime = videoStartTime
+
+        self.reset()
+
+
+    def reset(self):
+        """\
+        Forget everything, as the firmware does when the Arduino is reset: the enabled inputs, any captured
+        samples and the transfer encoding.
+        """
+        self.rawData = b""
+        self.nMilliBlks = 0
+        self.transferEncoding = ENCODING_RAW
+        self.doinit()
+
+
+    def doinit(self):
+        """\
+        Clear down the enable flags, as the firmware does after power-up and after a bulk transfer.
+        """
+        self.enable = [ False ] * N_INPUTS
+        self.activeInputs = []
+
+
+    def micros(self):
+        """\
+        :returns: the emulated Arduino micros() value (an unsigned 32 bit integer that wraps)
+        """
+        return self.microsAt(self.timeFunc())
+
+
+    def microsAt(self, hostTime):
+        """\
+        :returns: the emulated Arduino micros() value at a given time (according to `timeFunc`)
+        """
+        elapsed = hostTime - self.epoch
+        return int(elapsed * 1000000 * (1.0 + self.driftPpm / 1000000.0)) & 0xffffffff
+
+
+    def hostTimeForMicros(self, micros, referenceHostTime):
+        """\
+        :returns: the time (according to `timeFunc`) corresponding to an emulated Arduino micros() value,
+            ignoring wrapping of the Arduino clock
+        """
+        return referenceHostTime + micros / 1000000.0 / (1.0 + self.driftPpm / 1000000.0)
+
+
+    def _usbDelay(self):
+        delay = self.usbLatencySecs
+        if self.usbJitterSecs > 0:
+            delay += self.rand.expovariate(1.0 / self.usbJitterSecs)
+        if delay > 0:
+            time.sleep(delay)
+
+
+    def serve(self, stream):
+        """\
+        Respond to commands arriving on a stream until it is closed.
+
+        :param stream: object with read(n), available() and write(data) methods. read() must block until
+            n bytes are available, or return fewer bytes (or none) if the stream has closed.
+            available() returns True if read(1) would not block.
+        """
+        while True:
+            cmd = stream.read(1)
+            if len(cmd) == 0:
+                return
+
+            # respond to any command immediately with a local time measurement
+            self._usbDelay()
+            now = self.micros()
+            self._usbDelay()
+            stream.write(struct.pack(">I", now))
+
+            opcode = cmd.decode("latin-1")
+            if opcode in "0123":
+                self.enable[int(opcode)] = True
+            elif opcode == "4":
+                nSecs = bytearray(stream.read(1))[0]
+                stream.write(self.prepareToCapture(nSecs))
+            elif opcode == "S":
+                stream.write(self.capture(stream))
+            elif opcode == "B":
+                stream.write(self.bulkTransfer())
+            elif opcode == "T":
+                pass # timing command .. handled above
+            elif opcode == "E":
+                encoding = bytearray(stream.read(1))[0]
+                if encoding not in (ENCODING_RAW, ENCODING_RLE):
+                    encoding = ENCODING_RAW
+                self.transferEncoding = encoding
+                stream.write(struct.pack(">I", encoding))
+            elif opcode == "C":
+                nBlocks = struct.unpack(">H", stream.read(2))[0]
+                self.streamCapture(stream, nBlocks)
+
+
+    def prepareToCapture(self, nSecs):
+        """\
+        :returns: bytes of the response to the prepare to capture command
+        """
+        self.activeInputs = [ i for i in range(0, N_INPUTS) if self.enable[i] ]
+        nActivePorts = len(self.activeInputs)
+        nMilliBlks = nSecs * 1000
+        if nActivePorts == 0 or nSecs <= 0 or nMilliBlks * nActivePorts * BLKSIZE_PER_PIN > NINETY_KB:
+            self.doinit()
+            return struct.pack(">II", 0, 0)
+        self.nMilliBlks = nMilliBlks
+        return struct.pack(">II", nActivePorts, nMilliBlks)
+
+
+    def capture(self, stream=None):
+        """\
+        Sample the enabled inputs in real time.
+
+        :param stream: if not None, then the timing command is responded to (and any other
+            commands ignored) on this stream while sampling, as the firmware does
+        :returns: bytes of the response to the capture command
+        """
+        hostStart = self.timeFunc()
+        startTime = self.microsAt(hostStart)
+
+        # the emulated arduino clock may be running fast or slow
+        hostDuration = self.hostTimeForMicros(self.nMilliBlks * 1000, 0)
+        hostEnd = hostStart + hostDuration
+        while self.timeFunc() < hostEnd:
+            if stream is not None and stream.available():
+                if stream.read(1) == b"T":
+                    self._usbDelay()
+                    now = self.micros()
+                    self._usbDelay()
+                    stream.write(struct.pack(">I", now))
+            else:
+                time.sleep(max(0, min(0.001, hostEnd - self.timeFunc())))
+        endTime = (startTime + self.nMilliBlks * 1000) & 0xffffffff
+
+        self.rawData = self.synthesise(hostStart, self.nMilliBlks)
+        return struct.pack(">III", startTime, endTime, self.nMilliBlks)
+
+
+    def synthesise(self, hostStart, nMilliBlks):
+        """\
+        :param hostStart: time (according to `timeFunc`) when sampling began
+        :param nMilliBlks: number of millisecond sample periods
+        :returns: bytes of sample data, interleaved in the same way as the firmware
+        """
+        mediaTimes = [ self.hostTimeForMicros(i * 1000, hostStart) - self.videoStartTime for i in range(0, nMilliBlks) ]
+
+        perInput = []
+        for i in self.activeInputs:
+            if i in self.pinMetadata:
+                perInput.append(synthesiseSamples(self.pinMetadata[i], AUDIO_INPUTS[i], mediaTimes, self.offsetSecs, self.noise, self.rand))
+            else:
+                noEvents = { "eventCentreTimes" : [], "approxBeepDurationSecs" : 0, "approxFlashDurationSecs" : 0 }
+                perInput.append(synthesiseSamples(noEvents, AUDIO_INPUTS[i], mediaTimes, 0, self.noise, self.rand))
+
+        data = bytearray(nMilliBlks * len(perInput) * BLKSIZE_PER_PIN)
+        for j, (hiSamples, loSamples) in enumerate(perInput):
+            data[j * BLKSIZE_PER_PIN :: len(perInput) * BLKSIZE_PER_PIN] = bytearray(hiSamples)
+            data[j * BLKSIZE_PER_PIN + 1 :: len(perInput) * BLKSIZE_PER_PIN] = bytearray(loSamples)
+        return bytes(data)
+
+
+    def streamCapture(self, stream, nBlocks):
+        """\
+        Sample the enabled inputs in real time, writing each block of samples to the stream
+        as soon as it has been sampled.
+
+        :param stream: the stream to write to, and check for the stop command on
+        :param nBlocks: number of blocks to stream, or 0 to continue until the stop command is received
+        """
+        self.activeInputs = [ i for i in range(0, N_INPUTS) if self.enable[i] ]
+        if len(self.activeInputs) == 0:
+            self.doinit()
+            stream.write(struct.pack(">II", 0, 0))
+            return
+        stream.write(struct.pack(">II", len(self.activeInputs), STREAM_BLOCK_MILLIS))
+
+        hostStart = self.timeFunc()
+        startTime = self.microsAt(hostStart)
+        blockHostDuration = self.hostTimeForMicros(STREAM_BLOCK_MILLIS * 1000, 0)
+        seq = 0
+        stopRequested = False
+        while not stopRequested and (nBlocks == 0 or seq < nBlocks):
+            blockHostStart = hostStart + seq * blockHostDuration
+            time.sleep(max(0, blockHostStart + blockHostDuration - self.timeFunc()))
+            blockStartTime = (startTime + seq * STREAM_BLOCK_MILLIS * 1000) & 0xffffffff
+            data = self.synthesise(blockHostStart, STREAM_BLOCK_MILLIS)
+            stream.write(struct.pack(">II", seq, blockStartTime) + data)
+            seq += 1
+            # other commands are ignored while streaming
+            while not stopRequested and stream.available():
+                stopRequested = stream.read(1) in (b"X", b"")
+
+        stream.write(struct.pack(">III", STREAM_END, self.micros(), seq))
+        self.doinit()
+
+
+    def bulkTransfer(self):
+        """\
+        :returns: bytes of the response to the bulk transfer command
+        """
+        blkSize = len(self.activeInputs) * BLKSIZE_PER_PIN
+        nbytes = self.nMilliBlks * blkSize
+        if self.transferEncoding == ENCODING_RLE:
+            encoded = rleEncode(self.rawData[:nbytes], blkSize)
+            response = struct.pack(">II", len(encoded), blkSize) + encoded
+        else:
+            response = struct.pack(">I", nbytes) + self.rawData[:nbytes]
+        # prepare for any further runs
+        self.rawData = b""
+        self.doinit()
+        return response
+
+
+
+class _SocketStream(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def read(self, n):
+        data = b""
+        while len(data) < n:
+            chunk = self.conn.recv(n - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def available(self):
+        return len(select.select([self.conn], [], [], 0)[0]) > 0
+
+    def write(self, data):
+        self.conn.sendall(data)
+
+
+
+class _FdStream(object):
+    def __init__(self, fd):
+        self.fd = fd
+
+    def read(self, n):
+        data = b""
+        while len(data) < n:
+            try:
+                chunk = os.read(self.fd, n - len(data))
+            except OSError:
+                break
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def available(self):
+        return len(select.select([self.fd], [], [], 0)[0]) > 0
+
+    def write(self, data):
+        while data:
+            data = data[os.write(self.fd, data):]
+
+
+
+class EmulatorSocketServer(object):
+
+    def __init__(self, emulator, host="127.0.0.1", port=0):
+        """\
+        Makes an :class:`ArduinoEmulator` available over TCP. Connect to it using
+        the URL in the `url` attribute (e.g. by passing it to :func:`arduino.connect`).
+
+        Connections are served one at a time, in the same way that only one
+        program can open the Arduino's serial port at a time.
+
+        :param emulator: the :class:`ArduinoEmulator` to serve
+        :param host: address to listen on
+        :param port: port to listen on (0 = pick any free port)
+        """
+        super(EmulatorSocketServer, self).__init__()
+        self.emulator = emulator
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(1)
+        self.host, self.port = self.sock.getsockname()
+        self.url = "socket://%s:%d" % (self.host, self.port)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.sock.close()
+
+    def _run(self):
+        while True:
+            try:
+                conn, addr = self.sock.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                self.emulator.serve(_SocketStream(conn))
+            except OSError:
+                pass
+            finally:
+                conn.close()
+
+
+
+class EmulatorPty(object):
+
+    def __init__(self, emulator):
+        """\
+        Makes an :class:`ArduinoEmulator` available via a pseudo-terminal (POSIX only).
+        The device name for the serial port is in the `url` attribute.
+
+        :param emulator: the :class:`ArduinoEmulator` to serve
+        """
+        super(EmulatorPty, self).__init__()
+        import tty
+        self.emulator = emulator
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.url = os.ttyname(self.slave)
+        self.thread = threading.Thread(target=self.emulator.serve, args=(_FdStream(self.master),))
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+
+def _loadMetadata(filename):
+    import json
+    f = open(filename)
+    metadata = json.load(f)
+    f.close()
+    return metadata
+
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Emulates an Arduino Due running the sampling code, for testing without the measurement hardware.")
+    parser.add_argument("--light0", dest="light0_metadatafile", type=str, help="JSON metadata file describing the flashes seen by light sensor input 0.")
+    parser.add_argument("--audio0", dest="audio0_metadatafile", type=str, help="JSON metadata file describing the beeps heard by audio input 0.")
+    parser.add_argument("--light1", dest="light1_metadatafile", type=str, help="JSON metadata file describing the flashes seen by light sensor input 1.")
+    parser.add_argument("--audio1", dest="audio1_metadatafile", type=str, help="JSON metadata file describing the beeps heard by audio input 1.")
+    parser.add_argument("--offsetMillis", dest="offsetMillis", type=float, default=0.0, help="How early (positive) or late (negative) the emulated device presents flashes and beeps (default=0)")
+    parser.add_argument("--driftPpm", dest="driftPpm", type=float, default=0.0, help="How fast (positive) or slow (negative) the emulated Arduino clock runs in ppm (default=0)")
+    parser.add_argument("--noise", dest="noise", type=int, default=0, help="Amplitude of random noise added to sample values (default=0)")
+    parser.add_argument("--latencyMillis", dest="latencyMillis", type=float, default=0.0, help="USB latency in each direction in milliseconds (default=0)")
+    parser.add_argument("--jitterMillis", dest="jitterMillis", type=float, default=0.0, help="Mean additional random USB latency in milliseconds (default=0)")
+    parser.add_argument("--addr", dest="addr", type=str, default="127.0.0.1", help="IP address to listen on (default=127.0.0.1)")
+    parser.add_argument("--port", dest="port", type=int, default=0, help="Port to listen on (default=any free port)")
+    parser.add_argument("--pty", dest="pty", action="store_true", default=False, help="Serve via a pseudo-terminal instead of a TCP socket (POSIX only)")
+    args = parser.parse_args()
+
+    pinMetadata = {}
+    for pin, filename in enumerate([ args.light0_metadatafile, args.audio0_metadatafile, args.light1_metadatafile, args.audio1_metadatafile ]):
+        if filename is not None:
+            pinMetadata[pin] = _loadMetadata(filename)
+
+    emulator = ArduinoEmulator(pinMetadata, offsetSecs=args.offsetMillis / 1000.0, driftPpm=args.driftPpm, noise=args.noise,
+                               usbLatencySecs=args.latencyMillis / 1000.0, usbJitterSecs=args.jitterMillis / 1000.0)
+    if args.pty:
+        server = EmulatorPty(emulator)
+    else:
+        server = EmulatorSocketServer(emulator, args.addr, args.port)
+    server.start()
+
+    print("Emulated Arduino Due available at: %s" % server.url)
+    print("Press Ctrl-C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    server.stop()
+    sys.exit(0)
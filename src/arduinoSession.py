@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+A long-lived connection to the Arduino Due, for running many captures one
+after another.
+
+:class:`ArduinoSession` finds the Arduino once and keeps the serial port
+open between captures. If the Arduino is reset (e.g. it is unplugged and
+plugged back in) it finds and reopens the port, and sets the transfer encoding
+again (see :meth:`ArduinoSession.setTransferEncoding`), as the Arduino forgets it
+when it is reset.
+
+It also cuts the number of round trips needed to set up a capture: the pin
+enable commands and the prepare to capture command are all written at once,
+then the replies are read back (see :meth:`ArduinoSession.setupCapture`).
+
+
+Usage
+-----
+
+.. code-block:: python
+
+    session = ArduinoSession()
+    for i in range(0, 100):
+        nActivePorts, nMilliBlocks, timeDatas = session.setupCapture(clock, [0, 1], 10)
+        ... = arduino.capture(session.f, clock)
+        ... = arduino.bulkTransfer(session.f, clock)
+    session.close()
+
+"""
+
+import time
+
+import arduino
+import lazyImport
+
+serial = lazyImport.LazyModule("serial", package="pyserial")
+
+
+
+class ArduinoSession(object):
+
+    def __init__(self, url=None, reopenAttempts=10, reopenDelaySecs=0.5):
+        """\
+        Long-lived connection to an Arduino. The connection is opened when first needed.
+
+        :param url: None to search for an Arduino Due connected via USB. Otherwise the serial port or URL to connect to
+            (see :func:`arduino.connect`)
+        :param reopenAttempts: number of times to look for the Arduino again after it has been reset
+        :param reopenDelaySecs: time to wait between attempts, to allow the Arduino to reappear on the USB bus
+        """
+        super(ArduinoSession, self).__init__()
+        self.url = url
+        self.reopenAttempts = reopenAttempts
+        self.reopenDelaySecs = reopenDelaySecs
+        self.port = None
+        self.transferEncoding = arduino.ENCODING_RAW
+        self._encodingClock = None
+        self._f = None
+
+
+    @property
+    def f(self):
+        """\
+        The file handle for the serial connection to the Arduino, for passing to the functions in :mod:`arduino`.
+        The connection is opened if needed.
+        """
+        if self._f is None:
+            self.open()
+        return self._f
+
+
+    def open(self):
+        """\
+        Open the connection to the Arduino, only searching for it if it has not already been found.
+        If a transfer encoding other than raw has been set, it is set again.
+
+        :raises RuntimeError: if unable to detect a connected Arduino Due
+        """
+        if self.url is not None:
+            f = arduino.connect(self.url)
+        else:
+            if self.port is None:
+                self.port = arduino.findArduinoPort()
+            f = arduino.connect(self.port)
+        if self.transferEncoding != arduino.ENCODING_RAW:
+            try:
+                self.transferEncoding = arduino.setTransferEncoding(f, self._encodingClock, self.transferEncoding)[0]
+            except Exception:
+                f.close()
+                raise
+        self._f = f
+
+
+    def close(self):
+        if self._f is not None:
+            try:
+                self._f.close()
+            except (serial.SerialException, OSError):
+                pass
+            self._f = None
+
+
+    def reopen(self):
+        """\
+        Close and reopen the connection, e.g. after the Arduino has been reset.
+        When searching via USB, the Arduino is searched for again, as it may have reappeared under a different
+        port name.
+
+        :raises RuntimeError: if the Arduino does not reappear
+        """
+        self.close()
+        for attempt in range(0, self.reopenAttempts):
+            if self.url is None:
+                self.port = None
+            try:
+                self.open()
+                return
+            except (RuntimeError, serial.SerialException, OSError):
+                time.sleep(self.reopenDelaySecs)
+        raise RuntimeError("Could not reopen arduino serial port connection after it was reset.")
+
+
+    def run(self, func, *args):
+        """\
+        Call a function, passing it the file handle and the given arguments. If communication with the Arduino fails,
+        reopen the connection and try once more.
+
+        Only use this for commands that can safely be repeated, because the Arduino loses its state when it is reset.
+
+        :param func: function to call, e.g. :func:`arduino.prepareToCapture`
+        :returns: whatever the function returns
+        """
+        try:
+            return func(self.f, *args)
+        except (serial.SerialException, OSError):
+            self.reopen()
+            return func(self.f, *args)
+
+
+    def setTransferEncoding(self, clock, encoding):
+        """\
+        Choose how the Arduino encodes the sample data for bulk transfers (see :func:`arduino.setTransferEncoding`).
+        The encoding is remembered, and set again whenever the connection is reopened.
+
+        :param clock: a :class:`dvbcss.clock` clock object
+        :param encoding: :data:`arduino.ENCODING_RAW` or :data:`arduino.ENCODING_RLE`
+        :returns: the encoding the Arduino will now use, which is also available as the attribute :data:`transferEncoding`
+        """
+        self.transferEncoding = self.run(arduino.setTransferEncoding, clock, encoding)[0]
+        self._encodingClock = clock
+        return self.transferEncoding
+
+
+    def setupCapture(self, clock, pins, captureSecs):
+        """\
+        Enable sampling of pins and prepare the Arduino to capture, in a single write.
+        Retried once, after reopening the connection, if communication with the Arduino fails.
+
+        :param clock: a :class:`dvbcss.clock` clock object
+        :param pins: list of pin numbers to enable (see :func:`arduino.samplePinDuringCapture`)
+        :param captureSecs: the number of seconds to capture from the pin(s)
+
+        :returns: tuple (nActivePorts, nMilliBlocks, timeDatas) where nActivePorts and nMilliBlocks are as returned
+            by :func:`arduino.prepareToCapture` and timeDatas is a list of round-trip timing data, one per command sent
+
+        Every command is sent at the time t1 recorded in the round-trip timing data, so the replies to later commands
+        show longer round-trip times. These should not be used for clock synchronisation.
+        """
+        return self.run(pipelinedSetup, clock, pins, captureSecs)
+
+
+
+def pipelinedSetup(f, clock, pins, captureSecs):
+    """\
+    Send the pin enable commands and the prepare to capture command in a single write, then read the replies.
+
+    See :meth:`ArduinoSession.setupCapture`
+    """
+    cmds = [ arduino.CMDS_ENABLE_PIN[pin] for pin in pins ]
+    cmds.append(arduino.CMD_PREPARE_TO_CAPTURE + chr(captureSecs))
+
+    t1 = clock.ticks
+    f.write("".join(cmds).encode("latin-1"))
+
+    timeDatas = []
+    for cmd in cmds:
+        n, t4 = arduino.getIntWithTime(f, clock)
+        arduinoArrivalTime = n * 1000
+        timeDatas.append([ t1, arduinoArrivalTime, arduinoArrivalTime, t4 ])
+    nActivePorts = arduino.getInt(f)
+    nMilliBlocks = arduino.getInt(f)
+    return nActivePorts, nMilliBlocks, timeDatas
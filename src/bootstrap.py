@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Bootstrap confidence intervals for the statistics of observed timings: the
+mean offset, percentiles of the offsets and the proportion of observations
+within a tolerance (the pass rate).
+
+The observations are resampled with replacement many times. Each batch of
+resamples is drawn as a matrix of indices (one row per resample), so the statistics
+for the whole batch are calculated with array operations. Batches can be spread
+across a pool of processes. Each batch has its own random seed, derived from the
+seed given, so results are exactly the same for the same seed however many
+processes are used.
+
+Confidence intervals are found using the percentile method.
+
+Requires 'numpy'.
+
+
+Usage
+-----
+
+.. code-block:: python
+
+    result = bootstrap(diffsAndErrors, toleranceSecs=0.01, nResamples=10000, seed=1, processes=4)
+    print(result["meanOffsetSecs"]["lo"], result["meanOffsetSecs"]["hi"])
+    printBootstrap(result)
+
+"""
+
+import multiprocessing
+
+import numpy
+
+from stats import PERCENTILES, determineWithinTolerance
+
+
+DEFAULT_RESAMPLES = 10000
+DEFAULT_CONFIDENCE = 0.95
+
+# number of resamples drawn in each batch (and so the number of rows of each index matrix)
+DEFAULT_BATCH_SIZE = 1000
+
+
+
+def _resampleBatch(args):
+    """\
+    :returns: tuple (means, percentiles, passRates) of arrays of the statistics for each resample in a batch.
+        passRates is None if there is no tolerance.
+    """
+    diffs, passes, seedSequence, size, percentiles = args
+    rng = numpy.random.default_rng(seedSequence)
+    indices = rng.integers(0, len(diffs), size=(size, len(diffs)))
+    resampled = diffs[indices]
+    means = resampled.mean(axis=1)
+    percentileValues = numpy.percentile(resampled, percentiles, axis=1).reshape(len(percentiles), size)
+    passRates = None if passes is None else passes[indices].mean(axis=1)
+    return means, percentileValues, passRates
+
+
+
+def _interval(estimate, samples, confidence):
+    lo, hi = numpy.percentile(samples, [ 50.0 * (1.0 - confidence), 50.0 * (1.0 + confidence) ])
+    return { "estimate" : float(estimate), "lo" : float(lo), "hi" : float(hi) }
+
+
+
+def bootstrap(diffsAndErrors, toleranceSecs=None, nResamples=DEFAULT_RESAMPLES, confidence=DEFAULT_CONFIDENCE, percentiles=PERCENTILES, seed=None, processes=None, batchSize=DEFAULT_BATCH_SIZE):
+    """\
+    Calculate bootstrap confidence intervals.
+
+    :param diffsAndErrors: List of tuples (diff, err) in seconds, as for :func:`stats.computeStats`
+    :param toleranceSecs: None, or a tolerance (in seconds). If given, an interval is also found for the
+        proportion of observations within it (taking into account error bounds, see :func:`stats.determineWithinTolerance`)
+    :param nResamples: number of times to resample the observations
+    :param confidence: the confidence level of the intervals, e.g. 0.95
+    :param percentiles: the percentiles (0 to 100) of the offsets to find intervals for
+    :param seed: None, or an integer seed, to make the results reproducible
+    :param processes: None or 1 to resample in this process. Otherwise the number of processes to spread the batches across.
+    :param batchSize: number of resamples in each batch
+
+    :returns: dict with keys:
+        * "count", "nResamples", "confidence", "seed" ... as given
+        * "meanOffsetSecs" ... interval for the mean offset
+        * "offsetPercentilesSecs" ... dict mapping each percentile (as a string, e.g. "50") to an interval
+        * "passRate" ... interval for the proportion of observations within the tolerance, or None if no tolerance was given
+        Each interval is a dict with keys "estimate" (from the observations themselves), "lo" and "hi".
+
+    :raises ValueError: if there are no observations, or nResamples or batchSize is less than 1
+    """
+    if len(diffsAndErrors) == 0:
+        raise ValueError("No observations to resample.")
+    if nResamples < 1:
+        raise ValueError("Number of resamples must be at least 1.")
+    if batchSize < 1:
+        raise ValueError("Batch size must be at least 1.")
+
+    data = numpy.asarray(diffsAndErrors, dtype=float).reshape(-1, 2)
+    diffs = data[:,0]
+    if toleranceSecs is None:
+        passes = None
+    else:
+        passes = numpy.asarray(determineWithinTolerance(diffsAndErrors, toleranceSecs)[1]) == 0
+
+    batchSizes = [ batchSize ] * (nResamples // batchSize)
+    if nResamples % batchSize:
+        batchSizes.append(nResamples % batchSize)
+    seedSequences = numpy.random.SeedSequence(seed).spawn(len(batchSizes))
+    tasks = [ (diffs, passes, seedSequence, size, list(percentiles)) for seedSequence, size in zip(seedSequences, batchSizes) ]
+
+    if processes is None or processes <= 1:
+        batches = [ _resampleBatch(task) for task in tasks ]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            batches = pool.map(_resampleBatch, tasks)
+
+    means = numpy.concatenate([ batch[0] for batch in batches ])
+    percentileValues = numpy.concatenate([ batch[1] for batch in batches ], axis=1)
+
+    result = {
+        "count" : len(diffs),
+        "nResamples" : nResamples,
+        "confidence" : confidence,
+        "seed" : seed,
+        "meanOffsetSecs" : _interval(diffs.mean(), means, confidence),
+        "offsetPercentilesSecs" : {},
+        "passRate" : None,
+    }
+    estimates = numpy.percentile(diffs, percentiles)
+    for i, p in enumerate(percentiles):
+        result["offsetPercentilesSecs"][str(p)] = _interval(estimates[i], percentileValues[i], confidence)
+    if passes is not None:
+        passRates = numpy.concatenate([ batch[2] for batch in batches ])
+        result["passRate"] = _interval(passes.mean(), passRates, confidence)
+    return result
+
+
+
+def printBootstrap(result):
+    """\
+    Prints out confidence intervals calculated by :func:`bootstrap`.
+
+    :returns: Nothing. Output is printed to standard output.
+    """
+    print("Confidence intervals (%g%%, from %d resamples of %d readings):" % (result["confidence"]*100, result["nResamples"], result["count"]))
+    def line(label, interval, scale, units):
+        print("    %-14s: %9.3f %-2s   (%.3f to %.3f)" % (label, interval["estimate"]*scale, units, interval["lo"]*scale, interval["hi"]*scale))
+    line("Mean offset", result["meanOffsetSecs"], 1000.0, "ms")
+    for p in sorted(result["offsetPercentilesSecs"], key=float):
+        line("%s%% offset" % p, result["offsetPercentilesSecs"][p], 1000.0, "ms")
+    if result["passRate"] is not None:
+        line("Pass rate", result["passRate"], 100.0, "%")
+
+
+
+if __name__ == "__main__":
+
+    import random
+
+    rand = random.Random(0)
+    diffsAndErrors = [ (rand.gauss(0.010, 0.004), 0.002) for i in range(0, 200) ]
+    printBootstrap(bootstrap(diffsAndErrors, toleranceSecs=0.015, seed=1))
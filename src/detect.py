@@ -80,6 +80,12 @@ the arduino performed its sampling process. The times are all in nanoseconds:
         },
     }    
 
+Optionally, there can also be a "mid" entry: a list of request-response
+exchanges made while the arduino was sampling. If there are any, then arduino
+times are mapped to wall clock times by straight lines between consecutive
+exchanges instead of one straight line from "pre" to "post". This stops any
+drift of the arduino clock during a long capture from adding to the error.
+
 
 **2. The tick rate of the synchronisation timeline (in Hz).**
 
@@ -202,8 +208,12 @@ each in units of ticks of the synchronisation timeline.
 
 """
 
+import bisect
 import math
 
+import arduino
+import instrumentation
+
 # ---------------------------------------------------------------------------
 
 
@@ -280,6 +290,75 @@ class ErrorBoundInterpolator(object):
         return self._a2b(v)
 
 
+class PiecewiseConvertAtoB(object):
+    def __init__(self, points):
+        """\
+        Returns a function that maps from reference frame A to reference frame B
+        where the relationship is defined by straight lines between consecutive
+        points in a list of (a,b) points (see :class:`ConvertAtoB`).
+
+        Values of A before the first point, or after the last, are extrapolated
+        from the first or last line respectively.
+
+        :param points: list of at least two (a,b) tuples, in any order. If several
+            have the same value of a, then only the first is used.
+        """
+        super(PiecewiseConvertAtoB, self).__init__()
+        points = _uniquePoints(points)
+        if len(points) < 2:
+            raise ValueError("Need at least two points with different values in reference frame A.")
+        self.aValues = [ a for a, b in points ]
+        self.segments = [ ConvertAtoB(p1, p2) for p1, p2 in zip(points[:-1], points[1:]) ]
+
+    def __call__(self, a):
+        i = bisect.bisect_right(self.aValues, a) - 1
+        i = min(max(i, 0), len(self.segments) - 1)
+        return self.segments[i](a)
+
+
+
+class PiecewiseErrorBoundInterpolator(object):
+    def __init__(self, points):
+        """\
+        Given readings taken at several points and the error bounds of those
+        readings, interpolates the error between consecutive points (see
+        :class:`ErrorBoundInterpolator`).
+
+        Will not work outside the range from the first to the last point.
+
+        :param points: list of at least two (v, errorBound) tuples, in any order. If several
+            have the same value of v, then only the first is used.
+        """
+        super(PiecewiseErrorBoundInterpolator, self).__init__()
+        points = _uniquePoints(points)
+        if len(points) < 2:
+            raise ValueError("Need at least two points with different values.")
+        self.lo = points[0][0]
+        self.hi = points[-1][0]
+        self.vValues = [ v for v, e in points ]
+        self.segments = [ ErrorBoundInterpolator(p1, p2) for p1, p2 in zip(points[:-1], points[1:]) ]
+
+    def __call__(self, v):
+        if v<self.lo or v>self.hi:
+            raise ValueError("Cannot extrapolate error for "+str(v)+" because it is outside of the range from "+str(self.lo)+" to "+str(self.hi)+" covered by the interpolator.")
+        i = bisect.bisect_right(self.vValues, v) - 1
+        i = min(i, len(self.segments) - 1)
+        return self.segments[i](v)
+
+
+
+def _uniquePoints(points):
+    """\
+    :returns: list of the points, sorted by their first value, keeping only the first point for each first value
+    """
+    unique = []
+    for point in sorted(points, key=lambda point: point[0]):
+        if not unique or unique[-1][0] != point[0]:
+            unique.append(point)
+    return unique
+
+
+
 def calcAcWcCorrelationAndDispersion( wcT1, acT2, acT3, wcT4, wcPrecision, acPrecision ):
     """\
     Returns correlation and dispersion at the time of the correlation given
@@ -301,6 +380,74 @@ def calcAcWcCorrelationAndDispersion( wcT1, acT2, acT3, wcT4, wcPrecision, acPre
     return correlation, dispersion
 
 
+def selectLowestRttExchange(exchanges):
+    """\
+    Given one or more clock sync request-response exchanges, returns the one
+    with the lowest round-trip time (and therefore the lowest dispersion when
+    passed to :func:`calcAcWcCorrelationAndDispersion`).
+
+    :param exchanges: Either a single (t1, t2, t3, t4) tuple, or a list of them
+        (e.g. from a burst of exchanges). All values in nanoseconds.
+
+    :returns: (t1, t2, t3, t4) with the lowest round-trip time
+    """
+    if len(exchanges) == 0:
+        raise ValueError("Need at least one clock sync request-response exchange.")
+
+    if not isinstance(exchanges[0], (list, tuple)):
+        return exchanges
+
+    return tuple(min(exchanges, key=arduino.roundTripTime))
+
+
+
+class IndexedControlTimestamps(object):
+
+    def __init__(self, whens, correlations):
+        """\
+        A history of control timestamp style data, already sorted by the time at which each was recorded,
+        and indexed by that time, ready for use by :class:`TimelineReconstructor`.
+
+        :param whens: list of times (on the parent timeline) at which each correlation was recorded, in ascending order
+        :param correlations: list of corresponding tuples (parentTime, timelineTime, speed)
+
+        Iterating over it gives tuples (parentTimeAt, (parentTime, timelineTime, speed)), in the same form as
+        the list that :class:`TimelineReconstructor` otherwise accepts.
+        """
+        super(IndexedControlTimestamps, self).__init__()
+        if len(whens) != len(correlations):
+            raise ValueError("Need a correlation for every time at which one was recorded.")
+        self.whens = whens
+        self.correlations = correlations
+
+    @classmethod
+    def fromUnsorted(cls, timestampedControlTimestamps):
+        """\
+        :param timestampedControlTimestamps: list of tuples: (parentTimeAt, (parentTime,timelineTime, speed)), in any order
+        :returns: an :class:`IndexedControlTimestamps`
+        """
+        ordered = sorted(timestampedControlTimestamps)
+        return cls([ when for when, cT in ordered ], [ tuple(cT) for when, cT in ordered ])
+
+    def __len__(self):
+        return len(self.whens)
+
+    def __iter__(self):
+        return iter(list(zip(self.whens, self.correlations)))
+
+    def around(self, at):
+        """\
+        :param at: Time on the parent timeline
+        :returns: tuple (mostRecent, next) where mostRecent is the last entry recorded at or before the time and next
+            is the entry after it. Each is a tuple (parentTimeAt, (parentTime, timelineTime, speed)), or None
+            if there is no such entry.
+        """
+        i = bisect.bisect_right(self.whens, at)
+        mostRecent = (self.whens[i-1], self.correlations[i-1]) if i > 0 else None
+        following = (self.whens[i], self.correlations[i]) if i < len(self.whens) else None
+        return mostRecent, following
+
+
 
 class TimelineReconstructor(object):
 
@@ -316,12 +463,15 @@ class TimelineReconstructor(object):
         convert wall clock times to sync timeline times using only the
         information available at any particular point in the past.
         
-        :param timestampedControlTimestamps: list of tuples: (parentTimeAt, (parentTime,timelineTime, speed))
+        :param timestampedControlTimestamps: list of tuples: (parentTimeAt, (parentTime,timelineTime, speed)),
+            or an :class:`IndexedControlTimestamps`, which is used as it is, without sorting it again
         :param parentTickRate: tick rate of parent timeline (ticks per second)
         :param timelineTickRate: tick rate of timeline being reconstructed
         :param interpolate: if True, then (assuming speeds don't change) will interpolate between consecutive control timestamps
         """
-        self.controlTimestamps = sorted(timestampedControlTimestamps)
+        if not isinstance(timestampedControlTimestamps, IndexedControlTimestamps):
+            timestampedControlTimestamps = IndexedControlTimestamps.fromUnsorted(timestampedControlTimestamps)
+        self.controlTimestamps = timestampedControlTimestamps
         self.parentTickRate = float(parentTickRate)
         self.childTickRate = float(childTickRate)
         self.interpolate = interpolate
@@ -338,14 +488,7 @@ class TimelineReconstructor(object):
         
         # first find the control timestamp "most recent" and the one after
         # (if there is one)
-        controlTimestamp = None
-        nextControlTimestamp = None
-        for when, cT in self.controlTimestamps:
-            if when <= at:
-                controlTimestamp = when, cT
-            else:
-                nextControlTimestamp = when, cT
-                break
+        controlTimestamp, nextControlTimestamp = self.controlTimestamps.around(at)
             
         if controlTimestamp is None:
             raise ValueError("Asked for a conversion at a time at which no control timestamps had yet arrived.")
@@ -587,6 +730,10 @@ class BeepFlashDetector(object):
         * Arduino time at which request was received by the Arduino (t2),
         * Arduino time at which response was sent by the Arduino (t3)
         * PC time at which response was received by the PC (t4)
+        Instead of a single 4-tuple, the value can be a list of 4-tuples (e.g. from a burst
+        of exchanges). The one with the lowest round-trip time is used (see :func:`selectLowestRttExchange`).
+        There can also be a "mid" key, whose value is a list of 4-tuples from exchanges made
+        during the sampling period. All of these are used.
         
         :param syncTimelineTickRate: The tick rate (in Hz) of the synchronisation timeline used for the CSS-TS exchanges
 
@@ -616,21 +763,36 @@ class BeepFlashDetector(object):
         acWcCorr = {}
         acWcDisp = {}
 
-        t1, t2, t3, t4 = wcAcReqResp["pre"]
+        t1, t2, t3, t4 = selectLowestRttExchange(wcAcReqResp["pre"])
         acWcCorr["pre"], acWcDisp["pre"] = calcAcWcCorrelationAndDispersion(t1, t2, t3, t4, wcPrecisionNanos, acPrecisionNanos)
     
-        t1, t2, t3, t4 = wcAcReqResp["post"]
+        t1, t2, t3, t4 = selectLowestRttExchange(wcAcReqResp["post"])
         acWcCorr["post"], acWcDisp["post"] = calcAcWcCorrelationAndDispersion(t1, t2, t3, t4, wcPrecisionNanos, acPrecisionNanos)
     
-        # create an object that can convert between arduino and wall clock time
-        ac2wc = ConvertAtoB(acWcCorr["pre"], acWcCorr["post"])
-        
-        # create an object that can calculate error bound on arduino time estimates
-        # given a particular arduino time (ignoring sampling resolution atm)
+        # and for any made during the sampling process
+        midCorrs = []
+        midDisps = []
+        for t1, t2, t3, t4 in wcAcReqResp.get("mid", []):
+            corr, disp = calcAcWcCorrelationAndDispersion(t1, t2, t3, t4, wcPrecisionNanos, acPrecisionNanos)
+            midCorrs.append(corr)
+            midDisps.append(disp)
+
         acPreTime = acWcCorr["pre"][0]
         acPostTime = acWcCorr["post"][0]
 
-        ac2acErr = ErrorBoundInterpolator( (acPreTime, acWcDisp["pre"]), (acPostTime, acWcDisp["post"]) )
+        if not midCorrs:
+            # create an object that can convert between arduino and wall clock time
+            ac2wc = ConvertAtoB(acWcCorr["pre"], acWcCorr["post"])
+
+            # create an object that can calculate error bound on arduino time estimates
+            # given a particular arduino time (ignoring sampling resolution atm)
+            ac2acErr = ErrorBoundInterpolator( (acPreTime, acWcDisp["pre"]), (acPostTime, acWcDisp["post"]) )
+        else:
+            # as above, but piecewise between each consecutive pair of correlations
+            corrs = [ acWcCorr["pre"] ] + midCorrs + [ acWcCorr["post"] ]
+            disps = [ acWcDisp["pre"] ] + midDisps + [ acWcDisp["post"] ]
+            ac2wc = PiecewiseConvertAtoB(corrs)
+            ac2acErr = PiecewiseErrorBoundInterpolator([ (corr[0], disp) for corr, disp in zip(corrs, disps) ])
         
         wc2wcDisp = wcDispersions
         
@@ -704,15 +866,18 @@ class BeepFlashDetector(object):
     def convertSamplesToDetectionTimings(self, loSampleData, hiSampleData, acStartNanos, acEndNanos, detectFunc, minPulseDuration, holdCount):
         
         # determine indexes in the sample data corresponding to centre time of each pulse
-        pulseIndices = detectFunc(loSampleData, hiSampleData, minPulseDuration, holdCount)
+        with instrumentation.span("detect.detectPulses"):
+            pulseIndices = detectFunc(loSampleData, hiSampleData, minPulseDuration, holdCount)
+        instrumentation.count("detect.pulsesDetected", len(pulseIndices))
         
         # generate list of timings corresponding to start time of each sample
-        stTimesAndErrors = timesForSamples(
-            numSamples=len(loSampleData),
-            acToStFunc=self.ac2st,
-            acFirstSampleStart=acStartNanos,
-            acLastSampleEnd=acEndNanos
-        )
+        with instrumentation.span("detect.timesForSamples"):
+            stTimesAndErrors = timesForSamples(
+                numSamples=len(loSampleData),
+                acToStFunc=self.ac2st,
+                acFirstSampleStart=acStartNanos,
+                acLastSampleEnd=acEndNanos
+            )
         
         timings = []
         
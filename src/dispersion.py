@@ -102,29 +102,40 @@ class DispersionRecorder(object):
         :returns: dispersion (in nanoseconds) when the wall clock had the time specified
         """
         
-        changeInfo = None
-        for ci in self.changeHistory:
-            when = ci[0]
-            if when <= wcTime:
-                changeInfo = ci
-            else:
-                pass # don't abort immediately but instead
-                # keep looking through because, due to clock adjustment we
-                # might get a later recorded history entry that covers the
-                # same range of wall clock values (because the clock could jump
-                # backwards when adjusted)
-        
-        if changeInfo is None:
-            raise ValueError("History did not contain any entries early enough to give dispersion at time "+str(wcTime))
-        
-        # unpack    
-        when, adjustment, oldDispersionNanos, newDispersionNanos, dispersionGrowthRate = changeInfo
-        
-        # 'when' is before 'wcTime'
-        # so we extrapolate the newDispersion
-        timeDiff = wcTime - when
-        dispersion = newDispersionNanos + dispersionGrowthRate * timeDiff
-        
-        return dispersion
+        return dispersionFromHistory(self.changeHistory, wcTime)
 
 
+
+def dispersionFromHistory(changeHistory, wcTime):
+    """\
+    Calculate the dispersion at a given wall clock time from a history of changes in dispersion,
+    such as one recorded by :class:`DispersionRecorder` (or loaded from a stored session, see :mod:`sessionFile`).
+
+    :param changeHistory: list of (timeAfterAdjustment, adjustment, oldDispersionNanos, newDispersionNanos, dispersionGrowthRate)
+    :param wcTime: time of the wall clock
+    :returns: dispersion (in nanoseconds) when the wall clock had the time specified
+    """
+    changeInfo = None
+    for ci in changeHistory:
+        when = ci[0]
+        if when <= wcTime:
+            changeInfo = ci
+        else:
+            pass # don't abort immediately but instead
+            # keep looking through because, due to clock adjustment we
+            # might get a later recorded history entry that covers the
+            # same range of wall clock values (because the clock could jump
+            # backwards when adjusted)
+    
+    if changeInfo is None:
+        raise ValueError("History did not contain any entries early enough to give dispersion at time "+str(wcTime))
+    
+    # unpack    
+    when, adjustment, oldDispersionNanos, newDispersionNanos, dispersionGrowthRate = changeInfo
+    
+    # 'when' is before 'wcTime'
+    # so we extrapolate the newDispersion
+    timeDiff = wcTime - when
+    dispersion = newDispersionNanos + dispersionGrowthRate * timeDiff
+    
+    return dispersion
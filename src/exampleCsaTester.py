@@ -64,6 +64,7 @@ The overall process is:
         light-sensor and audio inputs are to be sampled
 
     Wait for the operator to indicate when the client device under test is ready.
+    (When running headless, instead wait for the readiness conditions in the headless config, see headless.py)
 
         For example, a few seconds of test video clip may have already played before
         the operator arranged for the device under test to attempt to
@@ -93,7 +94,7 @@ The overall process is:
     over CSS_TS protocol.
 
     The operator is prompted to enter the worst case wall clock dispersion for the CSA (the CSA could
-    intermittently print out the dispersion).
+    intermittently print out the dispersion). When running headless, it is taken from the headless config.
 
     This dispersion value is passed to the measurer object.
 
@@ -107,34 +108,38 @@ The overall process is:
 '''
 
 
-import cherrypy
 import sys
 import time
 
-from ws4py.server.cherrypyserver import WebSocketPlugin
-from dvbcss.protocol.server.cii import CIIServer
-
-from dvbcss.protocol.server.wc import WallClockServer
-from dvbcss.protocol.cii import TimelineOption
-from dvbcss.clock import SysClock, CorrelatedClock, measurePrecision
-from dvbcss.protocol.server.ts import TSServer, SimpleClockTimelineSource
-
+import arduino
+import headless
+import instrumentation
+import lazyImport
+import profiling
+import resultsStore
+from headless import HeadlessRun, NotReady
 from measurer import Measurer
 from measurer import DubiousInput
 import stats
+from testsetupcmdline import DEFAULT_MAX_CII_CONNECTIONS, DEFAULT_MAX_TS_CONNECTIONS
+
+# cherrypy (and pydvbcss, imported in the functions that use it) are only imported when needed,
+# so this module can be imported without them installed
+cherrypy = lazyImport.LazyModule("cherrypy", package="cherrypy")
 
 
 
 
 # bind it to the URL path /cii in the cherrypy server
+# (exposed in the same way as by the cherrypy.expose decorator)
 class Root(object):
-    @cherrypy.expose
     def cii(self):
         pass
+    cii.exposed = True
 
-    @cherrypy.expose
     def ts(self):
         pass
+    ts.exposed = True
 
 
 def exposeWebSocketsViaCherrypy(ciiServer, tsServer):
@@ -150,13 +155,17 @@ def exposeWebSocketsViaCherrypy(ciiServer, tsServer):
 
 
 def setupWallClockMaster(maxFreqError, addr, port):
+    from dvbcss.clock import SysClock, measurePrecision
+    from dvbcss.protocol.server.wc import WallClockServer
+
     wallClock=SysClock(tickRate=1000000000)
     precisionSecs=measurePrecision(wallClock)
     wcServer=WallClockServer(wallClock, precisionSecs, maxFreqError, addr, port)
     return (wcServer, wallClock, precisionSecs)
 
 
-def setupCIIAndTSMasters(wclock, contentId, timelineSelector, unitsPerTick, unitsPerSecond):
+def setupCIIAndTSMasters(wclock, contentId, timelineSelector, unitsPerTick, unitsPerSecond, \
+                         maxCiiConnections=DEFAULT_MAX_CII_CONNECTIONS, maxTsConnections=DEFAULT_MAX_TS_CONNECTIONS):
     """\
 
     initialise the web socket plugin for cherrypy, and createthe CII and TS servers
@@ -164,13 +173,20 @@ def setupCIIAndTSMasters(wclock, contentId, timelineSelector, unitsPerTick, unit
     into the cherrypy framework so they will get called when clients connect
     to the respective /cii and /ts web socket resources
 
+    :param maxCiiConnections: the most CSS-CII clients that can be connected at once
+    :param maxTsConnections: the most CSS-TS clients that can be connected at once
+
     """
+    from ws4py.server.cherrypyserver import WebSocketPlugin
+    from dvbcss.protocol.server.cii import CIIServer
+    from dvbcss.protocol.server.ts import TSServer
+
     # initialise the ws4py websocket plugin
     WebSocketPlugin(cherrypy.engine).subscribe()
     # create CII Server
-    ciiServer = CIIServer(maxConnectionsAllowed=2)
+    ciiServer = CIIServer(maxConnectionsAllowed=maxCiiConnections)
     setInitialCII(ciiServer, contentId, timelineSelector, unitsPerTick, unitsPerSecond)
-    tsServer = TSServer(contentId=ciiServer.cii.contentId, wallClock=wclock, maxConnectionsAllowed=3)
+    tsServer = TSServer(contentId=ciiServer.cii.contentId, wallClock=wclock, maxConnectionsAllowed=maxTsConnections)
     exposeWebSocketsViaCherrypy(ciiServer, tsServer)
     return (ciiServer, tsServer)
 
@@ -201,6 +217,8 @@ def setInitialCII(ciiServer, contentId, timelineSelector, unitsPerTick, unitsPer
     them as the user changes to a different service, or a new DVB event occurs on same service
 
     """
+    from dvbcss.protocol.cii import TimelineOption
+
     ciiServer.cii.protocolVersion = "1.1"
     ciiServer.cii.contentId = contentId # "urn:uk.co.bbc.rd:companion-screen:test-calibration-stream"
     ciiServer.cii.contentIdStatus = "final"
@@ -221,6 +239,9 @@ def makeTSServerObjects(tsServer, wallClock, timelineSelector, tickRate, startTi
     client(s) are connected, and only then when sendTSMessage() is called by the harness
 
     """
+    from dvbcss.clock import CorrelatedClock
+    from dvbcss.protocol.server.ts import SimpleClockTimelineSource
+
     syncClock=CorrelatedClock(parentClock=wallClock, tickRate=tickRate)
     syncClock.speed = 0
     syncClock.correlation = (wallClock.ticks, startTickValue)
@@ -244,6 +265,7 @@ def createServers(args):
                 args.addr[0] is host address for servers
                 args.portwc[0] is the WC server port
                 args.portwebsocket[0] is the web socket port via which CII and TS server access occurs
+                args.maxCiiConnections and args.maxTsConnections limit how many CII and TS clients can connect
     :returns tuple (wcServer instance, tsServer instance, wallClock instance,
                     wcUrl, ciiUrl, tsUrl)
 
@@ -254,7 +276,8 @@ def createServers(args):
     tsUrl = "ws://" + args.addr[0] + ":" + str(args.portwebsocket[0])  + "/ts"
 
     wcServer, wallClock, precisionSecs = setupWallClockMaster(args.maxFreqError, args.addr[0], args.portwc[0])
-    ciiServer, tsServer = setupCIIAndTSMasters(wallClock, args.contentId, args.timelineSelector, args.unitsPerTick, args.unitsPerSec)
+    ciiServer, tsServer = setupCIIAndTSMasters(wallClock, args.contentId, args.timelineSelector, args.unitsPerTick, args.unitsPerSec, \
+                                               args.maxCiiConnections, args.maxTsConnections)
     ciiServer.cii.wcUrl = wcUrl
     ciiServer.cii.tsUrl = tsUrl
 
@@ -350,9 +373,31 @@ if __name__ == "__main__":
     cmdParser.setupArguments()
     cmdParser.parseArguments()
 
+    # when running headless, the outcome is written as a single JSON result.
+    # The config is checked before the servers are created, as they are not stopped if it aborts here
+    run = None
+    if cmdParser.headlessConfig is not None:
+        run = HeadlessRun("csa", cmdParser.headlessConfig)
+        if cmdParser.headlessConfig["dispersion"] is None:
+            headless.abortAndExit(run, "Headless config must specify the dispersion of the CSA.")
+
     servers = createServers(cmdParser.args)
     cmdParser.printTestSetup(servers["ciiServer"][1], servers["wcServer"][1], servers["tsServer"][1])
 
+    # record the time spent in each stage, to be written out at the end
+    if cmdParser.args.instrumentationFilename is not None:
+        instrumentation.enable()
+    if cmdParser.args.profileDir is not None:
+        profiling.enable(cmdParser.args.profileDir, cmdParser.args.profileTop)
+
+    # also record the outcome in a results database, if asked to
+    storedRun = None
+    if cmdParser.args.resultsDbFilename is not None:
+        storedRun = resultsStore.StoredRun(cmdParser.args.resultsDbFilename, "csa", \
+                                           device=cmdParser.args.deviceLabel, firmware=cmdParser.args.firmwareLabel, \
+                                           rig=cmdParser.args.rigLabel, content=cmdParser.args.contentId, \
+                                           toleranceSecs=cmdParser.args.toleranceSecs[0])
+
     syncTimelineClock, syncClockTickRate = createTimeline(servers["tsServer"][0], servers["wallclock"], cmdParser.args)
 
     # measure precision of wall clock empirically
@@ -367,20 +412,36 @@ if __name__ == "__main__":
     # once servers are started, need to catch keyboard interrupt to close them
     # down in event of ctrl-c to exit the app
     try:
-        measurer = Measurer("master", \
-                            cmdParser.pinsToMeasure, \
-                            cmdParser.pinExpectedTimes, \
-                            cmdParser.pinEventDurations, \
-                            cmdParser.args.videoStartTicks, \
-                            servers["wallclock"], \
-                            syncTimelineClock, \
-                            syncClockTickRate, \
-                            wcPrecisionNanos, \
-                            acPrecisionNanos, \
-                            cmdParser.measurerTime)
-
-        print()
-        input("Press RETURN once CSA is connected and synchronising to this 'TV Device' server")
+        with profiling.stage("setup"):
+            measurer = Measurer("master", \
+                                cmdParser.pinsToMeasure, \
+                                cmdParser.pinExpectedTimes, \
+                                cmdParser.pinEventDurations, \
+                                cmdParser.args.videoStartTicks, \
+                                servers["wallclock"], \
+                                syncTimelineClock, \
+                                syncClockTickRate, \
+                                wcPrecisionNanos, \
+                                acPrecisionNanos, \
+                                cmdParser.measurerTime, \
+                                syncBurstSize=cmdParser.args.syncBurstSize, \
+                                arduinoUrl=cmdParser.args.arduinoUrl, \
+                                transferEncoding=arduino.ENCODING_RLE if cmdParser.args.compressTransfer else arduino.ENCODING_RAW, \
+                                syncIntervalSecs=cmdParser.args.syncIntervalSecs)
+            if storedRun is not None:
+                measurer.recordResults(storedRun, cmdParser.args.toleranceSecs[0])
+
+        if run is None:
+            print()
+            input("Press RETURN once CSA is connected and synchronising to this 'TV Device' server")
+        else:
+            minTsClients = cmdParser.headlessConfig["minTsClients"]
+            try:
+                run.waitFor("%d CSS-TS client(s) to connect" % minTsClients, \
+                            lambda : len(servers["tsServer"][0].getConnections()) >= minTsClients)
+            except NotReady as e:
+                headless.abortAndExit(run, str(e))
+            time.sleep(cmdParser.headlessConfig["settleSecs"])
 
         # let the sync time line clock start ticking and inform any TS clients
         # the CSA will position the playback of the test video and start playing it.
@@ -393,40 +454,77 @@ if __name__ == "__main__":
         time.sleep(cmdParser.args.waitSecs[0])
 
         print("Beginning to measure")
-        measurer.capture()
+        with profiling.stage("capture"):
+            measurer.capture()
 
         print("Measurement complete. Timeline paused again.")
         pauseSyncTimelineClock(syncTimelineClock)
         servers["tsServer"][0].updateAllClients()
 
-        worstCaseDispersion = getWorstCaseDispersionFromDeviceUnderTest()
+        if run is None:
+            worstCaseDispersion = getWorstCaseDispersionFromDeviceUnderTest()
+        else:
+            try:
+                worstCaseDispersion = headless.dispersionFromConfig(cmdParser.headlessConfig)
+            except (IOError, ValueError) as e:
+                headless.abortAndExit(run, "Could not read dispersion: "+str(e))
+            run.set("syncRttStats", measurer.syncRttStats)
 
         def dispersionFunc(wcTime):
             return worstCaseDispersion
 
-        measurer.detectBeepsAndFlashes(dispersionFunc = dispersionFunc)
+        if cmdParser.args.sessionFilename is not None:
+            measurer.saveSession(cmdParser.args.sessionFilename, worstCaseDispersion)
+
+        with profiling.stage("detect"):
+            measurer.detectBeepsAndFlashes(dispersionFunc = dispersionFunc)
 
         for channel in measurer.getComparisonChannels():
             try:
-                index, expected, timeDifferencesAndErrors = measurer.doComparison(channel)
+                with profiling.stage("compare"):
+                    index, expected, timeDifferencesAndErrors = measurer.doComparison(channel)
 
                 print()
                 print("Results for channel: %s" % channel["pinName"])
                 print("----------------------------")
                 stats.calcAndPrintStats(index, expected, timeDifferencesAndErrors, cmdParser.args.toleranceSecs[0])
+                if run is not None:
+                    run.addChannelResult(channel["pinName"], index, expected, timeDifferencesAndErrors, cmdParser.args.toleranceSecs[0])
 
             except DubiousInput:
 
                 print()
                 print("Cannot reliably measure on pin: %s" % channel["pinName"])
                 print("Is input plugged into pin?  Is the input level is too low?")
+                if run is not None:
+                    run.addChannelError(channel["pinName"], "Cannot reliably measure on pin", cmdParser.args.toleranceSecs[0])
+
+        if run is not None:
+            run.finish()
+        if storedRun is not None:
+            storedRun.finish()
 
     except KeyboardInterrupt:
-        pass
+        if run is not None:
+            run.abort("Interrupted")
+            run.finish()
+        if storedRun is not None:
+            storedRun.abort("Interrupted")
 
     finally:
         cherrypy.engine.exit()
         servers["wcServer"][0].stop()
+        if instrumentation.current() is not None:
+            instrumentation.current().write(cmdParser.args.instrumentationFilename)
+        if storedRun is not None:
+            storedRun.close()
+        summaryFilename = profiling.finish()
+        if summaryFilename is not None:
+            if run is None:
+                print("Profiling summary written to: %s" % summaryFilename)
+            else:
+                # the JSON result must stay the last line of standard output
+                sys.stderr.write("Profiling summary written to: %s\n" % summaryFilename)
 
 
     sys.exit(0)
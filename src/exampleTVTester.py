@@ -118,6 +118,7 @@ The overall process is:
     to their servers, and timeout if unsuccessful.
 
     Wait for the operator to indicate when the client device under test is ready.
+    (When running headless, instead wait for the readiness conditions in the headless config, see headless.py)
 
         For example, a few seconds of test video clip may have already played before
         the operator arranged for the device under test to attempt to
@@ -145,12 +146,12 @@ The overall process is:
 import sys
 import time
 
-from dvbcss.clock import SysClock, CorrelatedClock, measurePrecision, TunableClock
-from dvbcss.protocol.client.wc.algorithm import LowestDispersionCandidate
-from dvbcss.protocol.client.wc import WallClockClient
-from dvbcss.protocol.client.ts import TSClientClockController
-
-
+import arduino
+import headless
+import instrumentation
+import profiling
+import resultsStore
+from headless import HeadlessRun, NotReady
 from measurer import Measurer
 from measurer import DubiousInput
 from dispersion import DispersionRecorder
@@ -167,6 +168,12 @@ def createCSSClientObjects(cmdParser):
 
     """
     args = cmdParser.args
+    # only imported when needed, so this module can be imported without pydvbcss installed
+    from dvbcss.clock import SysClock, CorrelatedClock, measurePrecision, TunableClock
+    from dvbcss.protocol.client.wc.algorithm import LowestDispersionCandidate
+    from dvbcss.protocol.client.wc import WallClockClient
+    from dvbcss.protocol.client.ts import TSClientClockController
+
     sysclock=SysClock()
     wallClock=TunableClock(sysclock,tickRate=1000000000) # nanos
     # measure precision of wall clock empirically
@@ -214,6 +221,25 @@ if __name__ == "__main__":
     cmdParser.parseArguments()
     cmdParser.printTestSetup()
 
+    # when running headless, the outcome is written as a single JSON result
+    run = None
+    if cmdParser.headlessConfig is not None:
+        run = HeadlessRun("tv", cmdParser.headlessConfig)
+
+    # record the time spent in each stage, to be written out at the end
+    if cmdParser.args.instrumentationFilename is not None:
+        instrumentation.enable()
+    if cmdParser.args.profileDir is not None:
+        profiling.enable(cmdParser.args.profileDir, cmdParser.args.profileTop)
+
+    # also record the outcome in a results database, if asked to
+    storedRun = None
+    if cmdParser.args.resultsDbFilename is not None:
+        storedRun = resultsStore.StoredRun(cmdParser.args.resultsDbFilename, "tv", \
+                                           device=cmdParser.args.deviceLabel, firmware=cmdParser.args.firmwareLabel, \
+                                           rig=cmdParser.args.rigLabel, content=cmdParser.args.contentIdStem, \
+                                           toleranceSecs=cmdParser.args.toleranceSecs[0])
+
     syncTimelineClockController, \
     syncTimelineClock, \
     syncClockTickRate, \
@@ -233,17 +259,24 @@ if __name__ == "__main__":
     # down in event of ctrl-c to exit the app
     try:
 
-        measurer = Measurer("client", \
-                            cmdParser.pinsToMeasure, \
-                            cmdParser.pinExpectedTimes, \
-                            cmdParser.pinEventDurations, \
-                            cmdParser.args.videoStartTicks, \
-                            wallClock, \
-                            syncTimelineClock, \
-                            syncClockTickRate, \
-                            wcPrecisionNanos, \
-                            acPrecisionNanos, \
-                            cmdParser.measurerTime)
+        with profiling.stage("setup"):
+            measurer = Measurer("client", \
+                                cmdParser.pinsToMeasure, \
+                                cmdParser.pinExpectedTimes, \
+                                cmdParser.pinEventDurations, \
+                                cmdParser.args.videoStartTicks, \
+                                wallClock, \
+                                syncTimelineClock, \
+                                syncClockTickRate, \
+                                wcPrecisionNanos, \
+                                acPrecisionNanos, \
+                                cmdParser.measurerTime, \
+                                syncBurstSize=cmdParser.args.syncBurstSize, \
+                                arduinoUrl=cmdParser.args.arduinoUrl, \
+                                transferEncoding=arduino.ENCODING_RLE if cmdParser.args.compressTransfer else arduino.ENCODING_RAW, \
+                                syncIntervalSecs=cmdParser.args.syncIntervalSecs)
+            if storedRun is not None:
+                measurer.recordResults(storedRun, cmdParser.args.toleranceSecs[0])
 
         measurer.setSyncTimeLinelockController(syncTimelineClockController)
 
@@ -255,63 +288,118 @@ if __name__ == "__main__":
         while not syncTimelineClockController.connected and time.time() < timeout:
             time.sleep(0.1)
         if not syncTimelineClockController.connected:
-            sys.stderr.write("\nTimed out trying to connect to CSS-TS. Aborting.\n\n")
-            sys.exit(1)
+            headless.abortAndExit(run, "Timed out trying to connect to CSS-TS.")
 
         print("Connected.")
 
         # check we're receiving control timestamps for a valid timeline
         print("Syncing to timeline...")
-        timeout = time.time() + TIMELINE_AVAILABLE_TIMEOUT
-        while not syncTimelineClockController.timelineAvailable and time.time() < timeout:
-            time.sleep(0.1)
-        if not syncTimelineClockController.timelineAvailable:
-            sys.stderr.write("\n\nWaited a while, but timeline was not available. Aborting.\n\n")
-            sys.exit(1)
+        if run is None:
+            timeout = time.time() + TIMELINE_AVAILABLE_TIMEOUT
+            while not syncTimelineClockController.timelineAvailable and time.time() < timeout:
+                time.sleep(0.1)
+            if not syncTimelineClockController.timelineAvailable:
+                headless.abortAndExit(run, "Waited a while, but timeline was not available.")
+        else:
+            try:
+                run.waitFor("the timeline to become available", lambda : syncTimelineClockController.timelineAvailable)
+            except NotReady as e:
+                headless.abortAndExit(run, str(e))
 
         print("Synced to timeline.")
 
-        input("Press RETURN once ready to begin measuring.")
+        if run is None:
+            input("Press RETURN once ready to begin measuring.")
+            maxDispersion = 1000000000*1.0
+        else:
+            # wait for the wall clock client to achieve the required dispersion, instead of the operator
+            maxDispersion = cmdParser.headlessConfig["maxDispersionMillis"] * 1000000.0
+            try:
+                run.waitFor("wall clock dispersion to fall below %.3f milliseconds" % (maxDispersion / 1000000.0), \
+                            lambda : wallClockClient.algorithm.getCurrentDispersion() <= maxDispersion)
+            except NotReady as e:
+                headless.abortAndExit(run, str(e))
+            time.sleep(cmdParser.headlessConfig["settleSecs"])
 
         # finally check if dispersion is sane before proceeding
         currentDispersion = wallClockClient.algorithm.getCurrentDispersion()
-        if currentDispersion > 1000000000*1.0:
-            sys.stderr.write("\n\nWall clock client synced with dispersion +/- %f.3 milliseconds." % (currentDispersion / 1000000.0))
-            sys.stderr.write("\nWhich is greater than +/- 1 second. Aborting.\n\n")
-            sys.exit(1)
+        if currentDispersion > maxDispersion:
+            headless.abortAndExit(run, "Wall clock client synced with dispersion +/- %.3f milliseconds, which is greater than +/- %.3f milliseconds." % \
+                                       (currentDispersion / 1000000.0, maxDispersion / 1000000.0))
 
 
         print()
         print("Beginning to measure")
-        measurer.capture()
+        with profiling.stage("capture"):
+            measurer.capture()
 
         # sanity check we are still connected to the CSS-TS server
         if not syncTimelineClockController.connected and syncTimelineClockController.timelineAvailable:
-            sys.write("\n\nLost connection to CSS-TS or timeline became unavailable. Aborting.\n\n")
-            sys.exit(1)
+            headless.abortAndExit(run, "Lost connection to CSS-TS or timeline became unavailable.")
+
+        # the dispersion recorded by the wall clock client, unless a headless config specifies otherwise
+        dispersionFunc = dispRecorder.dispersionAt
+        dispersion = dispRecorder.changeHistory
+        if run is not None:
+            try:
+                worstCaseDispersion = headless.dispersionFromConfig(cmdParser.headlessConfig)
+            except (IOError, ValueError) as e:
+                headless.abortAndExit(run, "Could not read dispersion: "+str(e))
+            if worstCaseDispersion is not None:
+                dispersionFunc = lambda wcTime : worstCaseDispersion
+                dispersion = worstCaseDispersion
+            run.set("syncRttStats", measurer.syncRttStats)
 
-        measurer.detectBeepsAndFlashes(dispersionFunc = dispRecorder.dispersionAt)
+        if cmdParser.args.sessionFilename is not None:
+            measurer.saveSession(cmdParser.args.sessionFilename, dispersion)
+
+        with profiling.stage("detect"):
+            measurer.detectBeepsAndFlashes(dispersionFunc = dispersionFunc)
 
         for channel in measurer.getComparisonChannels():
             try:
-                index, expected, timeDifferencesAndErrors = measurer.doComparison(channel)
+                with profiling.stage("compare"):
+                    index, expected, timeDifferencesAndErrors = measurer.doComparison(channel)
 
                 print()
                 print("Results for channel: %s" % channel["pinName"])
                 print("----------------------------")
                 stats.calcAndPrintStats(index, expected, timeDifferencesAndErrors, cmdParser.args.toleranceSecs[0])
+                if run is not None:
+                    run.addChannelResult(channel["pinName"], index, expected, timeDifferencesAndErrors, cmdParser.args.toleranceSecs[0])
 
             except DubiousInput:
 
                 print()
                 print("Cannot reliably measure on pin: %s" % channel["pinName"])
                 print("Is input plugged into pin?  Is the input level is too low?")
+                if run is not None:
+                    run.addChannelError(channel["pinName"], "Cannot reliably measure on pin", cmdParser.args.toleranceSecs[0])
+
+        if run is not None:
+            run.finish()
+        if storedRun is not None:
+            storedRun.finish()
 
     except KeyboardInterrupt:
-        pass
+        if run is not None:
+            run.abort("Interrupted")
+            run.finish()
+        if storedRun is not None:
+            storedRun.abort("Interrupted")
 
     finally:
-        pass
+        if instrumentation.current() is not None:
+            instrumentation.current().write(cmdParser.args.instrumentationFilename)
+        if storedRun is not None:
+            storedRun.close()
+        summaryFilename = profiling.finish()
+        if summaryFilename is not None:
+            if run is None:
+                print("Profiling summary written to: %s" % summaryFilename)
+            else:
+                # the JSON result must stay the last line of standard output
+                sys.stderr.write("Profiling summary written to: %s\n" % summaryFilename)
 
 
     sys.exit(0)
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Support for running the example testers without an operator (headless mode),
+e.g. for unattended overnight sweeps.
+
+Instead of waiting for the operator to press RETURN, the testers wait until
+readiness conditions given in a JSON config file are met. Instead of asking
+the operator for the worst case dispersion of the CSA, it is taken from the
+config file. Each run produces one JSON result, describing either the
+measurements or why the run was aborted.
+
+The config file is a JSON object. All keys are optional:
+
+* "timeoutSecs" ... how long to wait for each readiness condition before aborting (default 60)
+* "pollSecs" ... how often to check readiness conditions (default 0.1)
+* "settleSecs" ... time to wait once all readiness conditions are met, before measuring (default 0)
+* "maxDispersionMillis" ... (TV tester) wait until the wall clock dispersion is below this (default 1000)
+* "minTsClients" ... (CSA tester) wait until this many CSS-TS clients have connected (default 1)
+* "dispersion" ... the wall clock dispersion of the device under test. Either { "worstCaseMillis" : <number> },
+  or { "file" : <filename> } to read the number of milliseconds from a file once the capture is complete
+  (e.g. one written by the CSA). Required by the CSA tester. The TV tester uses its own recorded
+  dispersion unless this is given.
+* "resultFile" ... file to write the JSON result to. If not given, the result is printed as the last line of output.
+
+
+Usage
+-----
+
+.. code-block:: python
+
+    config = loadConfig("sweep.json")
+    run = HeadlessRun("csa", config)
+    try:
+        run.waitFor("the CSA to connect", lambda : ...)
+    except NotReady as e:
+        abortAndExit(run, str(e))
+    ...
+    run.addChannelResult(pinName, index, expected, diffsAndErrors, toleranceSecs)
+    run.finish()
+
+"""
+
+import json
+import sys
+import time
+
+import stats
+
+
+DEFAULTS = {
+    "timeoutSecs" : 60.0,
+    "pollSecs" : 0.1,
+    "settleSecs" : 0.0,
+    "maxDispersionMillis" : 1000.0,
+    "minTsClients" : 1,
+    "dispersion" : None,
+    "resultFile" : None,
+}
+
+
+
+class NotReady(Exception):
+
+    def __init__(self, value):
+        super(NotReady, self).__init__(value)
+
+
+
+def loadConfig(filename):
+    """\
+    Load a headless mode config file, filling in defaults.
+
+    :param filename: name of the JSON config file
+    :returns: dict of config values (see module documentation)
+    :raises ValueError: if the config is not valid
+    """
+    with open(filename) as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError("Headless config must be a JSON object.")
+
+    unknown = set(config.keys()) - set(DEFAULTS.keys())
+    if unknown:
+        raise ValueError("Unrecognised keys in headless config: "+", ".join(sorted(unknown)))
+
+    dispersion = config.get("dispersion")
+    if dispersion is not None:
+        if not isinstance(dispersion, dict) or len(dispersion) != 1 or list(dispersion.keys())[0] not in ("worstCaseMillis", "file"):
+            raise ValueError("Headless config \"dispersion\" must be { \"worstCaseMillis\" : <number> } or { \"file\" : <filename> }")
+
+    result = dict(DEFAULTS)
+    result.update(config)
+    return result
+
+
+
+def waitFor(description, predicate, config):
+    """\
+    Wait until a readiness condition is met.
+
+    :param description: what is being waited for (used in the error message)
+    :param predicate: function that returns True once the condition is met
+    :param config: headless config, providing "timeoutSecs" and "pollSecs"
+    :raises NotReady: if the condition is not met within the timeout
+    """
+    timeout = time.time() + config["timeoutSecs"]
+    while not predicate():
+        if time.time() >= timeout:
+            raise NotReady("Timed out waiting for "+description)
+        time.sleep(config["pollSecs"])
+
+
+
+def abortAndExit(run, message):
+    """\
+    Report that the run has been aborted and exit.
+
+    :param run: None when not running headless, otherwise the :class:`HeadlessRun`, which writes its result
+    :param message: why the run was aborted
+    """
+    sys.stderr.write("\n"+message+" Aborting.\n\n")
+    if run is not None:
+        run.abort(message)
+        run.finish()
+    sys.exit(1)
+
+
+
+def dispersionFromConfig(config):
+    """\
+    :param config: headless config
+    :returns: the worst case dispersion (in nanoseconds) given by the config, or None if it does not specify one
+    :raises ValueError: if the dispersion file does not contain a number
+    """
+    dispersion = config["dispersion"]
+    if dispersion is None:
+        return None
+    if "worstCaseMillis" in dispersion:
+        millis = dispersion["worstCaseMillis"]
+    else:
+        with open(dispersion["file"]) as f:
+            millis = f.read().strip()
+    return float(millis) * 1000000.0
+
+
+
+def summariseChannel(pinName, matchIndex, allExpectedTimes, diffsAndErrors, toleranceSecs=None):
+    """\
+    Summarise the results for one channel, for inclusion in a JSON result. This is the same
+    information that :func:`stats.calcAndPrintStats` prints.
+
+    :param pinName: the name of the pin
+    :param matchIndex, allExpectedTimes, diffsAndErrors, toleranceSecs: see :func:`stats.computeStats`
+    :returns: dict summarising the results (all times in seconds). As returned by :func:`stats.computeStats`,
+        with the addition of "pinName" and "diffsAndErrors".
+    """
+    summary = { "pinName" : pinName }
+    summary.update(stats.computeStats(matchIndex, allExpectedTimes, diffsAndErrors, toleranceSecs))
+    summary["diffsAndErrors"] = [ [diff, err] for diff,err in diffsAndErrors ]
+    return summary
+
+
+
+def overallPassed(channels, toleranceSecs=None):
+    """\
+    Decide whether a run passed, from the results for each of its pins.
+
+    :param channels: list of results per pin. Each is either a summary (see :func:`summariseChannel`) or a dict
+        with keys "pinName" and "error"
+    :param toleranceSecs: None, or the tolerance (in seconds) the results were tested against
+    :returns: None if no tolerance test was requested, otherwise whether all pins passed. A pin that could not
+        be measured has not passed.
+    """
+    if toleranceSecs is None:
+        return None
+    return all("error" not in channel and channel["passed"] for channel in channels)
+
+
+
+class HeadlessRun(object):
+
+    def __init__(self, tester, config):
+        """\
+        Collects the outcome of a headless run, and writes it as a single JSON result.
+
+        :param tester: name of the tester, e.g. "tv" or "csa"
+        :param config: headless config (see :func:`loadConfig`)
+
+        The result is a JSON object with keys:
+        * "tester" ... the name of the tester
+        * "status" ... "ok", or "aborted" if the run did not complete
+        * "reason" ... None, or why the run was aborted
+        * "started", "finished" ... local times (see :func:`time.time`) when the run started and finished
+        * "channels" ... list of results per pin. Either a summary (see :func:`summariseChannel`) or a dict with keys
+          "pinName" and "error"
+        * "passed" ... None if no tolerance test was requested, otherwise whether all pins passed
+
+        Other keys can be added using :meth:`set`.
+        """
+        super(HeadlessRun, self).__init__()
+        self.config = config
+        self.result = {
+            "tester" : tester,
+            "status" : "ok",
+            "reason" : None,
+            "started" : time.time(),
+            "finished" : None,
+            "channels" : [],
+            "passed" : None,
+        }
+        self.toleranceSecs = None
+
+
+    def waitFor(self, description, predicate):
+        """\
+        See :func:`waitFor`
+        """
+        waitFor(description, predicate, self.config)
+
+
+    def set(self, key, value):
+        self.result[key] = value
+
+
+    def addChannelResult(self, pinName, matchIndex, allExpectedTimes, diffsAndErrors, toleranceSecs=None):
+        """\
+        Add the results of comparing observed and expected timings for a pin. Arguments are as for :func:`summariseChannel`.
+        """
+        self._addChannel(summariseChannel(pinName, matchIndex, allExpectedTimes, diffsAndErrors, toleranceSecs), toleranceSecs)
+
+
+    def addChannelError(self, pinName, error, toleranceSecs=None):
+        """\
+        Record that a pin could not be measured. If a tolerance test was requested (for this or any other pin),
+        the run has not passed.
+        """
+        self._addChannel({ "pinName" : pinName, "error" : error }, toleranceSecs)
+
+
+    def _addChannel(self, channel, toleranceSecs):
+        self.result["channels"].append(channel)
+        if toleranceSecs is not None:
+            self.toleranceSecs = toleranceSecs
+        self.result["passed"] = overallPassed(self.result["channels"], self.toleranceSecs)
+
+
+    def abort(self, reason):
+        """\
+        Record that the run did not complete.
+        """
+        self.result["status"] = "aborted"
+        self.result["reason"] = reason
+
+
+    def finish(self):
+        """\
+        Write the result, to the "resultFile" given in the config, or otherwise as a single line to standard output.
+
+        :returns: the result, as a dict
+        """
+        self.result["finished"] = time.time()
+        if self.config["resultFile"] is None:
+            sys.stdout.write(json.dumps(self.result) + "\n")
+            sys.stdout.flush()
+        else:
+            with open(self.config["resultFile"], "w") as f:
+                json.dump(self.result, f, indent=1)
+        return self.result
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Lightweight instrumentation of the stages of a measurement: how long is spent
+in each stage (serial setup, capture, bulk transfer, detection, correlation ...)
+and counts of what was processed (bytes transferred, samples processed, pulses
+detected, offsets scanned).
+
+Stages are timed with :func:`span` and quantities are counted with :func:`count`.
+Both do nothing (and cost next to nothing) unless instrumentation has been
+turned on with :func:`enable`. The totals collected can then be written out
+as JSON, or as a Prometheus textfile (e.g. for the node exporter's textfile collector).
+
+Span and counter names are dotted, with the module they are in first,
+e.g. "arduino.bulkTransfer". Spans can be nested, in which case the time spent
+in the inner span is also included in the time for the outer span.
+
+
+Usage
+-----
+
+.. code-block:: python
+
+    recorder = instrumentation.enable()
+
+    with instrumentation.span("arduino.capture"):
+        ...
+    instrumentation.count("arduino.bytesTransferred", len(data))
+
+    recorder.writeJson("timings.json")
+    recorder.writePrometheus("timings.prom")
+
+"""
+
+import json
+import os
+import re
+import threading
+import time
+
+
+PROMETHEUS_PREFIX = "dvbcss_synctiming"
+
+# the recorder that spans and counts are added to, or None if instrumentation is turned off
+_recorder = None
+
+
+
+class _NullSpan(object):
+    """Context manager that does nothing, used for spans when instrumentation is turned off"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+
+
+class _Span(object):
+    """Context manager that times a span and adds it to a recorder"""
+    __slots__ = ("recorder", "name", "started")
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.recorder.addSpan(self.name, time.perf_counter() - self.started)
+        return False
+
+
+
+def span(name):
+    """\
+    Time a stage, using a `with` statement.
+
+    :param name: name of the stage, e.g. "arduino.capture"
+    :returns: a context manager, that does nothing if instrumentation is turned off
+    """
+    recorder = _recorder
+    if recorder is None:
+        return _NULL_SPAN
+    return _Span(recorder, name)
+
+
+
+def count(name, amount=1):
+    """\
+    Add to a counter. Does nothing if instrumentation is turned off.
+
+    :param name: name of the counter, e.g. "arduino.bytesTransferred"
+    :param amount: amount to add
+    """
+    recorder = _recorder
+    if recorder is not None:
+        recorder.count(name, amount)
+
+
+
+def enable(recorder=None):
+    """\
+    Turn instrumentation on.
+
+    :param recorder: the :class:`Recorder` to add spans and counts to, or None to create a new one
+    :returns: the recorder
+    """
+    global _recorder
+    if recorder is None:
+        recorder = Recorder()
+    _recorder = recorder
+    return recorder
+
+
+
+def disable():
+    """\
+    Turn instrumentation off.
+
+    :returns: the :class:`Recorder` that was in use, or None if instrumentation was already off
+    """
+    global _recorder
+    recorder, _recorder = _recorder, None
+    return recorder
+
+
+
+def current():
+    """\
+    :returns: the :class:`Recorder` in use, or None if instrumentation is turned off
+    """
+    return _recorder
+
+
+
+def _prometheusName(name):
+    # "arduino.bytesTransferred" -> "arduino_bytes_transferred"
+    name = re.sub(r"([a-z0-9])([A-Z])", r"\1_\2", name).lower()
+    return re.sub(r"[^a-z0-9_]", "_", name)
+
+
+def _prometheusLabelValue(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+
+class Recorder(object):
+
+    def __init__(self):
+        """\
+        Collects the total time spent in each span and the total of each counter.
+        Spans and counts can be added from any thread.
+
+        The totals are available as the attributes :data:`spans` (dict mapping span names to dicts
+        with keys "count", "totalSecs", "minSecs" and "maxSecs") and :data:`counters` (dict mapping counter names
+        to totals).
+        """
+        super(Recorder, self).__init__()
+        self._lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        """\
+        Discard everything recorded so far.
+        """
+        with self._lock:
+            self.started = time.time()
+            self.spans = {}
+            self.counters = {}
+
+
+    def addSpan(self, name, secs):
+        """\
+        :param name: name of the span
+        :param secs: how long (in seconds) was spent in it
+        """
+        with self._lock:
+            entry = self.spans.get(name)
+            if entry is None:
+                self.spans[name] = { "count" : 1, "totalSecs" : secs, "minSecs" : secs, "maxSecs" : secs }
+            else:
+                entry["count"] += 1
+                entry["totalSecs"] += secs
+                entry["minSecs"] = min(entry["minSecs"], secs)
+                entry["maxSecs"] = max(entry["maxSecs"], secs)
+
+
+    def span(self, name):
+        """\
+        :returns: a context manager that times a span and adds it to this recorder, whether or not it is the one
+            turned on with :func:`enable`
+        """
+        return _Span(self, name)
+
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+
+    def snapshot(self):
+        """\
+        :returns: dict, with keys "started" (when recording started, see :func:`time.time`), "spans" and "counters",
+            holding copies of what has been recorded so far
+        """
+        with self._lock:
+            return {
+                "started" : self.started,
+                "spans" : dict( (name, dict(entry)) for name, entry in self.spans.items() ),
+                "counters" : dict(self.counters),
+            }
+
+
+    def writeJson(self, filename):
+        """\
+        Write what has been recorded so far as JSON (see :meth:`snapshot`).
+        """
+        with open(filename, "w") as f:
+            json.dump(self.snapshot(), f, indent=1, sort_keys=True)
+
+
+    def prometheusText(self, prefix=PROMETHEUS_PREFIX):
+        """\
+        :param prefix: prefix for the metric names
+        :returns: what has been recorded so far, in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        metrics = [
+            ("stage_seconds_total", "counter", "Total time spent in each stage.", "totalSecs"),
+            ("stage_calls_total", "counter", "Number of times each stage ran.", "count"),
+            ("stage_max_seconds", "gauge", "Longest time spent in a single run of each stage.", "maxSecs"),
+        ]
+        for suffix, kind, description, key in metrics:
+            metric = prefix + "_" + suffix
+            lines.append("# HELP %s %s" % (metric, description))
+            lines.append("# TYPE %s %s" % (metric, kind))
+            for name in sorted(snapshot["spans"]):
+                lines.append("%s{stage=\"%s\"} %s" % (metric, _prometheusLabelValue(name), repr(snapshot["spans"][name][key])))
+
+        for name in sorted(snapshot["counters"]):
+            metric = prefix + "_" + _prometheusName(name) + "_total"
+            lines.append("# TYPE %s counter" % metric)
+            lines.append("%s %s" % (metric, repr(snapshot["counters"][name])))
+
+        return "\n".join(lines) + "\n"
+
+
+    def writePrometheus(self, filename, prefix=PROMETHEUS_PREFIX):
+        """\
+        Write what has been recorded so far as a Prometheus textfile. The file is replaced in one step, so
+        a collector never reads a partly written file.
+
+        :param filename: name of the file to write (the textfile collector only reads files ending ".prom")
+        :param prefix: prefix for the metric names
+        """
+        tmpFilename = filename + ".tmp"
+        with open(tmpFilename, "w") as f:
+            f.write(self.prometheusText(prefix))
+        os.replace(tmpFilename, filename)
+
+
+    def write(self, filename):
+        """\
+        Write what has been recorded so far, as a Prometheus textfile if the filename ends ".prom", otherwise as JSON.
+        """
+        if filename.endswith(".prom"):
+            self.writePrometheus(filename)
+        else:
+            self.writeJson(filename)
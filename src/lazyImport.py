@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Lazy importing of libraries that are slow to import (e.g. numpy) or that are only
+needed for some uses of a module (e.g. pyserial, which is only needed to talk to
+an Arduino, not to analyse a capture, or PIL, which the test sequence generator only
+needs to draw video frames).
+
+A :class:`LazyModule` stands in for a module, and only imports it when one of its
+attributes is first used. Modules that import libraries this way can be imported
+quickly, and without those libraries being installed. If a library is missing,
+the error is raised when it is first used, saying how to install it.
+
+:func:`optional` is for libraries that a module can do without, e.g. using numpy
+for speed when it is installed. It returns None, without importing anything, if the
+library is not installed.
+
+
+Usage
+-----
+
+.. code-block:: python
+
+    numpy = lazyImport.optional("numpy")
+    serial = lazyImport.LazyModule("serial", submodules=["serial.tools.list_ports"], package="pyserial")
+
+    if numpy is not None:
+        data = numpy.asarray(values)     # numpy is imported here
+
+"""
+
+import importlib
+import importlib.util
+import threading
+
+
+
+class LazyModule(object):
+
+    def __init__(self, name, submodules=(), package=None):
+        """\
+        Stands in for a module, which is imported when one of its attributes is first used.
+        Can be used from any thread.
+
+        :param name: the name of the module, e.g. "numpy" or "PIL.Image"
+        :param submodules: names of any submodules to import at the same time, e.g. [ "serial.tools.list_ports" ]
+        :param package: None, or the name of the package to install with pip if the module is missing.
+            If given, the :class:`ImportError` raised when the module is missing says how to install it.
+        """
+        super(LazyModule, self).__init__()
+        self._name = name
+        self._submodules = list(submodules)
+        self._package = package
+        self._module = None
+        self._lock = threading.Lock()
+
+
+    def load(self):
+        """\
+        Import the module, if it has not been already.
+
+        :returns: the module
+        :raises ImportError: if the module (or one of the submodules) is not installed
+        """
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    try:
+                        module = importlib.import_module(self._name)
+                        for submodule in self._submodules:
+                            importlib.import_module(submodule)
+                    except ImportError as e:
+                        if self._package is None:
+                            raise
+                        raise ImportError("Needs %s library. Install with PIP, e.g.: pip install %s (%s)" % (self._package, self._package, e))
+                    self._module = module
+                module = self._module
+        return module
+
+
+    @property
+    def loaded(self):
+        """\
+        True if the module has been imported.
+        """
+        return self._module is not None
+
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+
+    def __repr__(self):
+        return "<LazyModule %s%s>" % (self._name, "" if self._module is not None else " (not yet imported)")
+
+
+
+def isInstalled(name):
+    """\
+    :param name: the name of a top level module, e.g. "numpy"
+    :returns: True if the module can be imported. The module is not imported.
+    """
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+
+def optional(name, submodules=()):
+    """\
+    :param name: the name of a top level module, e.g. "numpy"
+    :param submodules: see :class:`LazyModule`
+    :returns: a :class:`LazyModule` for the module, or None if it is not installed
+    """
+    if not isInstalled(name):
+        return None
+    return LazyModule(name, submodules)
@@ -18,44 +18,136 @@
 Wrapper class for detect.py and analyse.py functions to gather measurmeents
 from an arduino and analyse them.
 
+For repeatability studies, a :class:`Campaign` runs a series of captures back
+to back. Separating the samples of one capture into channels, detection and
+comparison run on a worker thread while the arduino carries out the next capture.
+
+When acting as client, the Control Timestamps received over CSS-TS are kept in
+a :class:`ControlTimestampBuffer`, which only holds on to those needed for
+the captures in progress, so long-lived measurers do not accumulate them without bound.
+
 '''
 
 
+import bisect
+import queue
+import threading
+import time
+
 import analyse
 import arduino
 import detect
+import instrumentation
+import stats
+from analyse import DubiousInput
+from arduinoSession import ArduinoSession
 
 
-class DubiousInput(Exception):
+# mapping from pin names to the arduino pin numbers that sample them
+PIN_MAP = {"LIGHT_0": 0, "AUDIO_0": 1, "LIGHT_1": 2, "AUDIO_1": 3}
 
-    def __init__(self, value):
-        super(DubiousInput, self).__init__(value)
+# Control Timestamps received this long (in seconds) either side of a capture are kept for analysing it
+CONTROL_TIMESTAMP_MARGIN_SECS = 5
 
 
-class Measurer:
+class ControlTimestampBuffer(object):
 
-    def __init__(self, role, pinsToMeasure, expectedTimings, eventDurations, videoStartTicks, wallClock, syncTimelineClock, syncTimelineTickRate, wcPrecisionNanos, acPrecisionNanos, captureSecs):
+    def __init__(self, retentionNanos=None):
         """\
 
-        connect with the arduino and send commands on which pins are to be read during
-        data capture.
+        Holds Control Timestamps received over CSS-TS, in columns sorted by the wall clock time
+        at which each was received.
 
-        :param role "master" or "client" which role the measurement system is acting in
-        :param pinsToMeasure a list of pin names that are to be measured.
-                a name must be one of "LIGHT_0", "LIGHT_1", "AUDIO_0" or "AUDIO_1"
-        :param expectedTimings  dict mapping pin names ("LIGHT_0","LIGHT_1","AUDIO_0","AUDIO_1") to lists containing expected flash/beep times
-        read from a json metadata file. For pins that are not specified as arguments, there will be no entry in the dict.
-        :param eventdurations dict mapping pin names to the expected duration of the flash/beep in seconds (e.g. 0.001 = 1 millisecond)
-        :param videoStartTicks initial sync time line clock value
-        :param wallClock the wall clock object.  This will be used in arduino.py
-                to take various time snapshots
-        :param syncTimelineClock the sync time line clock object
-        :param syncTimelineTickRate: tick rate of the sync timeline
-        :param wcPrecisionNanos the wall clock precision in nanoseconds
-        :param acPrecisionNanos the arduino clock's precision in nanoseconds
-        :param captureSecs length of the capture to be taken on arduino in seconds
+        :param retentionNanos: None to keep everything until :meth:`prune` is called. Otherwise, entries received
+            longer than this before the most recently received one are discarded as new ones are appended.
+
+        The entry most recently received before the start of what is kept is always kept too, because the
+        correlation it carries still applies until the next one was received.
+
+        Entries are tuples (whenReceived, (wallClockTime, syncTimelineTime, speed)), as recorded by
+        :meth:`Measurer.ctsRecorder`. Appending is thread safe, so can take place while :meth:`window` is
+        taking a view of the entries for a capture.
+        """
+        super(ControlTimestampBuffer, self).__init__()
+        self.retentionNanos = retentionNanos
+        self.whens = []
+        self.correlations = []
+        self._lock = threading.Lock()
+
+
+    def append(self, entry):
+        """\
+        :param entry: tuple (whenReceived, (wallClockTime, syncTimelineTime, speed))
+        """
+        when, correlation = entry
+        with self._lock:
+            if len(self.whens) == 0 or when >= self.whens[-1]:
+                i = len(self.whens)
+            else:
+                i = bisect.bisect_right(self.whens, when)
+            self.whens.insert(i, when)
+            self.correlations.insert(i, tuple(correlation))
+            if self.retentionNanos is not None:
+                self._pruneBefore(self.whens[-1] - self.retentionNanos)
+
+
+    def prune(self, beforeWhen):
+        """\
+        Discard entries received before a wall clock time, except for the most recent of them.
+
+        :param beforeWhen: wall clock time
         """
+        with self._lock:
+            self._pruneBefore(beforeWhen)
 
+
+    def _pruneBefore(self, beforeWhen):
+        n = bisect.bisect_left(self.whens, beforeWhen) - 1
+        if n > 0:
+            del self.whens[:n]
+            del self.correlations[:n]
+
+
+    def window(self, startWhen, finishWhen, marginNanos=0):
+        """\
+        :param startWhen: wall clock time at which the capture started
+        :param finishWhen: wall clock time at which the capture finished
+        :param marginNanos: entries received this long either side of the capture are included
+        :returns: a :class:`detect.IndexedControlTimestamps` holding the entries received during the capture and
+            margin, plus the closest entry either side of them. It gives the same conversions throughout the
+            capture and margin as the whole history would.
+        """
+        with self._lock:
+            first = max(0, bisect.bisect_right(self.whens, startWhen - marginNanos) - 1)
+            last = min(len(self.whens), bisect.bisect_right(self.whens, finishWhen + marginNanos) + 1)
+            return detect.IndexedControlTimestamps(self.whens[first:last], self.correlations[first:last])
+
+
+    def __len__(self):
+        return len(self.whens)
+
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(zip(self.whens, self.correlations)))
+
+
+
+class MeasurerBase(object):
+
+    def __init__(self, role, pinsToMeasure, expectedTimings, eventDurations, videoStartTicks, wallClock, syncTimelineClock, syncTimelineTickRate, wcPrecisionNanos, acPrecisionNanos, captureSecs, syncBurstSize=arduino.SYNC_BURST_SIZE):
+        """\
+
+        The state and analysis shared by :class:`Measurer`, which captures from one arduino, and
+        :class:`rigGroup.RigGroupMeasurer`, which captures from several at once.
+
+        Subclasses capture the samples and detect the flashes and beeps in them, by implementing
+        :meth:`armCapture`, :meth:`_captureSamples`, :meth:`takeCaptureData` and :meth:`detectInCaptureData`.
+        They must set nActivePins once the arduino(s) are ready to capture.
+
+        The parameters are as for :class:`Measurer`.
+        """
+        super(MeasurerBase, self).__init__()
         self.role = role
         self.pinsToMeasure = pinsToMeasure
         self.expectedTimings = expectedTimings
@@ -66,22 +158,31 @@ class Measurer:
         self.syncClockTickRate = syncTimelineTickRate
         self.wcPrecisionNanos = wcPrecisionNanos
         self.acPrecisionNanos = acPrecisionNanos
+        self.syncBurstSize = syncBurstSize
+        self.captureSecs = captureSecs
+        self.nActivePins = 0
+        self.streamingStats = None
+        self.resultsRecorder = None
+        self.resultsToleranceSecs = None
 
-        self.f = arduino.connect()
-        self.pinMap = {"LIGHT_0": 0, "AUDIO_0": 1, "LIGHT_1": 2, "AUDIO_1": 3}
-        self.activatePinReading()
-        self.nActivePins  = arduino.prepareToCapture(self.f, wallClock, captureSecs)[0]
 
-        if self.nActivePins != len(self.pinsToMeasure) :
-            raise ValueError("# activated pins mismatches request: ")
+    def armCapture(self):
+        """\
 
+        Enable the pins to be read and prepare to capture. The arduino clears the enabled pins once it has
+        transferred the samples, so this must be done again before every further capture.
+
+        :raise ValueError if the arduino does not activate the requested pins
+
+        """
+        raise NotImplementedError()
 
 
     def ctsRecorder(self, speedChanged):
         """\
 
         Only used when the measurement system is acting as client.
-        Append to list of reported correlations as a tuple
+        Append to the buffer of reported correlations a tuple
         (local wallclock time, (received wallclock, received sync time line clock value, speed multiplier of sync time line clock)
 
         """
@@ -104,39 +205,21 @@ class Measurer:
         Only used when the measurement system is acting as client.
         Remember the clock controller used to drive changes to our
         emulation of the sync timeline based on correlations received over
-        the TS protocol.  Initialise the list that will capture these
+        the TS protocol.  Initialise the buffer (see :class:`ControlTimestampBuffer`) that will capture these
         reported correlations also.  Set the bound function to be called back
         by the clock controller as any time changes are detected by the controller examining
         the TS protocol messages.  These are notified using the bound function "ctsRecorder" above
 
         """
 
-        self.timestampedReceivedControlTimeStamps = []
+        retentionNanos = (self.captureSecs + 2 * CONTROL_TIMESTAMP_MARGIN_SECS) * 1000000000
+        self.timestampedReceivedControlTimeStamps = ControlTimestampBuffer(retentionNanos)
         self.syncTimelineClockController = syncTimelineClockController
         syncTimelineClockController.onTimingChange = self.ctsRecorder
 
 
 
 
-    def activatePinReading(self):
-        """\
-
-        Activate each of the pins mentioned in the input array for reading
-        during the Arduino capture phase
-
-        :param pinsToMeasure a list of pin names that are to be measured.
-                    a name must be one of "LIGHT_0", "LIGHT_1", "AUDIO_0" or "AUDIO_1"
-        :param pinMap dictionary that maps from pin name to pin number
-        :param f: the file handle for serial communication with the Arduino
-        :param wallClock: the wall clock providing times for the CSS_WC protocol
-         (wall clock protocol)
-
-        """
-
-        for pin in self.pinsToMeasure:
-             arduino.samplePinDuringCapture(self.f, self.pinMap[pin], self.wallClock)
-
-
     def snapShot(self):
         """\
 
@@ -170,16 +253,49 @@ class Measurer:
 
         """
         if self.nActivePins > 0:
+            wcStart = self.wallClock.ticks
             if self.role == "master":
                 correlationPre = self.snapShot()
-            (self.channels, self.dueStartTimeUsecs, self.dueFinishTimeUsecs, timeDataPre, timeDataPost) = \
-                                        captureAndPackageIntoChannels(self.f, self.pinsToMeasure, self.pinMap, self.wallClock)
-            self.wcAcReqResp = {"pre":timeDataPre, "post":timeDataPost}
+            self._captureSamples()
             if self.role == "master":
                  correlationPost = self.snapShot()
                  self.wcSyncTimeCorrelations = [correlationPre, correlationPost]
             elif self.role == "client":
-                self.wcSyncTimeCorrelations = self.timestampedReceivedControlTimeStamps
+                self.wcSyncTimeCorrelations = self.controlTimestampsForCapture(wcStart, self.wallClock.ticks)
+
+
+    def _captureSamples(self):
+        """\
+        Capture on the arduino(s), transfer the samples, and keep them and the clock sync round trip timing data.
+        """
+        raise NotImplementedError()
+
+
+    def controlTimestampsForCapture(self, wcStart, wcFinish):
+        """\
+
+        Only used when the measurement system is acting as client.
+
+        :param wcStart: wall clock time at which the capture started
+        :param wcFinish: wall clock time at which the capture finished
+        :returns: the received Control Timestamps needed to analyse the capture, sorted and indexed ready for detection
+            (see :meth:`ControlTimestampBuffer.window`). Older ones are discarded, as they will not be needed again.
+
+        """
+        marginNanos = CONTROL_TIMESTAMP_MARGIN_SECS * 1000000000
+        self.timestampedReceivedControlTimeStamps.prune(wcStart - marginNanos)
+        return self.timestampedReceivedControlTimeStamps.window(wcStart, wcFinish, marginNanos)
+
+
+    def takeCaptureData(self):
+        """\
+
+        :returns: dict holding everything from the most recent capture that is needed for detection, so
+            that it can be analysed while the next capture is taking place. It is passed to
+            :meth:`detectInCaptureData`. There is always a "syncRttStats" key.
+
+        """
+        raise NotImplementedError()
 
 
     def detectBeepsAndFlashes(self, dispersionFunc):
@@ -194,26 +310,54 @@ class Measurer:
             measured by the CSA. When testing a TV, it should be the dispersion
             reported by the local wall clock client algorithm in the measuring system.
         """
-        # add hint about duration of flashes/beeps to self.channels
-        for pinName in self.eventDurations:
-            self.channels[self.pinMap[pinName]]["eventDuration"] = self.eventDurations[pinName]
+        self.observedTimings, self.testPackage = self.detectInCaptureData(self.takeCaptureData(), dispersionFunc)
 
-        # copy self.channels, but only the entries that are not 'None'
-        measuredChannels = []
-        for channel in self.channels:
-            if channel is not None:
-                measuredChannels.append(channel)
 
-        # run detection process
-        detector = detect.BeepFlashDetector(self.wcAcReqResp, self.syncClockTickRate, \
-                                            self.wcSyncTimeCorrelations, dispersionFunc, \
-                                            self.wcPrecisionNanos, self.acPrecisionNanos)
-        self.observedTimings = analyse.runDetection(detector, measuredChannels, self.dueStartTimeUsecs, self.dueFinishTimeUsecs)
+    def detectInCaptureData(self, captureData, dispersionFunc):
+        """\
 
-        self.testPackage = []
-        for result in self.observedTimings:
-            pinName = result["pinName"]
-            self.testPackage.append( { "pinName":pinName,  "observed": result["observed"],  "expected":self.expectedTimings[pinName] } )
+        Detect flashes or beeps in the data from a capture.
+
+        :param captureData: dict as returned by :meth:`takeCaptureData`
+        :param dispersionFunc: see :meth:`detectBeepsAndFlashes`
+        :returns tuple (observedTimings, testPackage): as set by :meth:`detectBeepsAndFlashes`
+        """
+        raise NotImplementedError()
+
+
+    def compareCaptureData(self, captureData, dispersionFunc):
+        """\
+
+        Detect flashes or beeps in the data from a capture, and compare them with the expected timings.
+
+        :param captureData: dict as returned by :meth:`takeCaptureData`
+        :param dispersionFunc: see :meth:`detectBeepsAndFlashes`
+        :returns list of results, one per pin, each a dict with keys "pinName" and "observed", and either
+            "matchIndex", "expectedSecs" and "diffsAndErrors" (as returned by :meth:`doComparison`) or
+            "error" (if the comparison raised :class:`DubiousInput`)
+        """
+        results = []
+        for channel in self.detectInCaptureData(captureData, dispersionFunc)[1]:
+            result = { "pinName" : channel["pinName"], "observed" : channel["observed"] }
+            try:
+                result["matchIndex"], result["expectedSecs"], result["diffsAndErrors"] = self.doComparison(channel)
+            except DubiousInput as e:
+                result["error"] = str(e)
+            results.append(result)
+        return results
+
+
+
+
+    def runCampaign(self, nCaptures, dispersionFunc, queueSize=1, onResult=None):
+        """\
+
+        Make a series of captures back to back, analysing each one while the next is taken.
+        See :class:`Campaign` (which can also be cancelled part way through).
+
+        :returns list of result records, one per capture
+        """
+        return Campaign(self, nCaptures, dispersionFunc, queueSize, onResult).run()
 
 
 
@@ -242,20 +386,283 @@ class Measurer:
             list of (diff, err) for the best match, corresponding to the individual time differences and each one's error bound)
         :raise DubiousInput exception if the observed data is longer than the expected data
 
-        Results are normalised to be in units of seconds since start of the test video sequence.
+        Results are normalised to be in units of seconds since start of the test video sequence
+        (see :func:`analyse.compareChannel`).
+
+        """
+        try:
+            with instrumentation.span("measurer.doComparison"):
+                result = analyse.compareChannel(channel, self.videoStartTicks, self.syncClockTickRate)
+        except DubiousInput as e:
+            if self.resultsRecorder is not None:
+                self.resultsRecorder.addChannelError(channel["pinName"], str(e))
+            raise
+
+        matchIndex, expectedSecs, diffsAndErrorsSecs = result
+        if self.streamingStats is not None and channel["pinName"] in self.streamingStats:
+            self.streamingStats[channel["pinName"]].addComparison(result)
+        if self.resultsRecorder is not None:
+            self.resultsRecorder.addChannelResult(channel["pinName"], matchIndex, expectedSecs, diffsAndErrorsSecs, self.resultsToleranceSecs)
+        return result
+
+
+    def accumulateStats(self, toleranceSecs=None):
+        """\
+
+        Start accumulating statistics across captures. From now on, the results of every call to
+        :meth:`doComparison` are added to a :class:`stats.StreamingStats` for the pin.
+
+        :param toleranceSecs: None, or a tolerance (in seconds) to count observations that are outside it
+        :returns: dict mapping pin names to the :class:`stats.StreamingStats` for each
+
+        """
+        self.streamingStats = dict( (pinName, stats.StreamingStats(toleranceSecs)) for pinName in self.pinsToMeasure )
+        return self.streamingStats
+
+
+    def recordResults(self, recorder, toleranceSecs=None):
+        """\
+
+        Record results as they are produced. From now on, the results of every call to :meth:`doComparison`
+        (or the error, if it raises :class:`DubiousInput`) are added to the recorder.
+
+        :param recorder: an object with addChannelResult and addChannelError methods, such as a
+            :class:`resultsStore.StoredRun`, or None to stop recording
+        :param toleranceSecs: None, or the tolerance (in seconds) results are tested against
 
         """
-        if  (len(channel["observed"]) - len(channel["expected"]) > 0) or len(channel["observed"]) == 0 :
-            raise DubiousInput("poor data or no data")
+        self.resultsRecorder = recorder
+        self.resultsToleranceSecs = toleranceSecs
+
 
-        test = (channel["observed"], channel["expected"])
-        matchIndex, expected, diffsAndErrors = analyse.doComparison(test, self.videoStartTicks, self.syncClockTickRate)
 
-        # convert everything to units of seconds
-        expectedSecs = [ ((e-self.videoStartTicks) / self.syncClockTickRate) for e in expected ]
-        diffsAndErrorsSecs = [ (d/self.syncClockTickRate, e/self.syncClockTickRate) for (d,e) in diffsAndErrors ]
+class Measurer(MeasurerBase):
+
+    def __init__(self, role, pinsToMeasure, expectedTimings, eventDurations, videoStartTicks, wallClock, syncTimelineClock, syncTimelineTickRate, wcPrecisionNanos, acPrecisionNanos, captureSecs, syncBurstSize=arduino.SYNC_BURST_SIZE, arduinoUrl=None, session=None, transferEncoding=arduino.ENCODING_RAW, syncIntervalSecs=None):
+        """\
+
+        connect with the arduino and send commands on which pins are to be read during
+        data capture.
+
+        :param role "master" or "client" which role the measurement system is acting in
+        :param pinsToMeasure a list of pin names that are to be measured.
+                a name must be one of "LIGHT_0", "LIGHT_1", "AUDIO_0" or "AUDIO_1"
+        :param expectedTimings  dict mapping pin names ("LIGHT_0","LIGHT_1","AUDIO_0","AUDIO_1") to lists containing expected flash/beep times
+        read from a json metadata file. For pins that are not specified as arguments, there will be no entry in the dict.
+        :param eventdurations dict mapping pin names to the expected duration of the flash/beep in seconds (e.g. 0.001 = 1 millisecond)
+        :param videoStartTicks initial sync time line clock value
+        :param wallClock the wall clock object.  This will be used in arduino.py
+                to take various time snapshots
+        :param syncTimelineClock the sync time line clock object
+        :param syncTimelineTickRate: tick rate of the sync timeline
+        :param wcPrecisionNanos the wall clock precision in nanoseconds
+        :param acPrecisionNanos the arduino clock's precision in nanoseconds
+        :param captureSecs length of the capture to be taken on arduino in seconds
+        :param syncBurstSize number of clock sync round trips made with the arduino immediately before and after
+                capture. The lowest round-trip time exchange is used (see :func:`arduino.syncBurst`)
+        :param arduinoUrl None to find the arduino connected via USB, otherwise the serial port or URL to connect to
+                (see :func:`arduino.connect`). Ignored if a session is provided.
+        :param session an :class:`arduinoSession.ArduinoSession` to use, e.g. one kept open across many measurer objects.
+                If None, a new session is created.
+        :param transferEncoding encoding the arduino should use to transfer the samples (see :func:`arduino.setTransferEncoding`)
+        :param syncIntervalSecs if not None, then clock sync round trips are also made with the arduino at this interval
+                while it is capturing (see :func:`arduino.captureWithSyncPings`)
+        """
 
-        return matchIndex, expectedSecs, diffsAndErrorsSecs
+        super(Measurer, self).__init__(role, pinsToMeasure, expectedTimings, eventDurations, videoStartTicks, wallClock, syncTimelineClock, syncTimelineTickRate, wcPrecisionNanos, acPrecisionNanos, captureSecs, syncBurstSize)
+        self.syncIntervalSecs = syncIntervalSecs
+
+        if session is None:
+            session = ArduinoSession(arduinoUrl)
+        self.session = session
+        self.pinMap = PIN_MAP
+        self.armCapture()
+
+        if transferEncoding != arduino.ENCODING_RAW:
+            session.setTransferEncoding(wallClock, transferEncoding)
+
+
+    @property
+    def transferEncoding(self):
+        """\
+        The encoding the arduino uses to transfer the samples. The session sets it again if the arduino is reset.
+        """
+        return self.session.transferEncoding
+
+
+
+    def armCapture(self):
+        """\
+
+        Enable the pins to be read and prepare the arduino to capture. This is done when the measurer is
+        created. The arduino clears the enabled pins once it has transferred the samples, so it must be done
+        again before every further capture.
+
+        :raise ValueError if the arduino does not activate the requested pins
+
+        """
+        pins = [ self.pinMap[pin] for pin in self.pinsToMeasure ]
+        with instrumentation.span("measurer.armCapture"):
+            self.nActivePins, self.nMilliBlocks = self.session.setupCapture(self.wallClock, pins, self.captureSecs)[0:2]
+        self.f = self.session.f
+
+        if self.nActivePins != len(self.pinsToMeasure) :
+            raise ValueError("# activated pins mismatches request: ")
+
+
+
+    def activatePinReading(self):
+        """\
+
+        Activate each of the pins in pinsToMeasure for reading during the Arduino capture phase.
+
+        This is the same as :meth:`armCapture`, which enables the pins and prepares the arduino to capture in a
+        single write (see :meth:`arduinoSession.ArduinoSession.setupCapture`).
+
+        :raise ValueError if the arduino does not activate the requested pins
+
+        """
+        self.armCapture()
+
+
+
+    def _captureSamples(self):
+        burstPre, rttStatsPre = arduino.syncBurst(self.f, self.wallClock, self.syncBurstSize, perfCounter=True)
+        if self.syncIntervalSecs is None:
+            (self.dueStartTimeUsecs, self.dueFinishTimeUsecs, nMilliBlocks, timeDataPre, timeDataPost) = \
+                                        arduino.capture(self.f, self.wallClock, perfCounter=True)
+            timeDataMid = []
+        else:
+            (self.dueStartTimeUsecs, self.dueFinishTimeUsecs, nMilliBlocks, timeDataPre, timeDataPost, timeDataMid) = \
+                                        arduino.captureWithSyncPings(self.f, self.wallClock, self.nMilliBlocks, self.syncIntervalSecs, perfCounter=True)
+        # the samples are only separated into channels when they are analysed (see channels and detectInCaptureData),
+        # so that a campaign does it on its worker thread instead of delaying the next capture
+        self.samples = arduino.bulkTransfer(self.f, self.wallClock, self.transferEncoding)[0]
+        self.capturedMilliBlocks = nMilliBlocks
+        self._channels = None
+        burstPost, rttStatsPost = arduino.syncBurst(self.f, self.wallClock, self.syncBurstSize, perfCounter=True)
+        # the detector will pick whichever exchange has the lowest round-trip time
+        self.wcAcReqResp = {
+            "pre"  : [ arduino.alignWrap(burstPre, timeDataPre), timeDataPre ],
+            "mid"  : timeDataMid,
+            "post" : [ timeDataPost, arduino.alignWrap(burstPost, timeDataPost) ],
+        }
+        self.syncRttStats = {"pre":rttStatsPre, "post":rttStatsPost}
+
+
+    @property
+    def channels(self):
+        """\
+        The samples from the most recent capture, separated into a channel per pin (see :func:`repackageSamples`).
+        """
+        if self._channels is None:
+            self._channels = repackageSamples(self.pinsToMeasure, self.pinMap, self.capturedMilliBlocks, self.samples)
+        return self._channels
+
+
+    def takeCaptureData(self):
+        """\
+
+        :returns: dict holding everything from the most recent capture that is needed for detection, so
+            that it can be analysed while the next capture is taking place. Keys are "samples", "nMilliBlocks",
+            "dueStartTimeUsecs", "dueFinishTimeUsecs", "wcAcReqResp", "wcSyncTimeCorrelations" and "syncRttStats".
+            The samples are as transferred from the arduino (see :meth:`channelsInCaptureData`)
+
+        """
+        return {
+            "samples" : self.samples,
+            "nMilliBlocks" : self.capturedMilliBlocks,
+            "dueStartTimeUsecs" : self.dueStartTimeUsecs,
+            "dueFinishTimeUsecs" : self.dueFinishTimeUsecs,
+            "wcAcReqResp" : self.wcAcReqResp,
+            "wcSyncTimeCorrelations" : self.wcSyncTimeCorrelations,
+            "syncRttStats" : self.syncRttStats,
+        }
+
+
+    def channelsInCaptureData(self, captureData):
+        """\
+
+        :param captureData: dict as returned by :meth:`takeCaptureData`
+        :returns: the samples from the capture, separated into a channel per pin (see :func:`repackageSamples`)
+        """
+        return repackageSamples(self.pinsToMeasure, self.pinMap, captureData["nMilliBlocks"], captureData["samples"])
+
+
+    def detectInCaptureData(self, captureData, dispersionFunc):
+        """\
+
+        Detect flashes or beeps in the data from a capture.
+
+        :param captureData: dict as returned by :meth:`takeCaptureData`
+        :param dispersionFunc: see :meth:`detectBeepsAndFlashes`
+        :returns tuple (observedTimings, testPackage): as set by :meth:`detectBeepsAndFlashes`
+        """
+        channels = self.channelsInCaptureData(captureData)
+
+        # add hint about duration of flashes/beeps to the channels
+        for pinName in self.eventDurations:
+            channels[self.pinMap[pinName]]["eventDuration"] = self.eventDurations[pinName]
+
+        # copy the channels, but only the entries that are not 'None'
+        measuredChannels = []
+        for channel in channels:
+            if channel is not None:
+                measuredChannels.append(channel)
+
+        # run detection process
+        with instrumentation.span("measurer.detect"):
+            detector = detect.BeepFlashDetector(captureData["wcAcReqResp"], self.syncClockTickRate, \
+                                                captureData["wcSyncTimeCorrelations"], dispersionFunc, \
+                                                self.wcPrecisionNanos, self.acPrecisionNanos)
+            observedTimings = analyse.runDetection(detector, measuredChannels, captureData["dueStartTimeUsecs"], captureData["dueFinishTimeUsecs"])
+
+        testPackage = []
+        for result in observedTimings:
+            pinName = result["pinName"]
+            testPackage.append( { "pinName":pinName,  "observed": result["observed"],  "expected":self.expectedTimings[pinName] } )
+        return observedTimings, testPackage
+
+
+    def saveSession(self, filename, dispersion, captureData=None):
+        """\
+
+        Save the most recent capture, and everything needed to analyse it, to a session file
+        (see :mod:`sessionFile`), so that detection and comparison can be repeated later. Needs numpy.
+
+        :param filename: name of the file to write
+        :param dispersion: the wall clock dispersion during the capture. Either a number (a worst case dispersion,
+            in nanoseconds) or a history of changes in dispersion (see :data:`dispersion.DispersionRecorder.changeHistory`)
+        :param captureData: None for the most recent capture, otherwise as returned by :meth:`takeCaptureData`
+        """
+        # only imported when needed, because it needs numpy
+        import sessionFile
+
+        if captureData is None:
+            captureData = self.takeCaptureData()
+        if isinstance(dispersion, (int, float)):
+            dispersion = { "constantNanos" : dispersion }
+        else:
+            dispersion = { "changeHistory" : [ list(entry) for entry in dispersion ] }
+
+        header = {
+            "role" : self.role,
+            "pinsToMeasure" : self.pinsToMeasure,
+            "pinMap" : self.pinMap,
+            "expectedTimings" : self.expectedTimings,
+            "eventDurations" : self.eventDurations,
+            "videoStartTicks" : self.videoStartTicks,
+            "syncTimelineTickRate" : self.syncClockTickRate,
+            "wcPrecisionNanos" : self.wcPrecisionNanos,
+            "acPrecisionNanos" : self.acPrecisionNanos,
+            "dueStartTimeUsecs" : captureData["dueStartTimeUsecs"],
+            "dueFinishTimeUsecs" : captureData["dueFinishTimeUsecs"],
+            "wcAcReqResp" : captureData["wcAcReqResp"],
+            "wcSyncTimeCorrelations" : [ [when, list(correlation)] for when, correlation in captureData["wcSyncTimeCorrelations"] ],
+            "syncRttStats" : captureData["syncRttStats"],
+            "dispersion" : dispersion,
+        }
+        sessionFile.saveSession(filename, header, self.channelsInCaptureData(captureData))
 
 def isAudio(pinName):
     """\
@@ -303,14 +710,16 @@ def repackageSamples(pinsToMeasure, pinMap, nMilliBlocks, samples):
     for pinName in pinsToMeasure:
         channels[pinMap[pinName]] = ( { "pinName": pinName, "isAudio": isAudio(pinName), "min": [], "max": [] } )
 
-    i = 0
-    for blk in range(0, nMilliBlocks):
-        for channel in channels:
-            if channel is not None:
-                channel["max"].append(ord(samples[i]))
-                i += 1
-                channel["min"].append(ord(samples[i]))
-                i += 1
+    with instrumentation.span("measurer.repackageSamples"):
+        samples = bytearray(samples)
+        i = 0
+        for blk in range(0, nMilliBlocks):
+            for channel in channels:
+                if channel is not None:
+                    channel["max"].append(samples[i])
+                    i += 1
+                    channel["min"].append(samples[i])
+                    i += 1
 
     return channels
 
@@ -319,7 +728,7 @@ def repackageSamples(pinsToMeasure, pinMap, nMilliBlocks, samples):
 
 
 
-def captureAndPackageIntoChannels(f, pinsToMeasure, pinMap, wallClock):
+def captureAndPackageIntoChannels(f, pinsToMeasure, pinMap, wallClock, encoding=arduino.ENCODING_RAW, perfCounter=False):
     """\
 
     capture the data on the arduino, transfer it, and repackage
@@ -329,6 +738,8 @@ def captureAndPackageIntoChannels(f, pinsToMeasure, pinMap, wallClock):
         LIGHT_0, LIGHT_1, AUDIO_0 and AUDIO_1.
     :param pinMap: dictionary that maps from pin name to arduino pin number
     :param wallClock: the wall clock providing times for the CSS_WC protocol (wall clock protocol)
+    :param encoding: the encoding the arduino uses for transferring the samples (see :func:`arduino.setTransferEncoding`)
+    :param perfCounter: if True, time the clock sync round trips using the performance counter (see :func:`arduino.writeCmdAndTimeRoundTrip`)
     :returns a tuple: (data channels (see repackageSamples() ),
         nanosecond time when sampling commenced,
         nanosecond time when sampling ended,
@@ -337,7 +748,135 @@ def captureAndPackageIntoChannels(f, pinsToMeasure, pinMap, wallClock):
 
     """
 
-    dueStartTimeUsecs, dueFinishTimeUsecs, nMilliBlocks, timeDataPre, timeDataPost = arduino.capture(f, wallClock)
-    samples = arduino.bulkTransfer(f, wallClock)[0]
+    dueStartTimeUsecs, dueFinishTimeUsecs, nMilliBlocks, timeDataPre, timeDataPost = arduino.capture(f, wallClock, perfCounter)
+    samples = arduino.bulkTransfer(f, wallClock, encoding)[0]
     channels = repackageSamples(pinsToMeasure, pinMap, nMilliBlocks, samples)
     return (channels, dueStartTimeUsecs, dueFinishTimeUsecs, timeDataPre, timeDataPost)
+
+
+
+class Campaign(object):
+
+    def __init__(self, measurer, nCaptures, dispersionFunc, queueSize=1, onResult=None):
+        """\
+
+        A series of captures made back to back, for repeatability studies.
+
+        The captures are made on the thread that calls :meth:`run`. Each capture is passed, through a bounded
+        queue, to a worker thread that separates the samples into channels, detects the flashes and beeps and
+        compares them with the expected timings while the arduino carries out the next capture. If the worker falls behind, the next capture
+        waits until there is room in the queue.
+
+        :param measurer: the :class:`Measurer` (or :class:`rigGroup.RigGroupMeasurer`) to make the captures with.
+            It must be ready to capture (as it is when newly created)
+        :param nCaptures: the number of captures to make
+        :param dispersionFunc: see :meth:`Measurer.detectBeepsAndFlashes`
+        :param queueSize: the maximum number of captures waiting to be analysed
+        :param onResult: None, or a function that is called (on the worker thread) with each result record once
+            it is complete
+
+        Each result record is a dict with keys:
+        * "index" ... the number of the capture, counting from zero
+        * "status" ... "ok", "failed" (see "error") or "cancelled" (the capture was taken but not analysed)
+        * "captureStarted", "captureFinished" ... local times (see :func:`time.time`) when the capture began and ended
+        * "processingStarted", "processingFinished" ... local times when analysis began and ended
+        * "syncRttStats" ... round-trip time statistics from the clock sync bursts (see :func:`arduino.syncBurst`),
+          as in the capture data (see :meth:`MeasurerBase.takeCaptureData`)
+        * "results" ... list of results per pin (see :meth:`Measurer.compareCaptureData`)
+        * "error" ... None, or a description of what went wrong
+
+        Analysis runs on a thread in this process, because the dispersion function usually looks up
+        dispersion recorded live in this process.
+        """
+        super(Campaign, self).__init__()
+        self.measurer = measurer
+        self.nCaptures = nCaptures
+        self.dispersionFunc = dispersionFunc
+        self.onResult = onResult
+        self.records = []
+        self._queue = queue.Queue(maxsize=queueSize)
+        self._cancelled = threading.Event()
+
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+
+    def cancel(self):
+        """\
+        Stop the campaign. Can be called from any thread, including from the onResult function.
+
+        No further captures are started. Any capture still in progress is completed (the arduino cannot be
+        interrupted) and, along with any captures waiting to be analysed, is recorded with status "cancelled".
+        """
+        self._cancelled.set()
+
+
+    def run(self):
+        """\
+        Make the captures, returning once they have all been analysed or the campaign has been cancelled.
+
+        :returns: list of result records (see :class:`Campaign`), in order of capture
+        :raises: any exception raised while capturing, once the captures before it have been analysed. The failed
+            capture is recorded with status "failed".
+        """
+        worker = threading.Thread(target=self._processQueue)
+        worker.daemon = True
+        worker.start()
+        try:
+            for index in range(0, self.nCaptures):
+                if self.cancelled:
+                    break
+                record = { "index" : index, "status" : None, "error" : None, "results" : [],
+                           "captureStarted" : time.time(), "captureFinished" : None, "syncRttStats" : None,
+                           "processingStarted" : None, "processingFinished" : None }
+                try:
+                    if index > 0:
+                        self.measurer.armCapture()
+                    self.measurer.capture()
+                    captureData = self.measurer.takeCaptureData()
+                except Exception as e:
+                    record["status"] = "failed"
+                    record["error"] = "Capture failed: " + repr(e)
+                    self._queue.put((record, None))
+                    raise
+                except KeyboardInterrupt:
+                    self.cancel()
+                    raise
+                record["captureFinished"] = time.time()
+                record["syncRttStats"] = captureData["syncRttStats"]
+                self._queue.put((record, captureData))
+        finally:
+            self._queue.put(None)
+            worker.join()
+        return self.records
+
+
+    def _processQueue(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            record, captureData = item
+            record["processingStarted"] = time.time()
+            if captureData is None:
+                pass
+            elif self.cancelled:
+                record["status"] = "cancelled"
+            else:
+                try:
+                    record["results"] = self.measurer.compareCaptureData(captureData, self.dispersionFunc)
+                    record["status"] = "ok"
+                except Exception as e:
+                    record["status"] = "failed"
+                    record["error"] = "Analysis failed: " + repr(e)
+            record["processingFinished"] = time.time()
+            self.records.append(record)
+            if self.onResult is not None:
+                try:
+                    self.onResult(record)
+                except Exception as e:
+                    # keep draining the queue, so the capturing thread is not left waiting
+                    self.cancel()
+                    record["error"] = record["error"] or "onResult failed: " + repr(e)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Profiling of the stages of a run of the testers (e.g. setup, capture, detection
+and comparison) using :mod:`cProfile`, turned on by the `--profile` option. The
+test sequence generator (test_sequence_gen/src/generate.py) uses it in the same way,
+for the audio and video frames.
+
+Each stage gets its own profile. When the run finishes, the profile for each stage
+is written to a `.prof` file (which can be examined with :mod:`pstats` or tools such
+as snakeviz) and a summary listing the functions that took the most time in each
+stage is written to `summary.txt`.
+
+Only one profile can be active at once, so if a stage is entered during another,
+the outer stage is paused until the inner one ends. Only the thread that enters a
+stage is profiled.
+
+
+Usage
+-----
+
+.. code-block:: python
+
+    profiling.enable("profiles", topN=20)
+
+    with profiling.stage("capture"):
+        measurer.capture()
+
+    profiling.finish()
+
+"""
+
+import io
+import os
+import re
+
+import lazyImport
+
+# only imported when profiling is turned on
+cProfile = lazyImport.LazyModule("cProfile")
+pstats = lazyImport.LazyModule("pstats")
+
+
+# the profiler in use, or None if profiling is turned off
+_profiler = None
+
+
+
+class _NullStage(object):
+    """Context manager that does nothing, used for stages when profiling is turned off"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+
+
+class _Stage(object):
+    """Context manager that profiles a stage"""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.begin(self.name)
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.profiler.end()
+        return False
+
+
+
+class StageProfiler(object):
+
+    def __init__(self, directory, topN=20):
+        """\
+        Keeps a separate :class:`cProfile.Profile` for each stage of a run.
+
+        :param directory: directory to write the `.prof` files and summary to. It is created if needed.
+        :param topN: number of functions to list for each stage in the summary
+        """
+        super(StageProfiler, self).__init__()
+        self.directory = directory
+        self.topN = topN
+        self.profiles = {}
+        self.order = []
+        self._active = []
+
+
+    def stage(self, name):
+        """\
+        :returns: a context manager that profiles a stage. If the same stage is entered more than once,
+            the profiles are combined.
+        """
+        return _Stage(self, name)
+
+
+    def begin(self, name):
+        profile = self.profiles.get(name)
+        if profile is None:
+            profile = cProfile.Profile()
+            self.profiles[name] = profile
+            self.order.append(name)
+        if self._active:
+            self._active[-1].disable()
+        self._active.append(profile)
+        profile.enable()
+
+
+    def end(self):
+        self._active.pop().disable()
+        if self._active:
+            self._active[-1].enable()
+
+
+    def profileFilename(self, name):
+        """\
+        :returns: the filename the profile for a stage is written to
+        """
+        return os.path.join(self.directory, re.sub(r"[^A-Za-z0-9_.-]", "_", name) + ".prof")
+
+
+    def summary(self):
+        """\
+        :returns: text listing, for each stage, the total time spent and the functions with the highest cumulative time
+        """
+        out = io.StringIO()
+        for name in self.order:
+            stats = pstats.Stats(self.profiles[name], stream=out)
+            out.write("=" * 78 + "\n")
+            out.write("Stage: %s  (%.3f seconds, profile in %s)\n" % (name, stats.total_tt, self.profileFilename(name)))
+            out.write("=" * 78 + "\n")
+            stats.sort_stats("cumulative").print_stats(self.topN)
+        return out.getvalue()
+
+
+    def write(self):
+        """\
+        Write the `.prof` file for each stage, and the summary.
+
+        :returns: the filename of the summary
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        for name in self.order:
+            self.profiles[name].dump_stats(self.profileFilename(name))
+        summaryFilename = os.path.join(self.directory, "summary.txt")
+        with open(summaryFilename, "w") as f:
+            f.write(self.summary())
+        return summaryFilename
+
+
+
+def enable(directory, topN=20):
+    """\
+    Turn profiling on.
+
+    :param directory: see :class:`StageProfiler`
+    :param topN: see :class:`StageProfiler`
+    :returns: the :class:`StageProfiler`
+    """
+    global _profiler
+    _profiler = StageProfiler(directory, topN)
+    return _profiler
+
+
+
+def stage(name):
+    """\
+    Profile a stage, using a `with` statement.
+
+    :param name: name of the stage, e.g. "capture"
+    :returns: a context manager, that does nothing if profiling is turned off
+    """
+    profiler = _profiler
+    if profiler is None:
+        return _NULL_STAGE
+    return profiler.stage(name)
+
+
+
+def finish():
+    """\
+    Turn profiling off and write out the profiles and summary.
+
+    :returns: the filename of the summary, or None if profiling was not turned on
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return None
+    return profiler.write()
@@ -0,0 +1,534 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+A store of measurement results in an SQLite database, for comparing the
+synchronisation timing of devices across firmware builds, test rigs and days.
+
+The database has these tables:
+
+* `runs` ... one row per measurement run: when it took place, which tester was used,
+  labels identifying the device, its firmware, the test rig and the content, the
+  tolerance tested against, whether it passed and any other details (as JSON).
+* `channels` ... one row per pin measured in a run, with the error if it could not be measured.
+* `channelStats` ... the statistics for each channel that was measured (see :func:`stats.computeStats`).
+* `channelDiffs` ... the offset and error bound of every observation for each channel, packed into
+  blobs of little-endian doubles.
+
+Runs are indexed by device, content, firmware and the time they started. Trend
+queries (:meth:`ResultsStore.trend`) aggregate the per-channel statistics in SQL,
+and never read the per-observation blobs, so they stay fast for tens of thousands of runs.
+
+
+Usage
+-----
+
+.. code-block:: python
+
+    store = ResultsStore("results.db")
+    runId = store.addRun("tv", device="tv-1", firmware="1.2.3", content="sequence-7")
+    store.addChannelResult(runId, "LIGHT_0", matchIndex, expectedSecs, diffsAndErrors, toleranceSecs)
+    store.finishRun(runId)
+
+Or have a :class:`measurer.Measurer` record the results of every comparison it makes, as the testers do
+when given the `--resultsDb` option:
+
+.. code-block:: python
+
+    run = StoredRun("results.db", "tv", device="tv-1", firmware="1.2.3", toleranceSecs=0.02)
+    measurer.recordResults(run, 0.02)
+    ...
+    run.finish()
+    run.close()
+
+Then query trends:
+
+.. code-block:: python
+
+    for row in store.trend("day", device="tv-1"):
+        print(row["group"], row["meanOffsetSecs"])
+
+Or from the command line:
+
+.. code-block:: bash
+
+    $ python src/resultsStore.py results.db trend --by firmware --device tv-1
+    $ python src/resultsStore.py results.db runs --since 2026-01-01
+
+"""
+
+import json
+import sqlite3
+import struct
+import threading
+import time
+
+import stats
+
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    finished REAL,
+    tester TEXT,
+    device TEXT,
+    firmware TEXT,
+    rig TEXT,
+    content TEXT,
+    status TEXT NOT NULL,
+    reason TEXT,
+    toleranceSecs REAL,
+    passed INTEGER,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS runsByStarted ON runs (started);
+CREATE INDEX IF NOT EXISTS runsByDevice ON runs (device, started);
+CREATE INDEX IF NOT EXISTS runsByContent ON runs (content, started);
+CREATE INDEX IF NOT EXISTS runsByFirmware ON runs (firmware, started);
+
+CREATE TABLE IF NOT EXISTS channels (
+    id INTEGER PRIMARY KEY,
+    runId INTEGER NOT NULL REFERENCES runs (id),
+    pinName TEXT NOT NULL,
+    matchIndex INTEGER,
+    firstExpectedSecs REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS channelsByRun ON channels (runId);
+
+CREATE TABLE IF NOT EXISTS channelStats (
+    channelId INTEGER PRIMARY KEY REFERENCES channels (id),
+    count INTEGER NOT NULL,
+    meanOffsetSecs REAL,
+    stdDevSecs REAL,
+    minOffsetSecs REAL,
+    maxOffsetSecs REAL,
+    offsetP5Secs REAL,
+    offsetP25Secs REAL,
+    offsetP50Secs REAL,
+    offsetP75Secs REAL,
+    offsetP95Secs REAL,
+    meanErrorSecs REAL,
+    minErrorSecs REAL,
+    maxErrorSecs REAL,
+    passed INTEGER,
+    numExceeded INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS channelDiffs (
+    channelId INTEGER PRIMARY KEY REFERENCES channels (id),
+    diffs BLOB NOT NULL,
+    errors BLOB NOT NULL
+);
+"""
+
+# the percentiles of the offsets that are stored, and the columns they are stored in
+STORED_PERCENTILES = (5, 25, 50, 75, 95)
+
+STATS_COLUMNS = [ "count", "meanOffsetSecs", "stdDevSecs", "minOffsetSecs", "maxOffsetSecs" ] + \
+                [ "offsetP%dSecs" % p for p in STORED_PERCENTILES ] + \
+                [ "meanErrorSecs", "minErrorSecs", "maxErrorSecs", "passed", "numExceeded" ]
+
+RUN_COLUMNS = [ "id", "started", "finished", "tester", "device", "firmware", "rig", "content", "status", "reason", "toleranceSecs", "passed", "extra" ]
+
+# what trends can be grouped by, and the SQL expression for each
+TREND_GROUPS = {
+    "day" : "date(runs.started, 'unixepoch', 'localtime')",
+    "month" : "strftime('%Y-%m', runs.started, 'unixepoch', 'localtime')",
+    "device" : "runs.device",
+    "firmware" : "runs.firmware",
+    "rig" : "runs.rig",
+    "content" : "runs.content",
+    "pinName" : "channels.pinName",
+}
+
+
+
+def packValues(values):
+    """\
+    :returns: bytes containing the values as little-endian doubles
+    """
+    return struct.pack("<%dd" % len(values), *values)
+
+
+def unpackValues(blob):
+    """\
+    :returns: list of the values packed by :func:`packValues`
+    """
+    return list(struct.unpack("<%dd" % (len(blob) // 8), blob))
+
+
+
+class ResultsStore(object):
+
+    def __init__(self, filename):
+        """\
+        Opens (creating if necessary) a results database. Results can be added from any thread.
+
+        :param filename: name of the SQLite database file, or ":memory:"
+        """
+        super(ResultsStore, self).__init__()
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filename, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version not in (0, SCHEMA_VERSION):
+                raise ValueError("Unsupported results database schema version: "+repr(version))
+            self._conn.executescript(SCHEMA)
+            self._conn.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+    def addRun(self, tester, device=None, firmware=None, rig=None, content=None, toleranceSecs=None, started=None, extra=None):
+        """\
+        Record the start of a measurement run.
+
+        :param tester: name of the tester, e.g. "tv" or "csa"
+        :param device, firmware, rig, content: None, or labels identifying the device under test, its firmware build,
+            the test rig and the content (e.g. content ID) played
+        :param toleranceSecs: None, or the tolerance the run is tested against
+        :param started: when the run started (see :func:`time.time`), or None for now
+        :param extra: None, or a dict of any other JSON serialisable details to store with the run
+        :returns: the id of the run
+        """
+        if started is None:
+            started = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO runs (started, tester, device, firmware, rig, content, status, toleranceSecs, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (started, tester, device, firmware, rig, content, "running", toleranceSecs, None if extra is None else json.dumps(extra)))
+            return cursor.lastrowid
+
+
+    def addChannelResult(self, runId, pinName, matchIndex, allExpectedTimes, diffsAndErrors, toleranceSecs=None):
+        """\
+        Record the results of comparing observed and expected timings for a pin, as returned by
+        :meth:`measurer.Measurer.doComparison`. Statistics are calculated with :func:`stats.computeStats`.
+
+        :returns: the id of the channel
+        """
+        result = stats.computeStats(matchIndex, allExpectedTimes, diffsAndErrors, toleranceSecs, STORED_PERCENTILES)
+        row = dict(result)
+        for p in STORED_PERCENTILES:
+            row["offsetP%dSecs" % p] = result["offsetPercentilesSecs"][str(p)]
+        values = [ row[column] for column in STATS_COLUMNS ]
+
+        with self._lock, self._conn:
+            channelId = self._conn.execute(
+                "INSERT INTO channels (runId, pinName, matchIndex, firstExpectedSecs) VALUES (?, ?, ?, ?)",
+                (runId, pinName, matchIndex, result["firstExpectedSecs"])).lastrowid
+            self._conn.execute(
+                "INSERT INTO channelStats (channelId, %s) VALUES (?, %s)" % (", ".join(STATS_COLUMNS), ", ".join("?" * len(STATS_COLUMNS))),
+                [ channelId ] + values)
+            self._conn.execute(
+                "INSERT INTO channelDiffs (channelId, diffs, errors) VALUES (?, ?, ?)",
+                (channelId, packValues([ d for d,e in diffsAndErrors ]), packValues([ e for d,e in diffsAndErrors ])))
+            return channelId
+
+
+    def addChannelError(self, runId, pinName, error):
+        """\
+        Record that a pin could not be measured.
+
+        :returns: the id of the channel
+        """
+        with self._lock, self._conn:
+            return self._conn.execute("INSERT INTO channels (runId, pinName, error) VALUES (?, ?, ?)", (runId, pinName, error)).lastrowid
+
+
+    def addComparisonResults(self, runId, results, toleranceSecs=None):
+        """\
+        Record the results for all pins of a capture.
+
+        :param results: list of results, as returned by :meth:`measurer.Measurer.compareCaptureData`
+        """
+        for result in results:
+            if "error" in result:
+                self.addChannelError(runId, result["pinName"], result["error"])
+            else:
+                self.addChannelResult(runId, result["pinName"], result["matchIndex"], result["expectedSecs"], result["diffsAndErrors"], toleranceSecs)
+
+
+    def finishRun(self, runId, status="ok", reason=None, finished=None):
+        """\
+        Record the end of a run. Whether it passed is worked out from its channels: it passed if it was tested
+        against a tolerance, completed, and every channel was measured and passed.
+
+        :param status: "ok", or "aborted" if the run did not complete
+        :param reason: None, or why the run was aborted
+        :param finished: when the run finished, or None for now
+        """
+        if finished is None:
+            finished = time.time()
+        with self._lock, self._conn:
+            run = self._conn.execute("SELECT toleranceSecs FROM runs WHERE id = ?", (runId,)).fetchone()
+            if run is None:
+                raise ValueError("No such run: "+repr(runId))
+            passed = None
+            if run["toleranceSecs"] is not None:
+                failures = self._conn.execute(
+                    "SELECT COUNT(*) FROM channels LEFT JOIN channelStats ON channelStats.channelId = channels.id "
+                    "WHERE channels.runId = ? AND (channels.error IS NOT NULL OR NOT channelStats.passed)", (runId,)).fetchone()[0]
+                passed = int(status == "ok" and failures == 0)
+            self._conn.execute("UPDATE runs SET finished = ?, status = ?, reason = ?, passed = ? WHERE id = ?",
+                               (finished, status, reason, passed, runId))
+
+
+    def _filters(self, device=None, firmware=None, rig=None, content=None, pinName=None, since=None, until=None):
+        clauses, params = [], []
+        for column, value in [ ("runs.device", device), ("runs.firmware", firmware), ("runs.rig", rig), ("runs.content", content), ("channels.pinName", pinName) ]:
+            if value is not None:
+                clauses.append(column + " = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("runs.started >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("runs.started < ?")
+            params.append(until)
+        return clauses, params
+
+
+    def trend(self, groupBy="day", **filters):
+        """\
+        Aggregate statistics across the channels that were measured, grouped, e.g. by day or by firmware build.
+        Per-observation data is not read.
+
+        :param groupBy: one of "day", "month", "device", "firmware", "rig", "content" or "pinName"
+        :param filters: any of device, firmware, rig, content, pinName (values to match) and since, until
+            (the range of times, see :func:`time.time`, that runs started in)
+        :returns: list of dicts, in order of group, with keys "group", "runs", "channels" (the number measured), "count"
+            (the number of observations), "meanOffsetSecs" and "stdDevSecs" (across all observations), "minOffsetSecs",
+            "maxOffsetSecs", "meanP50OffsetSecs" (the mean of the medians of the channels), "maxP95OffsetSecs",
+            "maxErrorSecs", "tested" (the number of channels tested against a tolerance) and "passRate" (the proportion
+            of those that passed, or None)
+        """
+        if groupBy not in TREND_GROUPS:
+            raise ValueError("Cannot group trends by "+repr(groupBy))
+        group = TREND_GROUPS[groupBy]
+        clauses, params = self._filters(**filters)
+        where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        query = (
+            "SELECT %s AS grp, COUNT(DISTINCT runs.id) AS runs, COUNT(*) AS channels, SUM(s.count) AS count, "
+            "SUM(s.count * s.meanOffsetSecs) AS sumOffset, "
+            "SUM(s.count * (s.stdDevSecs * s.stdDevSecs + s.meanOffsetSecs * s.meanOffsetSecs)) AS sumSquares, "
+            "MIN(s.minOffsetSecs) AS minOffsetSecs, MAX(s.maxOffsetSecs) AS maxOffsetSecs, "
+            "AVG(s.offsetP50Secs) AS meanP50OffsetSecs, MAX(s.offsetP95Secs) AS maxP95OffsetSecs, "
+            "MAX(s.maxErrorSecs) AS maxErrorSecs, COUNT(s.passed) AS tested, SUM(s.passed) AS passes "
+            "FROM runs JOIN channels ON channels.runId = runs.id JOIN channelStats AS s ON s.channelId = channels.id "
+            "%s GROUP BY grp ORDER BY grp" % (group, where))
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+
+        trend = []
+        for row in rows:
+            mean = row["sumOffset"] / row["count"]
+            variance = max(0.0, row["sumSquares"] / row["count"] - mean * mean)
+            trend.append({
+                "group" : row["grp"],
+                "runs" : row["runs"],
+                "channels" : row["channels"],
+                "count" : row["count"],
+                "meanOffsetSecs" : mean,
+                "stdDevSecs" : variance ** 0.5,
+                "minOffsetSecs" : row["minOffsetSecs"],
+                "maxOffsetSecs" : row["maxOffsetSecs"],
+                "meanP50OffsetSecs" : row["meanP50OffsetSecs"],
+                "maxP95OffsetSecs" : row["maxP95OffsetSecs"],
+                "maxErrorSecs" : row["maxErrorSecs"],
+                "tested" : row["tested"],
+                "passRate" : float(row["passes"]) / row["tested"] if row["tested"] else None,
+            })
+        return trend
+
+
+    def runs(self, limit=None, **filters):
+        """\
+        :param limit: None, or the maximum number of runs to return (the most recent)
+        :param filters: see :meth:`trend`. If pinName is given, only runs with that pin are included.
+        :returns: list of runs, most recent first, each a dict of the columns of the `runs` table (with "extra"
+            decoded), plus "channels": a list of dicts with keys "id", "pinName", "matchIndex", "firstExpectedSecs",
+            "error" and the statistics stored for the channel (or None for those if it could not be measured).
+            Per-observation data is not read (see :meth:`diffsAndErrors`).
+        """
+        clauses, params = self._filters(**filters)
+        where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        query = "SELECT DISTINCT %s FROM runs LEFT JOIN channels ON channels.runId = runs.id %s ORDER BY runs.started DESC, runs.id DESC" % \
+                (", ".join("runs." + column for column in RUN_COLUMNS), where)
+        if limit is not None:
+            query += " LIMIT %d" % int(limit)
+
+        with self._lock:
+            runs = [ dict(row) for row in self._conn.execute(query, params).fetchall() ]
+            for run in runs:
+                run["extra"] = None if run["extra"] is None else json.loads(run["extra"])
+                run["passed"] = None if run["passed"] is None else bool(run["passed"])
+                channelRows = self._conn.execute(
+                    "SELECT channels.id, channels.pinName, channels.matchIndex, channels.firstExpectedSecs, channels.error, %s "
+                    "FROM channels LEFT JOIN channelStats AS s ON s.channelId = channels.id WHERE channels.runId = ? ORDER BY channels.id" % \
+                    ", ".join("s." + column for column in STATS_COLUMNS), (run["id"],)).fetchall()
+                run["channels"] = [ dict(row) for row in channelRows ]
+                for channel in run["channels"]:
+                    channel["passed"] = None if channel["passed"] is None else bool(channel["passed"])
+        return runs
+
+
+    def diffsAndErrors(self, channelId):
+        """\
+        :returns: list of (diff, err) tuples in seconds, for every observation of a channel, or None if there are none
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT diffs, errors FROM channelDiffs WHERE channelId = ?", (channelId,)).fetchone()
+        if row is None:
+            return None
+        return list(zip(unpackValues(row["diffs"]), unpackValues(row["errors"])))
+
+
+
+class StoredRun(object):
+
+    def __init__(self, filename, tester, **labels):
+        """\
+        Records the outcome of a run of a tester in a results database, in the same way as
+        :class:`headless.HeadlessRun` collects it for a JSON result.
+
+        :param filename: name of the results database
+        :param tester: name of the tester, e.g. "tv" or "csa"
+        :param labels: device, firmware, rig, content and toleranceSecs (see :meth:`ResultsStore.addRun`)
+
+        If the run is closed (see :meth:`close`) without :meth:`finish` being called, it is recorded as aborted.
+        """
+        super(StoredRun, self).__init__()
+        self.store = ResultsStore(filename)
+        self.runId = self.store.addRun(tester, **labels)
+        self.toleranceSecs = labels.get("toleranceSecs")
+        self.status = "ok"
+        self.reason = None
+        self.finished = False
+
+
+    def addChannelResult(self, pinName, matchIndex, allExpectedTimes, diffsAndErrors, toleranceSecs=None):
+        """\
+        See :meth:`ResultsStore.addChannelResult`
+        """
+        self.store.addChannelResult(self.runId, pinName, matchIndex, allExpectedTimes, diffsAndErrors, toleranceSecs)
+
+
+    def addChannelError(self, pinName, error):
+        """\
+        See :meth:`ResultsStore.addChannelError`
+        """
+        self.store.addChannelError(self.runId, pinName, error)
+
+
+    def abort(self, reason):
+        """\
+        Record that the run did not complete.
+        """
+        self.status = "aborted"
+        self.reason = reason
+
+
+    def finish(self):
+        """\
+        Record the end of the run.
+        """
+        if not self.finished:
+            self.store.finishRun(self.runId, self.status, self.reason)
+            self.finished = True
+
+
+    def close(self):
+        """\
+        Record the end of the run, as aborted if :meth:`finish` was not called, and close the database.
+        """
+        if not self.finished:
+            if self.status == "ok":
+                self.abort("Did not complete")
+            self.finish()
+        self.store.close()
+
+
+
+def _parseDate(value):
+    return time.mktime(time.strptime(value, "%Y-%m-%d"))
+
+
+def _formatMillis(value):
+    return "" if value is None else "%.3f" % (value * 1000.0)
+
+
+if __name__ == "__main__":
+
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Query a database of measurement results.")
+    parser.add_argument("filename", help="The results database (as written with the --resultsDb option of the testers)")
+    parser.add_argument("query", choices=[ "trend", "runs" ], help="\"trend\" to aggregate statistics, or \"runs\" to list runs")
+    parser.add_argument("--by", dest="groupBy", choices=sorted(TREND_GROUPS.keys()), default="day", help="What to group the trend by (default=day)")
+    parser.add_argument("--device", dest="device", default=None, help="Only include runs for this device")
+    parser.add_argument("--firmware", dest="firmware", default=None, help="Only include runs for this firmware build")
+    parser.add_argument("--rig", dest="rig", default=None, help="Only include runs on this test rig")
+    parser.add_argument("--content", dest="content", default=None, help="Only include runs with this content")
+    parser.add_argument("--pin", dest="pinName", default=None, help="Only include this pin, e.g. LIGHT_0")
+    parser.add_argument("--since", dest="since", type=_parseDate, default=None, help="Only include runs started on or after this date (YYYY-MM-DD)")
+    parser.add_argument("--until", dest="until", type=_parseDate, default=None, help="Only include runs started before this date (YYYY-MM-DD)")
+    parser.add_argument("--limit", dest="limit", type=int, default=None, help="Maximum number of runs to list")
+    parser.add_argument("--json", dest="asJson", action="store_true", default=False, help="Output as JSON")
+    args = parser.parse_args()
+
+    filters = dict(device=args.device, firmware=args.firmware, rig=args.rig, content=args.content, pinName=args.pinName, since=args.since, until=args.until)
+    store = ResultsStore(args.filename)
+    if args.query == "trend":
+        rows = store.trend(args.groupBy, **filters)
+        if args.asJson:
+            json.dump(rows, sys.stdout, indent=1)
+            print()
+        else:
+            print("%-24s %6s %8s %9s %11s %11s %11s %11s %9s" % (args.groupBy, "runs", "channels", "readings", "mean (ms)", "stddev (ms)", "min (ms)", "max (ms)", "pass rate"))
+            for row in rows:
+                passRate = "" if row["passRate"] is None else "%.1f%%" % (row["passRate"] * 100.0)
+                print("%-24s %6d %8d %9d %11s %11s %11s %11s %9s" % (row["group"], row["runs"], row["channels"], row["count"], \
+                      _formatMillis(row["meanOffsetSecs"]), _formatMillis(row["stdDevSecs"]), _formatMillis(row["minOffsetSecs"]), \
+                      _formatMillis(row["maxOffsetSecs"]), passRate))
+    else:
+        runs = store.runs(args.limit, **filters)
+        if args.asJson:
+            json.dump(runs, sys.stdout, indent=1)
+            print()
+        else:
+            for run in runs:
+                print("%s  run %d  %s  device=%s firmware=%s rig=%s content=%s  passed=%s" % \
+                      (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run["started"])), run["id"], run["status"], \
+                       run["device"], run["firmware"], run["rig"], run["content"], run["passed"]))
+                for channel in run["channels"]:
+                    if channel["error"] is not None:
+                        print("    %-8s %s" % (channel["pinName"], channel["error"]))
+                    else:
+                        print("    %-8s mean %s ms, std dev %s ms, %d readings" % (channel["pinName"], \
+                              _formatMillis(channel["meanOffsetSecs"]), _formatMillis(channel["stdDevSecs"]), channel["count"]))
+    store.close()
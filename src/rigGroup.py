@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Capturing from several Arduinos ("rigs") at the same time, for example to
+measure a TV and its companion devices, or several CSAs, at the same moment.
+
+:class:`RigGroup` connects to the Arduinos and runs their captures and bulk
+transfers in parallel (using :mod:`arduinoAsync`). Each Arduino has its own
+clock, so each rig keeps its own round-trip timing data for correlating its
+clock with the wall clock.
+
+:class:`RigGroupMeasurer` is the equivalent of :class:`measurer.Measurer` for
+a rig group, and shares its analysis (:class:`measurer.MeasurerBase`),
+including campaigns. Pins are named by prefixing the rig name, e.g. "tv:LIGHT_0"
+or "companion1:AUDIO_0", and the channels from all rigs are presented
+together for detection and comparison. Sessions can only be saved from a
+single arduino :class:`measurer.Measurer`.
+
+'''
+
+import asyncio
+
+import analyse
+import arduino
+import detect
+import instrumentation
+from arduinoAsync import AsyncArduino
+from measurer import MeasurerBase, PIN_MAP, repackageSamples
+
+
+def namespacedPinName(rigName, pinName):
+    """\
+    :returns: name identifying a pin on a particular rig, e.g. "tv:LIGHT_0"
+    """
+    return rigName + ":" + pinName
+
+
+def splitPinName(name):
+    """\
+    :param name: namespaced pin name, e.g. "tv:LIGHT_0"
+    :returns: tuple (rigName, pinName)
+    :raises ValueError: if the name is not namespaced by a rig name
+    """
+    rigName, sep, pinName = name.rpartition(":")
+    if not sep or not rigName:
+        raise ValueError("Pin name is not prefixed with a rig name: "+repr(name))
+    return rigName, pinName
+
+
+def repackageRigSamples(rigName, pinsToMeasure, nMilliBlocks, samples):
+    """\
+    :returns: channels as returned by :func:`measurer.repackageSamples`, but with pin names namespaced by the rig name
+    """
+    channels = repackageSamples(pinsToMeasure, PIN_MAP, nMilliBlocks, samples)
+    for channel in channels:
+        if channel is not None:
+            channel["pinName"] = namespacedPinName(rigName, channel["pinName"])
+    return channels
+
+
+def discoverRigs(pinsToMeasure):
+    """\
+    Find all Arduino Dues connected via USB and name them "rig0", "rig1", etc.
+
+    :param pinsToMeasure: list of pin names (e.g. "LIGHT_0") to measure on every rig
+    :returns: list of (rigName, serial port, pinsToMeasure) tuples, suitable for passing to :class:`RigGroup`
+    :raises RuntimeError: if no Arduino Due is connected
+    """
+    ports = arduino.findArduinoPorts()
+    if not ports:
+        raise RuntimeError("Could not locate any arduino serial port connections.")
+    return [ ("rig%d" % i, port, list(pinsToMeasure)) for i, port in enumerate(ports) ]
+
+
+
+class Rig(object):
+
+    def __init__(self, name, url, pinsToMeasure):
+        """\
+        One Arduino in a :class:`RigGroup`, and the results of its most recent capture.
+
+        :param name: name of the rig, used to prefix its pin names
+        :param url: serial port or URL of the Arduino (see :meth:`arduinoAsync.AsyncArduino.connect`)
+        :param pinsToMeasure: list of pin names ("LIGHT_0", "AUDIO_0", "LIGHT_1", "AUDIO_1") to be sampled on this rig
+
+        The transferEncoding attribute is the encoding the Arduino uses to transfer the samples. It can be
+        :data:`arduino.ENCODING_RAW` even if run-length encoding was requested, if the Arduino does not support it.
+
+        The armed attribute is True while the Arduino has the pins enabled and is prepared to capture
+        (see :meth:`RigGroup.arm`).
+
+        After :meth:`RigGroup.capture` the following attributes are set:
+        * samples, nMilliBlocks - the samples as transferred from the Arduino, and the number of millisecond blocks
+        * channels - the samples, as returned by :func:`repackageRigSamples`. They are only repackaged when first needed
+        * dueStartTimeUsecs, dueFinishTimeUsecs - when sampling started and finished (in Arduino clock nanoseconds)
+        * wcAcReqResp - round-trip timing data for this rig, as passed to :class:`detect.BeepFlashDetector`
+        * syncRttStats - summary of the round-trip times of the sync bursts before and after capture
+        """
+        super(Rig, self).__init__()
+        if ":" in name:
+            raise ValueError("Rig name cannot contain ':' : "+repr(name))
+        self.name = name
+        self.url = url
+        self.pinsToMeasure = pinsToMeasure
+        self.device = None
+        self.nActivePins = 0
+        self.armed = False
+        self.transferEncoding = arduino.ENCODING_RAW
+        self._channels = None
+
+
+    @property
+    def channels(self):
+        if self._channels is None:
+            self._channels = repackageRigSamples(self.name, self.pinsToMeasure, self.nMilliBlocks, self.samples)
+        return self._channels
+
+
+
+class RigGroup(object):
+
+    def __init__(self, rigs, wallClock, captureSecs, syncBurstSize=arduino.SYNC_BURST_SIZE, transferEncoding=arduino.ENCODING_RAW):
+        """\
+        Connect to several Arduinos and prepare them all to capture (see :meth:`arm`).
+
+        :param rigs: list of (rigName, url, pinsToMeasure) tuples. See :class:`Rig`. Use :func:`discoverRigs`
+            to find all Arduino Dues connected via USB.
+        :param wallClock: the wall clock object used to time the round trips to every Arduino
+        :param captureSecs: length of the capture to be taken on every arduino in seconds
+        :param syncBurstSize: number of clock sync round trips made with each arduino immediately before and after capture
+        :param transferEncoding: encoding every arduino should use to transfer the samples (see :func:`arduino.setTransferEncoding`)
+
+        :raises ValueError: if rig names are duplicated, or an arduino does not activate the requested pins
+        :raises RuntimeError: if run-length encoding is requested but numpy is not installed
+        """
+        super(RigGroup, self).__init__()
+        self.rigs = [ Rig(name, url, pinsToMeasure) for (name, url, pinsToMeasure) in rigs ]
+        if len(set(rig.name for rig in self.rigs)) != len(self.rigs):
+            raise ValueError("Rig names must be unique")
+        self.wallClock = wallClock
+        self.captureSecs = captureSecs
+        self.syncBurstSize = syncBurstSize
+        self.transferEncoding = transferEncoding
+
+        # the asyncio streams for each arduino belong to this event loop
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self._connectAll())
+        self.arm()
+
+
+    @property
+    def pinNames(self):
+        """\
+        :returns: list of the namespaced names of the pins being measured across all rigs
+        """
+        return [ namespacedPinName(rig.name, pin) for rig in self.rigs for pin in rig.pinsToMeasure ]
+
+
+    async def _connect(self, rig):
+        rig.device = await AsyncArduino.connect(rig.url)
+        if self.transferEncoding != arduino.ENCODING_RAW:
+            rig.transferEncoding = (await rig.device.setTransferEncoding(self.wallClock, self.transferEncoding))[0]
+
+
+    async def _connectAll(self):
+        await asyncio.gather(*[ self._connect(rig) for rig in self.rigs ])
+
+
+    async def _arm(self, rig):
+        for pin in rig.pinsToMeasure:
+            await rig.device.samplePinDuringCapture(PIN_MAP[pin], self.wallClock)
+        rig.nActivePins = (await rig.device.prepareToCapture(self.wallClock, self.captureSecs))[0]
+        if rig.nActivePins != len(rig.pinsToMeasure):
+            raise ValueError("# activated pins mismatches request on rig: "+rig.name)
+        rig.armed = True
+
+
+    async def _armAll(self, rigs):
+        await asyncio.gather(*[ self._arm(rig) for rig in rigs ])
+
+
+    def arm(self):
+        """\
+        Enable the pins to be read and prepare every arduino to capture.
+
+        This is done when the group is created. Each arduino clears the enabled pins once it has transferred
+        the samples, so :meth:`capture` does it again for any rig that has not been armed since its last capture.
+
+        :raises ValueError: if an arduino does not activate the requested pins
+        """
+        self.loop.run_until_complete(self._armAll(self.rigs))
+
+
+    async def _captureAll(self):
+        rigs = self.rigs
+        clock = self.wallClock
+
+        await self._armAll([ rig for rig in rigs if not rig.armed ])
+
+        # each phase runs on all rigs at once, so the captures start as close together as possible
+        burstsPre = await asyncio.gather(*[ rig.device.syncBurst(clock, self.syncBurstSize) for rig in rigs ])
+        captures = await asyncio.gather(*[ rig.device.capture(clock) for rig in rigs ])
+        burstsPost = await asyncio.gather(*[ rig.device.syncBurst(clock, self.syncBurstSize) for rig in rigs ])
+        transfers = await asyncio.gather(*[ rig.device.bulkTransfer(clock, rig.transferEncoding) for rig in rigs ])
+        for rig in rigs:
+            rig.armed = False
+
+        for rig, (burstPre, rttStatsPre), capture, (burstPost, rttStatsPost), (samples, timeData) in \
+                zip(rigs, burstsPre, captures, burstsPost, transfers):
+            rig.dueStartTimeUsecs, rig.dueFinishTimeUsecs, rig.nMilliBlocks, timeDataPre, timeDataPost = capture
+            rig.wcAcReqResp = {
+                "pre"  : [ arduino.alignWrap(burstPre, timeDataPre), timeDataPre ],
+                "post" : [ timeDataPost, arduino.alignWrap(burstPost, timeDataPost) ],
+            }
+            rig.syncRttStats = {"pre":rttStatsPre, "post":rttStatsPost}
+            rig.samples = samples
+            rig._channels = None
+
+
+    def capture(self):
+        """\
+        Capture on all rigs in parallel, then transfer the samples from all rigs in parallel. Any rig
+        that has not been armed since its last capture is armed first (see :meth:`arm`).
+
+        Results are placed in the attributes of each :class:`Rig` object in :data:`rigs`.
+        """
+        self.loop.run_until_complete(self._captureAll())
+
+
+    def close(self):
+        """\
+        Close the connections to all the arduinos.
+        """
+        for rig in self.rigs:
+            if rig.device is not None:
+                rig.device.close()
+                rig.device = None
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+
+
+
+class RigGroupMeasurer(MeasurerBase):
+
+    def __init__(self, role, rigs, expectedTimings, eventDurations, videoStartTicks, wallClock, syncTimelineClock, syncTimelineTickRate, wcPrecisionNanos, acPrecisionNanos, captureSecs, syncBurstSize=arduino.SYNC_BURST_SIZE, transferEncoding=arduino.ENCODING_RAW):
+        """\
+
+        connect with all the arduinos in a rig group and send commands on which pins are to be read during
+        data capture.
+
+        :param role "master" or "client" which role the measurement system is acting in
+        :param rigs list of (rigName, url, pinsToMeasure) tuples. See :class:`RigGroup`
+        :param expectedTimings dict mapping namespaced pin names (e.g. "tv:LIGHT_0") to lists containing expected flash/beep times
+        :param eventDurations dict mapping namespaced pin names to the expected duration of the flash/beep in seconds
+        :param videoStartTicks initial sync time line clock value
+        :param transferEncoding encoding every arduino should use to transfer the samples (see :func:`arduino.setTransferEncoding`)
+
+        All other parameters are the same as for :class:`measurer.Measurer`.
+        """
+        pinsToMeasure = [ namespacedPinName(rigName, pin) for (rigName, url, pins) in rigs for pin in pins ]
+        super(RigGroupMeasurer, self).__init__(role, pinsToMeasure, expectedTimings, eventDurations, videoStartTicks, wallClock, syncTimelineClock, syncTimelineTickRate, wcPrecisionNanos, acPrecisionNanos, captureSecs, syncBurstSize)
+
+        self.rigGroup = RigGroup(rigs, wallClock, captureSecs, syncBurstSize, transferEncoding)
+        self.nActivePins = sum(rig.nActivePins for rig in self.rigGroup.rigs)
+
+
+    def armCapture(self):
+        """\
+
+        Enable the pins to be read and prepare every arduino in the group to capture (see :meth:`RigGroup.arm`).
+        This is done when the measurer is created, and :meth:`capture` does it again if needed.
+
+        :raise ValueError if an arduino does not activate the requested pins
+
+        """
+        self.rigGroup.arm()
+        self.nActivePins = sum(rig.nActivePins for rig in self.rigGroup.rigs)
+
+
+    def _captureSamples(self):
+        self.rigGroup.capture()
+
+
+    def takeCaptureData(self):
+        """\
+
+        :returns: dict holding everything from the most recent capture that is needed for detection, so
+            that it can be analysed while the next capture is taking place. Keys are "rigs",
+            "wcSyncTimeCorrelations" and "syncRttStats". "rigs" is a list with a dict per rig, with keys
+            "name", "pinsToMeasure", "samples", "nMilliBlocks", "dueStartTimeUsecs", "dueFinishTimeUsecs"
+            and "wcAcReqResp" (see :class:`Rig`). The samples are separated into channels by :meth:`detectInCaptureData`.
+            "syncRttStats" maps each rig name to the round-trip time statistics for that rig.
+
+        """
+        rigs = self.rigGroup.rigs
+        return {
+            "rigs" : [ {
+                "name" : rig.name,
+                "pinsToMeasure" : rig.pinsToMeasure,
+                "samples" : rig.samples,
+                "nMilliBlocks" : rig.nMilliBlocks,
+                "dueStartTimeUsecs" : rig.dueStartTimeUsecs,
+                "dueFinishTimeUsecs" : rig.dueFinishTimeUsecs,
+                "wcAcReqResp" : rig.wcAcReqResp,
+            } for rig in rigs ],
+            "wcSyncTimeCorrelations" : self.wcSyncTimeCorrelations,
+            "syncRttStats" : dict((rig.name, rig.syncRttStats) for rig in rigs),
+        }
+
+
+    def detectInCaptureData(self, captureData, dispersionFunc):
+        """\
+
+        Detect flashes and beeps on every rig, using each rig's own correlation between its
+        arduino clock and the wall clock.
+
+        :param captureData: dict as returned by :meth:`takeCaptureData`
+        :param dispersionFunc: see :meth:`measurer.Measurer.detectBeepsAndFlashes`
+        :returns tuple (observedTimings, testPackage): as set by :meth:`detectBeepsAndFlashes`, for all rigs together
+        """
+        observedTimings = []
+        for rigData in captureData["rigs"]:
+            channels = repackageRigSamples(rigData["name"], rigData["pinsToMeasure"], rigData["nMilliBlocks"], rigData["samples"])
+            measuredChannels = [ channel for channel in channels if channel is not None ]
+            for channel in measuredChannels:
+                if channel["pinName"] in self.eventDurations:
+                    channel["eventDuration"] = self.eventDurations[channel["pinName"]]
+
+            with instrumentation.span("measurer.detect"):
+                detector = detect.BeepFlashDetector(rigData["wcAcReqResp"], self.syncClockTickRate, \
+                                                    captureData["wcSyncTimeCorrelations"], dispersionFunc, \
+                                                    self.wcPrecisionNanos, self.acPrecisionNanos)
+                observedTimings.extend(analyse.runDetection(detector, measuredChannels, rigData["dueStartTimeUsecs"], rigData["dueFinishTimeUsecs"]))
+
+        testPackage = []
+        for result in observedTimings:
+            pinName = result["pinName"]
+            testPackage.append( { "pinName":pinName,  "observed": result["observed"],  "expected":self.expectedTimings[pinName] } )
+        return observedTimings, testPackage
+
+
+    def close(self):
+        self.rigGroup.close()
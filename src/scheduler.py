@@ -0,0 +1,809 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Scheduling of measurement jobs across a pool of test rigs (each a PC with an
+Arduino, wired to a device under test), so that a whole matrix of test
+configurations can be queued and left to run.
+
+A job is one run of a tester, described by a config (a JSON object):
+
+* "tester" ... "tv" or "csa"
+* "pins" ... dict mapping pin names (e.g. "LIGHT_0") to the metadata file with the expected timings for that pin
+* "timelineSelector", "unitsPerTick", "unitsPerSec", "videoStartTicks" ... the timeline (as for the testers)
+* "contentId" ... the content ID stem asked of the TV, or the content ID the CSA is told is playing
+* "tsUrl", "wcUrl" ... (TV tester) the CSS-TS and CSS-WC end points of the TV
+* "toleranceMillis" ... (optional) tolerance for a pass/fail test
+* "measureSecs" ... (optional) duration of the measurement, in whole seconds
+* "headless" ... (optional) headless config (see :mod:`headless`), e.g. the dispersion of the CSA
+* "rigs" ... (optional) list of the names of the rigs the job can run on
+* "args" ... (optional) list of any other command line arguments for the tester
+
+A matrix (see :func:`expandMatrix`) gives a "base" config and, in "matrix", lists of
+values for some of the keys. A job is queued for every combination of those values.
+
+Each rig is described by a dict with keys "name", and optionally "arduinoUrl" (see the
+`--arduino` option of the testers), "pins" (the pins wired up on that rig; jobs needing
+others are not run on it) and "args" (other command line arguments for the testers run on it).
+
+The :class:`Scheduler` runs one job at a time on each rig, and gives a rig the next
+job it can run as soon as it is free. If a run cannot reliably measure a pin (the tester
+reports :class:`measurer.DubiousInput`), the job is retried after a backoff that grows
+with each attempt, until it has been attempted `maxAttempts` times. Other failures are
+not retried.
+
+The queue is kept in a JSON file (see :class:`JobQueue`), rewritten under a lock whenever
+a job changes, so it survives restarts, and more jobs can be added while it is being run.
+When the scheduler is started again, jobs that were running when it stopped are queued
+again (see :meth:`JobQueue.recover`). :func:`report` summarises per-job latency and the utilisation of each rig.
+
+Jobs are run by a backend: :class:`TesterBackend` runs the testers in headless mode,
+and :class:`SimulatedRigBackend` captures from an emulated Arduino (see :mod:`arduinoEmulator`)
+instead of real hardware, for testing.
+
+
+Usage
+-----
+
+.. code-block:: bash
+
+    $ python src/scheduler.py queue.json add matrix.json
+    $ python src/scheduler.py queue.json run rigs.json
+    $ python src/scheduler.py queue.json report
+
+Or from python:
+
+.. code-block:: python
+
+    queue = JobQueue("queue.json")
+    queue.add(expandMatrix(spec))
+    queue.recover()
+    Scheduler(queue, rigs, TesterBackend()).run()
+    print(report(queue.jobs()))
+
+"""
+
+import itertools
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows
+    fcntl = None
+    import msvcrt
+
+import headless
+import stats
+
+
+FORMAT_VERSION = 1
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BACKOFF_SECS = 30.0
+DEFAULT_BACKOFF_FACTOR = 2.0
+DEFAULT_MAX_BACKOFF_SECS = 600.0
+
+# how often idle rigs check for jobs that have become ready
+POLL_SECS = 0.5
+
+# command line options of the testers for each pin
+PIN_OPTIONS = { "LIGHT_0" : "--light0", "LIGHT_1" : "--light1", "AUDIO_0" : "--audio0", "AUDIO_1" : "--audio1" }
+
+TESTERS = {
+    "tv" : "exampleTVTester.py",
+    "csa" : "exampleCsaTester.py",
+}
+
+# outcomes of an attempt to run a job
+OK = "ok"
+DUBIOUS = "dubious"
+ERROR = "error"
+INTERRUPTED = "interrupted"
+
+
+
+def expandMatrix(spec):
+    """\
+    :param spec: dict with keys "base" (a job config) and "matrix" (dict mapping config keys to lists of values)
+    :returns: list of job configs, one for every combination of the values in the matrix, in a repeatable order
+    """
+    base = spec.get("base", {})
+    matrix = spec.get("matrix", {})
+    keys = sorted(matrix.keys())
+    for key in keys:
+        if not isinstance(matrix[key], list) or len(matrix[key]) == 0:
+            raise ValueError("Matrix entry "+repr(key)+" must be a list of one or more values.")
+    configs = []
+    for values in itertools.product(*[ matrix[key] for key in keys ]):
+        config = dict(base)
+        config.update(zip(keys, values))
+        configs.append(config)
+    return configs
+
+
+
+def checkConfig(config):
+    """\
+    :raises ValueError: if a job config is not valid
+    """
+    if config.get("tester") not in TESTERS:
+        raise ValueError("Job \"tester\" must be one of: "+", ".join(sorted(TESTERS)))
+    required = [ "pins", "timelineSelector", "unitsPerTick", "unitsPerSec", "videoStartTicks", "contentId" ]
+    if config["tester"] == "tv":
+        required += [ "tsUrl", "wcUrl" ]
+    missing = [ key for key in required if key not in config ]
+    if missing:
+        raise ValueError("Job config is missing: "+", ".join(missing))
+    if not isinstance(config["pins"], dict) or len(config["pins"]) == 0 or not set(config["pins"]) <= set(PIN_OPTIONS):
+        raise ValueError("Job \"pins\" must map one or more of "+", ".join(sorted(PIN_OPTIONS))+" to metadata files.")
+    measureSecs = config.get("measureSecs")
+    if measureSecs is not None and (not isinstance(measureSecs, int) or isinstance(measureSecs, bool) or measureSecs < 1):
+        raise ValueError("Job \"measureSecs\" must be a whole number of seconds, of at least 1.")
+
+
+
+def canRunOn(config, rig):
+    """\
+    :returns: True if a job can run on a rig
+    """
+    if "rigs" in config and rig["name"] not in config["rigs"]:
+        return False
+    if "pins" in rig and not set(config["pins"]) <= set(rig["pins"]):
+        return False
+    return True
+
+
+
+def classifyResult(result):
+    """\
+    :param result: the result of a run (see :class:`headless.HeadlessRun`)
+    :returns: tuple (outcome, reason): :data:`OK`, :data:`DUBIOUS` if a pin could not be reliably measured,
+        or :data:`ERROR` if the run was aborted, and None or why
+    """
+    if result["status"] != "ok":
+        return ERROR, result["reason"]
+    dubious = [ channel["pinName"] for channel in result["channels"] if "error" in channel ]
+    if dubious:
+        return DUBIOUS, "Cannot reliably measure on pin: "+", ".join(dubious)
+    return OK, None
+
+
+
+class _QueueFileLock(object):
+    """\
+    Context manager holding a lock on a job queue, against other threads and (using a lock file
+    alongside the queue file) other processes
+    """
+
+    def __init__(self, filename):
+        self.lockFilename = filename + ".lock"
+        self._threadLock = threading.Lock()
+        self._f = None
+
+    def __enter__(self):
+        self._threadLock.acquire()
+        try:
+            self._f = open(self.lockFilename, "a")
+            if fcntl is not None:
+                fcntl.flock(self._f.fileno(), fcntl.LOCK_EX)
+            else:
+                self._f.seek(0)
+                msvcrt.locking(self._f.fileno(), msvcrt.LK_LOCK, 1)
+        except Exception:
+            if self._f is not None:
+                self._f.close()
+            self._threadLock.release()
+            raise
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+            else:
+                self._f.seek(0)
+                msvcrt.locking(self._f.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._f.close()
+            self._threadLock.release()
+        return False
+
+
+
+class JobQueue(object):
+
+    def __init__(self, filename):
+        """\
+        A queue of jobs, kept in a JSON file. Every change re-reads the file and rewrites it (in one step) while
+        holding a lock, so jobs can be added, and the queue reported on, by other processes while a scheduler
+        is running it. Opening the queue, and reading the jobs, does not change the file. Can be used from any thread.
+
+        :param filename: name of the file. It is created when the first jobs are added.
+        :raises ValueError: if the file exists but is not a job queue of a format version that is understood
+
+        Each job is a dict with keys:
+
+        * "id" ... number of the job
+        * "config" ... the job config (see module documentation)
+        * "status" ... "queued", "running", "done" (it ran, whether or not it passed) or "failed"
+        * "submitted", "finished" ... when the job was queued and when it finished (see :func:`time.time`, or None)
+        * "notBefore" ... None, or the time before which the job should not be run (while backing off)
+        * "attempts" ... list of attempts to run the job, each a dict with keys "rig", "started", "finished",
+          "outcome" (:data:`OK`, :data:`DUBIOUS`, :data:`ERROR` or :data:`INTERRUPTED`) and "reason"
+        * "result" ... the result of the last attempt (see :class:`headless.HeadlessRun`), or None
+        """
+        super(JobQueue, self).__init__()
+        self.filename = filename
+        self._lock = _QueueFileLock(filename)
+        self._load()
+
+
+    def _load(self):
+        """\
+        :returns: tuple (nextId, jobs) read from the file
+        """
+        if not os.path.exists(self.filename):
+            return 1, []
+        with open(self.filename) as f:
+            contents = json.load(f)
+        if contents.get("formatVersion") != FORMAT_VERSION:
+            raise ValueError("Unsupported job queue format version: "+repr(contents.get("formatVersion")))
+        return contents["nextId"], contents["jobs"]
+
+
+    def _save(self, nextId, jobs):
+        tmpFilename = self.filename + ".tmp"
+        with open(tmpFilename, "w") as f:
+            json.dump({ "formatVersion" : FORMAT_VERSION, "nextId" : nextId, "jobs" : jobs }, f, indent=1)
+        os.replace(tmpFilename, self.filename)
+
+
+    def recover(self, now=None):
+        """\
+        Queue again the jobs that were left running when a scheduler stopped, recording the attempts as
+        :data:`INTERRUPTED`. Call this before starting to run the queue, and only when no other scheduler is running it.
+
+        :returns: the number of jobs queued again
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            nextId, jobs = self._load()
+            recovered = 0
+            for job in jobs:
+                if job["status"] == "running":
+                    job["status"] = "queued"
+                    job["attempts"][-1].update({ "finished" : now, "outcome" : INTERRUPTED, "reason" : "Scheduler stopped" })
+                    recovered += 1
+            if recovered:
+                self._save(nextId, jobs)
+            return recovered
+
+
+    def add(self, configs):
+        """\
+        :param configs: list of job configs to queue
+        :returns: list of the ids of the jobs
+        :raises ValueError: if any of the configs is not valid (none are queued)
+        """
+        for config in configs:
+            checkConfig(config)
+        with self._lock:
+            nextId, jobs = self._load()
+            ids = []
+            for config in configs:
+                jobs.append({ "id" : nextId, "config" : config, "status" : "queued", "submitted" : time.time(), \
+                              "finished" : None, "notBefore" : None, "attempts" : [], "result" : None })
+                ids.append(nextId)
+                nextId += 1
+            self._save(nextId, jobs)
+            return ids
+
+
+    def jobs(self):
+        """\
+        :returns: list of all the jobs, in the order they were queued
+        """
+        return self._load()[1]
+
+
+    def take(self, rig, now=None):
+        """\
+        Start running the first job that is ready to run, and can run on the rig.
+
+        :param rig: the rig (see module documentation)
+        :returns: the job, or None if there is none
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            nextId, jobs = self._load()
+            for job in jobs:
+                if job["status"] == "queued" and (job["notBefore"] is None or job["notBefore"] <= now) and canRunOn(job["config"], rig):
+                    job["status"] = "running"
+                    job["notBefore"] = None
+                    job["attempts"].append({ "rig" : rig["name"], "started" : now, "finished" : None, "outcome" : None, "reason" : None })
+                    self._save(nextId, jobs)
+                    return job
+        return None
+
+
+    def pending(self, rig):
+        """\
+        :returns: tuple (nJobs, nextReady): the number of jobs that are queued or running and could run on the rig,
+            and the earliest time at which a queued one will be ready (or None if there are none queued)
+        """
+        nJobs, nextReady = 0, None
+        for job in self.jobs():
+            if job["status"] in ("queued", "running") and canRunOn(job["config"], rig):
+                nJobs += 1
+                if job["status"] == "queued":
+                    ready = job["notBefore"] or 0
+                    nextReady = ready if nextReady is None else min(nextReady, ready)
+        return nJobs, nextReady
+
+
+    def finishAttempt(self, jobId, outcome, reason=None, result=None, retryAt=None, now=None):
+        """\
+        Record the outcome of the attempt to run a job that is in progress.
+
+        :param outcome: :data:`OK`, :data:`DUBIOUS` or :data:`ERROR`
+        :param reason: None, or why the attempt did not succeed
+        :param result: the result of the attempt, or None
+        :param retryAt: None if the job has finished, otherwise the time at which to run it again
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            nextId, jobs = self._load()
+            job = [ job for job in jobs if job["id"] == jobId ][0]
+            job["attempts"][-1].update({ "finished" : now, "outcome" : outcome, "reason" : reason })
+            job["result"] = result
+            if retryAt is not None:
+                job["status"] = "queued"
+                job["notBefore"] = retryAt
+            else:
+                job["status"] = "done" if outcome == OK else "failed"
+                job["finished"] = now
+            self._save(nextId, jobs)
+
+
+
+class Scheduler(object):
+
+    def __init__(self, queue, rigs, backend, maxAttempts=DEFAULT_MAX_ATTEMPTS, backoffSecs=DEFAULT_BACKOFF_SECS, \
+                 backoffFactor=DEFAULT_BACKOFF_FACTOR, maxBackoffSecs=DEFAULT_MAX_BACKOFF_SECS, onAttempt=None):
+        """\
+        Runs the jobs in a queue on a pool of rigs, one job at a time per rig.
+
+        :param queue: the :class:`JobQueue`
+        :param rigs: list of rigs (see module documentation)
+        :param backend: runs a job on a rig. Has a method `run(rig, config)` returning a result (see :class:`headless.HeadlessRun`)
+        :param maxAttempts: the number of times a job is attempted before it is failed, if it cannot reliably measure a pin
+        :param backoffSecs: how long to wait before the first retry
+        :param backoffFactor: how much longer to wait before each retry than the one before
+        :param maxBackoffSecs: the longest to wait before a retry
+        :param onAttempt: None, or a function called (from the thread for the rig) with the job once each attempt finishes
+        """
+        super(Scheduler, self).__init__()
+        names = [ rig["name"] for rig in rigs ]
+        if len(set(names)) != len(names):
+            raise ValueError("Rig names must be unique.")
+        self.queue = queue
+        self.rigs = rigs
+        self.backend = backend
+        self.maxAttempts = maxAttempts
+        self.backoffSecs = backoffSecs
+        self.backoffFactor = backoffFactor
+        self.maxBackoffSecs = maxBackoffSecs
+        self.onAttempt = onAttempt
+        self._stopping = threading.Event()
+        self._wake = threading.Condition()
+
+
+    def backoff(self, nAttempts):
+        """\
+        :param nAttempts: the number of attempts so far
+        :returns: how long to wait (in seconds) before the next attempt
+        """
+        return min(self.maxBackoffSecs, self.backoffSecs * self.backoffFactor ** (nAttempts - 1))
+
+
+    def run(self, untilDone=True):
+        """\
+        Run jobs on all the rigs, until :meth:`stop` is called or (if `untilDone` is True) there are no more jobs
+        that can run on any of the rigs.
+        """
+        threads = []
+        for rig in self.rigs:
+            thread = threading.Thread(target=self._runRig, args=(rig, untilDone), name="scheduler-"+rig["name"])
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            self.stop()
+            raise
+
+
+    def stop(self):
+        """\
+        Stop giving rigs jobs. Jobs already running are finished.
+        """
+        self._stopping.set()
+        with self._wake:
+            self._wake.notify_all()
+
+
+    def _runRig(self, rig, untilDone):
+        while not self._stopping.is_set():
+            job = self.queue.take(rig)
+            if job is None:
+                nJobs, nextReady = self.queue.pending(rig)
+                if nJobs == 0 and untilDone:
+                    return
+                # wait until a retry is due, or another rig finishes a job (which might then be retried)
+                waitSecs = POLL_SECS if nextReady is None else max(0.0, min(POLL_SECS, nextReady - time.time()))
+                with self._wake:
+                    self._wake.wait(waitSecs)
+                continue
+
+            try:
+                result = self.backend.run(rig, job["config"])
+                outcome, reason = classifyResult(result)
+            except Exception as e:
+                result, outcome, reason = None, ERROR, "%s: %s" % (type(e).__name__, e)
+
+            nAttempts = sum(1 for attempt in job["attempts"] if attempt["outcome"] != INTERRUPTED)
+            retryAt = None
+            if outcome == DUBIOUS and nAttempts < self.maxAttempts:
+                retryAt = time.time() + self.backoff(nAttempts)
+            self.queue.finishAttempt(job["id"], outcome, reason, result, retryAt)
+
+            with self._wake:
+                self._wake.notify_all()
+            if self.onAttempt is not None:
+                self.onAttempt([ j for j in self.queue.jobs() if j["id"] == job["id"] ][0])
+
+
+
+def report(jobs):
+    """\
+    Summarise how long jobs took, and how busy each rig was.
+
+    :param jobs: list of jobs (see :class:`JobQueue`)
+    :returns: dict with keys:
+
+        * "jobs" ... list of dicts, one per job, with keys "id", "status", "attempts" (the number made), "rigs" (the names
+          of the rigs used), "queueSecs" (from being queued to first starting), "runSecs" (total time spent running)
+          and "latencySecs" (from being queued to finishing). Times are None if not yet known.
+        * "counts" ... dict mapping job status to the number of jobs with that status
+        * "latencySecs" ... None, or dict with keys "mean", "p50", "p95" and "max", across the jobs that have finished
+        * "spanSecs" ... time from the first attempt starting to the last one finishing
+        * "rigs" ... dict mapping rig names to dicts with keys "attempts", "busySecs" and "utilisation"
+          (the proportion of the span that the rig was busy)
+    """
+    summaries = []
+    counts = {}
+    rigs = {}
+    starts, finishes = [], []
+    for job in jobs:
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+        attempts = job["attempts"]
+        runSecs = 0.0
+        for attempt in attempts:
+            starts.append(attempt["started"])
+            if attempt["finished"] is None:
+                continue
+            finishes.append(attempt["finished"])
+            secs = attempt["finished"] - attempt["started"]
+            runSecs += secs
+            entry = rigs.setdefault(attempt["rig"], { "attempts" : 0, "busySecs" : 0.0 })
+            entry["attempts"] += 1
+            entry["busySecs"] += secs
+        summaries.append({
+            "id" : job["id"],
+            "status" : job["status"],
+            "attempts" : len(attempts),
+            "rigs" : sorted(set(attempt["rig"] for attempt in attempts)),
+            "queueSecs" : attempts[0]["started"] - job["submitted"] if attempts else None,
+            "runSecs" : runSecs,
+            "latencySecs" : None if job["finished"] is None else job["finished"] - job["submitted"],
+        })
+
+    latencies = [ summary["latencySecs"] for summary in summaries if summary["latencySecs"] is not None ]
+    latency = None
+    if latencies:
+        latency = { "mean" : sum(latencies) / len(latencies), "p50" : stats.calcPercentile(latencies, 50), \
+                    "p95" : stats.calcPercentile(latencies, 95), "max" : max(latencies) }
+
+    spanSecs = (max(finishes) - min(starts)) if starts and finishes else 0.0
+    for entry in rigs.values():
+        entry["utilisation"] = entry["busySecs"] / spanSecs if spanSecs > 0 else None
+
+    return { "jobs" : summaries, "counts" : counts, "latencySecs" : latency, "spanSecs" : spanSecs, "rigs" : rigs }
+
+
+
+def testerCommand(config, rig, headlessConfigFilename, srcDir=None, python=sys.executable):
+    """\
+    :param config: the job config
+    :param rig: the rig to run it on
+    :param headlessConfigFilename: name of the headless config file to give the tester
+    :param srcDir: the directory containing the testers, or None for the directory containing this module
+    :param python: the python interpreter to run the tester with
+    :returns: the command line (a list of arguments) to run the tester for a job on a rig
+    """
+    if srcDir is None:
+        srcDir = os.path.dirname(os.path.abspath(__file__))
+    command = [ python, os.path.join(srcDir, TESTERS[config["tester"]]), config["contentId"], config["timelineSelector"], \
+                str(config["unitsPerTick"]), str(config["unitsPerSec"]), str(config["videoStartTicks"]) ]
+    if config["tester"] == "tv":
+        command += [ config["tsUrl"], config["wcUrl"] ]
+    for pinName in sorted(config["pins"]):
+        command += [ PIN_OPTIONS[pinName], config["pins"][pinName] ]
+    if config.get("toleranceMillis") is not None:
+        command += [ "--toleranceTest", str(config["toleranceMillis"]) ]
+    if config.get("measureSecs") is not None:
+        command += [ "--measureSecs", str(config["measureSecs"]) ]
+    if rig.get("arduinoUrl") is not None:
+        command += [ "--arduino", rig["arduinoUrl"] ]
+    command += [ "--rig", rig["name"], "--headless", headlessConfigFilename ]
+    command += [ str(arg) for arg in rig.get("args", []) + config.get("args", []) ]
+    return command
+
+
+
+class TesterBackend(object):
+
+    def __init__(self, srcDir=None, python=sys.executable, timeoutSecs=None, logDir=None):
+        """\
+        Runs jobs by running the testers in headless mode.
+
+        :param srcDir: see :func:`testerCommand`
+        :param python: see :func:`testerCommand`
+        :param timeoutSecs: None, or how long to let a tester run before it is killed
+        :param logDir: None, or a directory to write the output of each run to
+        """
+        super(TesterBackend, self).__init__()
+        self.srcDir = srcDir
+        self.python = python
+        self.timeoutSecs = timeoutSecs
+        self.logDir = logDir
+
+
+    def run(self, rig, config):
+        """\
+        :returns: the JSON result written by the tester (see :class:`headless.HeadlessRun`)
+        :raises RuntimeError: if the tester did not write a result
+        """
+        tmpDir = tempfile.mkdtemp(prefix="scheduler")
+        try:
+            resultFilename = os.path.join(tmpDir, "result.json")
+            headlessConfig = dict(config.get("headless", {}))
+            headlessConfig["resultFile"] = resultFilename
+            headlessConfigFilename = os.path.join(tmpDir, "headless.json")
+            with open(headlessConfigFilename, "w") as f:
+                json.dump(headlessConfig, f)
+
+            command = testerCommand(config, rig, headlessConfigFilename, self.srcDir, self.python)
+            output = subprocess.DEVNULL
+            if self.logDir is not None:
+                if not os.path.isdir(self.logDir):
+                    os.makedirs(self.logDir)
+                output = open(os.path.join(self.logDir, "%s-%d.log" % (rig["name"], int(time.time() * 1000))), "w")
+            try:
+                subprocess.run(command, stdin=subprocess.DEVNULL, stdout=output, stderr=subprocess.STDOUT, timeout=self.timeoutSecs)
+            except subprocess.TimeoutExpired:
+                raise RuntimeError("Tester did not finish within %s seconds" % self.timeoutSecs)
+            finally:
+                if output is not subprocess.DEVNULL:
+                    output.close()
+
+            if not os.path.exists(resultFilename):
+                raise RuntimeError("Tester did not write a result")
+            with open(resultFilename) as f:
+                return json.load(f)
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+
+
+
+class _SimulatedClock(object):
+    """Stands in for the wall clock, with nanosecond ticks"""
+    @property
+    def ticks(self):
+        return int(time.time() * 1000000000)
+
+
+class _SimulatedTimelineController(object):
+    """Stands in for the TS client clock controller, which the simulated rig does not need"""
+    pass
+
+
+class SimulatedRigBackend(object):
+
+    def __init__(self, captureSecs=1, offsetSecs=0.0, dubiousRate=0.0, seed=None):
+        """\
+        Runs jobs by capturing from an emulated Arduino (see :class:`arduinoEmulator.ArduinoEmulator`), observing an
+        emulated device playing the test sequence from the metadata files of the job. The timelines and device
+        end points in the job config are ignored. For testing the scheduler without any hardware.
+
+        :param captureSecs: duration of each capture, unless a job gives "measureSecs"
+        :param offsetSecs: how early (positive) or late (negative) the emulated device presents flashes and beeps
+        :param dubiousRate: the probability of each pin being left unplugged for a run, so that it cannot be reliably measured
+        :param seed: seed for choosing which pins are left unplugged
+        """
+        super(SimulatedRigBackend, self).__init__()
+        self.captureSecs = captureSecs
+        self.offsetSecs = offsetSecs
+        self.dubiousRate = dubiousRate
+        self._rand = random.Random(seed)
+        self._lock = threading.Lock()
+
+
+    def run(self, rig, config):
+        """\
+        :returns: a result, in the same form as written by the testers (see :class:`headless.HeadlessRun`)
+        """
+        # only imported when needed, as only the simulated rig needs them
+        from arduinoEmulator import ArduinoEmulator, EmulatorSocketServer
+        from arduinoSession import ArduinoSession
+        from measurer import Measurer, PIN_MAP
+
+        result = { "tester" : "simulated", "status" : "ok", "reason" : None, "started" : time.time(), "finished" : None, \
+                   "channels" : [], "passed" : None, "rig" : rig["name"] }
+
+        pins = sorted(config["pins"])
+        metadata = {}
+        for pinName in pins:
+            with open(config["pins"][pinName]) as f:
+                metadata[pinName] = json.load(f)
+        with self._lock:
+            plugged = [ pinName for pinName in pins if self._rand.random() >= self.dubiousRate ]
+
+        emulator = ArduinoEmulator(dict( (PIN_MAP[pinName], metadata[pinName]) for pinName in plugged ), offsetSecs=self.offsetSecs)
+        server = EmulatorSocketServer(emulator)
+        server.start()
+        session = ArduinoSession(server.url)
+        try:
+            expected = dict( (pinName, metadata[pinName]["eventCentreTimes"]) for pinName in pins )
+            durations = dict( (pinName, metadata[pinName]["approxBeepDurationSecs" if "AUDIO" in pinName else "approxFlashDurationSecs"]) for pinName in pins )
+            measurer = Measurer("client", pins, expected, durations, 0, _SimulatedClock(), None, 1000, 1000, 1000, \
+                                config.get("measureSecs", self.captureSecs), session=session)
+            measurer.setSyncTimeLinelockController(_SimulatedTimelineController())
+            # sync timeline counts milliseconds since the emulated device started playing
+            videoStartNanos = int(emulator.videoStartTime * 1000000000)
+            measurer.timestampedReceivedControlTimeStamps.append( (videoStartNanos, (videoStartNanos, 0, 1.0)) )
+            measurer.capture()
+        finally:
+            session.close()
+            server.stop()
+
+        toleranceSecs = None if config.get("toleranceMillis") is None else config["toleranceMillis"] / 1000.0
+        for channel in measurer.compareCaptureData(measurer.takeCaptureData(), lambda wcTime : 0):
+            if "error" in channel:
+                result["channels"].append({ "pinName" : channel["pinName"], "error" : channel["error"] })
+            else:
+                result["channels"].append(headless.summariseChannel(channel["pinName"], channel["matchIndex"], channel["expectedSecs"], channel["diffsAndErrors"], toleranceSecs))
+        result["passed"] = headless.overallPassed(result["channels"], toleranceSecs)
+        result["finished"] = time.time()
+        return result
+
+
+
+def printReport(summary):
+    print("%6s %-8s %8s %-20s %10s %10s %10s" % ("job", "status", "attempts", "rigs", "queue (s)", "run (s)", "latency (s)"))
+    for job in summary["jobs"]:
+        print("%6d %-8s %8d %-20s %10s %10.1f %10s" % (job["id"], job["status"], job["attempts"], ",".join(job["rigs"]), \
+              "" if job["queueSecs"] is None else "%.1f" % job["queueSecs"], job["runSecs"], \
+              "" if job["latencySecs"] is None else "%.1f" % job["latencySecs"]))
+    print()
+    print("Jobs: " + ", ".join("%d %s" % (n, status) for status, n in sorted(summary["counts"].items())))
+    if summary["latencySecs"] is not None:
+        latency = summary["latencySecs"]
+        print("Latency: mean %.1f s, median %.1f s, 95th percentile %.1f s, max %.1f s" % (latency["mean"], latency["p50"], latency["p95"], latency["max"]))
+    for name in sorted(summary["rigs"]):
+        rig = summary["rigs"][name]
+        utilisation = "" if rig["utilisation"] is None else ", %.0f%% utilised" % (rig["utilisation"] * 100.0)
+        print("Rig %s: %d attempts, busy %.1f s%s" % (name, rig["attempts"], rig["busySecs"], utilisation))
+
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Queue measurement jobs, and run them across a pool of test rigs.")
+    parser.add_argument("queueFilename", help="The job queue file (created if it does not exist)")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    addParser = subparsers.add_parser("add", help="Queue the jobs for every combination in a matrix of test configurations")
+    addParser.add_argument("matrixFilename", help="JSON file with the \"base\" job config and the \"matrix\" of values")
+
+    runParser = subparsers.add_parser("run", help="Run the queued jobs on a pool of rigs")
+    runParser.add_argument("rigsFilename", help="JSON file listing the rigs")
+    runParser.add_argument("--maxAttempts", dest="maxAttempts", type=int, default=DEFAULT_MAX_ATTEMPTS, help="Number of times to attempt a job that cannot reliably measure a pin (default="+str(DEFAULT_MAX_ATTEMPTS)+")")
+    runParser.add_argument("--backoffSecs", dest="backoffSecs", type=float, default=DEFAULT_BACKOFF_SECS, help="Time to wait before the first retry (default="+str(DEFAULT_BACKOFF_SECS)+")")
+    runParser.add_argument("--backoffFactor", dest="backoffFactor", type=float, default=DEFAULT_BACKOFF_FACTOR, help="How much longer to wait before each further retry (default="+str(DEFAULT_BACKOFF_FACTOR)+")")
+    runParser.add_argument("--maxBackoffSecs", dest="maxBackoffSecs", type=float, default=DEFAULT_MAX_BACKOFF_SECS, help="Longest time to wait before a retry (default="+str(DEFAULT_MAX_BACKOFF_SECS)+")")
+    runParser.add_argument("--timeoutSecs", dest="timeoutSecs", type=float, default=None, help="Kill a tester that runs for longer than this")
+    runParser.add_argument("--logDir", dest="logDir", type=str, default=None, help="Directory to write the output of each run of a tester to")
+    runParser.add_argument("--keepRunning", dest="keepRunning", action="store_true", default=False, help="Keep waiting for more jobs once the queue is empty")
+    runParser.add_argument("--simulated", dest="simulated", action="store_true", default=False, help="Capture from emulated Arduinos instead of running the testers, for testing")
+    runParser.add_argument("--dubiousRate", dest="dubiousRate", type=float, default=0.0, help="(With --simulated) probability of each pin being unplugged for a run")
+
+    reportParser = subparsers.add_parser("report", help="Summarise per-job latency and rig utilisation")
+    reportParser.add_argument("--json", dest="asJson", action="store_true", default=False, help="Output as JSON")
+
+    args = parser.parse_args()
+
+    queue = JobQueue(args.queueFilename)
+
+    if args.command == "add":
+        with open(args.matrixFilename) as f:
+            spec = json.load(f)
+        try:
+            ids = queue.add(expandMatrix(spec))
+        except ValueError as e:
+            sys.stderr.write("\nCould not queue jobs: "+str(e)+"\n\n")
+            sys.exit(1)
+        print("Queued %d jobs." % len(ids))
+
+    elif args.command == "run":
+        with open(args.rigsFilename) as f:
+            rigs = json.load(f)
+        if args.simulated:
+            backend = SimulatedRigBackend(dubiousRate=args.dubiousRate)
+        else:
+            backend = TesterBackend(timeoutSecs=args.timeoutSecs, logDir=args.logDir)
+
+        nRecovered = queue.recover()
+        if nRecovered:
+            print("Queued again %d jobs that were running when the scheduler last stopped." % nRecovered)
+
+        def onAttempt(job):
+            attempt = job["attempts"][-1]
+            print("Job %d on rig %s: %s%s" % (job["id"], attempt["rig"], attempt["outcome"], "" if attempt["reason"] is None else " ("+attempt["reason"]+")"))
+
+        scheduler = Scheduler(queue, rigs, backend, args.maxAttempts, args.backoffSecs, args.backoffFactor, args.maxBackoffSecs, onAttempt)
+        try:
+            scheduler.run(untilDone=not args.keepRunning)
+        except KeyboardInterrupt:
+            pass
+        print()
+        printReport(report(queue.jobs()))
+
+    else:
+        summary = report(queue.jobs())
+        if args.asJson:
+            json.dump(summary, sys.stdout, indent=1)
+            print()
+        else:
+            printReport(summary)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Stored measurement sessions, so that captures can be analysed again later
+without re-capturing.
+
+A session file is a zip file (without compression) containing:
+
+* `header.json` ... everything needed for detection and comparison other than the samples:
+  the configuration of the measurer, the clock sync round-trip timing data (`wcAcReqResp`),
+  the sync timeline correlations, the wall clock dispersion and the expected timings.
+* one `.npy` array per sampled pin (e.g. `LIGHT_0.npy`). Each is an array of unsigned bytes
+  with two rows: the minimum and maximum values sampled in each millisecond.
+
+Because the arrays are stored without compression, :func:`loadSession` memory-maps
+them straight out of the zip file, so opening a session is cheap and samples are only
+read from disk when they are used.
+
+Requires 'numpy'.
+
+
+Usage
+-----
+
+Save a session once a :class:`measurer.Measurer` has made a capture:
+
+.. code-block:: python
+
+    measurer.capture()
+    measurer.saveSession("session.zip", dispRecorder.changeHistory)
+
+Then replay the analysis at any later time:
+
+.. code-block:: python
+
+    session = loadSession("session.zip")
+    for result in session.compare():
+        print(result["pinName"], result.get("diffsAndErrors"))
+
+"""
+
+import io
+import json
+import struct
+import zipfile
+
+import numpy
+
+import analyse
+import detect
+from dispersion import dispersionFromHistory
+
+
+FORMAT_VERSION = 1
+
+HEADER_NAME = "header.json"
+
+# size of the fixed part of a zip local file header, which precedes the name and extra field of each member
+_ZIP_LOCAL_HEADER_SIZE = 30
+
+
+
+def saveSession(filename, header, channels):
+    """\
+    Write a session file.
+
+    :param filename: name of the file to write
+    :param header: dict of JSON serialisable values to store as the header (see :meth:`measurer.Measurer.saveSession`)
+    :param channels: data channels (see :func:`measurer.repackageSamples`). Entries that are None are skipped.
+
+    A "channels" entry is added to the header, listing the name of the pin and the array for each channel.
+    """
+    header = dict(header)
+    header["formatVersion"] = FORMAT_VERSION
+    header["channels"] = []
+
+    with zipfile.ZipFile(filename, "w", zipfile.ZIP_STORED) as zf:
+        for channel in channels:
+            if channel is None:
+                continue
+            arrayName = channel["pinName"] + ".npy"
+            samples = numpy.array([ channel["min"], channel["max"] ], dtype=numpy.uint8)
+            buffer = io.BytesIO()
+            numpy.save(buffer, samples)
+            zf.writestr(arrayName, buffer.getvalue())
+            header["channels"].append({ "pinName" : channel["pinName"], "isAudio" : channel["isAudio"], "array" : arrayName })
+
+        zf.writestr(HEADER_NAME, json.dumps(header, indent=1))
+
+
+
+def _memmapMember(filename, zf, name):
+    """\
+    :returns: a read only :class:`numpy.memmap` of a .npy array stored without compression in a zip file
+    """
+    info = zf.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError("Array "+name+" is compressed, so cannot be memory-mapped.")
+
+    with open(filename, "rb") as f:
+        f.seek(info.header_offset)
+        localHeader = f.read(_ZIP_LOCAL_HEADER_SIZE)
+        nameLength, extraLength = struct.unpack("<HH", localHeader[26:30])
+        f.seek(info.header_offset + _ZIP_LOCAL_HEADER_SIZE + nameLength + extraLength)
+        version = numpy.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortranOrder, dtype = numpy.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortranOrder, dtype = numpy.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    if 0 in shape:
+        return numpy.zeros(shape, dtype=dtype)
+    return numpy.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=shape, order="F" if fortranOrder else "C")
+
+
+
+def loadSession(filename):
+    """\
+    Open a session file.
+
+    :param filename: name of the file to read
+    :returns: a :class:`StoredSession`
+    :raises ValueError: if the file is of a format version that is not understood
+    """
+    with zipfile.ZipFile(filename, "r") as zf:
+        header = json.loads(zf.read(HEADER_NAME).decode("utf-8"))
+        if header.get("formatVersion") != FORMAT_VERSION:
+            raise ValueError("Unsupported session file format version: "+repr(header.get("formatVersion")))
+        samples = {}
+        for entry in header["channels"]:
+            samples[entry["pinName"]] = _memmapMember(filename, zf, entry["array"])
+    return StoredSession(filename, header, samples)
+
+
+
+class StoredSession(object):
+
+    def __init__(self, filename, header, samples):
+        """\
+        A measurement session loaded from a session file. Use :func:`loadSession` to create one.
+
+        :param filename: name of the file the session was loaded from
+        :param header: the header, as a dict
+        :param samples: dict mapping pin names to (memory-mapped) arrays, with rows of minimum and maximum sample values
+
+        The header and samples are available as the attributes :data:`header` and :data:`samples`.
+        Detection and comparison can then be run again, in the same way as by :class:`measurer.Measurer`,
+        optionally with a different dispersion function.
+        """
+        super(StoredSession, self).__init__()
+        self.filename = filename
+        self.header = header
+        self.samples = samples
+
+
+    def dispersionAt(self, wcTime):
+        """\
+        :returns: the wall clock dispersion (in nanoseconds) at the given wall clock time, as stored in the session
+        """
+        dispersion = self.header["dispersion"]
+        if "changeHistory" in dispersion:
+            return dispersionFromHistory(dispersion["changeHistory"], wcTime)
+        return dispersion["constantNanos"]
+
+
+    def channels(self):
+        """\
+        :returns: list of data channels (in the form returned by :func:`measurer.repackageSamples`, but without
+            the None entries) with the sample values copied out of the arrays, ready for detection
+        """
+        channels = []
+        for entry in self.header["channels"]:
+            pinName = entry["pinName"]
+            samples = self.samples[pinName]
+            channel = { "pinName" : pinName, "isAudio" : entry["isAudio"], "min" : samples[0].tolist(), "max" : samples[1].tolist() }
+            if pinName in self.header["eventDurations"]:
+                channel["eventDuration"] = self.header["eventDurations"][pinName]
+            channels.append(channel)
+        return channels
+
+
+    def makeDetector(self, dispersionFunc=None):
+        """\
+        :param dispersionFunc: None to use the dispersion stored in the session, otherwise a replacement
+            (see :meth:`measurer.Measurer.detectBeepsAndFlashes`)
+        :returns: a :class:`detect.BeepFlashDetector` set up as it was for the stored capture
+        """
+        if dispersionFunc is None:
+            dispersionFunc = self.dispersionAt
+        header = self.header
+        return detect.BeepFlashDetector(header["wcAcReqResp"], header["syncTimelineTickRate"], \
+                                        header["wcSyncTimeCorrelations"], dispersionFunc, \
+                                        header["wcPrecisionNanos"], header["acPrecisionNanos"])
+
+
+    def detect(self, dispersionFunc=None):
+        """\
+        Run detection again.
+
+        :param dispersionFunc: see :meth:`makeDetector`
+        :returns: list of dicts, one per pin, with keys "pinName", "observed" and "expected"
+            (as returned by :meth:`measurer.Measurer.getComparisonChannels`)
+        """
+        header = self.header
+        observedTimings = analyse.runDetection(self.makeDetector(dispersionFunc), self.channels(), \
+                                               header["dueStartTimeUsecs"], header["dueFinishTimeUsecs"])
+        return [ { "pinName" : result["pinName"], "observed" : result["observed"], "expected" : header["expectedTimings"][result["pinName"]] } \
+                 for result in observedTimings ]
+
+
+    def compare(self, dispersionFunc=None):
+        """\
+        Run detection and comparison again.
+
+        :param dispersionFunc: see :meth:`makeDetector`
+        :returns: list of results, one per pin (as returned by :meth:`measurer.Measurer.compareCaptureData`)
+        """
+        header = self.header
+        videoStartTicks = header["videoStartTicks"]
+        tickRate = header["syncTimelineTickRate"]
+
+        results = []
+        for channel in self.detect(dispersionFunc):
+            result = { "pinName" : channel["pinName"], "observed" : channel["observed"] }
+            try:
+                result["matchIndex"], result["expectedSecs"], result["diffsAndErrors"] = analyse.compareChannel(channel, videoStartTicks, tickRate)
+            except analyse.DubiousInput as e:
+                result["error"] = str(e)
+            results.append(result)
+        return results
+
+
+
+if __name__ == "__main__":
+
+    import argparse
+    import bootstrap
+    import stats
+
+    parser = argparse.ArgumentParser(description="Run detection and comparison again for stored measurement sessions, and print the results.")
+    parser.add_argument("filenames", nargs="+", help="Session files (as saved with the --saveSession option of the testers)")
+    parser.add_argument("--toleranceTest", dest="toleranceMillis", type=float, default=None, help="Do a pass/fail test on whether sync is accurate to within this specified tolerance, in milliseconds.")
+    parser.add_argument("--bootstrap", dest="nResamples", type=int, default=None, help="Also print bootstrap confidence intervals, from this number of resamples.")
+    parser.add_argument("--seed", dest="seed", type=int, default=None, help="Random seed for the bootstrap resampling, to make the intervals reproducible.")
+    parser.add_argument("--processes", dest="processes", type=int, default=None, help="Number of processes to spread the bootstrap resampling across.")
+    args = parser.parse_args()
+    if args.nResamples is not None and args.nResamples < 1:
+        parser.error("Number of bootstrap resamples must be at least 1.")
+
+    toleranceSecs = None if args.toleranceMillis is None else args.toleranceMillis / 1000.0
+
+    for filename in args.filenames:
+        for result in loadSession(filename).compare():
+            print()
+            print("Results for channel: %s in session: %s" % (result["pinName"], filename))
+            print("----------------------------")
+            if "error" in result:
+                print("Cannot reliably measure on pin: %s" % result["pinName"])
+            else:
+                stats.calcAndPrintStats(result["matchIndex"], result["expectedSecs"], result["diffsAndErrors"], toleranceSecs)
+                if args.nResamples is not None:
+                    bootstrap.printBootstrap(bootstrap.bootstrap(result["diffsAndErrors"], toleranceSecs, args.nResamples, seed=args.seed, processes=args.processes))
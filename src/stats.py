@@ -23,8 +23,119 @@ Usage:
 Call the :func:`calcAndPrintStats` function to output statistics. Values supplied
 must be in seconds.
 
+Or call :func:`computeStats` to get the statistics as a dict, which can be written
+out as JSON, or as CSV using :func:`writeStatsCsv`:
+
+.. code-block:: python
+
+    result = computeStats(matchIndex, allExpectedTimes, diffsAndErrors, toleranceSecs)
+    print(result["meanOffsetSecs"], result["passed"])
+    json.dump(result, f)
+
+For long soak tests, a :class:`StreamingStats` accumulates statistics across
+any number of captures without keeping every observation. Accumulators can be
+merged, e.g. to combine those from several processes:
+
+.. code-block:: python
+
+    acc = StreamingStats(toleranceSecs=0.01)
+    for capture in captures:
+        acc.addComparison(measurer.doComparison(channel))
+    acc.merge(StreamingStats.fromDict(otherProcessState))
+    print(acc.snapshot())
+
+If numpy is installed, the statistics are calculated with array operations over
+all the observations at once. Otherwise they are calculated in plain Python.
+numpy is only imported when it is first needed (see :mod:`lazyImport`).
+
 """
 
+import csv
+import math
+import threading
+
+import instrumentation
+import lazyImport
+
+numpy = lazyImport.optional("numpy")
+
+
+# percentiles of the offsets included in the results of computeStats
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def computeStats(matchIndex, allExpectedTimes, diffsAndErrors, toleranceSecs=None, percentiles=PERCENTILES):
+    """\
+    Calculates statistics about the observed timings.
+
+    :param matchIndex: Index into allExpectedTimes that the first observation matched up with
+    :param allExpectedTimes: List of all expected times (units of seconds)
+    :param diffsAndErrors: List of tuples (diff, err) where diff is the
+        offset between expected and observed (units of secs), and err is the
+        error bound of measurement for that difference (also in units of secs)
+    :param toleranceSecs: None, or a tolerance (in seconds) to be used in
+        making a PASS/FAIL judgement on whether the observations were in sync.
+    :param percentiles: the percentiles (0 to 100) of the offsets to calculate
+
+    :returns: dict, that can be serialised as JSON, with keys (all times in seconds):
+        * "firstExpectedSecs" ... the expected time that the first observation matched
+        * "count" ... the number of observations
+        * "meanOffsetSecs", "stdDevSecs", "minOffsetSecs", "maxOffsetSecs" ... summarising the offsets
+        * "offsetPercentilesSecs" ... dict mapping each percentile (as a string, e.g. "50") to the offset at that percentile
+        * "meanErrorSecs", "minErrorSecs", "maxErrorSecs" ... summarising the measurement error bounds
+        * "toleranceSecs" ... the tolerance, or None
+        * "passed" ... None if no tolerance was given, otherwise whether all observations were within the tolerance
+        * "exceeds" ... None if no tolerance was given, otherwise a list of how much each observation was outside
+          the tolerance by (see :func:`determineWithinTolerance`)
+        * "numExceeded" ... None if no tolerance was given, otherwise the number of observations outside the tolerance
+
+    :raises ValueError: if there are no observations
+
+    Offsets (difference values) are expected to be positive when the observation
+    was early with respect to the expected time, and negative when it is late.
+    """
+    if len(diffsAndErrors) == 0:
+        raise ValueError("No observations to calculate statistics for.")
+
+    with instrumentation.span("stats.computeStats"):
+        if numpy is not None:
+            data = numpy.asarray(diffsAndErrors, dtype=float).reshape(-1, 2)
+            diffs, errorBounds = data[:,0], data[:,1]
+            result = {
+                "count" : len(diffs),
+                "meanOffsetSecs" : float(diffs.mean()),
+                "stdDevSecs" : float(diffs.std()),
+                "minOffsetSecs" : float(diffs.min()),
+                "maxOffsetSecs" : float(diffs.max()),
+                "offsetPercentilesSecs" : dict(zip([ str(p) for p in percentiles ], [ float(v) for v in numpy.percentile(diffs, percentiles) ])),
+                "meanErrorSecs" : float(errorBounds.mean()),
+                "minErrorSecs" : float(errorBounds.min()),
+                "maxErrorSecs" : float(errorBounds.max()),
+            }
+        else:
+            diffs       = [diff for diff,err in diffsAndErrors]
+            errorBounds = [err  for diff,err in diffsAndErrors]
+            result = {
+                "count" : len(diffs),
+                "meanOffsetSecs" : calcMean(diffs),
+                "stdDevSecs" : calcVariance(diffs)**0.5,
+                "minOffsetSecs" : min(diffs),
+                "maxOffsetSecs" : max(diffs),
+                "offsetPercentilesSecs" : dict( (str(p), calcPercentile(diffs, p)) for p in percentiles ),
+                "meanErrorSecs" : calcMean(errorBounds),
+                "minErrorSecs" : min(errorBounds),
+                "maxErrorSecs" : max(errorBounds),
+            }
+
+        result["firstExpectedSecs"] = allExpectedTimes[matchIndex]
+        result["toleranceSecs"] = toleranceSecs
+        if toleranceSecs is None:
+            result["passed"], result["exceeds"], result["numExceeded"] = None, None, None
+        else:
+            result["passed"], result["exceeds"] = determineWithinTolerance(diffsAndErrors, toleranceSecs)
+            result["numExceeded"] = len([e for e in result["exceeds"] if e != 0])
+    return result
+
 
 def calcAndPrintStats(matchIndex, allExpectedTimes, diffsAndErrors, toleranceSecs=None):
     """\
@@ -43,20 +154,24 @@ def calcAndPrintStats(matchIndex, allExpectedTimes, diffsAndErrors, toleranceSec
     
     :returns: Nothing. Output is printed to standard output.
     """
+    printStats(computeStats(matchIndex, allExpectedTimes, diffsAndErrors, toleranceSecs))
+
+
+def printStats(result):
+    """\
+    Prints out statistics calculated by :func:`computeStats`.
+
+    :returns: Nothing. Output is printed to standard output.
+    """
+    print("First observed flash/beep matched to one expected at %.3f seconds into the test video sequence. There were %d readings recorded." % (result["firstExpectedSecs"], result["count"]))
     
-    diffs       = [diff for diff,err in diffsAndErrors]
-    errorBounds = [err  for diff,err in diffsAndErrors]
-    
-    firstExpectedTime = allExpectedTimes[matchIndex]
-    print("First observed flash/beep matched to one expected at %.3f seconds into the test video sequence. There were %d readings recorded." % (firstExpectedTime, len(diffs)))
-    
-    avgOffsetMillis = secsToNearestMilli(calcMean(diffs))
-    stdDevMillis    = secsToNearestMilli(calcVariance(diffs)**0.5)
+    avgOffsetMillis = secsToNearestMilli(result["meanOffsetSecs"])
+    stdDevMillis    = secsToNearestMilli(result["stdDevSecs"])
     
     earlyLate = earlyLateString(avgOffsetMillis)
     
-    minMillis = secsToNearestMilli(min(diffs))
-    maxMillis = secsToNearestMilli(max(diffs))
+    minMillis = secsToNearestMilli(result["minOffsetSecs"])
+    maxMillis = secsToNearestMilli(result["maxOffsetSecs"])
     minEarlyLate = earlyLateString(minMillis)
     maxEarlyLate = earlyLateString(maxMillis)
     
@@ -67,9 +182,9 @@ def calcAndPrintStats(matchIndex, allExpectedTimes, diffsAndErrors, toleranceSec
     print("    Highest       : %7d   milliseconds %s" % (maxMillis, maxEarlyLate))
     print("    Std. deviation: %9.1f milliseconds" % stdDevMillis)
     
-    errMeanMillis = calcMean(errorBounds) * 1000.0
-    errMinMillis  = min(errorBounds) * 1000.0
-    errMaxMillis  = max(errorBounds) * 1000.0
+    errMeanMillis = result["meanErrorSecs"] * 1000.0
+    errMinMillis  = result["minErrorSecs"] * 1000.0
+    errMaxMillis  = result["maxErrorSecs"] * 1000.0
 
     print()
     print("Total measurement error bounds (range of uncertainty):")
@@ -77,22 +192,19 @@ def calcAndPrintStats(matchIndex, allExpectedTimes, diffsAndErrors, toleranceSec
     print("   Average (mean): %8.3f milliseconds" % errMeanMillis)
     print("   Highest       : %8.3f milliseconds" % errMaxMillis)
 
-    if toleranceSecs is not None:
+    if result["toleranceSecs"] is not None:
         print("")
-        print("Accuracy tolerance specified of %.3f milliseconds" % (toleranceSecs*1000.0))
+        print("Accuracy tolerance specified of %.3f milliseconds" % (result["toleranceSecs"]*1000.0))
         
-        success, exceeds = determineWithinTolerance(diffsAndErrors, toleranceSecs)
-        
-        if success:
+        if result["passed"]:
             print("    PASSED ... all observations within the tolerance interval")
             print("               (after taking into account measurement error bounds)")
         else:
-            numFails = len([e for e in exceeds if e != 0])
-            print("    FAILED ... %d of %d observations outside the tolerance interval" % (numFails, len(diffs)))
+            print("    FAILED ... %d of %d observations outside the tolerance interval" % (result["numExceeded"], result["count"]))
             print("               (taking into account measurement error bounds)")
             print("")
             i=0
-            for e in exceeds:
+            for e in result["exceeds"]:
                 i=i+1
                 if e != 0:
                     eMillis = e*1000.0
@@ -100,6 +212,42 @@ def calcAndPrintStats(matchIndex, allExpectedTimes, diffsAndErrors, toleranceSec
                     print("        Observation %d was outside tolerance and error margin by %.3f milliseconds %s" % (i, eMillis, earlyLate))
         print("")
 
+
+def flattenStats(result):
+    """\
+    :param result: statistics calculated by :func:`computeStats`, optionally with other keys added (e.g. "pinName")
+    :returns: dict of the same values suitable for a row of a CSV file: the percentiles are
+        separate entries (e.g. "offsetP50Secs") and the per observation "exceeds" list is left out.
+    """
+    row = {}
+    for key, value in result.items():
+        if key == "offsetPercentilesSecs":
+            for p, v in value.items():
+                row["offsetP%sSecs" % p] = v
+        elif not isinstance(value, (list, tuple, dict)):
+            row[key] = value
+    return row
+
+
+def writeStatsCsv(f, results):
+    """\
+    Writes statistics calculated by :func:`computeStats` as CSV, one row per result.
+
+    :param f: file object to write to (opened with newline="")
+    :param results: list of results. Columns are the keys of the results (see :func:`flattenStats`),
+        in the order they are first seen.
+    """
+    rows = [ flattenStats(result) for result in results ]
+    fieldnames = []
+    for row in rows:
+        for key in row:
+            if key not in fieldnames:
+                fieldnames.append(key)
+    writer = csv.DictWriter(f, fieldnames=fieldnames)
+    writer.writeheader()
+    writer.writerows(rows)
+
+
 def calcMean(data):
     """\
     Calculates statistical mean.
@@ -120,6 +268,19 @@ def calcVariance(data):
     
     return squaresDiff / len(data)
     
+def calcPercentile(data, percentile):
+    """\
+    Calculates a percentile, interpolating linearly between values (in the same way as :func:`numpy.percentile`).
+    :param data: List of values
+    :param percentile: the percentile, from 0 to 100
+    :returns: the value at that percentile.
+    """
+    ordered = sorted(data)
+    position = (len(ordered) - 1) * percentile / 100.0
+    lo = int(math.floor(position))
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (position - lo)
+
 def secsToNearestMilli(value):
     """\
     Return value converted to the nearest number of milliseconds
@@ -145,6 +306,16 @@ def determineWithinTolerance(diffsAndErrors,tolerance):
     was exceeded (minus the error bound). exceeds will contain only zeros in
     the event of a pass.
     """
+    if numpy is not None:
+        data = numpy.asarray(diffsAndErrors, dtype=float).reshape(-1, 2)
+        minPossibleDiffs = data[:,0] - data[:,1]
+        maxPossibleDiffs = data[:,0] + data[:,1]
+
+        # same as gapBetweenRanges( (minPossibleDiff,maxPossibleDiff), (-tolerance,+tolerance) ) for every observation
+        exceeds = numpy.where(minPossibleDiffs > tolerance, minPossibleDiffs - tolerance, \
+                  numpy.where(maxPossibleDiffs < -tolerance, maxPossibleDiffs + tolerance, 0.0))
+        return not exceeds.any(), exceeds.tolist()
+
     exceededErrorBy=[]
     allPassed = True
     for diff,errorBound in diffsAndErrors:
@@ -190,6 +361,323 @@ def gapBetweenRanges(rangeA,rangeB):
     else:
         return 0
         
+
+
+# default maximum number of bins kept by a QuantileSketch
+DEFAULT_SKETCH_BINS = 2048
+
+# default width of the bins of a QuantileSketch, before it has to coarsen them
+DEFAULT_SKETCH_RESOLUTION_SECS = 0.0001
+
+
+class QuantileSketch(object):
+
+    def __init__(self, maxBins=DEFAULT_SKETCH_BINS, resolutionSecs=DEFAULT_SKETCH_RESOLUTION_SECS):
+        """\
+        Histogram of values, for estimating quantiles using bounded memory.
+
+        Values are counted in bins of equal width, starting at resolutionSecs. If there would be
+        more than maxBins bins in use, the width is doubled (merging pairs of bins) until there are not.
+        Quantiles are therefore accurate to within half the current bin width. Sketches with the same
+        starting resolution can be merged.
+
+        :param maxBins: the maximum number of bins to keep (at least 2)
+        :param resolutionSecs: the starting width of the bins
+        """
+        super(QuantileSketch, self).__init__()
+        if maxBins < 2:
+            raise ValueError("A quantile sketch needs at least 2 bins.")
+        self.maxBins = maxBins
+        self.resolutionSecs = resolutionSecs
+        self.level = 0          # bins are resolutionSecs * 2**level wide
+        self.bins = {}          # bin index -> count
+        self.count = 0
+
+
+    @property
+    def binWidth(self):
+        return self.resolutionSecs * 2**self.level
+
+
+    def add(self, value, count=1):
+        index = int(math.floor(value / self.binWidth))
+        self.bins[index] = self.bins.get(index, 0) + count
+        self.count += count
+        self._compact()
+
+
+    def addAll(self, values):
+        """\
+        :param values: list (or numpy array) of values to add
+        """
+        if numpy is not None and len(values) > 0:
+            indices, counts = numpy.unique(numpy.floor(numpy.asarray(values, dtype=float) / self.binWidth).astype(numpy.int64), return_counts=True)
+            for index, count in zip(indices.tolist(), counts.tolist()):
+                self.bins[index] = self.bins.get(index, 0) + count
+            self.count += len(values)
+        else:
+            for value in values:
+                index = int(math.floor(value / self.binWidth))
+                self.bins[index] = self.bins.get(index, 0) + 1
+            self.count += len(values)
+        self._compact()
+
+
+    def _coarsen(self):
+        bins = {}
+        for index, count in self.bins.items():
+            bins[index // 2] = bins.get(index // 2, 0) + count
+        self.bins = bins
+        self.level += 1
+
+
+    def _compact(self):
+        while len(self.bins) > self.maxBins:
+            self._coarsen()
+
+
+    def merge(self, other):
+        """\
+        Add the counts from another sketch into this one.
+
+        :raises ValueError: if the sketches were created with different starting resolutions
+        """
+        if other.resolutionSecs != self.resolutionSecs:
+            raise ValueError("Cannot merge quantile sketches with different resolutions.")
+        while self.level < other.level:
+            self._coarsen()
+        shift = self.level - other.level
+        for index, count in other.bins.items():
+            index = index >> shift
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.count += other.count
+        self._compact()
+
+
+    def quantile(self, q):
+        """\
+        :param q: the quantile, from 0 to 1
+        :returns: estimate of the value at that quantile (the middle of the bin it falls in), or None if empty
+        """
+        if self.count == 0:
+            return None
+        target = q * self.count
+        cumulative = 0
+        indices = sorted(self.bins)
+        for index in indices:
+            cumulative += self.bins[index]
+            if cumulative >= target:
+                break
+        return (index + 0.5) * self.binWidth
+
+
+    def toDict(self):
+        """\
+        :returns: the state of the sketch, as a JSON serialisable dict (see :meth:`fromDict`)
+        """
+        return {
+            "maxBins" : self.maxBins,
+            "resolutionSecs" : self.resolutionSecs,
+            "level" : self.level,
+            "bins" : [ [index, count] for index, count in sorted(self.bins.items()) ],
+        }
+
+
+    @classmethod
+    def fromDict(cls, state):
+        sketch = cls(state["maxBins"], state["resolutionSecs"])
+        sketch.level = state["level"]
+        sketch.bins = dict( (index, count) for index, count in state["bins"] )
+        sketch.count = sum(sketch.bins.values())
+        return sketch
+
+
+
+class StreamingStats(object):
+
+    def __init__(self, toleranceSecs=None, maxBins=DEFAULT_SKETCH_BINS, resolutionSecs=DEFAULT_SKETCH_RESOLUTION_SECS):
+        """\
+        Accumulates statistics about observed timings across any number of captures, without keeping
+        every observation: the mean and variance of the offsets (using Welford's method), their range, the
+        error bounds, how many observations were outside a tolerance, and a :class:`QuantileSketch` of
+        the offsets for percentiles.
+
+        Observations can be added from any thread. Accumulators can be merged with :meth:`merge`, and
+        passed between processes using :meth:`toDict` and :meth:`fromDict`.
+
+        :param toleranceSecs: None, or a tolerance (in seconds) to count observations that are outside it
+            (taking into account measurement error bounds, as :func:`determineWithinTolerance` does)
+        :param maxBins, resolutionSecs: see :class:`QuantileSketch`
+        """
+        super(StreamingStats, self).__init__()
+        self.toleranceSecs = toleranceSecs
+        self._lock = threading.Lock()
+        self.captures = 0
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0           # sum of squared differences from the mean
+        self.minOffset = None
+        self.maxOffset = None
+        self.errorSum = 0.0
+        self.minError = None
+        self.maxError = None
+        self.numExceeded = 0
+        self.maxExceededBy = 0.0
+        self.sketch = QuantileSketch(maxBins, resolutionSecs)
+
+
+    def _combine(self, count, mean, m2, minOffset, maxOffset, errorSum, minError, maxError, numExceeded, maxExceededBy):
+        # combine summary statistics for another set of observations into these (Chan et al.)
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.minOffset = minOffset if self.minOffset is None else min(self.minOffset, minOffset)
+        self.maxOffset = maxOffset if self.maxOffset is None else max(self.maxOffset, maxOffset)
+        self.errorSum += errorSum
+        self.minError = minError if self.minError is None else min(self.minError, minError)
+        self.maxError = maxError if self.maxError is None else max(self.maxError, maxError)
+        self.numExceeded += numExceeded
+        if abs(maxExceededBy) > abs(self.maxExceededBy):
+            self.maxExceededBy = maxExceededBy
+
+
+    def addDiffsAndErrors(self, diffsAndErrors):
+        """\
+        Add observations.
+
+        :param diffsAndErrors: List of tuples (diff, err) in seconds, as for :func:`computeStats`
+        """
+        if len(diffsAndErrors) == 0:
+            return
+        if numpy is not None:
+            data = numpy.asarray(diffsAndErrors, dtype=float).reshape(-1, 2)
+            diffs, errorBounds = data[:,0], data[:,1]
+            mean = float(diffs.mean())
+            summary = [ len(diffs), mean, float(((diffs - mean)**2).sum()), float(diffs.min()), float(diffs.max()), \
+                        float(errorBounds.sum()), float(errorBounds.min()), float(errorBounds.max()) ]
+        else:
+            diffs       = [diff for diff,err in diffsAndErrors]
+            errorBounds = [err  for diff,err in diffsAndErrors]
+            mean = calcMean(diffs)
+            summary = [ len(diffs), mean, sum([(value - mean)**2 for value in diffs]), min(diffs), max(diffs), \
+                        sum(errorBounds), min(errorBounds), max(errorBounds) ]
+
+        if self.toleranceSecs is None:
+            summary += [ 0, 0.0 ]
+        else:
+            exceeds = determineWithinTolerance(diffsAndErrors, self.toleranceSecs)[1]
+            summary += [ len([e for e in exceeds if e != 0]), max(exceeds, key=abs) ]
+
+        with self._lock:
+            self._combine(*summary)
+            self.sketch.addAll(diffs)
+
+
+    def add(self, diff, err):
+        """\
+        Add a single observation.
+        """
+        self.addDiffsAndErrors([ (diff, err) ])
+
+
+    def addComparison(self, result):
+        """\
+        Add the observations from one capture.
+
+        :param result: the tuple (matchIndex, expected, diffsAndErrors) returned by :meth:`measurer.Measurer.doComparison`
+        """
+        matchIndex, expected, diffsAndErrors = result
+        self.addDiffsAndErrors(diffsAndErrors)
+        with self._lock:
+            self.captures += 1
+
+
+    def merge(self, other):
+        """\
+        Add everything accumulated by another accumulator into this one.
+
+        :raises ValueError: if the accumulators have different tolerances
+        """
+        if other.toleranceSecs != self.toleranceSecs:
+            raise ValueError("Cannot merge statistics accumulated with different tolerances.")
+        state = other.toDict()
+        with self._lock:
+            self._mergeState(state)
+
+
+    def _mergeState(self, state):
+        self.captures += state["captures"]
+        self._combine(state["count"], state["mean"], state["m2"], state["minOffset"], state["maxOffset"], \
+                      state["errorSum"], state["minError"], state["maxError"], state["numExceeded"], state["maxExceededBy"])
+        self.sketch.merge(QuantileSketch.fromDict(state["sketch"]))
+
+
+    def toDict(self):
+        """\
+        :returns: the complete state of the accumulator, as a JSON serialisable dict (see :meth:`fromDict`)
+        """
+        with self._lock:
+            return {
+                "toleranceSecs" : self.toleranceSecs,
+                "captures" : self.captures,
+                "count" : self.count,
+                "mean" : self.mean,
+                "m2" : self.m2,
+                "minOffset" : self.minOffset,
+                "maxOffset" : self.maxOffset,
+                "errorSum" : self.errorSum,
+                "minError" : self.minError,
+                "maxError" : self.maxError,
+                "numExceeded" : self.numExceeded,
+                "maxExceededBy" : self.maxExceededBy,
+                "sketch" : self.sketch.toDict(),
+            }
+
+
+    @classmethod
+    def fromDict(cls, state):
+        """\
+        :param state: as returned by :meth:`toDict`
+        :returns: a new :class:`StreamingStats` with that state
+        """
+        sketch = state["sketch"]
+        acc = cls(state["toleranceSecs"], sketch["maxBins"], sketch["resolutionSecs"])
+        acc._mergeState(state)
+        return acc
+
+
+    def snapshot(self, percentiles=PERCENTILES):
+        """\
+        :param percentiles: the percentiles (0 to 100) of the offsets to estimate
+        :returns: dict summarising what has been accumulated so far (all times in seconds), with keys
+            "captures", "count", "meanOffsetSecs", "stdDevSecs", "minOffsetSecs", "maxOffsetSecs",
+            "offsetPercentilesSecs" (estimates, see :class:`QuantileSketch`), "meanErrorSecs", "minErrorSecs",
+            "maxErrorSecs", "toleranceSecs", "numExceeded" and "maxExceededBySecs" (the largest amount an observation
+            was outside the tolerance by). These are the same keys as returned by :func:`computeStats` where they match.
+            The values are None if nothing has been accumulated.
+        """
+        with self._lock:
+            hasData = self.count > 0
+            return {
+                "captures" : self.captures,
+                "count" : self.count,
+                "meanOffsetSecs" : self.mean if hasData else None,
+                "stdDevSecs" : (self.m2 / self.count)**0.5 if hasData else None,
+                "minOffsetSecs" : self.minOffset,
+                "maxOffsetSecs" : self.maxOffset,
+                "offsetPercentilesSecs" : dict( (str(p), self.sketch.quantile(p / 100.0)) for p in percentiles ),
+                "meanErrorSecs" : self.errorSum / self.count if hasData else None,
+                "minErrorSecs" : self.minError,
+                "maxErrorSecs" : self.maxError,
+                "toleranceSecs" : self.toleranceSecs,
+                "numExceeded" : self.numExceeded if self.toleranceSecs is not None else None,
+                "maxExceededBySecs" : self.maxExceededBy if self.toleranceSecs is not None else None,
+            }
+
         
 if __name__ == "__main__":
 
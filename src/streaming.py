@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Long (or unbounded) captures, using the streaming mode of the Arduino.
+
+In streaming mode the Arduino sends its samples in blocks (of e.g. 100 ms)
+while it carries on sampling, so the length of the capture is not limited by
+its 90 KB of sample memory. Each block is tagged with a sequence number, and
+the Arduino clock time at which sampling of the block began.
+
+:func:`streamCapture` reads the blocks and passes them to a consumer object
+as they arrive. Along the way it checks for gaps: missing sequence numbers
+(blocks that were lost) or blocks that start later than the previous block
+finished (the Arduino could not send the samples fast enough and had to pause
+sampling).
+
+A consumer has the following methods:
+
+* `block(seq, startNanos, channels)` ... called for every block. `channels` is as returned by :func:`measurer.repackageSamples`
+* `gap(gapInfo)`                     ... called before the block that follows a gap
+* `end(finishNanos)`                 ... called once the final block has been received
+
+:class:`ChannelSegmentAccumulator` is a consumer that collects the blocks into
+contiguous segments that can be passed to the detection process.
+
+The whole capture, including the time spent in the consumer, is timed as the span
+"streaming.streamCapture", and the sample data received is counted in
+"arduino.bytesTransferred" (see :mod:`instrumentation`).
+
+'''
+
+import time
+
+import arduino
+import instrumentation
+from measurer import repackageSamples
+
+
+# wrapping period of the Arduino micros() clock, in nanoseconds
+_WRAP_NANOS = 1000 * (2 ** 32)
+
+# a block starting more than this much later than the previous one finished counts as a gap
+GAP_TOLERANCE_NANOS = 500000
+
+
+def _unwrapAfter(arduinoNanos, referenceNanos):
+    """\
+    :returns: arduinoNanos adjusted for wrapping of the arduino clock, to be the first time not before referenceNanos
+    """
+    while arduinoNanos < referenceNanos:
+        arduinoNanos += _WRAP_NANOS
+    return arduinoNanos
+
+
+
+def streamCapture(f, clock, pinsToMeasure, pinMap, consumer, nBlocks=0, durationSecs=None):
+    """\
+    Sample pins on the arduino using its streaming mode, passing the samples to a consumer as they arrive.
+
+    :param f: file handle for the serial connection to the Arduino Due. The pins must not yet have been enabled.
+    :param clock: a :class:`dvbcss.clock` clock object
+    :param pinsToMeasure: list of pin names to be sampled (e.g. "LIGHT_0")
+    :param pinMap: dictionary that maps from pin name to arduino pin number
+    :param consumer: object that is passed the samples (see module documentation)
+    :param nBlocks: number of blocks to capture (up to 65535), or 0 to continue until `durationSecs` has passed
+    :param durationSecs: if nBlocks is 0, then the number of seconds (according to the local time) after which
+        the arduino is asked to stop streaming. If None, then streaming continues until
+        the consumer's `block()` method returns True.
+
+    If nBlocks is not 0, the arduino is never asked to stop, because the request could arrive after it has
+    sent the final record, and its reply would then be mistaken for the reply to the next command. Instead,
+    if the consumer's `block()` method returns True, the remaining blocks are read but not passed to the consumer.
+
+    :returns: dict summarising the capture, with keys:
+        * "nBlocks" ... the number of blocks passed to the consumer
+        * "gaps" ... list of gaps found (see below)
+        * "startNanos", "finishNanos" ... Arduino clock times (in nanoseconds) when sampling began and finished
+        * "timeDataPre", "timeDataPost" ... round-trip timing data at the start and after the end of streaming
+
+    Each gap is described by a dict with keys:
+        * "afterSeq" ... the sequence number of the last block received before the gap
+        * "missingBlocks" ... number of sequence numbers skipped
+        * "missingNanos" ... length of the gap in time (in Arduino clock nanoseconds)
+
+    All Arduino clock times are adjusted for wrapping of the arduino clock.
+
+    :raises ValueError: if the arduino does not activate the requested pins
+    """
+    with instrumentation.span("streaming.streamCapture"):
+        for pin in pinsToMeasure:
+            arduino.samplePinDuringCapture(f, pinMap[pin], clock)
+        nActivePorts, blockMillis, timeDataPre = arduino.startStreaming(f, clock, nBlocks)
+        if nActivePorts != len(pinsToMeasure):
+            raise ValueError("# activated pins mismatches request: ")
+        blockNanos = blockMillis * 1000000
+
+        stopAt = None
+        if nBlocks == 0 and durationSecs is not None:
+            stopAt = time.time() + durationSecs
+        stopRequested = False
+
+        gaps = []
+        startNanos = None
+        prevSeq = None
+        prevNanos = timeDataPre[2]
+        count = 0
+        while True:
+            seq, arduinoNanos, samples = arduino.readStreamRecord(f, nActivePorts, blockMillis)
+            arduinoNanos = _unwrapAfter(arduinoNanos, prevNanos)
+            if seq == arduino.STREAM_END:
+                finishNanos = arduinoNanos
+                break
+            if stopRequested:
+                prevNanos = arduinoNanos
+                continue
+
+            if startNanos is None:
+                startNanos = arduinoNanos
+            elif seq != prevSeq + 1 or arduinoNanos - prevNanos > blockNanos + GAP_TOLERANCE_NANOS:
+                gapInfo = {
+                    "afterSeq" : prevSeq,
+                    "missingBlocks" : seq - prevSeq - 1,
+                    "missingNanos" : arduinoNanos - prevNanos - blockNanos,
+                }
+                gaps.append(gapInfo)
+                consumer.gap(gapInfo)
+
+            count += 1
+            prevSeq = seq
+            prevNanos = arduinoNanos
+            channels = repackageSamples(pinsToMeasure, pinMap, blockMillis, samples)
+            stop = consumer.block(seq, arduinoNanos, channels)
+
+            if stop or (stopAt is not None and time.time() >= stopAt):
+                if nBlocks == 0:
+                    arduino.stopStreaming(f)
+                stopRequested = True
+
+        consumer.end(finishNanos)
+        timeDataPost = arduino.writeCmdAndTimeRoundTrip(f, clock, arduino.CMD_TIMEONLY)
+        timeDataPost[1] = _unwrapAfter(timeDataPost[1], finishNanos)
+        timeDataPost[2] = _unwrapAfter(timeDataPost[2], timeDataPost[1])
+
+    return {
+        "nBlocks" : count,
+        "gaps" : gaps,
+        "startNanos" : startNanos,
+        "finishNanos" : finishNanos,
+        "timeDataPre" : timeDataPre,
+        "timeDataPost" : timeDataPost,
+    }
+
+
+
+class ChannelSegmentAccumulator(object):
+
+    def __init__(self):
+        """\
+        Stream consumer that collects the blocks of samples into contiguous segments.
+
+        A new segment is started after every gap in the stream. Each segment is a dict with keys:
+        * "startNanos" ... Arduino clock time when sampling of the segment began
+        * "finishNanos" ... Arduino clock time when sampling of the segment ended
+        * "channels" ... data channels (see :func:`measurer.repackageSamples`) covering the whole segment
+
+        These are suitable for passing to :func:`analyse.runDetection`.
+        """
+        super(ChannelSegmentAccumulator, self).__init__()
+        self.segments = []
+        self.current = None
+
+
+    def block(self, seq, startNanos, channels):
+        if self.current is None:
+            self.current = { "startNanos" : startNanos, "finishNanos" : startNanos, "channels" : channels }
+            self.segments.append(self.current)
+        else:
+            for accumulated, channel in zip(self.current["channels"], channels):
+                if accumulated is not None:
+                    accumulated["min"].extend(channel["min"])
+                    accumulated["max"].extend(channel["max"])
+        blockMillis = len([ channel for channel in channels if channel is not None ][0]["min"])
+        self.current["finishNanos"] = startNanos + blockMillis * 1000000
+        return False
+
+
+    def gap(self, gapInfo):
+        self.current = None
+
+
+    def end(self, finishNanos):
+        self.current = None
@@ -33,8 +33,15 @@ import sys
 import argparse
 import json
 import arduino
+import headless
 
-import dvbcss.util
+import lazyImport
+
+dvbcssUtil = lazyImport.LazyModule("dvbcss.util", package="pydvbcss")
+
+# default limits on how many CSS-CII and CSS-TS clients can be connected at once to the CSA tester
+DEFAULT_MAX_CII_CONNECTIONS = 2
+DEFAULT_MAX_TS_CONNECTIONS = 3
 
 
 def ToleranceOrNone(value):
@@ -79,6 +86,8 @@ class BaseCmdLineParser(object):
         # if no time specified, we'll calculate time based on number of pins
         self.MEASURE_SECS = -1
         self.TOLERANCE = None
+        self.SYNC_BURST_SIZE = arduino.SYNC_BURST_SIZE
+        self.PROFILE_TOP = 20
 
 
 
@@ -101,6 +110,19 @@ class BaseCmdLineParser(object):
                         "--maxfreqerror", dest="maxFreqError",  type=int, action="store",default=self.PPM,help="Set the maximum frequency error for the local wall clock in ppm (default="+str(self.PPM)+")")
 
         self.parser.add_argument("--toleranceTest",dest="toleranceSecs",type=ToleranceOrNone, action="store", nargs=1,help="Do a pass/fail test on whether sync is accurate to within this specified tolerance, in milliseconds. Test is not performed if this is not specified.",default=[self.TOLERANCE])
+        self.parser.add_argument("--syncBurst", dest="syncBurstSize", type=int, action="store", default=self.SYNC_BURST_SIZE, help="Number of clock sync round trips made with the Arduino before and after capture. The one with the lowest round trip time is used (default="+str(self.SYNC_BURST_SIZE)+")")
+        self.parser.add_argument("--arduino", dest="arduinoUrl", type=str, action="store", default=None, help="Serial port or pyserial URL of the Arduino (e.g. socket://localhost:5555 for an emulated Arduino, see arduinoEmulator.py). Default is to find an Arduino Due connected via USB.")
+        self.parser.add_argument("--compressTransfer", dest="compressTransfer", action="store_true", default=False, help="Ask the Arduino to run-length encode the samples when transferring them (needs numpy, and the latest Arduino sampling code).")
+        self.parser.add_argument("--syncInterval", dest="syncIntervalSecs", type=float, action="store", default=None, help="Also make clock sync round trips with the Arduino at this interval (in seconds) while it is sampling, to track drift of its clock during long captures (needs the latest Arduino sampling code). Default is not to.")
+        self.parser.add_argument("--saveSession", dest="sessionFilename", type=str, action="store", default=None, help="Save the capture, and everything needed to analyse it again later, to this session file (needs numpy). Replay stored sessions with sessionFile.py. Default is not to.")
+        self.parser.add_argument("--headless", dest="headlessConfigFilename", type=str, action="store", default=None, help="Run without an operator, waiting for the readiness conditions in this JSON config file instead of prompting, and writing a single JSON result (see headless.py). Default is to prompt the operator.")
+        self.parser.add_argument("--instrumentation", dest="instrumentationFilename", type=str, action="store", default=None, help="Record the time spent in each stage of the measurement (serial setup, capture, transfer, detection, correlation) and counts of what was processed, and write them to this file: as a Prometheus textfile if the name ends .prom, otherwise as JSON (see instrumentation.py). Default is not to.")
+        self.parser.add_argument("--profile", dest="profileDir", type=str, action="store", default=None, help="Profile each stage of the run (setup, capture, detection, comparison) with cProfile, and write a .prof file per stage plus a summary of the functions taking the most time to this directory (see profiling.py). Default is not to.")
+        self.parser.add_argument("--profileTop", dest="profileTop", type=int, action="store", default=self.PROFILE_TOP, help="Number of functions to list for each stage in the profiling summary (default="+str(self.PROFILE_TOP)+")")
+        self.parser.add_argument("--resultsDb", dest="resultsDbFilename", type=str, action="store", default=None, help="Also record the results in this SQLite database of results (see resultsStore.py), which can be queried for trends across devices, firmware builds, rigs and days. Default is not to.")
+        self.parser.add_argument("--device", dest="deviceLabel", type=str, action="store", default=None, help="Label identifying the device under test, recorded with the results in the results database.")
+        self.parser.add_argument("--firmware", dest="firmwareLabel", type=str, action="store", default=None, help="Label identifying the firmware build of the device under test, recorded with the results in the results database.")
+        self.parser.add_argument("--rig", dest="rigLabel", type=str, action="store", default=None, help="Label identifying the test rig, recorded with the results in the results database.")
 
 
     def parseArguments(self, args=None):
@@ -129,6 +151,26 @@ class BaseCmdLineParser(object):
         self.pinExpectedTimes, self.pinEventDurations = _loadExpectedTimeMetadata(self.pinMetadataFilenames)
         self.pinsToMeasure = self.pinExpectedTimes.keys()
 
+        if self.args.syncBurstSize < 1:
+            sys.stderr.write("\nAborting. Sync burst size must be at least 1.\n\n")
+            sys.exit(1)
+
+        if self.args.syncIntervalSecs is not None and self.args.syncIntervalSecs <= 0:
+            sys.stderr.write("\nAborting. Sync interval must be greater than zero.\n\n")
+            sys.exit(1)
+
+        if self.args.profileTop < 1:
+            sys.stderr.write("\nAborting. Number of functions to list in the profiling summary must be at least 1.\n\n")
+            sys.exit(1)
+
+        self.headlessConfig = None
+        if self.args.headlessConfigFilename is not None:
+            try:
+                self.headlessConfig = headless.loadConfig(self.args.headlessConfigFilename)
+            except (IOError, ValueError) as e:
+                sys.stderr.write("\nAborting. Could not load headless config: "+str(e)+"\n\n")
+                sys.exit(1)
+
         if len(self.pinsToMeasure) == 0:
           sys.stderr.write("\nAborting. No light sensor or audio inputs have been specified.\n\n")
           sys.exit(1)
@@ -210,10 +252,10 @@ class TVTesterCmdLineParser(BaseCmdLineParser):
         super(TVTesterCmdLineParser,self).setupArguments()
 
         # add arguments to end of set of arguments (called after superclass method)
-        self.parser.add_argument("tsUrl", action="store", type=dvbcss.util.wsUrl_str, nargs=1, help="ws:// URL of TV's CSS-TS end point")
-        self.parser.add_argument("wcUrl", action="store", type=dvbcss.util.udpUrl_str, nargs=1, help="udp://<host>:<port> URL of TV's CSS-WC end point")
-        self.parser.add_argument("wcBindAddr",action="store", type=dvbcss.util.iphost_str, nargs="?",help="IP address or host name to bind WC client to (default="+str(self.DEFAULT_WC_BIND[0])+")",default=self.DEFAULT_WC_BIND[0])
-        self.parser.add_argument("wcBindPort",action="store", type=dvbcss.util.port_int_or_random,   nargs="?",help="Port number to bind WC client to (default="+str(self.DEFAULT_WC_BIND[1])+")",default=self.DEFAULT_WC_BIND[1])
+        self.parser.add_argument("tsUrl", action="store", type=dvbcssUtil.wsUrl_str, nargs=1, help="ws:// URL of TV's CSS-TS end point")
+        self.parser.add_argument("wcUrl", action="store", type=dvbcssUtil.udpUrl_str, nargs=1, help="udp://<host>:<port> URL of TV's CSS-WC end point")
+        self.parser.add_argument("wcBindAddr",action="store", type=dvbcssUtil.iphost_str, nargs="?",help="IP address or host name to bind WC client to (default="+str(self.DEFAULT_WC_BIND[0])+")",default=self.DEFAULT_WC_BIND[0])
+        self.parser.add_argument("wcBindPort",action="store", type=dvbcssUtil.port_int_or_random,   nargs="?",help="Port number to bind WC client to (default="+str(self.DEFAULT_WC_BIND[1])+")",default=self.DEFAULT_WC_BIND[1])
 
 
     def parseArguments(self, args=None):
@@ -268,6 +310,8 @@ class CsaTesterCmdLineParser(BaseCmdLineParser):
         self.PORT_WC=6677
         self.PORT_WS=7681
         self.WAIT_SECS=5.0
+        self.MAX_CII_CONNECTIONS=DEFAULT_MAX_CII_CONNECTIONS
+        self.MAX_TS_CONNECTIONS=DEFAULT_MAX_TS_CONNECTIONS
 
         desc = "Measures synchronisation timing for a Companion Screen using the DVB CSS protocols. Does this by pretending to be the TV Device and using an external Arduino microcontroller to take measurements."
         super(CsaTesterCmdLineParser,self).__init__(desc)
@@ -283,15 +327,21 @@ class CsaTesterCmdLineParser(BaseCmdLineParser):
 
         # add arguments to end of set of arguments (called after superclass method)
         self.parser.add_argument("--waitSecs",     dest="waitSecs",      type=float,                  nargs=1, help="Number of seconds to wait before beginning to measure after timeline is unpaused (default=%4.2f)" % self.WAIT_SECS, default=[self.WAIT_SECS])
-        self.parser.add_argument("--addr",         dest="addr",          type=dvbcss.util.iphost_str, nargs=1, help="IP address or host name to bind to (default=\""+str(self.ADDR)+"\")",default=[self.ADDR])
-        self.parser.add_argument("--wc-port",      dest="portwc",        type=dvbcss.util.port_int,   nargs=1, help="Port number for wall clock server to listen on (default="+str(self.PORT_WC)+")",default=[self.PORT_WC])
-        self.parser.add_argument("--ws-port",      dest="portwebsocket", type=dvbcss.util.port_int,   nargs=1, help="Port number for web socket server to listen on (default="+str(self.PORT_WS)+")",default=[self.PORT_WS])
+        self.parser.add_argument("--addr",         dest="addr",          type=dvbcssUtil.iphost_str, nargs=1, help="IP address or host name to bind to (default=\""+str(self.ADDR)+"\")",default=[self.ADDR])
+        self.parser.add_argument("--wc-port",      dest="portwc",        type=dvbcssUtil.port_int,   nargs=1, help="Port number for wall clock server to listen on (default="+str(self.PORT_WC)+")",default=[self.PORT_WC])
+        self.parser.add_argument("--ws-port",      dest="portwebsocket", type=dvbcssUtil.port_int,   nargs=1, help="Port number for web socket server to listen on (default="+str(self.PORT_WS)+")",default=[self.PORT_WS])
+        self.parser.add_argument("--max-cii-connections", dest="maxCiiConnections", type=int, action="store", default=self.MAX_CII_CONNECTIONS, help="Most CSS-CII clients that can be connected at once (default="+str(self.MAX_CII_CONNECTIONS)+")")
+        self.parser.add_argument("--max-ts-connections", dest="maxTsConnections", type=int, action="store", default=self.MAX_TS_CONNECTIONS, help="Most CSS-TS clients that can be connected at once (default="+str(self.MAX_TS_CONNECTIONS)+")")
 
 
     def parseArguments(self, args=None):
         # let the superclass do the argument parsing and parse the pin data
         super(CsaTesterCmdLineParser,self).parseArguments(args)
 
+        if self.args.maxCiiConnections < 1 or self.args.maxTsConnections < 1:
+            sys.stderr.write("\nAborting. Maximum numbers of CII and TS connections must be at least 1.\n\n")
+            sys.exit(1)
+
 
 
     def printTestSetup(self, ciiUrl, wcUrl, tsUrl):
@@ -309,6 +359,7 @@ class CsaTesterCmdLineParser(BaseCmdLineParser):
         print("   CII server at                 : %s" % ciiUrl)
         print("   TS server at                  : %s" % tsUrl)
         print("   WC server at                  : %s" % wcUrl)
+        print("   ... allowing at most          : %d CII and %d TS clients" % (self.args.maxCiiConnections, self.args.maxTsConnections))
         print("   Pretending to have content id : %s" % self.args.contentId)
         print("   Pretending to have timeline   : %s" % self.args.timelineSelector)
         print("   ... with tick rate            : %d/%d ticks per second" % (self.args.unitsPerSec, self.args.unitsPerTick))
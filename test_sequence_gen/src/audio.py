@@ -60,7 +60,8 @@ def saveAsWavFile(seq, filename, sampleRateHz):
     :param sampleRateHz: The sample rate of the sample data
     """
     # turn into signed 16 bit little-endian raw samples
-    values = list(seq)
+    # (values are truncated to integers, as struct did under Python 2)
+    values = [ int(v) for v in seq ]
     num = len(values)
     sampleData = struct.pack("<"+str(num)+"h", *values)
     
@@ -40,7 +40,9 @@ beeps/flashes anywhere else in the sequence.
 
 """
 
+import os
 import re
+import sys
 
 from audio import genBeepSequence, saveAsWavFile
 from eventTimingGen import (
@@ -50,6 +52,11 @@ from eventTimingGen import (
 )
 from video import genFlashSequence, genFrameImages
 
+# profiling is shared with the measurement system, in src/ at the top of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+
+import profiling
+
 # timings for how we will generate pulses depending on framerates
 # each bit is represented by pulse(s). The first always occurs at the same
 # moment. the second is only present if it is a one bit. For a zero bit, there
@@ -170,6 +177,7 @@ if __name__ == "__main__":
     AUDIO_FILENAME = "build/audio.wav"
     FRAME_FILENAME_PATTERN = "build/img_%06d.png"
     METADATA_FILENAME = "build/metadata.json"
+    PROFILE_TOP = 20
 
     parser=argparse.ArgumentParser(
         description="Generates a test sequence for timing measurement, consisting of a WAV file for the audio, and PNG image files for each frame, plus metadata describing the timings of flashes and beeps within the sequence.")
@@ -271,6 +279,18 @@ if __name__ == "__main__":
         help="List one or more segments on the time progress pie. Each argument should be <label>:<start_time_secs>:<description>"
     )
 
+    parser.add_argument(
+        "--profile", dest="PROFILE_DIR", action="store", nargs=1,
+        type=str,
+        default=[None],
+        help="Profile each stage of generation (audio and video frames) with cProfile, and write a .prof file per stage plus a summary of the functions taking the most time to this directory. Default is not to profile.")
+
+    parser.add_argument(
+        "--profile-top", dest="PROFILE_TOP", action="store", nargs=1,
+        type=int,
+        default=[PROFILE_TOP],
+        help="Number of functions to list for each stage in the profiling summary. Default is "+str(PROFILE_TOP))
+
     args = parser.parse_args()
 
     fps = args.FPS[0]
@@ -339,6 +359,9 @@ if __name__ == "__main__":
             print("            Description: %s" % args.SEGMENTS[i][2])
     print("")
 
+    if args.PROFILE_DIR[0] is not None:
+        profiling.enable(args.PROFILE_DIR[0], args.PROFILE_TOP[0])
+
     # -----------------------------------------------------------------------
 
     # FIRST generate a WAV file containing audio with beeps of a fixed duration
@@ -363,10 +386,11 @@ if __name__ == "__main__":
         # tone sine wave to make it really nice and clean and symmetrical
 
         print("Generating audio...")
-        seqIter = genBeepSequence(eventCentreTimesSecs, idealBeepDurationSecs, sequenceDurationSecs, sampleRateHz, toneHz, amplitude)
+        with profiling.stage("audio"):
+            seqIter = genBeepSequence(eventCentreTimesSecs, idealBeepDurationSecs, sequenceDurationSecs, sampleRateHz, toneHz, amplitude)
 
-        print("Saving audio...")
-        saveAsWavFile(seqIter, audioFilename, sampleRateHz)
+            print("Saving audio...")
+            saveAsWavFile(seqIter, audioFilename, sampleRateHz)
     else:
         print("NOT generating audio (no filename provided)")
 
@@ -416,15 +440,17 @@ if __name__ == "__main__":
         frames = genFrameImages(pixelsSize, flashSequence, pipTrainSequence, numFrames, fps, \
             BG_COLOUR=bg_colour, GFX_COLOUR=gfx_colour, TEXT_COLOUR=text_colour, title=title_text, TITLE_COLOUR=title_colour, \
             FRAMES_AS_FIELDS=FIELD_BASED, frameSkipChecker=skipChecker, segments=segments )
-        n=0
-        for frame in frames:
-            filename = genFrameFilename(n)
-            if frame is not None:
-                print("    Generating and saving image %d of %d" % (n, numFrames-1))
-                frame.save(filename, format="PNG")
-            else:
-                print("    Skipping image %d of %d (already exists)" % (n, numFrames-1))
-            n=n+1
+        # frames are drawn lazily as they are saved, so this stage covers both drawing and PNG encoding
+        with profiling.stage("video"):
+            n=0
+            for frame in frames:
+                filename = genFrameFilename(n)
+                if frame is not None:
+                    print("    Generating and saving image %d of %d" % (n, numFrames-1))
+                    frame.save(filename, format="PNG")
+                else:
+                    print("    Skipping image %d of %d (already exists)" % (n, numFrames-1))
+                n=n+1
     else:
         print("NOT generating video images (no filename provided)")
 
@@ -467,5 +493,9 @@ if __name__ == "__main__":
     else:
         print("NOT generating metadata file (no filename provided)")
 
+    summaryFilename = profiling.finish()
+    if summaryFilename is not None:
+        print("Profiling summary written to: %s" % summaryFilename)
+
     print("Done.")
     print()
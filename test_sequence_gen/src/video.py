@@ -16,6 +16,7 @@
 
 import itertools
 import math
+import os
 import sys
 
 from eventTimingGen import (
@@ -25,17 +26,16 @@ from eventTimingGen import (
     secsToTicks,
 )
 
-try:
-    from PIL import Image, ImageDraw, ImageFont
-except ImportError:
-    print("\n".join([
-        "",
-        "Error importing PIL (Python Image Library). Is it installed? Suggest installing using PIP, e.g.:",
-        "",
-        "    sudo pip install pillow\n",
-        ""
-        ]), file=sys.stderr)
-    sys.exit(1)
+# lazyImport and profiling are shared with the measurement system, in src/ at the top of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+
+import lazyImport
+
+# PIL (Python Image Library) is only imported when frames are first drawn, so flash sequences
+# (and the audio and metadata, in generate.py) can be generated without it installed
+Image = lazyImport.LazyModule("PIL.Image", package="pillow")
+ImageDraw = lazyImport.LazyModule("PIL.ImageDraw", package="pillow")
+ImageFont = lazyImport.LazyModule("PIL.ImageFont", package="pillow")
 
 
 
@@ -122,7 +122,7 @@ class AspectPreservingCoordinateScaler(object):
         return v * self.scale
 
 def loadFont(sizePt):
-    possibleFonts = [ "Arial.ttf", "arial.ttf", "FreeSans.ttf", "freesans.ttf" ]
+    possibleFonts = [ "Arial.ttf", "arial.ttf", "FreeSans.ttf", "freesans.ttf", "DejaVuSans.ttf" ]
 
     for fontName in possibleFonts:
         try:
@@ -133,11 +133,12 @@ def loadFont(sizePt):
     possibleFontFiles = [
         "/usr/share/fonts/truetype/freefont/FreeSans.ttf",
         "/usr/share/fonts/truetype/FreeSans.ttf",
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
     ]
 
     for fontFile in possibleFontFiles:
         try:
-            return ImageFont.truetype(filename=fontFile, size=int(sizePt))
+            return ImageFont.truetype(fontFile, int(sizePt))
         except IOError:
             pass
     raise RuntimeError("Cannot find a TTF font file.")
@@ -155,7 +156,7 @@ def frameNumToTimecode(n, fps, framesAreFields=False):
     h = (n / fps / 60 / 60)
 
     if framesAreFields:
-        fieldIndicator = u'  ' + FIELD_INDICATOR[f % 2]
+        fieldIndicator = u'  ' + FIELD_INDICATOR[int(f) % 2]
         f = f / 2
     else:
         fieldIndicator = ""
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Benchmarks for the stages of generating a test sequence, reporting throughput
+and peak memory use for each, so the effect of optimisations can be measured.
+
+Each scenario times these stages:
+
+* "audio" ... generating the beeps and writing the WAV file (:func:`audio.genBeepSequence`
+  and :func:`audio.saveAsWavFile`, or :func:`fractional_event_generation.genBeepSequenceFractional`
+  for fractional frame rates). Throughput is reported in samples/s and MB/s of WAV file written.
+* "flash" ... generating the colour of the flashing box for every frame (:func:`video.genFlashSequence`,
+  or :func:`fractional_event_generation.genFlashSequenceFractional`). Throughput is reported in frames/s.
+* "frames" ... drawing frame images and saving them as PNG files (:func:`video.genFrameImages`).
+  Only the first few frames are drawn, as drawing every frame at high resolution takes hours.
+  Throughput is reported in frames/s and MB/s of PNG files written.
+
+The scenarios vary the resolution, frame rate (integer and 1001-fractional), pattern
+window length and audio sample rate, one at a time, from the defaults of the generator
+(854x480, 50 fps, window length 7, 48 kHz). Only the stages affected by what is varied
+are run. By default the sequence is only 10 seconds long.
+
+Each stage runs in its own process, so that its peak resident set size (RSS) can be
+measured. A stage that fails (e.g. because no font can be found for drawing frames)
+is reported with its error, rather than stopping the benchmark.
+
+Results can be saved as a JSON baseline, and later runs checked against it.
+A stage is a regression if it takes longer than the baseline by more than the threshold.
+Baselines depend on the machine they were recorded on.
+
+
+Usage
+-----
+
+.. code-block:: bash
+
+    $ python tests/benchmarkGenerate.py --quick
+    $ python tests/benchmarkGenerate.py --save-baseline tests/baselines/generate.json
+    $ python tests/benchmarkGenerate.py --baseline tests/baselines/generate.json --threshold 0.25
+
+The exit status is 1 if any stage has regressed.
+
+"""
+
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None     # not available on Windows, so peak RSS is not reported
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+# baselines are saved and compared in the same way as for the analysis benchmark
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tests'))
+
+from benchmarkAnalysis import compareWithBaseline, loadBaseline, saveResults
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "generate.json")
+
+# regression threshold: fractional slowdown allowed before a stage counts as having regressed
+DEFAULT_THRESHOLD = 0.25
+
+DEFAULT_DURATION_SECS = 10
+DEFAULT_NUM_FRAMES = 3
+
+TYPICAL_SIZE = (854, 480)
+TYPICAL_FPS = (50, 1)
+TYPICAL_WINDOW_LEN = 7
+TYPICAL_SAMPLE_RATE = 48000
+
+SIZES = [ (854, 480), (1280, 720), (1920, 1080) ]
+FPS_RATES = [ (25, 1), (50, 1), (30000, 1001), (60000, 1001) ]
+WINDOW_LENGTHS = [ 5, 7, 9 ]
+SAMPLE_RATES = [ 44100, 48000, 96000 ]
+
+# left out by --quick, as the slowest
+QUICK_EXCLUDED_SIZES = [ (1920, 1080) ]
+QUICK_EXCLUDED_SAMPLE_RATES = [ 96000 ]
+
+STAGES = [ "audio", "flash", "frames" ]
+
+# as used by generate.py
+TONE_HZ = 3000
+AMPLITUDE = 32767*0.5
+EVENT_DURATION_FRAMES = 3.0
+
+
+def scenarioName(size, fps, windowLen, sampleRate):
+    fpsNum, fpsDen = fps
+    fpsText = "%dfps" % fpsNum if fpsDen == 1 else "%d_%dfps" % (fpsNum, fpsDen)
+    return "%dx%d-%s-window%02d-%dHz" % (size[0], size[1], fpsText, windowLen, sampleRate)
+
+
+def scenarios(quick=False, durationSecs=DEFAULT_DURATION_SECS):
+    """\
+    :param quick: if True, leave out the 1920x1080 and 96 kHz scenarios
+    :param durationSecs: duration of the sequence in seconds, or 0 for the full length of the pattern (2^n-1 seconds)
+    :returns: list of scenarios, each a dict with keys "name", "size" (width, height), "fps" (numerator, denominator),
+        "windowLen", "sampleRate", "durationSecs" and "stages" (list of the names of the stages to run)
+    """
+    combinations = [ (TYPICAL_SIZE, TYPICAL_FPS, TYPICAL_WINDOW_LEN, TYPICAL_SAMPLE_RATE, STAGES) ]
+    for size in SIZES:
+        if not (quick and size in QUICK_EXCLUDED_SIZES):
+            combinations.append((size, TYPICAL_FPS, TYPICAL_WINDOW_LEN, TYPICAL_SAMPLE_RATE, [ "frames" ]))
+    for fps in FPS_RATES:
+        combinations.append((TYPICAL_SIZE, fps, TYPICAL_WINDOW_LEN, TYPICAL_SAMPLE_RATE, STAGES))
+    for windowLen in WINDOW_LENGTHS:
+        combinations.append((TYPICAL_SIZE, TYPICAL_FPS, windowLen, TYPICAL_SAMPLE_RATE, [ "audio", "flash" ]))
+    for sampleRate in SAMPLE_RATES:
+        if not (quick and sampleRate in QUICK_EXCLUDED_SAMPLE_RATES):
+            combinations.append((TYPICAL_SIZE, TYPICAL_FPS, TYPICAL_WINDOW_LEN, sampleRate, [ "audio" ]))
+
+    result = []
+    for size, fps, windowLen, sampleRate, stages in combinations:
+        name = scenarioName(size, fps, windowLen, sampleRate)
+        if name not in [ s["name"] for s in result ]:
+            result.append({
+                "name" : name,
+                "size" : list(size),
+                "fps" : list(fps),
+                "windowLen" : windowLen,
+                "sampleRate" : sampleRate,
+                "durationSecs" : durationSecs if durationSecs > 0 else 2**windowLen - 1,
+                "stages" : stages,
+            })
+    return result
+
+
+def eventCentreTimes(scenario):
+    """\
+    :returns: list of the times (in seconds) of the beeps/flashes within the duration of the scenario's sequence.
+        For fractional frame rates these are :class:`fractions.Fraction` objects.
+    """
+    fpsNum, fpsDen = scenario["fps"]
+    if fpsDen == 1:
+        from generate import genEventCentreTimes
+        times = genEventCentreTimes(scenario["windowLen"], fpsNum)
+    else:
+        from fractional_event_generation import genEventCentreTimesFractional
+        times = genEventCentreTimesFractional(scenario["windowLen"], fpsNum, fpsDen)
+    result = []
+    for t in times:
+        if t >= scenario["durationSecs"]:
+            break
+        result.append(t)
+    return result
+
+
+def peakRssMB():
+    """\
+    :returns: peak resident set size of this process in megabytes, or None if it cannot be determined
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / 1024.0 / 1024.0   # bytes
+    return peak / 1024.0                # kilobytes
+
+
+def _audioStage(scenario, workDir, numFrames):
+    from audio import genBeepSequence, saveAsWavFile
+
+    fpsNum, fpsDen = scenario["fps"]
+    sampleRate = scenario["sampleRate"]
+    filename = os.path.join(workDir, "audio.wav")
+    started = time.perf_counter()
+    times = eventCentreTimes(scenario)
+    if fpsDen == 1:
+        seq = genBeepSequence(times, EVENT_DURATION_FRAMES/fpsNum, scenario["durationSecs"], sampleRate, TONE_HZ, AMPLITUDE)
+    else:
+        from fractional_event_generation import genBeepSequenceFractional
+        from frame_timing import calculate_frame_duration
+        seq = genBeepSequenceFractional(times, calculate_frame_duration(fpsNum, fpsDen) * 3, scenario["durationSecs"], \
+                                        sampleRate, fpsNum, fpsDen, TONE_HZ, int(AMPLITUDE))
+    saveAsWavFile(seq, filename, sampleRate)
+    secs = time.perf_counter() - started
+    nBytes = os.path.getsize(filename)
+    return { "secs" : secs, "samples" : scenario["durationSecs"] * sampleRate, "bytes" : nBytes }
+
+
+def _flashStage(scenario, workDir, numFrames):
+    fpsNum, fpsDen = scenario["fps"]
+    started = time.perf_counter()
+    times = eventCentreTimes(scenario)
+    if fpsDen == 1:
+        from video import genFlashSequence
+        seq = list(genFlashSequence(times, EVENT_DURATION_FRAMES/fpsNum, scenario["durationSecs"], fpsNum, (0,0,0), (255,255,255)))
+    else:
+        from fractional_event_generation import genFlashSequenceFractional
+        from frame_timing import calculate_frame_duration
+        seq = list(genFlashSequenceFractional(times, calculate_frame_duration(fpsNum, fpsDen) * 3, scenario["durationSecs"], \
+                                              fpsNum, fpsDen, (0,0,0), (255,255,255)))
+    secs = time.perf_counter() - started
+    return { "secs" : secs, "frames" : len(seq) }
+
+
+def _framesStage(scenario, workDir, numFrames):
+    from video import genFrameImages
+
+    fpsNum, fpsDen = scenario["fps"]
+    fps = fpsNum if fpsDen == 1 else float(fpsNum) / fpsDen
+    flashColours = [ (255,255,255) if i % 2 else (0,0,0) for i in range(0, numFrames) ]
+    started = time.perf_counter()
+    nBytes = 0
+    frames = genFrameImages(tuple(scenario["size"]), flashColours, flashColours, numFrames, fps)
+    for n, frame in enumerate(frames):
+        filename = os.path.join(workDir, "img_%06d.png" % n)
+        frame.save(filename, format="PNG")
+        nBytes += os.path.getsize(filename)
+    secs = time.perf_counter() - started
+    return { "secs" : secs, "frames" : numFrames, "bytes" : nBytes }
+
+
+_STAGE_FUNCS = {
+    "audio" : _audioStage,
+    "flash" : _flashStage,
+    "frames" : _framesStage,
+}
+
+
+def runStage(stage, scenario, numFrames=DEFAULT_NUM_FRAMES):
+    """\
+    Run and time one stage for a scenario, in this process.
+
+    :param stage: name of the stage (see :data:`STAGES`)
+    :param scenario: as returned by :func:`scenarios`
+    :param numFrames: number of frames to draw for the "frames" stage
+    :returns: dict with key "secs", the peak RSS "peakRssMB" and throughput: "samples" and "samplesPerSec"
+        (audio), "frames" and "framesPerSec" (flash and frames) and "bytes" and "mbPerSec" (audio and frames).
+        If the stage fails, the dict has the single key "error" instead.
+    """
+    workDir = tempfile.mkdtemp()
+    try:
+        result = _STAGE_FUNCS[stage](scenario, workDir, numFrames)
+    except Exception as e:
+        return { "error" : "%s: %s" % (type(e).__name__, e) }
+    finally:
+        shutil.rmtree(workDir)
+
+    secs = max(result["secs"], 1e-9)
+    for key, rateKey, scale in [ ("samples", "samplesPerSec", 1.0), ("frames", "framesPerSec", 1.0), ("bytes", "mbPerSec", 1.0/1024/1024) ]:
+        if key in result:
+            result[rateKey] = result[key] * scale / secs
+    result["peakRssMB"] = peakRssMB()
+    return result
+
+
+def runStageIsolated(stage, scenario, numFrames=DEFAULT_NUM_FRAMES):
+    """\
+    As :func:`runStage`, but in a new process, so that the peak RSS is for that stage alone.
+    """
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(runStage, (stage, scenario, numFrames))
+
+
+def runScenario(scenario, numFrames=DEFAULT_NUM_FRAMES, isolated=True):
+    """\
+    :param scenario: as returned by :func:`scenarios`
+    :param numFrames: number of frames to draw for the "frames" stage
+    :param isolated: if True, run each stage in a new process (see :func:`runStageIsolated`)
+    :returns: dict with keys "scenario" and "stages" (dict mapping stage names to results, see :func:`runStage`)
+    """
+    func = runStageIsolated if isolated else runStage
+    stages = {}
+    for stage in scenario["stages"]:
+        stages[stage] = func(stage, scenario, numFrames)
+    return { "scenario" : scenario, "stages" : stages }
+
+
+def formatStageResult(stage, result):
+    if "error" in result:
+        return "%-6s FAILED (%s)" % (stage, result["error"])
+    text = "%-6s %8.3fs" % (stage, result["secs"])
+    if "samplesPerSec" in result:
+        text += " %12.0f samples/s" % result["samplesPerSec"]
+    if "framesPerSec" in result:
+        text += " %10.2f frames/s" % result["framesPerSec"]
+    if "mbPerSec" in result:
+        text += " %8.2f MB/s" % result["mbPerSec"]
+    if result["peakRssMB"] is not None:
+        text += "  peak RSS %.1f MB" % result["peakRssMB"]
+    return text
+
+
+def printResult(result):
+    print(result["scenario"]["name"])
+    for stage in STAGES:
+        if stage in result["stages"]:
+            print("    " + formatStageResult(stage, result["stages"][stage]))
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the stages of generating a test sequence.")
+    parser.add_argument("--quick", action="store_true", default=False, help="Leave out the 1920x1080 and 96 kHz scenarios.")
+    parser.add_argument("--scenario", dest="scenarioPattern", type=str, default=None, help="Only run scenarios whose names match this regular expression.")
+    parser.add_argument("--duration", dest="durationSecs", type=int, default=DEFAULT_DURATION_SECS, help="Duration of the sequence in seconds, or 0 for the full length of the pattern. Default is "+str(DEFAULT_DURATION_SECS))
+    parser.add_argument("--frames", dest="numFrames", type=int, default=DEFAULT_NUM_FRAMES, help="Number of frame images to draw in the frames stage. Default is "+str(DEFAULT_NUM_FRAMES))
+    parser.add_argument("--in-process", dest="isolated", action="store_false", default=True, help="Run every stage in this process, rather than each in a new process. Peak RSS is then for the whole run so far.")
+    parser.add_argument("--baseline", dest="baselineFilename", type=str, default=None, help="Check for regressions against this baseline JSON file.")
+    parser.add_argument("--threshold", dest="threshold", type=float, default=DEFAULT_THRESHOLD, help="Fractional slowdown allowed before a stage counts as regressed. Default is "+str(DEFAULT_THRESHOLD))
+    parser.add_argument("--save-baseline", dest="saveFilename", type=str, default=None, help="Save the results as a baseline JSON file, e.g. "+os.path.relpath(DEFAULT_BASELINE))
+    args = parser.parse_args()
+
+    results = {}
+    for scenario in scenarios(args.quick, args.durationSecs):
+        if args.scenarioPattern is not None and not re.search(args.scenarioPattern, scenario["name"]):
+            continue
+        result = runScenario(scenario, args.numFrames, args.isolated)
+        printResult(result)
+        results[scenario["name"]] = result
+
+    if args.saveFilename is not None:
+        saveResults(args.saveFilename, results)
+        print("Saved baseline: %s" % args.saveFilename)
+
+    if args.baselineFilename is not None:
+        regressions = compareWithBaseline(results, loadBaseline(args.baselineFilename), args.threshold)
+        for r in regressions:
+            print("REGRESSION: %s %s took %.3fs, baseline %.3fs (x%.2f)" % (r["scenario"], r["stage"], r["secs"], r["baselineSecs"], r["ratio"]))
+        if regressions:
+            sys.exit(1)
+        print("No regressions beyond %d%% of the baseline." % round(args.threshold * 100))
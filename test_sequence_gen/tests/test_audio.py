@@ -18,14 +18,17 @@
 Unit-tests for audio.py
 """
 
+import os
 import sys
+import tempfile
+import wave
 
 sys.path.append("../src")
 
 
 import unittest
 
-from audio import GenTone
+from audio import GenTone, saveAsWavFile
 
 # ---------------------------------------------------------------------------
 
@@ -55,6 +58,21 @@ class Test_genTone(unittest.TestCase):
             self.assertAlmostEqual(next(tg),  0.0, places=15)
     
 
+class Test_saveAsWavFile(unittest.TestCase):
+
+    def test_floatSamplesTruncated(self):
+        fd, filename = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            saveAsWavFile(iter([ 0.0, 16383.5, -16383.5, 32767.0 ]), filename, 48000)
+            wav = wave.open(filename, "rb")
+            self.assertEqual(wav.getnchannels(), 1)
+            self.assertEqual(wav.getframerate(), 48000)
+            self.assertEqual(wav.readframes(4), b"\x00\x00\xff\x3f\x01\xc0\xff\x7f")
+            wav.close()
+        finally:
+            os.remove(filename)
+
  
 if __name__ == "__main__":
  
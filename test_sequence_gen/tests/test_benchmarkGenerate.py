@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Unit-tests for benchmarkGenerate.py
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import benchmarkGenerate
+from benchmarkGenerate import compareWithBaseline, runStage, scenarios
+
+
+def tinyScenario(fps, stages):
+    return {
+        "name" : "test", "size" : [ 160, 90 ], "fps" : list(fps), "windowLen" : 3,
+        "sampleRate" : 10000, "durationSecs" : 2, "stages" : stages,
+    }
+
+
+class Test_scenarios(unittest.TestCase):
+
+    def test_coversParameters(self):
+        all = scenarios()
+        self.assertEqual(len(all), len(set(s["name"] for s in all)))
+        self.assertEqual(set(tuple(s["size"]) for s in all), set(benchmarkGenerate.SIZES))
+        self.assertEqual(set(tuple(s["fps"]) for s in all), set(benchmarkGenerate.FPS_RATES))
+        self.assertEqual(set(s["windowLen"] for s in all), set(benchmarkGenerate.WINDOW_LENGTHS))
+        self.assertEqual(set(s["sampleRate"] for s in all), set(benchmarkGenerate.SAMPLE_RATES))
+        self.assertTrue(any(s["fps"][1] == 1001 for s in all))
+
+    def test_quickLeavesOutSlowest(self):
+        quick = scenarios(quick=True)
+        self.assertLess(len(quick), len(scenarios()))
+        self.assertFalse(any(tuple(s["size"]) == (1920, 1080) for s in quick))
+
+    def test_fullDuration(self):
+        for scenario in scenarios(durationSecs=0):
+            self.assertEqual(scenario["durationSecs"], 2**scenario["windowLen"] - 1)
+
+
+class Test_runStage(unittest.TestCase):
+
+    def test_audioAndFlash(self):
+        for fps in [ (50, 1), (30000, 1001) ]:
+            scenario = tinyScenario(fps, [ "audio", "flash" ])
+            audio = runStage("audio", scenario)
+            self.assertEqual(audio["samples"], 20000)
+            self.assertGreater(audio["bytes"], 40000)
+            self.assertGreater(audio["samplesPerSec"], 0)
+            self.assertGreater(audio["mbPerSec"], 0)
+
+            flash = runStage("flash", scenario)
+            self.assertAlmostEqual(flash["frames"], 2 * fps[0] / fps[1], delta=1)
+            self.assertGreater(flash["framesPerSec"], 0)
+
+    def test_failureReported(self):
+        scenario = tinyScenario((50, 1), [ "audio" ])
+        scenario["sampleRate"] = -1
+        result = runStage("audio", scenario)
+        self.assertEqual(list(result.keys()), [ "error" ])
+
+
+class Test_compareWithBaseline(unittest.TestCase):
+
+    def test_regressionsBeyondThreshold(self):
+        baseline = { "a" : { "stages" : { "audio" : { "secs" : 1.0 }, "flash" : { "secs" : 1.0 }, "frames" : { "error" : "x" } } } }
+        results = { "a" : { "stages" : { "audio" : { "secs" : 1.2 }, "flash" : { "secs" : 2.0 }, "frames" : { "secs" : 9.0 } } } }
+        regressions = compareWithBaseline(results, baseline, threshold=0.25)
+        self.assertEqual([ (r["scenario"], r["stage"]) for r in regressions ], [ ("a", "flash") ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -18,18 +18,64 @@
 Unit-tests for video.py
 """
 
+import os
 import sys
 
-sys.path.append("../src")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
 
 import unittest
 
-# from video import <something>
+import video
+from video import loadFont
 
 
 # ---------------------------------------------------------------------------
 
+class Mock_ImageFont(object):
+    """Pretends to be PIL's ImageFont module, with only the given font files available"""
+
+    def __init__(self, available):
+        self.available = available
+        self.calls = []
+
+    def truetype(self, font, size):
+        self.calls.append((font, size))
+        if font not in self.available:
+            raise IOError("cannot open resource")
+        return (font, size)
+
+
+class Test_loadFont(unittest.TestCase):
+
+    def setUp(self):
+        self.original = video.ImageFont
+
+    def tearDown(self):
+        video.ImageFont = self.original
+
+    def test_fontByName(self):
+        video.ImageFont = Mock_ImageFont([ "FreeSans.ttf" ])
+        self.assertEqual(loadFont(20.6), ("FreeSans.ttf", 20))
+
+    def test_fontFilePassedPositionally(self):
+        # Pillow no longer accepts the font file as a "filename" keyword argument
+        fontFile = "/usr/share/fonts/truetype/freefont/FreeSans.ttf"
+        video.ImageFont = Mock_ImageFont([ fontFile ])
+        self.assertEqual(loadFont(12), (fontFile, 12))
+
+    def test_noFont(self):
+        video.ImageFont = Mock_ImageFont([])
+        self.assertRaises(RuntimeError, loadFont, 12)
+
+    def test_drawsWithInstalledFont(self):
+        try:
+            font = loadFont(24)
+        except RuntimeError:
+            self.skipTest("No TTF font installed")
+        self.assertGreater(font.getbbox("00:00:00:00")[2], 0)
+
+
  
 if __name__ == "__main__":
  
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Benchmarks for the analysis pipeline (repackaging, detection and correlation),
+using synthetic captures at realistic scales.
+
+Captures are synthesised in the same way as by the emulated Arduino (see
+:func:`arduinoEmulator.synthesiseSamples`), from the timings of beeps and flashes
+that the test sequence generator would produce for a given pattern window length,
+with a history of Control Timestamps received every second.
+
+Each scenario times these stages:
+
+* "repackageSamples" ... separating the interleaved sample data into channels (:func:`measurer.repackageSamples`)
+* "detectPulses" ... finding the flashes/beeps in the samples (:func:`detect.detectFlashes` / :func:`detect.detectBeeps`)
+* "timesForSamples" ... converting the time of every sample to the sync timeline (:func:`detect.timesForSamples`)
+* "beepFlashDetector" ... the whole of detection, including setting up the detector (:class:`detect.BeepFlashDetector`)
+* "correlate" ... matching observed against expected timings (:func:`analyse.correlate`)
+
+The scenarios sweep the pattern window length (3 to 19), the number of pins (1 to 4)
+and the length of the capture (10 seconds to 1 hour), each with the others held
+at typical values. The test sequence is made as long as the capture plus a minute
+(as with the `--duration` option of the generator), repeating the pattern if the
+window is short. Without that limit, correlation against a long pattern window
+would scan days' worth of offsets and dominate everything else.
+
+Results can be saved as a JSON baseline, and later runs checked against it.
+A stage is a regression if it takes longer than the baseline by more than the threshold.
+Baselines depend on the machine they were recorded on.
+
+
+Usage
+-----
+
+.. code-block:: bash
+
+    $ python tests/benchmarkAnalysis.py --quick
+    $ python tests/benchmarkAnalysis.py --saveBaseline tests/baselines/analysis.json
+    $ python tests/benchmarkAnalysis.py --baseline tests/baselines/analysis.json --threshold 0.25
+
+The exit status is 1 if any stage has regressed.
+
+"""
+
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../test_sequence_gen/src")
+
+
+import analyse
+import detect
+from arduinoEmulator import synthesiseSamples
+from eventTimingGen import encodeBitStreamAsPulseTimings, mls
+from measurer import PIN_MAP, isAudio, repackageSamples
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "analysis.json")
+
+# regression threshold: fractional slowdown allowed before a stage counts as having regressed
+DEFAULT_THRESHOLD = 0.25
+
+# slowdowns smaller than this (in seconds) are ignored, as being within the noise for very quick stages
+MIN_REGRESSION_SECS = 0.005
+
+FPS = 50
+TICK_RATE = 90000
+EXPECTED_MARGIN_SECS = 60
+OFFSET_SECS = 0.012
+NOISE = 3
+
+# 3 to 19 seconds, as supported by the test sequence generator
+WINDOW_LENGTHS = range(3, 20)
+PIN_NAMES = [ "LIGHT_0", "AUDIO_0", "LIGHT_1", "AUDIO_1" ]
+CAPTURE_SECS = [ 10, 60, 600, 3600 ]
+
+TYPICAL_WINDOW_LEN = 7
+TYPICAL_PINS = 1
+TYPICAL_CAPTURE_SECS = 60
+
+QUICK_CAPTURE_SECS = [ 10, 60 ]
+
+
+def scenarios(quick=False):
+    """\
+    :param quick: if True, leave out the captures longer than a minute
+    :returns: list of scenarios, each a dict with keys "name", "windowLen", "nPins" and "captureSecs"
+    """
+    combinations = []
+    for windowLen in WINDOW_LENGTHS:
+        combinations.append((windowLen, TYPICAL_PINS, TYPICAL_CAPTURE_SECS))
+    for nPins in range(1, len(PIN_NAMES)+1):
+        combinations.append((TYPICAL_WINDOW_LEN, nPins, TYPICAL_CAPTURE_SECS))
+    for captureSecs in (QUICK_CAPTURE_SECS if quick else CAPTURE_SECS):
+        combinations.append((TYPICAL_WINDOW_LEN, TYPICAL_PINS, captureSecs))
+
+    result = []
+    for windowLen, nPins, captureSecs in combinations:
+        name = "window%02d-pins%d-%ds" % (windowLen, nPins, captureSecs)
+        if name not in [ s["name"] for s in result ]:
+            result.append({ "name" : name, "windowLen" : windowLen, "nPins" : nPins, "captureSecs" : captureSecs })
+    return result
+
+
+def makeMetadata(windowLen, durationSecs):
+    """\
+    :returns: metadata for the test sequence the generator would produce for the pattern window length and
+        duration, at 50 fps (see `generate.py` in the test sequence generator)
+    """
+    bitTimings = { 0 : [ 3.5/25 ], 1 : [ 3.5/25, 9.5/25 ] }
+    eventCentreTimes = []
+    for t in encodeBitStreamAsPulseTimings(mls(bitLen=windowLen, limitRepeats=None), 1.0, bitTimings[0], bitTimings[1]):
+        if t >= durationSecs:
+            break
+        eventCentreTimes.append(t)
+    return {
+        "durationSecs" : durationSecs,
+        "patternWindowLength" : windowLen,
+        "eventCentreTimes" : eventCentreTimes,
+        "approxBeepDurationSecs" : 3.0 / FPS,
+        "approxFlashDurationSecs" : 3.0 / FPS,
+    }
+
+
+def synthesiseCapture(scenario, seed=1):
+    """\
+    Synthesise everything the analysis needs for a scenario, as if captured from a device playing the test sequence
+    from the start of the capture.
+
+    :returns: dict with keys "pinNames", "metadata", "nMilliBlocks", "samples" (interleaved, as transferred by the arduino),
+        "wcAcReqResp", "wcSyncTimeCorrelations", "acStartNanos", "acEndNanos" and "videoStartTicks"
+    """
+    rand = random.Random(seed)
+    captureSecs = scenario["captureSecs"]
+    pinNames = PIN_NAMES[:scenario["nPins"]]
+    metadata = makeMetadata(scenario["windowLen"], captureSecs + EXPECTED_MARGIN_SECS)
+    nMilliBlocks = captureSecs * 1000
+
+    # the capture starts a little way into the sequence
+    mediaStartSecs = 2.0
+    mediaTimes = [ mediaStartSecs + i / 1000.0 for i in range(0, nMilliBlocks) ]
+    perPin = {}
+    for pinName in pinNames:
+        perPin[pinName] = synthesiseSamples(metadata, isAudio(pinName), mediaTimes, OFFSET_SECS, NOISE, rand)
+
+    # interleave in arduino pin order, high value then low value
+    samples = bytearray()
+    ordered = sorted(pinNames, key=lambda pinName : PIN_MAP[pinName])
+    for i in range(0, nMilliBlocks):
+        for pinName in ordered:
+            hiSamples, loSamples = perPin[pinName]
+            samples.append(hiSamples[i])
+            samples.append(loSamples[i])
+
+    # arduino clock and wall clock tick together; the wall clock is 1000 seconds ahead
+    wcOffsetNanos = 1000 * 1000000000
+    acStartNanos = 5000000
+    acEndNanos = acStartNanos + nMilliBlocks * 1000000
+    wcAcReqResp = {
+        "pre"  : (acStartNanos + wcOffsetNanos - 400000, acStartNanos - 200000, acStartNanos - 200000, acStartNanos + wcOffsetNanos),
+        "mid"  : [],
+        "post" : (acEndNanos + wcOffsetNanos, acEndNanos + 200000, acEndNanos + 200000, acEndNanos + wcOffsetNanos + 400000),
+    }
+
+    # control timestamps received every second; the sync timeline is at zero when the sequence starts
+    wcMediaStartNanos = acStartNanos + wcOffsetNanos - int(mediaStartSecs * 1000000000)
+    videoStartTicks = 0
+    wcSyncTimeCorrelations = []
+    for secs in range(-1, captureSecs + 2):
+        when = acStartNanos + wcOffsetNanos + secs * 1000000000 + rand.randint(0, 5000000)
+        wcSyncTimeCorrelations.append( (when, (wcMediaStartNanos, videoStartTicks, 1.0)) )
+
+    return {
+        "pinNames" : pinNames,
+        "metadata" : metadata,
+        "nMilliBlocks" : nMilliBlocks,
+        "samples" : bytes(samples),
+        "wcAcReqResp" : wcAcReqResp,
+        "wcSyncTimeCorrelations" : wcSyncTimeCorrelations,
+        "acStartNanos" : acStartNanos,
+        "acEndNanos" : acEndNanos,
+        "videoStartTicks" : videoStartTicks,
+    }
+
+
+def _timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+
+def runScenario(scenario, repeats=1):
+    """\
+    Time each stage of the analysis for a scenario.
+
+    :param scenario: as returned by :func:`scenarios`
+    :param repeats: number of times to repeat each stage. The fastest time is kept.
+    :returns: dict with keys "scenario", "samples" (number of samples processed per pin), "pulses" (number of
+        flashes/beeps observed on the first pin), "offsetsScanned" and "stages" (dict mapping stage names to seconds)
+    """
+    capture = synthesiseCapture(scenario)
+    pinNames = capture["pinNames"]
+    stages = {}
+
+    def record(stage, secs):
+        stages[stage] = min(stages.get(stage, secs), secs)
+
+    for i in range(0, repeats):
+        secs, channels = _timed(repackageSamples, pinNames, PIN_MAP, capture["nMilliBlocks"], capture["samples"])
+        record("repackageSamples", secs)
+    channels = [ channel for channel in channels if channel is not None ]
+
+    duration = capture["metadata"]["approxFlashDurationSecs"]
+    holdCount = int(duration * 0.5 * 1000)
+    for i in range(0, repeats):
+        total = 0.0
+        for channel in channels:
+            detectFunc = detect.detectBeeps if channel["isAudio"] else detect.detectFlashes
+            secs, pulseIndices = _timed(detectFunc, channel["min"], channel["max"], int(duration * 0.5 * 1000), holdCount)
+            total += secs
+        record("detectPulses", total)
+
+    for i in range(0, repeats):
+        secs, detector = _timed(detect.BeepFlashDetector, capture["wcAcReqResp"], TICK_RATE, capture["wcSyncTimeCorrelations"], \
+                                lambda wcTime : 1000000, 1000, 1000)
+        total = secs
+        secs, stTimes = _timed(detect.timesForSamples, capture["nMilliBlocks"], detector.ac2st, capture["acStartNanos"], capture["acEndNanos"])
+        record("timesForSamples", secs)
+        observed = []
+        for channel in channels:
+            func = detector.samplesToBeepTimings if channel["isAudio"] else detector.samplesToFlashTimings
+            secs, timings = _timed(func, channel["min"], channel["max"], capture["acStartNanos"], capture["acEndNanos"], duration)
+            total += secs
+            observed.append(timings)
+        record("beepFlashDetector", total)
+
+    expected = [ capture["videoStartTicks"] + TICK_RATE * t for t in capture["metadata"]["eventCentreTimes"] ]
+    for i in range(0, repeats):
+        total = 0.0
+        for timings in observed:
+            secs, result = _timed(analyse.correlate, expected, timings)
+            total += secs
+        record("correlate", total)
+
+    return {
+        "scenario" : scenario,
+        "samples" : capture["nMilliBlocks"],
+        "pulses" : len(observed[0]),
+        "offsetsScanned" : max(0, len(expected) - len(observed[0]) + 1),
+        "stages" : stages,
+    }
+
+
+def stageSecs(result):
+    """\
+    :param result: None, the time a stage took (in seconds), or a dict with key "secs" (which is missing if the stage failed)
+    :returns: the time the stage took, in seconds, or None if it is not known
+    """
+    if isinstance(result, dict):
+        return result.get("secs")
+    return result
+
+
+def compareWithBaseline(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """\
+    Also used by the import and sequence generator benchmarks.
+
+    :param results: dict mapping scenario names to results (see :func:`runScenario`). The time for each stage
+        can instead be given as a dict with key "secs" (see :func:`stageSecs`)
+    :param baseline: results from an earlier run, in the same form
+    :param threshold: fractional slowdown allowed, e.g. 0.25 for 25%
+    :returns: list of regressions, each a dict with keys "scenario", "stage", "baselineSecs", "secs" and "ratio".
+        Scenarios and stages that are not in both, or that failed in either, are ignored, as are slowdowns of less
+        than :data:`MIN_REGRESSION_SECS`.
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        for stage, result in sorted(results[name]["stages"].items()):
+            secs = stageSecs(result)
+            baselineSecs = stageSecs(baseline[name]["stages"].get(stage))
+            if secs is None or baselineSecs is None or baselineSecs <= 0:
+                continue
+            ratio = secs / baselineSecs
+            if ratio > 1.0 + threshold and secs - baselineSecs >= MIN_REGRESSION_SECS:
+                regressions.append({ "scenario" : name, "stage" : stage, "baselineSecs" : baselineSecs, "secs" : secs, "ratio" : ratio })
+    return regressions
+
+
+def loadBaseline(filename):
+    with open(filename) as f:
+        return json.load(f)["results"]
+
+
+def saveResults(filename, results):
+    directory = os.path.dirname(os.path.abspath(filename))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(filename, "w") as f:
+        json.dump({ "python" : sys.version.split()[0], "recorded" : time.time(), "results" : results }, f, indent=1, sort_keys=True)
+
+
+def printResult(result):
+    stages = result["stages"]
+    print("%-24s %9d samples %6d pulses  " % (result["scenario"]["name"], result["samples"], result["pulses"]) + \
+          "  ".join("%s %.4fs" % (stage, stages[stage]) for stage in sorted(stages)))
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline using synthetic captures.")
+    parser.add_argument("--quick", dest="quick", action="store_true", default=False, help="Leave out the captures longer than a minute.")
+    parser.add_argument("--scenario", dest="scenarioPattern", type=str, default=None, help="Only run scenarios whose names match this regular expression.")
+    parser.add_argument("--repeats", dest="repeats", type=int, default=1, help="Number of times to repeat each stage, keeping the fastest (default=1).")
+    parser.add_argument("--baseline", dest="baselineFilename", type=str, default=None, help="Check for regressions against this baseline JSON file.")
+    parser.add_argument("--threshold", dest="threshold", type=float, default=DEFAULT_THRESHOLD, help="Fractional slowdown allowed before a stage counts as regressed (default="+str(DEFAULT_THRESHOLD)+").")
+    parser.add_argument("--saveBaseline", dest="saveFilename", type=str, default=None, help="Save the results as a baseline JSON file, e.g. "+os.path.relpath(DEFAULT_BASELINE))
+    args = parser.parse_args()
+
+    results = {}
+    for scenario in scenarios(args.quick):
+        if args.scenarioPattern is not None and not re.search(args.scenarioPattern, scenario["name"]):
+            continue
+        result = runScenario(scenario, args.repeats)
+        printResult(result)
+        results[scenario["name"]] = result
+
+    if args.saveFilename is not None:
+        saveResults(args.saveFilename, results)
+        print("Saved baseline: %s" % args.saveFilename)
+
+    if args.baselineFilename is not None:
+        regressions = compareWithBaseline(results, loadBaseline(args.baselineFilename), args.threshold)
+        for r in regressions:
+            print("REGRESSION: %s %s took %.4fs, baseline %.4fs (x%.2f)" % (r["scenario"], r["stage"], r["secs"], r["baselineSecs"], r["ratio"]))
+        if regressions:
+            sys.exit(1)
+        print("No regressions beyond %d%% of the baseline." % round(args.threshold * 100))
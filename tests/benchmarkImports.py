@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Benchmark of how long it takes to import the modules of the measurement system and
+the test sequence generator, and check that the modules needed for analysis and for
+generating audio and metadata can be imported without the libraries only needed for
+measuring (pyserial, pydvbcss, cherrypy, ws4py) or for drawing video frames (PIL).
+
+Each module is imported in a new Python process, so nothing is already imported.
+Each module is timed:
+
+* "import" ... importing the module, with all libraries installed
+* "importBare" ... importing the module as if those libraries were not installed
+
+The libraries that are slow to import (listed in :data:`HEAVY_MODULES`) that were
+imported along with the module are also reported. They should only be imported
+when first used (see :mod:`lazyImport`).
+
+The fastest of several repeats is kept. Results can be saved as a JSON baseline
+and later runs checked against it, in the same way as by benchmarkAnalysis.py.
+
+
+Usage
+-----
+
+.. code-block:: bash
+
+    $ python tests/benchmarkImports.py
+    $ python tests/benchmarkImports.py --saveBaseline tests/baselines/imports.json
+    $ python tests/benchmarkImports.py --baseline tests/baselines/imports.json --threshold 0.5
+
+The exit status is 1 if any module has regressed, or cannot be imported without those libraries.
+
+"""
+
+import json
+import os
+import re
+import subprocess
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmarkAnalysis import compareWithBaseline, loadBaseline, saveResults
+
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SRC_DIRS = [ os.path.join(ROOT_DIR, "src"), os.path.join(ROOT_DIR, "test_sequence_gen", "src") ]
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "imports.json")
+
+# regression threshold: fractional slowdown allowed before an import counts as having regressed.
+# Import times are short and vary a lot between runs.
+DEFAULT_THRESHOLD = 0.5
+
+DEFAULT_REPEATS = 5
+
+# modules that are timed
+MODULES = [
+    "analyse", "detect", "stats", "bootstrap", "headless", "measurer", "sessionFile", "resultsStore",
+    "testsetupcmdline", "exampleTVTester", "exampleCsaTester",
+    "eventTimingGen", "audio", "video", "generate",
+]
+
+# libraries that are slow to import, or only needed for measuring or drawing video frames
+HEAVY_MODULES = [ "numpy", "serial", "dvbcss", "cherrypy", "ws4py", "PIL" ]
+
+# libraries that are treated as not installed for the "importBare" stage
+BARE_MISSING = [ "serial", "dvbcss", "cherrypy", "ws4py", "PIL" ]
+
+_SCRIPT = """\
+import json, sys, time
+for name in %(missing)r:
+    sys.modules[name] = None
+started = time.perf_counter()
+import %(module)s
+secs = time.perf_counter() - started
+print(json.dumps({ "secs" : secs, "loaded" : sorted(m for m in %(heavy)r if sys.modules.get(m) is not None) }))
+"""
+
+
+def importModule(module, missing=()):
+    """\
+    Import a module in a new Python process, and time it.
+
+    :param module: name of the module
+    :param missing: names of libraries to treat as not installed
+    :returns: dict with keys "secs" (time taken) and "loaded" (list of the :data:`HEAVY_MODULES` that were imported)
+    :raises RuntimeError: if the module cannot be imported
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(SRC_DIRS + [ p for p in [ env.get("PYTHONPATH") ] if p ])
+    script = _SCRIPT % { "module" : module, "missing" : list(missing), "heavy" : HEAVY_MODULES }
+    process = subprocess.run([ sys.executable, "-c", script ], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        lines = process.stderr.strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else "exit status %d" % process.returncode)
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def runModule(module, repeats=DEFAULT_REPEATS):
+    """\
+    Time importing a module, with and without the libraries in :data:`BARE_MISSING`.
+
+    :param module: name of the module
+    :param repeats: number of times to import it each way. The fastest time is kept.
+    :returns: dict with keys "module", "stages" (dict mapping "import" and "importBare" to seconds), "loaded"
+        and "loadedBare" (lists of the :data:`HEAVY_MODULES` imported along with the module), and "error"
+        (None, or why the module could not be imported without those libraries)
+    """
+    result = { "module" : module, "stages" : {}, "loaded" : None, "loadedBare" : None, "error" : None }
+    for stage, loadedKey, missing in [ ("import", "loaded", []), ("importBare", "loadedBare", BARE_MISSING) ]:
+        try:
+            for i in range(0, repeats):
+                timing = importModule(module, missing)
+                result["stages"][stage] = min(result["stages"].get(stage, timing["secs"]), timing["secs"])
+                result[loadedKey] = timing["loaded"]
+        except RuntimeError as e:
+            result["error"] = "%s: %s" % (stage, e)
+    return result
+
+
+def printResult(result):
+    stages = result["stages"]
+    line = "%-18s" % result["module"]
+    for stage in [ "import", "importBare" ]:
+        line += "  %s %7.1f ms" % (stage, stages[stage] * 1000.0) if stage in stages else "  %s %10s" % (stage, "-")
+    if result["loaded"]:
+        line += "  imports " + ", ".join(result["loaded"])
+    if result["error"] is not None:
+        line += "  FAILED " + result["error"]
+    print(line)
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the time taken to import modules.")
+    parser.add_argument("--module", dest="modulePattern", type=str, default=None, help="Only time modules whose names match this regular expression.")
+    parser.add_argument("--repeats", dest="repeats", type=int, default=DEFAULT_REPEATS, help="Number of times to import each module, keeping the fastest (default="+str(DEFAULT_REPEATS)+").")
+    parser.add_argument("--baseline", dest="baselineFilename", type=str, default=None, help="Check for regressions against this baseline JSON file.")
+    parser.add_argument("--threshold", dest="threshold", type=float, default=DEFAULT_THRESHOLD, help="Fractional slowdown allowed before an import counts as regressed (default="+str(DEFAULT_THRESHOLD)+").")
+    parser.add_argument("--saveBaseline", dest="saveFilename", type=str, default=None, help="Save the results as a baseline JSON file, e.g. "+os.path.relpath(DEFAULT_BASELINE))
+    args = parser.parse_args()
+
+    results = {}
+    for module in MODULES:
+        if args.modulePattern is not None and not re.search(args.modulePattern, module):
+            continue
+        result = runModule(module, args.repeats)
+        printResult(result)
+        results[module] = result
+
+    if args.saveFilename is not None:
+        saveResults(args.saveFilename, results)
+        print("Saved baseline: %s" % args.saveFilename)
+
+    failed = [ result for result in results.values() if result["error"] is not None ]
+
+    if args.baselineFilename is not None:
+        regressions = compareWithBaseline(results, loadBaseline(args.baselineFilename), args.threshold)
+        for r in regressions:
+            print("REGRESSION: %s %s took %.4fs, baseline %.4fs (x%.2f)" % (r["scenario"], r["stage"], r["secs"], r["baselineSecs"], r["ratio"]))
+        if regressions or failed:
+            sys.exit(1)
+        print("No regressions beyond %d%% of the baseline." % round(args.threshold * 100))
+
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Load test of the servers that the CSA tester (exampleCsaTester.py) runs in the role of
+the TV Device: CSS-WC, CSS-CII and CSS-TS.
+
+The servers are started locally in the same way as by the tester, but without an
+Arduino, as only the protocol servers are exercised. Then, for each of a series of
+numbers of clients, that many simulated companions connect. Each connects to CSS-CII
+and CSS-TS (web sockets) and sends CSS-WC requests (UDP) one after another. While
+they are connected, the timeline is repeatedly unpaused and paused again, each time
+calling `updateAllClients()` on the TS server, as the tester does. For each number of
+clients, the following are reported:
+
+* "wc" ... percentiles of the round trip time of the WC requests, and how many got no response ("lost")
+* "tsFanOut" ... percentiles of the time from calling `updateAllClients()` until each connected
+  TS client receives the new control timestamp, and how many did not receive it in time ("missed")
+* "dropped" ... the number of clients that could not connect to CII or TS, or were disconnected
+
+The connection limits of the servers (`--max-cii-connections` and `--max-ts-connections`
+options of the tester) are, by default, raised to the largest number of clients, so
+that the servers themselves are measured. Set them lower to see clients beyond the
+limit being dropped.
+
+Needs pydvbcss, cherrypy and ws4py.
+
+
+Usage
+-----
+
+.. code-block:: bash
+
+    $ python tests/loadTestCsa.py --clients 1 10 50 100
+    $ python tests/loadTestCsa.py --clients 10 --max-ts-connections 3 --json load.json
+
+"""
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import exampleCsaTester
+import stats
+
+
+DEFAULT_CLIENTS = [ 1, 5, 10, 25, 50 ]
+DEFAULT_ROUNDS = 20
+
+# time between one round of TS updates and the next
+ROUND_INTERVAL_SECS = 0.2
+
+# how long to wait for clients to connect, responses to WC requests and control timestamps to arrive
+CONNECT_TIMEOUT_SECS = 10.0
+WC_TIMEOUT_SECS = 1.0
+FANOUT_TIMEOUT_SECS = 2.0
+
+# time between one WC request from a client and the next
+WC_INTERVAL_SECS = 0.05
+
+CONTENT_ID = "urn:github.com/bbc/dvbcss-synctiming:sync-timing-test-sequence"
+TIMELINE_SELECTOR = "urn:dvb:css:timeline:pts"
+
+
+
+def summariseLatencies(secs):
+    """\
+    :param secs: list of latencies, in seconds
+    :returns: None if the list is empty, otherwise dict with keys "count", "p50", "p95", "p99" and "max" (in seconds)
+    """
+    if len(secs) == 0:
+        return None
+    return {
+        "count" : len(secs),
+        "p50" : stats.calcPercentile(secs, 50),
+        "p95" : stats.calcPercentile(secs, 95),
+        "p99" : stats.calcPercentile(secs, 99),
+        "max" : max(secs),
+    }
+
+
+
+class FanOutTimer(object):
+
+    def __init__(self):
+        """\
+        Times how long it takes for a control timestamp sent to all TS clients to reach each of them.
+        Call :meth:`begin` just before the TS server sends it, :meth:`received` from each client when it arrives,
+        then :meth:`end`.
+
+        The times are available as the attribute :data:`latencies` (list, in seconds), and the number of clients that
+        did not receive the control timestamp in time as :data:`missed`.
+        """
+        super(FanOutTimer, self).__init__()
+        self._lock = threading.Lock()
+        self._arrived = threading.Condition(self._lock)
+        self._started = None
+        self._speed = None
+        self._waitingFor = set()
+        self.latencies = []
+        self.missed = 0
+
+
+    def begin(self, clientIds, speed):
+        """\
+        :param clientIds: the clients that the control timestamp is being sent to
+        :param speed: the timeline speed of the control timestamp, to tell it apart from any sent before
+        """
+        with self._lock:
+            self._waitingFor = set(clientIds)
+            self._speed = speed
+            self._started = time.perf_counter()
+
+
+    def received(self, clientId, speed):
+        """\
+        Called by a client when it receives a control timestamp.
+        """
+        now = time.perf_counter()
+        with self._lock:
+            if clientId in self._waitingFor and speed == self._speed:
+                self._waitingFor.discard(clientId)
+                self.latencies.append(now - self._started)
+                self._arrived.notify_all()
+
+
+    def end(self, timeoutSecs=FANOUT_TIMEOUT_SECS):
+        """\
+        Wait until all the clients have received the control timestamp, or the timeout passes.
+
+        :returns: the number of clients that did not receive it
+        """
+        deadline = time.perf_counter() + timeoutSecs
+        with self._lock:
+            while self._waitingFor:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._arrived.wait(remaining)
+            missed = len(self._waitingFor)
+            self.missed += missed
+            self._waitingFor = set()
+            return missed
+
+
+
+class SimulatedCompanion(object):
+
+    def __init__(self, clientId, ciiUrl, tsUrl, wcAddr, fanOut):
+        """\
+        A simulated companion, that connects to CSS-CII and CSS-TS, and sends CSS-WC requests one after another
+        until disconnected.
+
+        :param clientId: number identifying the client
+        :param ciiUrl, tsUrl: web socket URLs of the CII and TS servers
+        :param wcAddr: tuple (host, port) of the WC server
+        :param fanOut: the :class:`FanOutTimer` told when control timestamps arrive
+
+        The round trip times of the WC requests are available as the attribute :data:`wcLatencies` (list, in seconds),
+        and the number that got no response as :data:`wcLost`.
+        """
+        super(SimulatedCompanion, self).__init__()
+        self.clientId = clientId
+        self.ciiUrl = ciiUrl
+        self.tsUrl = tsUrl
+        self.wcAddr = wcAddr
+        self.fanOut = fanOut
+        self.gotCii = threading.Event()
+        self.gotTs = threading.Event()
+        self.dropped = False
+        self.wcLatencies = []
+        self.wcLost = 0
+        self._stopping = threading.Event()
+        self._connections = []
+        self._wcThread = None
+
+
+    def _drop(self, *args):
+        if not self._stopping.is_set():
+            self.dropped = True
+
+
+    def _controlTimestamp(self, ct):
+        self.gotTs.set()
+        self.fanOut.received(self.clientId, ct.timelineSpeedMultiplier)
+
+
+    def connect(self):
+        """\
+        Connect to CII and TS, and start sending WC requests. If a connection cannot be made, the client is marked as dropped.
+        """
+        from dvbcss.protocol.client.cii import CIIClientConnection
+        from dvbcss.protocol.client.ts import TSClientConnection
+
+        cii = CIIClientConnection(self.ciiUrl)
+        cii.onCiiReceived = lambda cii : self.gotCii.set()
+        cii.onDisconnected = self._drop
+        ts = TSClientConnection(self.tsUrl, "", TIMELINE_SELECTOR)
+        ts.onControlTimestamp = self._controlTimestamp
+        ts.onDisconnected = self._drop
+        for connection in (cii, ts):
+            try:
+                connection.connect()
+                self._connections.append(connection)
+            except Exception:
+                self.dropped = True
+
+        self._wcThread = threading.Thread(target=self._sendWcRequests)
+        self._wcThread.daemon = True
+        self._wcThread.start()
+
+
+    @property
+    def connected(self):
+        """\
+        True if the client has received CII and a control timestamp, and has not been dropped
+        """
+        return self.gotCii.is_set() and self.gotTs.is_set() and not self.dropped
+
+
+    def resetMeasurements(self):
+        self.wcLatencies = []
+        self.wcLost = 0
+
+
+    def _sendWcRequests(self):
+        from dvbcss.protocol.wc import WCMessage
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            seq = 0
+            while not self._stopping.is_set():
+                seq += 1
+                request = WCMessage(WCMessage.TYPE_REQUEST, 0, 0, seq, 0, 0)
+                sent = time.perf_counter()
+                sock.sendto(request.pack(), self.wcAddr)
+                deadline = sent + WC_TIMEOUT_SECS
+                while True:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self.wcLost += 1
+                        break
+                    sock.settimeout(remaining)
+                    try:
+                        data = sock.recv(1024)
+                    except socket.timeout:
+                        continue
+                    response = WCMessage.unpack(data)
+                    # ignore responses to earlier requests, and follow-ups
+                    if response.originateNanos == seq and response.msgtype != WCMessage.TYPE_FOLLOWUP:
+                        self.wcLatencies.append(time.perf_counter() - sent)
+                        break
+                self._stopping.wait(WC_INTERVAL_SECS)
+        finally:
+            sock.close()
+
+
+    def disconnect(self):
+        """\
+        Stop sending WC requests and disconnect from CII and TS.
+        """
+        self._stopping.set()
+        for connection in self._connections:
+            try:
+                connection.disconnect()
+            except Exception:
+                pass
+        if self._wcThread is not None:
+            self._wcThread.join()
+
+
+
+def startTester(host, wcPort, wsPort, maxCiiConnections, maxTsConnections):
+    """\
+    Start the CSS-WC, CSS-CII and CSS-TS servers of the CSA tester, with the timeline paused.
+
+    :returns: tuple (servers, syncTimelineClock), where servers is as returned by :func:`exampleCsaTester.createServers`
+    """
+    import argparse
+
+    args = argparse.Namespace(addr=[host], portwc=[wcPort], portwebsocket=[wsPort], maxFreqError=500, \
+                              contentId=CONTENT_ID, timelineSelector=TIMELINE_SELECTOR, unitsPerTick=1, unitsPerSec=90000, videoStartTicks=0, \
+                              maxCiiConnections=maxCiiConnections, maxTsConnections=maxTsConnections)
+    servers = exampleCsaTester.createServers(args)
+    syncTimelineClock = exampleCsaTester.createTimeline(servers["tsServer"][0], servers["wallclock"], args)[0]
+    exampleCsaTester.startServers(args, servers["wcServer"][0])
+    return servers, syncTimelineClock
+
+
+def stopTester(servers):
+    exampleCsaTester.cherrypy.engine.exit()
+    servers["wcServer"][0].stop()
+
+
+
+def runStep(servers, syncTimelineClock, nClients, rounds=DEFAULT_ROUNDS):
+    """\
+    Connect a number of simulated companions to the tester, measure, then disconnect them.
+
+    :param servers: as returned by :func:`startTester`
+    :param syncTimelineClock: the sync timeline clock of the tester
+    :param nClients: the number of clients
+    :param rounds: the number of times to unpause or pause the timeline and update all TS clients
+    :returns: dict with keys "clients", "connected", "dropped", "wc" and "tsFanOut" (see module documentation)
+    """
+    tsServer = servers["tsServer"][0]
+    wcHost, wcPort = servers["wcServer"][1][len("udp://"):].rsplit(":", 1)
+    fanOut = FanOutTimer()
+    clients = [ SimulatedCompanion(i, servers["ciiServer"][1], servers["tsServer"][1], (wcHost, int(wcPort)), fanOut) for i in range(0, nClients) ]
+
+    try:
+        for client in clients:
+            client.connect()
+        deadline = time.time() + CONNECT_TIMEOUT_SECS
+        while time.time() < deadline and not all(client.connected or client.dropped for client in clients):
+            time.sleep(0.05)
+        for client in clients:
+            client.resetMeasurements()
+
+        for i in range(0, rounds):
+            if syncTimelineClock.speed == 0:
+                exampleCsaTester.unpauseSyncTimelineClock(syncTimelineClock)
+            else:
+                exampleCsaTester.pauseSyncTimelineClock(syncTimelineClock)
+            fanOut.begin([ client.clientId for client in clients if client.connected ], syncTimelineClock.speed)
+            tsServer.updateAllClients()
+            fanOut.end()
+            time.sleep(ROUND_INTERVAL_SECS)
+
+        exampleCsaTester.pauseSyncTimelineClock(syncTimelineClock)
+        tsServer.updateAllClients()
+    finally:
+        for client in clients:
+            client.disconnect()
+
+    # let the servers notice the clients have gone, before the next step
+    deadline = time.time() + CONNECT_TIMEOUT_SECS
+    while time.time() < deadline and len(tsServer.getConnections()) > 0:
+        time.sleep(0.05)
+
+    wc = summariseLatencies([ secs for client in clients for secs in client.wcLatencies ]) or {}
+    wc["lost"] = sum(client.wcLost for client in clients)
+    tsFanOut = summariseLatencies(fanOut.latencies) or {}
+    tsFanOut["missed"] = fanOut.missed
+    return {
+        "clients" : nClients,
+        "connected" : len([ client for client in clients if client.connected ]),
+        "dropped" : len([ client for client in clients if not client.connected ]),
+        "wc" : wc,
+        "tsFanOut" : tsFanOut,
+    }
+
+
+
+def _millis(summary, key):
+    return "%8.2f" % (summary[key] * 1000.0) if key in summary else "%8s" % "-"
+
+def printResult(result):
+    wc, ts = result["wc"], result["tsFanOut"]
+    print("%7d %9d %7d | %s %s %s %6d | %s %s %s %6d" % (result["clients"], result["connected"], result["dropped"], \
+          _millis(wc, "p50"), _millis(wc, "p99"), _millis(wc, "max"), wc["lost"], \
+          _millis(ts, "p50"), _millis(ts, "p99"), _millis(ts, "max"), ts["missed"]))
+
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load test the CSS-WC, CSS-CII and CSS-TS servers of the CSA tester with many simulated companions.")
+    parser.add_argument("--clients", dest="clients", type=int, nargs="+", default=DEFAULT_CLIENTS, help="Numbers of clients to connect, one step for each (default="+" ".join(str(n) for n in DEFAULT_CLIENTS)+").")
+    parser.add_argument("--rounds", dest="rounds", type=int, default=DEFAULT_ROUNDS, help="Number of TS updates sent to all clients in each step (default="+str(DEFAULT_ROUNDS)+").")
+    parser.add_argument("--addr", dest="addr", type=str, default="127.0.0.1", help="IP address to run the servers on (default=127.0.0.1).")
+    parser.add_argument("--wc-port", dest="portwc", type=int, default=6677, help="Port number for the wall clock server (default=6677).")
+    parser.add_argument("--ws-port", dest="portwebsocket", type=int, default=7681, help="Port number for the web socket server (default=7681).")
+    parser.add_argument("--max-cii-connections", dest="maxCiiConnections", type=int, default=None, help="Most CII clients the server allows (default is the largest number of clients).")
+    parser.add_argument("--max-ts-connections", dest="maxTsConnections", type=int, default=None, help="Most TS clients the server allows (default is the largest number of clients).")
+    parser.add_argument("--json", dest="jsonFilename", type=str, default=None, help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    maxClients = max(args.clients)
+    maxCiiConnections = maxClients if args.maxCiiConnections is None else args.maxCiiConnections
+    maxTsConnections = maxClients if args.maxTsConnections is None else args.maxTsConnections
+
+    servers, syncTimelineClock = startTester(args.addr, args.portwc, args.portwebsocket, maxCiiConnections, maxTsConnections)
+    print("Servers allow at most %d CII and %d TS clients." % (maxCiiConnections, maxTsConnections))
+    print()
+    print("%7s %9s %7s | %8s %8s %8s %6s | %8s %8s %8s %6s" % ("", "", "", "WC", "round", "trip", "(ms)", "TS", "fan-out", "(ms)", ""))
+    print("%7s %9s %7s | %8s %8s %8s %6s | %8s %8s %8s %6s" % ("clients", "connected", "dropped", "p50", "p99", "max", "lost", "p50", "p99", "max", "missed"))
+
+    results = []
+    try:
+        for nClients in args.clients:
+            result = runStep(servers, syncTimelineClock, nClients, args.rounds)
+            printResult(result)
+            results.append(result)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopTester(servers)
+
+    if args.jsonFilename is not None:
+        with open(args.jsonFilename, "w") as f:
+            json.dump({ "maxCiiConnections" : maxCiiConnections, "maxTsConnections" : maxTsConnections, "results" : results }, f, indent=1)
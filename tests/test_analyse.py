@@ -29,7 +29,7 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
 
 import unittest
 
-from analyse import correlate
+from analyse import compareChannel, correlate, DubiousInput
 
 
 class Test_DoComparison(unittest.TestCase):
@@ -258,5 +258,25 @@ class Test_DoComparison(unittest.TestCase):
     
     
 
+class Test_CompareChannel(unittest.TestCase):
+
+    def test_resultsInSeconds(self):
+        # sync timeline has 1000 ticks per second, starting at 5000 at the start of the video.
+        # flashes seen 20ms late, from the second one onwards
+        expected = [ 0.5, 1.1, 2.5, 3.0 ]
+        observed = [ (5000 + 1000 * t + 20, 1) for t in expected[1:] ]
+        matchIndex, expectedSecs, diffsAndErrors = compareChannel({ "observed" : observed, "expected" : expected }, 5000, 1000)
+        self.assertEqual(matchIndex, 1)
+        self.assertEqual(expectedSecs, expected)
+        for diff, err in diffsAndErrors:
+            self.assertAlmostEqual(diff, -0.020)
+            self.assertAlmostEqual(err, 0.001)
+
+    def test_poorOrNoData(self):
+        tooMany = [ (0, 1), (1000, 1), (2000, 1) ]
+        self.assertRaises(DubiousInput, compareChannel, { "observed" : tooMany, "expected" : [ 0.0, 1.0 ] }, 0, 1000)
+        self.assertRaises(DubiousInput, compareChannel, { "observed" : [], "expected" : [ 0.0, 1.0 ] }, 0, 1000)
+
+
 if __name__ == "__main__":
     unittest.main()
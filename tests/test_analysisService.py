@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+Unit-tests for the analysis service, run on session files captured from the emulated Arduino.
+The HTTP endpoints are not tested, as they need cherrypy.
+"""
+
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import analysisService
+from analysisService import AnalysisService, MetadataCache, QueueFull
+from arduinoEmulator import ArduinoEmulator, EmulatorSocketServer
+from measurer import Measurer
+
+
+def _irregularTimes(n):
+    # irregular intervals of 150 to 400 ms, so there is a unique best match
+    rand = random.Random(0)
+    t = 0.0
+    times = []
+    for i in range(0, n):
+        t += rand.uniform(0.15, 0.4)
+        times.append(round(t, 3))
+    return times
+
+METADATA = {
+    "durationSecs" : 60,
+    "eventCentreTimes" : [ t for t in _irregularTimes(300) if t < 59.9 ],
+    "approxBeepDurationSecs" : 0.06,
+    "approxFlashDurationSecs" : 0.06,
+}
+
+
+class NanosClock(object):
+    """Pretends to be a dvbcss clock object, with nanosecond ticks"""
+    @property
+    def ticks(self):
+        return int(time.time() * 1000000000)
+
+
+class DummyController(object):
+    pass
+
+
+def _writeMetadata(filename, metadata):
+    with open(filename, "w") as f:
+        json.dump(metadata, f)
+
+
+class Test_MetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for name in [ "a.json", "b.json", "c.json" ]:
+            _writeMetadata(os.path.join(self.dir, name), METADATA)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_cached(self):
+        cache = MetadataCache(self.dir)
+        first = cache.get("a.json")
+        self.assertEqual(first["eventCentreTimes"], METADATA["eventCentreTimes"])
+        self.assertIs(cache.get("a.json"), first)
+        self.assertEqual(cache.snapshot(), { "entries" : 1, "maxEntries" : analysisService.DEFAULT_MAX_CACHED_METADATA, "hits" : 1, "misses" : 1 })
+
+    def test_leastRecentlyUsedDiscarded(self):
+        cache = MetadataCache(self.dir, maxEntries=2)
+        cache.get("a.json")
+        cache.get("b.json")
+        cache.get("a.json")
+        cache.get("c.json")
+        cache.get("a.json")
+        self.assertEqual(cache.snapshot()["misses"], 3)
+        cache.get("b.json")
+        self.assertEqual(cache.snapshot()["misses"], 4)
+
+    def test_reloadedWhenChanged(self):
+        cache = MetadataCache(self.dir)
+        cache.get("a.json")
+        filename = os.path.join(self.dir, "a.json")
+        _writeMetadata(filename, dict(METADATA, eventCentreTimes=[ 1.0, 2.0 ]))
+        os.utime(filename, (time.time() + 10, time.time() + 10))
+        self.assertEqual(cache.get("a.json")["eventCentreTimes"], [ 1.0, 2.0 ])
+
+    def test_invalidNames(self):
+        cache = MetadataCache(self.dir)
+        for name in [ "missing.json", "../a.json", "", ".hidden" ]:
+            self.assertRaises(ValueError, cache.get, name)
+        self.assertRaises(ValueError, MetadataCache(None).get, "a.json")
+
+
+class Test_AnalysisService(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+        emulator = ArduinoEmulator({ 0 : METADATA, 1 : METADATA }, offsetSecs=0.020, seed=1)
+        server = EmulatorSocketServer(emulator)
+        server.start()
+        try:
+            pins = [ "LIGHT_0", "AUDIO_0" ]
+            expected = dict((pin, METADATA["eventCentreTimes"]) for pin in pins)
+            durations = dict((pin, 0.06) for pin in pins)
+            measurer = Measurer("client", pins, expected, durations, 0, NanosClock(), None, 1000, 1000, 1000, 1, arduinoUrl=server.url)
+            measurer.setSyncTimeLinelockController(DummyController())
+            # sync timeline counts milliseconds since the emulated device started playing
+            videoStartNanos = int(emulator.videoStartTime * 1000000000)
+            measurer.timestampedReceivedControlTimeStamps.append( (videoStartNanos, (videoStartNanos, 0, 1.0)) )
+            measurer.capture()
+            measurer.session.close()
+        finally:
+            server.stop()
+
+        filename = os.path.join(cls.dir, "session.zip")
+        measurer.saveSession(filename, 1000000)
+        with open(filename, "rb") as f:
+            cls.sessionData = f.read()
+        cls.metadataDir = os.path.join(cls.dir, "metadata")
+        os.mkdir(cls.metadataDir)
+        _writeMetadata(os.path.join(cls.metadataDir, "sequence.json"), METADATA)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir)
+
+    def test_analysedByWorkerProcess(self):
+        service = AnalysisService(workers=1, metadataDir=self.metadataDir)
+        try:
+            job = service.submit(self.sessionData, toleranceSecs=0.01)
+            self.assertEqual(job["status"], "queued")
+            job = service.wait(job["id"], timeoutSecs=60)
+        finally:
+            service.close()
+
+        self.assertEqual(job["status"], "done", job["error"])
+        self.assertLessEqual(job["submitted"], job["started"])
+        self.assertLessEqual(job["started"], job["finished"])
+        result = job["result"]
+        self.assertEqual([ channel["pinName"] for channel in result["channels"] ], [ "LIGHT_0", "AUDIO_0" ])
+        for channel in result["channels"]:
+            self.assertAlmostEqual(channel["meanOffsetSecs"], 0.020, delta=0.003)
+            self.assertEqual(len(channel["observed"]), channel["count"])
+            self.assertIn("matchIndex", channel)
+        self.assertFalse(result["passed"])
+        self.assertEqual(service.status()["done"], 1)
+
+    def test_metadataFromDirectory(self):
+        service = AnalysisService(workers=0, metadataDir=self.metadataDir)
+        try:
+            jobs = [ service.submit(self.sessionData, { "LIGHT_0" : "sequence.json" }) for i in range(0, 2) ]
+            jobs = [ service.wait(job["id"], timeoutSecs=60) for job in jobs ]
+            self.assertRaises(ValueError, service.submit, self.sessionData, { "LIGHT_0" : "missing.json" })
+            status = service.status()
+        finally:
+            service.close()
+
+        for job in jobs:
+            self.assertEqual(job["status"], "done", job["error"])
+            self.assertEqual(job["metadata"], { "LIGHT_0" : "sequence.json" })
+            self.assertIsNone(job["result"]["passed"])
+        self.assertEqual((status["metadataCache"]["misses"], status["metadataCache"]["hits"]), (1, 1))
+
+    def test_failedJob(self):
+        service = AnalysisService(workers=0)
+        try:
+            job = service.wait(service.submit(b"not a session file")["id"], timeoutSecs=60)
+        finally:
+            service.close()
+        self.assertEqual(job["status"], "failed")
+        self.assertIn("BadZipFile", job["error"])
+
+    def test_queueBounded(self):
+        release = threading.Event()
+        def blockingAnalysis(*args):
+            release.wait()
+            return { "channels" : [], "passed" : None }
+
+        saved = analysisService.analyseSessionFile
+        analysisService.analyseSessionFile = blockingAnalysis
+        service = AnalysisService(workers=0, maxQueued=2, maxFinishedJobs=2)
+        try:
+            running = service.submit(self.sessionData)
+            while service.job(running["id"])["status"] != "running":
+                time.sleep(0.01)
+            queued = [ service.submit(self.sessionData) for i in range(0, 2) ]
+            self.assertRaises(QueueFull, service.submit, self.sessionData)
+            status = service.status()
+            self.assertEqual((status["running"], status["queued"], status["refused"]), (1, 2, 1))
+
+            release.set()
+            service.wait(queued[-1]["id"], timeoutSecs=10)
+        finally:
+            analysisService.analyseSessionFile = saved
+            service.close()
+
+        # only the most recently finished jobs are kept
+        self.assertIsNone(service.job(running["id"]))
+        self.assertEqual([ job["id"] for job in service.jobs() ], [ job["id"] for job in queued ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -52,5 +52,163 @@ class TestArduinoPython3Compatibility(unittest.TestCase):
         self.assertIn("timing reference-point calibration", result.stdout)
 
 
+class Mock_Serial(object):
+    """Pretends to be an Arduino that answers each command with a scripted micros() value"""
+
+    def __init__(self, arduinoMicros):
+        self.arduinoMicros = list(arduinoMicros)
+        self.written = b""
+        self.pending = b""
+
+    def write(self, data):
+        self.written += data
+        v = self.arduinoMicros.pop(0)
+        self.pending += bytes([(v >> 24) & 0xff, (v >> 16) & 0xff, (v >> 8) & 0xff, v & 0xff])
+
+    def read(self, n):
+        data, self.pending = self.pending[:n], self.pending[n:]
+        return data
+
+
+class Mock_Clock(object):
+    """Clock whose ticks property returns scripted values"""
+
+    def __init__(self, ticks):
+        self._ticks = list(ticks)
+
+    @property
+    def ticks(self):
+        return self._ticks.pop(0)
+
+
+class TestSyncBurst(unittest.TestCase):
+
+    def test_picksLowestRoundTrip(self):
+        import arduino
+        f = Mock_Serial([10, 20, 30])
+        #                     t1    t4    t1    t4    t1    t4
+        clock = Mock_Clock([ 1000, 1900, 2000, 2300, 3000, 3500 ])
+        best, rttStats = arduino.syncBurst(f, clock, 3)
+
+        self.assertEqual(f.written, b"TTT")
+        self.assertEqual(best, [2000, 20000, 20000, 2300])
+        self.assertEqual(rttStats["count"], 3)
+        self.assertEqual(rttStats["min"], 300)
+        self.assertEqual(rttStats["max"], 900)
+        self.assertAlmostEqual(rttStats["mean"], 1700/3.0)
+
+    def test_needsAtLeastOneRoundTrip(self):
+        import arduino
+        self.assertRaises(ValueError, arduino.syncBurst, Mock_Serial([]), Mock_Clock([]), 0)
+
+    def test_lowestRoundTripKeepsFirstOfEqualBest(self):
+        import arduino
+        timeDatas = [ [0, 5, 5, 400], [1000, 1005, 1005, 1200], [2000, 2005, 2005, 2200] ]
+        best, rttStats = arduino.lowestRoundTrip(timeDatas)
+
+        self.assertIs(best, timeDatas[1])
+        self.assertEqual(rttStats, { "count" : 3, "min" : 200, "mean" : 800/3.0, "max" : 400 })
+
+    def test_alignWrap(self):
+        import arduino
+        WRAP = 1000 * 2**32
+        self.assertEqual(arduino.alignWrap([1, 5000, 5000, 2], [0, WRAP + 1000, WRAP + 1000, 0]), [1, WRAP + 5000, WRAP + 5000, 2])
+        self.assertEqual(arduino.alignWrap([1, 5000, 5000, 2], [0, 1000, 1000, 0]), [1, 5000, 5000, 2])
+
+
+class Counting_Clock(object):
+    """Clock with ticks in microseconds, that counts how many times it is read"""
+
+    tickRate = 1000000
+
+    def __init__(self):
+        self.reads = 0
+
+    @property
+    def ticks(self):
+        import time
+        self.reads += 1
+        return time.perf_counter_ns() // 1000
+
+
+class TestPerfCounterTimestamps(unittest.TestCase):
+
+    def test_perfCounterToTicks(self):
+        import arduino
+        self.assertEqual(arduino.perfCounterToTicks(1500, (1000, 20000, 1000000000)), 20500)
+        self.assertEqual(arduino.perfCounterToTicks(500, (1000, 20000, 1000000000)), 19500)
+        self.assertEqual(arduino.perfCounterToTicks(3001000, (1000, 20000, 1000000)), 23000)
+
+    def test_correlation(self):
+        import arduino
+        clock = Counting_Clock()
+        perfNanos, ticks, tickRate = arduino.correlatePerfCounter(clock)
+        self.assertEqual(clock.reads, arduino.PERF_COUNTER_CORRELATION_ATTEMPTS)
+        self.assertEqual(tickRate, 1000000)
+        self.assertAlmostEqual(ticks, perfNanos // 1000, delta=1000)
+
+    def test_nanosecondTicksAssumed(self):
+        import arduino
+        self.assertEqual(arduino.correlatePerfCounter(Mock_Clock([5] * 3))[1:], (5, 1000000000))
+
+    def test_syncBurstReadsClockOnlyAfterwards(self):
+        import arduino
+        f = Mock_Serial([10, 20, 30, 40])
+        clock = Counting_Clock()
+        best, rttStats = arduino.syncBurst(f, clock, 4, perfCounter=True)
+
+        self.assertEqual(f.written, b"TTTT")
+        self.assertEqual(clock.reads, arduino.PERF_COUNTER_CORRELATION_ATTEMPTS)
+        self.assertIn(best[1], [10000, 20000, 30000, 40000])
+        self.assertLessEqual(best[0], best[3])
+        self.assertEqual(rttStats["count"], 4)
+
+    def test_roundTripConvertedToTicks(self):
+        import arduino
+        clock = Counting_Clock()
+        before = clock.ticks
+        timeData = arduino.writeCmdAndTimeRoundTrip(Mock_Serial([7]), clock, arduino.CMD_TIMEONLY, perfCounter=True)
+        after = clock.ticks
+        self.assertEqual(timeData[1:3], [7000, 7000])
+        self.assertTrue(before - 1 <= timeData[0] <= timeData[3] <= after + 1)
+
+
+class TestRleDecode(unittest.TestCase):
+
+    def test_repeatsAndLiterals(self):
+        import arduino
+        #          repeat 3x      literal 2 blocks
+        encoded = bytes([0x82, 1, 2, 0x01, 3, 4, 5, 6])
+        self.assertEqual(arduino.rleDecode(encoded, 2), bytes([1, 2, 1, 2, 1, 2, 3, 4, 5, 6]))
+
+    def test_empty(self):
+        import arduino
+        self.assertEqual(arduino.rleDecode(b"", 4), b"")
+
+    def test_truncated(self):
+        import arduino
+        self.assertRaises(ValueError, arduino.rleDecode, bytes([0x01, 3, 4, 5]), 2)
+
+    def test_roundTripsWithEmulatorEncoder(self):
+        import random
+        import arduino
+        from arduinoEmulator import rleEncode
+        rand = random.Random(0)
+        for blkSize in [2, 4, 8]:
+            # long constant stretches, short bursts of varying samples
+            data = bytearray()
+            while len(data) < 20000 * blkSize:
+                if rand.random() < 0.5:
+                    data += bytes([rand.randrange(256) for i in range(0, blkSize)]) * rand.randrange(1, 400)
+                else:
+                    data += bytes([rand.randrange(256) for i in range(0, blkSize * rand.randrange(1, 300))])
+            encoded = rleEncode(data, blkSize)
+            self.assertEqual(arduino.rleDecode(encoded, blkSize), bytes(data))
+
+    def test_compressesConstantData(self):
+        from arduinoEmulator import rleEncode
+        self.assertEqual(len(rleEncode(bytes([20, 20]) * 1000, 2)), 8 * 3)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
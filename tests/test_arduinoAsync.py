@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+Unit-tests for the asyncio Arduino client, run against emulated Arduinos.
+"""
+
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import arduino
+from arduinoAsync import AsyncArduino
+from arduinoEmulator import ArduinoEmulator, EmulatorSocketServer
+
+
+METADATA = {
+    "durationSecs" : 10,
+    "eventCentreTimes" : [ 0.5 * i for i in range(1, 20) ],
+    "approxBeepDurationSecs" : 0.06,
+    "approxFlashDurationSecs" : 0.06,
+}
+
+
+class NanosClock(object):
+    """Pretends to be a dvbcss clock object, with nanosecond ticks"""
+    @property
+    def ticks(self):
+        return int(time.time() * 1000000000)
+
+
+class Test_AsyncArduino(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = []
+        for i in range(0, 2):
+            server = EmulatorSocketServer(ArduinoEmulator({ 0 : METADATA, 1 : METADATA }, seed=i))
+            server.start()
+            self.servers.append(server)
+        self.clock = NanosClock()
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    async def _measure(self, url):
+        device = await AsyncArduino.connect(url)
+        try:
+            await device.samplePinDuringCapture(0, self.clock)
+            await device.samplePinDuringCapture(1, self.clock)
+            nActivePorts, nMilliBlocks, timeData = await device.prepareToCapture(self.clock, 1)
+            self.assertEqual((nActivePorts, nMilliBlocks), (2, 1000))
+
+            best, rttStats = await device.syncBurst(self.clock, 3)
+            self.assertEqual(rttStats["count"], 3)
+            self.assertEqual(rttStats["min"], best[3] - best[0])
+
+            acStart, acEnd, n, timeDataPre, timeDataPost = await device.capture(self.clock)
+            self.assertEqual(n, 1000)
+            self.assertAlmostEqual(acEnd - acStart, 1000000000, delta=5000000)
+
+            samples, timeData = await device.bulkTransfer(self.clock)
+            self.assertEqual(len(samples), nActivePorts * nMilliBlocks * 2)
+        finally:
+            device.close()
+
+    def test_concurrentCaptures(self):
+        async def main():
+            await asyncio.gather(*[ self._measure(server.url) for server in self.servers ])
+
+        start = time.time()
+        asyncio.run(main())
+        duration = time.time() - start
+
+        # each capture takes 1 second; run concurrently they should overlap
+        self.assertLess(duration, 1.8)
+
+    def test_runLengthEncodedTransfer(self):
+        async def main():
+            device = await AsyncArduino.connect(self.servers[0].url)
+            try:
+                encoding, timeData = await device.setTransferEncoding(self.clock, arduino.ENCODING_RLE)
+                self.assertEqual(encoding, arduino.ENCODING_RLE)
+                await device.samplePinDuringCapture(0, self.clock)
+                nActivePorts, nMilliBlocks, timeData = await device.prepareToCapture(self.clock, 1)
+                await device.capture(self.clock)
+                samples, timeData = await device.bulkTransfer(self.clock, encoding)
+                # decoded back to the raw format
+                self.assertEqual(len(samples), nActivePorts * nMilliBlocks * 2)
+            finally:
+                device.close()
+
+        asyncio.run(main())
+
+    def test_syncBurstRejectsZeroCount(self):
+        async def main():
+            device = await AsyncArduino.connect(self.servers[0].url)
+            try:
+                with self.assertRaises(ValueError):
+                    await device.syncBurst(self.clock, 0)
+            finally:
+                device.close()
+
+        asyncio.run(main())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+Unit-tests for the software emulation of the Arduino, including running it
+end-to-end through capture, detection and analysis.
+"""
+
+import os
+import random
+import sys
+import time
+import unittest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import analyse
+import arduino
+import detect
+import measurer
+from arduinoEmulator import ArduinoEmulator, EmulatorSocketServer, synthesiseSamples
+
+
+def _irregularTimes(n):
+    # irregular intervals of 150 to 400 ms, so there is a unique best match
+    rand = random.Random(0)
+    t = 0.0
+    times = []
+    for i in range(0, n):
+        t += rand.uniform(0.15, 0.4)
+        times.append(round(t, 3))
+    return times
+
+# flashes/beeps each lasting 60 ms
+METADATA = {
+    "durationSecs" : 60,
+    "eventCentreTimes" : [ t for t in _irregularTimes(300) if t < 59.9 ],
+    "approxBeepDurationSecs" : 0.06,
+    "approxFlashDurationSecs" : 0.06,
+}
+
+
+class NanosClock(object):
+    """Pretends to be a dvbcss clock object, with nanosecond ticks"""
+    @property
+    def ticks(self):
+        return int(time.time() * 1000000000)
+
+
+class Test_synthesiseSamples(unittest.TestCase):
+
+    def test_flash(self):
+        metadata = { "eventCentreTimes" : [ 0.0105 ], "approxFlashDurationSecs" : 0.003 }
+        hi, lo = synthesiseSamples(metadata, False, [ 0.001 * i for i in range(0, 15) ])
+        # flash covers 9.0ms to 12.0ms
+        self.assertEqual(hi[8:13], [20, 220, 220, 220, 20])
+        self.assertEqual(lo[8:13], [20, 220, 220, 220, 20])
+
+    def test_earlyBeep(self):
+        metadata = { "eventCentreTimes" : [ 0.0105 ], "approxBeepDurationSecs" : 0.003 }
+        hi, lo = synthesiseSamples(metadata, True, [ 0.001 * i for i in range(0, 15) ], offsetSecs=0.002)
+        self.assertEqual(hi[6:11], [128, 228, 228, 228, 128])
+        self.assertEqual(lo[6:11], [128, 28, 28, 28, 128])
+
+    def test_partialCoverage(self):
+        metadata = { "eventCentreTimes" : [ 0.0100 ], "approxFlashDurationSecs" : 0.003 }
+        hi, lo = synthesiseSamples(metadata, False, [ 0.001 * i for i in range(0, 15) ])
+        self.assertEqual(hi[8:13], [220, 220, 220, 220, 20])
+        self.assertEqual(lo[8:13], [20, 220, 220, 20, 20])
+
+
+class Test_ArduinoEmulator(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = ArduinoEmulator({ 0 : METADATA, 1 : METADATA }, offsetSecs=0.020, seed=1)
+        self.server = EmulatorSocketServer(self.emulator)
+        self.server.start()
+        self.f = arduino.connect(self.server.url)
+        self.clock = NanosClock()
+
+    def tearDown(self):
+        self.f.close()
+        self.server.stop()
+
+    def test_prepareRejectsTooLongCapture(self):
+        for pin in [0, 1, 2, 3]:
+            arduino.samplePinDuringCapture(self.f, pin, self.clock)
+        nActivePorts, nMilliBlocks, timeData = arduino.prepareToCapture(self.f, self.clock, 20)
+        self.assertEqual((nActivePorts, nMilliBlocks), (0, 0))
+
+    def test_endToEnd(self):
+        pinsToMeasure = [ "LIGHT_0", "AUDIO_0" ]
+        pinMap = { "LIGHT_0": 0, "AUDIO_0": 1, "LIGHT_1": 2, "AUDIO_1": 3 }
+        for pin in pinsToMeasure:
+            arduino.samplePinDuringCapture(self.f, pinMap[pin], self.clock)
+        nActivePorts, nMilliBlocks, timeData = arduino.prepareToCapture(self.f, self.clock, 1)
+        self.assertEqual((nActivePorts, nMilliBlocks), (2, 1000))
+
+        burstPre, rttStats = arduino.syncBurst(self.f, self.clock, 3)
+        channels, acStart, acEnd, timeDataPre, timeDataPost = \
+            measurer.captureAndPackageIntoChannels(self.f, pinsToMeasure, pinMap, self.clock)
+        self.assertEqual(len(channels[0]["max"]), 1000)
+        self.assertEqual(len(channels[1]["min"]), 1000)
+        self.assertEqual(channels[2], None)
+
+        # sync timeline counts milliseconds since the emulated device started playing
+        videoStartNanos = int(self.emulator.videoStartTime * 1000000000)
+        wcSyncTimeCorrelations = [ (videoStartNanos, (videoStartNanos, 0, 1.0)) ]
+        detector = detect.BeepFlashDetector({ "pre" : [burstPre, timeDataPre], "post" : timeDataPost }, 1000,
+                                            wcSyncTimeCorrelations, lambda wc : 0, 1000, 1000)
+
+        for channel in channels[0:2]:
+            channel["eventDuration"] = 0.06
+        for result in analyse.runDetection(detector, channels[0:2], acStart, acEnd):
+            self.assertGreaterEqual(len(result["observed"]), 3)
+            matchIndex, expected, diffsAndErrors = analyse.doComparison((result["observed"], METADATA["eventCentreTimes"]), 0, 1000)
+            for diff, err in diffsAndErrors:
+                # device was 20 ms early
+                self.assertAlmostEqual(diff, 20, delta=2 + err)
+
+        # after a bulk transfer, the emulator clears down the enabled pins, just like the real thing
+        nActivePorts, nMilliBlocks, timeData = arduino.prepareToCapture(self.f, self.clock, 1)
+        self.assertEqual(nActivePorts, 0)
+
+    def test_compressedTransfer(self):
+        self.assertEqual(arduino.setTransferEncoding(self.f, self.clock, 7)[0], arduino.ENCODING_RAW)
+        self.assertEqual(arduino.setTransferEncoding(self.f, self.clock, arduino.ENCODING_RLE)[0], arduino.ENCODING_RLE)
+
+        arduino.samplePinDuringCapture(self.f, 0, self.clock)
+        arduino.samplePinDuringCapture(self.f, 3, self.clock)
+        arduino.prepareToCapture(self.f, self.clock, 1)
+        arduino.capture(self.f, self.clock)
+        samples, timeData = arduino.bulkTransfer(self.f, self.clock, arduino.ENCODING_RLE)
+        self.assertEqual(len(samples), 1000 * 2 * 2)
+        # light sensor 0 sees flashes. audio input 1 hears silence
+        self.assertEqual(set(samples[0::4]), set([20, 220]))
+        self.assertEqual(set(samples[2::4]), set([128]))
+
+    def test_syncPingsDuringCapture(self):
+        arduino.samplePinDuringCapture(self.f, 0, self.clock)
+        nActivePorts, nMilliBlocks, timeData = arduino.prepareToCapture(self.f, self.clock, 2)
+        acStart, acEnd, n, timeDataPre, timeDataPost, timeDataMid = \
+            arduino.captureWithSyncPings(self.f, self.clock, nMilliBlocks, 0.4)
+        self.assertEqual(n, 2000)
+        self.assertEqual(len(timeDataMid), 3)
+        for t1, t2, t3, t4 in timeDataMid:
+            self.assertTrue(acStart < t2 < acEnd)
+            self.assertLessEqual(t1, t4)
+        # samples can still be retrieved as normal afterwards
+        samples, timeData = arduino.bulkTransfer(self.f, self.clock)
+        self.assertEqual(len(samples), 2000 * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
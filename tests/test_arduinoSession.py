@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+Unit-tests for long-lived Arduino sessions, run against the emulated Arduino.
+"""
+
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import arduino
+from arduinoEmulator import ArduinoEmulator, EmulatorSocketServer
+from arduinoSession import ArduinoSession
+
+
+class NanosClock(object):
+    """Pretends to be a dvbcss clock object, with nanosecond ticks"""
+    @property
+    def ticks(self):
+        return int(time.time() * 1000000000)
+
+
+class Test_ArduinoSession(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EmulatorSocketServer(ArduinoEmulator({}, seed=1))
+        self.server.start()
+        self.clock = NanosClock()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_pipelinedSetup(self):
+        session = ArduinoSession(self.server.url)
+        try:
+            nActivePorts, nMilliBlocks, timeDatas = session.setupCapture(self.clock, [0, 1, 3], 1)
+            self.assertEqual((nActivePorts, nMilliBlocks), (3, 1000))
+            self.assertEqual(len(timeDatas), 4)
+            for t1, t2, t3, t4 in timeDatas:
+                self.assertEqual(t1, timeDatas[0][0])
+                self.assertLessEqual(t1, t4)
+
+            # replies have all been consumed, so the arduino can be used as normal
+            acStart, acEnd, n, timeDataPre, timeDataPost = arduino.capture(session.f, self.clock)
+            self.assertEqual(n, 1000)
+            samples, timeData = arduino.bulkTransfer(session.f, self.clock)
+            self.assertEqual(len(samples), 3 * 1000 * 2)
+        finally:
+            session.close()
+
+    def test_portFoundOnlyOnce(self):
+        with mock.patch("arduino.findArduinoPort", return_value=self.server.url) as findArduinoPort:
+            session = ArduinoSession()
+            try:
+                for i in range(0, 3):
+                    self.assertEqual(session.setupCapture(self.clock, [0], 1)[0:2], (1, 1000))
+                    session.close()
+            finally:
+                session.close()
+            self.assertEqual(findArduinoPort.call_count, 1)
+
+    def test_reopensAfterReset(self):
+        with mock.patch("arduino.findArduinoPort", return_value=self.server.url) as findArduinoPort:
+            session = ArduinoSession(reopenDelaySecs=0)
+            try:
+                session.setupCapture(self.clock, [0], 1)
+
+                # port goes away under our feet, as it does when the arduino is reset
+                session.f.close()
+
+                self.assertEqual(session.setupCapture(self.clock, [0, 1], 1)[0:2], (2, 1000))
+            finally:
+                session.close()
+            self.assertEqual(findArduinoPort.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+Unit-tests for the synthetic captures and baseline checks used by benchmarkAnalysis.py.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import analyse
+import detect
+import benchmarkAnalysis
+from benchmarkAnalysis import compareWithBaseline, makeMetadata, runScenario, synthesiseCapture
+from measurer import PIN_MAP, repackageSamples
+
+
+class Test_synthesiseCapture(unittest.TestCase):
+
+    def test_metadataRepeatsShortPatterns(self):
+        metadata = makeMetadata(3, 30)
+        self.assertEqual(metadata["durationSecs"], 30)
+        self.assertLess(max(metadata["eventCentreTimes"]), 30)
+        # pattern repeats every 7 seconds
+        first  = [ t + 7 for t in metadata["eventCentreTimes"] if t < 7 ]
+        second = [ t for t in metadata["eventCentreTimes"] if 7 <= t < 14 ]
+        self.assertEqual(len(first), len(second))
+        for a, b in zip(first, second):
+            self.assertAlmostEqual(a, b)
+
+    def test_offsetRecovered(self):
+        # window long enough that the pattern does not repeat within the expected timings, so the match is unambiguous
+        scenario = { "name" : "test", "windowLen" : 7, "nPins" : 2, "captureSecs" : 10 }
+        capture = synthesiseCapture(scenario)
+        channels = [ c for c in repackageSamples(capture["pinNames"], PIN_MAP, capture["nMilliBlocks"], capture["samples"]) if c is not None ]
+        self.assertEqual([ c["pinName"] for c in channels ], [ "LIGHT_0", "AUDIO_0" ])
+
+        detector = detect.BeepFlashDetector(capture["wcAcReqResp"], benchmarkAnalysis.TICK_RATE, capture["wcSyncTimeCorrelations"], \
+                                            lambda wcTime : 0, 1000, 1000)
+        duration = capture["metadata"]["approxFlashDurationSecs"]
+        for channel in channels:
+            func = detector.samplesToBeepTimings if channel["isAudio"] else detector.samplesToFlashTimings
+            observed = func(channel["min"], channel["max"], capture["acStartNanos"], capture["acEndNanos"], duration)
+            self.assertGreater(len(observed), 10)
+            test = (observed, capture["metadata"]["eventCentreTimes"])
+            index, expected, diffsAndErrors = analyse.doComparison(test, capture["videoStartTicks"], benchmarkAnalysis.TICK_RATE)
+            # positive offset means the device is presenting early
+            for diff, err in diffsAndErrors:
+                self.assertAlmostEqual(diff / benchmarkAnalysis.TICK_RATE, benchmarkAnalysis.OFFSET_SECS, delta=0.002)
+
+    def test_runScenario(self):
+        result = runScenario({ "name" : "test", "windowLen" : 3, "nPins" : 1, "captureSecs" : 10 })
+        self.assertEqual(result["samples"], 10000)
+        self.assertEqual(sorted(result["stages"].keys()), \
+                         [ "beepFlashDetector", "correlate", "detectPulses", "repackageSamples", "timesForSamples" ])
+
+
+class Test_compareWithBaseline(unittest.TestCase):
+
+    def test_regressionsBeyondThreshold(self):
+        baseline = { "a" : { "stages" : { "correlate" : 1.0, "detectPulses" : 1.0, "quick" : 0.0001 } } }
+        results = {
+            "a" : { "stages" : { "correlate" : 1.2, "detectPulses" : 1.5, "quick" : 0.001, "new" : 5.0 } },
+            "b" : { "stages" : { "correlate" : 9.0 } },
+        }
+        regressions = compareWithBaseline(results, baseline, threshold=0.25)
+        self.assertEqual([ (r["scenario"], r["stage"]) for r in regressions ], [ ("a", "detectPulses") ])
+        self.assertAlmostEqual(regressions[0]["ratio"], 1.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
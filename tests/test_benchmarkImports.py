@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+Unit-tests for benchmarkImports.py, checking that the modules needed for analysis and for
+generating audio and metadata import without pyserial, pydvbcss, cherrypy or PIL, and
+without importing numpy until it is used.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+from benchmarkImports import BARE_MISSING, importModule, runModule
+
+
+class Test_imports(unittest.TestCase):
+
+    def test_analysisWithoutMeasuringLibraries(self):
+        for module in [ "analyse", "detect", "stats", "measurer", "headless", "resultsStore" ]:
+            timing = importModule(module, BARE_MISSING)
+            self.assertEqual(timing["loaded"], [], module)
+
+    def test_generationWithoutPIL(self):
+        for module in [ "audio", "eventTimingGen", "video", "generate" ]:
+            timing = importModule(module, BARE_MISSING)
+            self.assertEqual(timing["loaded"], [], module)
+
+    def test_missingModule(self):
+        self.assertRaises(RuntimeError, importModule, "noSuchModuleForBenchmarkTest")
+
+    def test_runModule(self):
+        result = runModule("stats", repeats=1)
+        self.assertIsNone(result["error"])
+        self.assertEqual(sorted(result["stages"].keys()), [ "import", "importBare" ])
+        self.assertGreater(result["stages"]["import"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+Unit-tests for bootstrap confidence intervals.
+"""
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+from bootstrap import bootstrap
+
+
+class Test_bootstrap(unittest.TestCase):
+
+    def setUp(self):
+        rand = random.Random(0)
+        self.diffsAndErrors = [ (rand.gauss(0.010, 0.004), 0.002) for i in range(0, 300) ]
+
+    def test_intervals(self):
+        result = bootstrap(self.diffsAndErrors, toleranceSecs=0.015, nResamples=2000, seed=1)
+        self.assertEqual(result["count"], 300)
+        self.assertEqual(result["nResamples"], 2000)
+
+        mean = result["meanOffsetSecs"]
+        self.assertLess(mean["lo"], mean["estimate"])
+        self.assertGreater(mean["hi"], mean["estimate"])
+        self.assertLess(mean["lo"], 0.010)
+        self.assertGreater(mean["hi"], 0.010)
+        # standard error of the mean is about 0.004/sqrt(300)
+        self.assertAlmostEqual(mean["hi"] - mean["lo"], 2 * 1.96 * 0.004 / 300**0.5, delta=0.0003)
+
+        self.assertEqual(sorted(result["offsetPercentilesSecs"].keys(), key=float), [ "5", "25", "50", "75", "95" ])
+        median = result["offsetPercentilesSecs"]["50"]
+        self.assertLessEqual(median["lo"], median["estimate"])
+        self.assertGreaterEqual(median["hi"], median["estimate"])
+
+        passRate = result["passRate"]
+        self.assertTrue(0.0 <= passRate["lo"] <= passRate["estimate"] <= passRate["hi"] <= 1.0)
+
+    def test_noTolerance(self):
+        self.assertEqual(bootstrap(self.diffsAndErrors, nResamples=100, seed=1)["passRate"], None)
+
+    def test_allPass(self):
+        passRate = bootstrap(self.diffsAndErrors, toleranceSecs=1.0, nResamples=100, seed=1)["passRate"]
+        self.assertEqual((passRate["estimate"], passRate["lo"], passRate["hi"]), (1.0, 1.0, 1.0))
+
+    def test_reproducibleAcrossProcesses(self):
+        single = bootstrap(self.diffsAndErrors, toleranceSecs=0.015, nResamples=2500, seed=7, batchSize=1000)
+        again = bootstrap(self.diffsAndErrors, toleranceSecs=0.015, nResamples=2500, seed=7, batchSize=1000)
+        pooled = bootstrap(self.diffsAndErrors, toleranceSecs=0.015, nResamples=2500, seed=7, batchSize=1000, processes=2)
+        other = bootstrap(self.diffsAndErrors, toleranceSecs=0.015, nResamples=2500, seed=8, batchSize=1000)
+        self.assertEqual(single, again)
+        self.assertEqual(single, pooled)
+        self.assertNotEqual(single["meanOffsetSecs"], other["meanOffsetSecs"])
+
+    def test_noObservations(self):
+        self.assertRaises(ValueError, bootstrap, [])
+
+    def test_noResamples(self):
+        diffsAndErrors = [ (0.010, 0.001) ] * 10
+        self.assertRaises(ValueError, bootstrap, diffsAndErrors, nResamples=0)
+        self.assertRaises(ValueError, bootstrap, diffsAndErrors, nResamples=10, batchSize=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -33,12 +33,15 @@ from detect import (
     BeepFlashDetector,
     ConvertAtoB,
     ErrorBoundInterpolator,
+    PiecewiseConvertAtoB,
+    PiecewiseErrorBoundInterpolator,
     TimelineReconstructor,
     calcAcWcCorrelationAndDispersion,
     calcBeepThresholds,
     calcFlashThresholds,
     detectPulses,
     minMaxDataToEnvelopeData,
+    selectLowestRttExchange,
     timesForSamples,
 )
 
@@ -67,6 +70,41 @@ class Test_ErrorBoundInterpolator(unittest.TestCase):
 
  
  
+class Test_PiecewiseConvertAtoB(unittest.TestCase):
+    def test_interpolatesBetweenNeighbours(self):
+        a2b = PiecewiseConvertAtoB( [ (200, 20), (100, 10), (300, 40) ] )
+        self.assertEqual(a2b(150), 15.0)
+        self.assertEqual(a2b(200), 20.0)
+        self.assertEqual(a2b(250), 30.0)
+        self.assertEqual(a2b(300), 40.0)
+
+    def test_extrapolatesFromEndSegments(self):
+        a2b = PiecewiseConvertAtoB( [ (100, 10), (200, 20), (300, 40) ] )
+        self.assertEqual(a2b(0), 0.0)
+        self.assertEqual(a2b(400), 60.0)
+
+    def test_duplicatePointsIgnored(self):
+        a2b = PiecewiseConvertAtoB( [ (100, 10), (100, 11), (200, 20) ] )
+        self.assertEqual(a2b(150), 15.0)
+        self.assertRaises(ValueError, PiecewiseConvertAtoB, [ (100, 10), (100, 11) ])
+
+
+
+class Test_PiecewiseErrorBoundInterpolator(unittest.TestCase):
+    def testInterpolate(self):
+        err = PiecewiseErrorBoundInterpolator( [ (100, 0.5), (200, 0.1), (300, 0.7) ] )
+        self.assertAlmostEqual(err(150), 0.3)
+        self.assertAlmostEqual(err(200), 0.1)
+        self.assertAlmostEqual(err(250), 0.4)
+        self.assertAlmostEqual(err(300), 0.7)
+
+    def testOutOfBounds(self):
+        err = PiecewiseErrorBoundInterpolator( [ (100, 0.5), (200, 0.1), (300, 0.7) ] )
+        self.assertRaises(ValueError, err, 99)
+        self.assertRaises(ValueError, err, 301)
+
+ 
+ 
 class Test_calcAcWcCorrelationAndDispersion(unittest.TestCase):
     def testSimple(self):
         
@@ -85,6 +123,22 @@ class Test_calcAcWcCorrelationAndDispersion(unittest.TestCase):
 
 
 
+class Test_selectLowestRttExchange(unittest.TestCase):
+    def testSingleExchange(self):
+        self.assertEqual(selectLowestRttExchange((100, 1000, 1002, 140)), (100, 1000, 1002, 140))
+
+    def testPicksLowestRoundTrip(self):
+        exchanges = [
+            (100, 1000, 1000, 140),
+            (200, 1100, 1105, 215),
+            (300, 1200, 1200, 390),
+        ]
+        self.assertEqual(selectLowestRttExchange(exchanges), (200, 1100, 1105, 215))
+
+    def testEmpty(self):
+        self.assertRaises(ValueError, selectLowestRttExchange, [])
+
+
 class Test_TimelineReconstructor(unittest.TestCase):
     def testSimple(self):
         history = [
@@ -380,6 +434,19 @@ class Test_BeepFlashTimingDetector(unittest.TestCase):
         
         # check if error is equal to 1 pts tick + wcPrecision + acPrecision + acWcHalfRoundTrip + wcDispersion
         self.assertEqual(error, 1+(wcPrecisionNanos+acPrecisionNanos+144*US+0.5*1000000+0.5*1000000)*90000/1000000000)
+
+        # now add an exchange made during sampling, exactly when the beep happened, with no round trip time
+        # it agrees with the pre and post exchanges, so the time is the same, but the error bound is tighter
+        wcAcReqResp["mid"] = [ (205511000, 105500000, 105500000, 205511000) ]
+        detector = BeepFlashDetector(wcAcReqResp, syncTimelineTickRate, wcSyncTimeCorrelations, wcDispersions, wcPrecisionNanos, acPrecisionNanos)
+        beepTimings = detector.samplesToBeepTimings(loSamples, hiSamples, acStartNanos, acEndNanos, beepDurationSeconds)
+
+        self.assertEqual(len(beepTimings), 1)
+        self.assertAlmostEqual(beepTimings[0][0], 50495)
+        # the error is interpolated between the sample boundaries either side of the beep (at arduino times 105ms and 106ms)
+        # and, for each, interpolated between the "mid" exchange and the "pre" or "post" exchange
+        acWcHalfRoundTrip = ((144*US * 0.5/5.5) + (144*US * 0.5/6.5)) / 2
+        self.assertAlmostEqual(beepTimings[0][1], 1+(wcPrecisionNanos+acPrecisionNanos+acWcHalfRoundTrip+0.5*1000000+0.5*1000000)*90000/1000000000)
         
 
 
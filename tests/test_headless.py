@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+Unit-tests for running the testers headless.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import headless
+from headless import HeadlessRun, NotReady
+
+
+class Test_config(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, content):
+        filename = os.path.join(self.dir, name)
+        with open(filename, "w") as f:
+            f.write(content)
+        return filename
+
+    def test_defaultsFilledIn(self):
+        config = headless.loadConfig(self._write("c.json", json.dumps({ "settleSecs" : 2, "dispersion" : { "worstCaseMillis" : 1.5 } })))
+        self.assertEqual(config["settleSecs"], 2)
+        self.assertEqual(config["timeoutSecs"], headless.DEFAULTS["timeoutSecs"])
+        self.assertEqual(headless.dispersionFromConfig(config), 1500000)
+
+    def test_rejectsUnknownKeys(self):
+        self.assertRaises(ValueError, headless.loadConfig, self._write("c.json", json.dumps({ "timeout" : 2 })))
+
+    def test_rejectsBadDispersion(self):
+        self.assertRaises(ValueError, headless.loadConfig, self._write("c.json", json.dumps({ "dispersion" : 5 })))
+
+    def test_dispersionReadFromFile(self):
+        dispersionFile = self._write("disp.txt", "2.25\n")
+        config = headless.loadConfig(self._write("c.json", json.dumps({ "dispersion" : { "file" : dispersionFile } })))
+        self.assertEqual(headless.dispersionFromConfig(config), 2250000)
+
+    def test_noDispersion(self):
+        self.assertEqual(headless.dispersionFromConfig(dict(headless.DEFAULTS)), None)
+
+
+class Test_waitFor(unittest.TestCase):
+
+    def test_waitsForCondition(self):
+        config = dict(headless.DEFAULTS, pollSecs=0.01)
+        readyAt = time.time() + 0.1
+        headless.waitFor("ready", lambda : time.time() >= readyAt, config)
+        self.assertGreaterEqual(time.time(), readyAt)
+
+    def test_timesOut(self):
+        config = dict(headless.DEFAULTS, pollSecs=0.01, timeoutSecs=0.05)
+        self.assertRaises(NotReady, headless.waitFor, "never", lambda : False, config)
+
+
+class Test_HeadlessRun(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.resultFile = os.path.join(self.dir, "result.json")
+        self.config = dict(headless.DEFAULTS, resultFile=self.resultFile)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_resultWritten(self):
+        run = HeadlessRun("tv", self.config)
+        run.addChannelResult("LIGHT_0", 1, [0.0, 1.0, 2.0], [ (0.010, 0.001), (0.012, 0.001) ], 0.020)
+        run.addChannelResult("AUDIO_0", 0, [0.0, 1.0, 2.0], [ (0.030, 0.001) ], 0.020)
+        run.finish()
+
+        with open(self.resultFile) as f:
+            result = json.load(f)
+        self.assertEqual((result["tester"], result["status"]), ("tv", "ok"))
+        self.assertEqual([ channel["pinName"] for channel in result["channels"] ], [ "LIGHT_0", "AUDIO_0" ])
+        self.assertEqual(result["channels"][0]["firstExpectedSecs"], 1.0)
+        self.assertAlmostEqual(result["channels"][0]["meanOffsetSecs"], 0.011)
+        self.assertEqual([ channel["passed"] for channel in result["channels"] ], [ True, False ])
+        self.assertFalse(result["passed"])
+
+    def test_noToleranceTest(self):
+        run = HeadlessRun("csa", self.config)
+        run.addChannelResult("LIGHT_0", 0, [0.0], [ (0.010, 0.001) ])
+        self.assertEqual(run.finish()["passed"], None)
+
+    def test_unmeasurablePinFails(self):
+        run = HeadlessRun("csa", self.config)
+        run.addChannelResult("LIGHT_0", 0, [0.0], [ (0.010, 0.001) ], 0.020)
+        run.addChannelError("AUDIO_0", "Cannot reliably measure on pin")
+        self.assertFalse(run.finish()["passed"])
+
+    def test_unmeasurablePinWithoutToleranceTest(self):
+        run = HeadlessRun("csa", self.config)
+        run.addChannelError("LIGHT_0", "Cannot reliably measure on pin")
+        run.addChannelResult("AUDIO_0", 0, [0.0], [ (0.010, 0.001) ])
+        self.assertEqual(run.finish()["passed"], None)
+
+    def test_onlyPinUnmeasurable(self):
+        run = HeadlessRun("csa", self.config)
+        run.addChannelError("LIGHT_0", "Cannot reliably measure on pin", 0.020)
+        self.assertFalse(run.finish()["passed"])
+
+    def test_abort(self):
+        run = HeadlessRun("csa", self.config)
+        run.abort("Timed out")
+        result = run.finish()
+        self.assertEqual((result["status"], result["reason"]), ("aborted", "Timed out"))
+        self.assertLessEqual(result["started"], result["finished"])
+
+
+if __name__ == "__main__":
+    unittest.main()
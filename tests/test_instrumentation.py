@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+Unit-tests for instrumentation of the stages of a measurement.
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import analyse
+import arduino
+import instrumentation
+import stats
+from arduinoAsync import AsyncArduino
+from arduinoEmulator import ArduinoEmulator, EmulatorSocketServer
+from instrumentation import Recorder
+from measurer import PIN_MAP
+from streaming import ChannelSegmentAccumulator, streamCapture
+
+
+class NanosClock(object):
+    """Pretends to be a dvbcss clock object, with nanosecond ticks"""
+    @property
+    def ticks(self):
+        return int(time.time() * 1000000000)
+
+
+class Test_instrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        instrumentation.disable()
+        shutil.rmtree(self.dir)
+
+    def test_nothingRecordedWhenDisabled(self):
+        self.assertIsNone(instrumentation.current())
+        with instrumentation.span("test.stage") as s:
+            pass
+        self.assertIs(s, instrumentation.span("test.other"))
+        instrumentation.count("test.things", 5)
+
+        recorder = instrumentation.enable()
+        self.assertEqual(recorder.snapshot()["spans"], {})
+        self.assertEqual(recorder.snapshot()["counters"], {})
+
+    def test_spansAndCounters(self):
+        recorder = instrumentation.enable()
+        for i in range(0, 3):
+            with instrumentation.span("test.stage"):
+                pass
+        instrumentation.count("test.things", 5)
+        instrumentation.count("test.things")
+
+        snapshot = recorder.snapshot()
+        self.assertEqual(snapshot["spans"]["test.stage"]["count"], 3)
+        self.assertGreaterEqual(snapshot["spans"]["test.stage"]["maxSecs"], snapshot["spans"]["test.stage"]["minSecs"])
+        self.assertEqual(snapshot["counters"], { "test.things" : 6 })
+
+        self.assertIs(instrumentation.disable(), recorder)
+        instrumentation.count("test.things")
+        self.assertEqual(recorder.counters["test.things"], 6)
+
+    def test_spanRecordedWhenExceptionRaised(self):
+        recorder = instrumentation.enable()
+        try:
+            with instrumentation.span("test.stage"):
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(recorder.spans["test.stage"]["count"], 1)
+
+    def test_analysisInstrumented(self):
+        recorder = instrumentation.enable()
+        expected = [ 100, 200, 300, 400, 500 ]
+        observed = [ (301, 1), (401, 1) ]
+        analyse.correlate(expected, observed)
+        self.assertEqual(recorder.counters["analyse.offsetsScanned"], 4)
+        self.assertEqual(recorder.spans["analyse.correlate"]["count"], 1)
+
+    def test_statsInstrumented(self):
+        recorder = instrumentation.enable()
+        stats.computeStats(0, [ 0.0, 1.0 ], [ (0.010, 0.001), (0.012, 0.001) ])
+        self.assertEqual(recorder.spans["stats.computeStats"]["count"], 1)
+
+    def test_streamingInstrumented(self):
+        server = EmulatorSocketServer(ArduinoEmulator({}, seed=1))
+        server.start()
+        f = arduino.connect(server.url)
+        try:
+            recorder = instrumentation.enable()
+            streamCapture(f, NanosClock(), [ "LIGHT_0", "AUDIO_0" ], PIN_MAP, ChannelSegmentAccumulator(), nBlocks=3)
+        finally:
+            f.close()
+            server.stop()
+        self.assertEqual(recorder.spans["streaming.streamCapture"]["count"], 1)
+        # 3 blocks of 100 ms, 2 pins, 2 bytes per pin per ms
+        self.assertEqual(recorder.counters["arduino.bytesTransferred"], 3 * 100 * 2 * 2)
+
+    def test_asyncCaptureInstrumented(self):
+        server = EmulatorSocketServer(ArduinoEmulator({}, seed=1))
+        server.start()
+        clock = NanosClock()
+
+        async def measure():
+            device = await AsyncArduino.connect(server.url)
+            try:
+                await device.samplePinDuringCapture(0, clock)
+                await device.prepareToCapture(clock, 1)
+                await device.syncBurst(clock, 2)
+                await device.capture(clock)
+                await device.bulkTransfer(clock)
+            finally:
+                device.close()
+
+        try:
+            recorder = instrumentation.enable()
+            asyncio.run(measure())
+        finally:
+            server.stop()
+        for name in [ "arduino.syncBurst", "arduino.capture", "arduino.bulkTransfer" ]:
+            self.assertEqual(recorder.spans[name]["count"], 1)
+        self.assertEqual(recorder.counters["arduino.bytesTransferred"], 1000 * 2)
+
+    def test_writeJson(self):
+        recorder = Recorder()
+        recorder.addSpan("test.stage", 0.5)
+        recorder.count("test.things", 2)
+        filename = os.path.join(self.dir, "timings.json")
+        recorder.write(filename)
+        with open(filename) as f:
+            written = json.load(f)
+        self.assertEqual(written["spans"]["test.stage"], { "count" : 1, "totalSecs" : 0.5, "minSecs" : 0.5, "maxSecs" : 0.5 })
+        self.assertEqual(written["counters"], { "test.things" : 2 })
+
+    def test_writePrometheus(self):
+        recorder = Recorder()
+        recorder.addSpan("arduino.bulkTransfer", 0.25)
+        recorder.addSpan("arduino.bulkTransfer", 0.5)
+        recorder.count("arduino.bytesTransferred", 1024)
+        filename = os.path.join(self.dir, "timings.prom")
+        recorder.write(filename)
+        with open(filename) as f:
+            lines = f.read().splitlines()
+        self.assertIn("# TYPE dvbcss_synctiming_stage_seconds_total counter", lines)
+        self.assertIn("dvbcss_synctiming_stage_seconds_total{stage=\"arduino.bulkTransfer\"} 0.75", lines)
+        self.assertIn("dvbcss_synctiming_stage_calls_total{stage=\"arduino.bulkTransfer\"} 2", lines)
+        self.assertIn("dvbcss_synctiming_stage_max_seconds{stage=\"arduino.bulkTransfer\"} 0.5", lines)
+        self.assertIn("dvbcss_synctiming_arduino_bytes_transferred_total 1024", lines)
+        self.assertFalse(os.path.exists(filename + ".tmp"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+Unit-tests for lazy importing of libraries.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import lazyImport
+from lazyImport import LazyModule
+
+
+class Test_LazyModule(unittest.TestCase):
+
+    def test_importedOnFirstUse(self):
+        module = LazyModule("colorsys")
+        self.assertFalse(module.loaded)
+        self.assertEqual(module.rgb_to_hsv(1.0, 0.0, 0.0), (0.0, 1.0, 1.0))
+        self.assertTrue(module.loaded)
+        self.assertIs(module.load(), sys.modules["colorsys"])
+
+    def test_submodules(self):
+        module = LazyModule("xml", submodules=[ "xml.dom.minidom" ])
+        self.assertTrue(hasattr(module.dom.minidom, "parseString"))
+
+    def test_missing(self):
+        module = LazyModule("noSuchModuleForLazyImportTest", package="no-such-package")
+        with self.assertRaises(ImportError) as cm:
+            module.something
+        self.assertIn("pip install no-such-package", str(cm.exception))
+        self.assertFalse(module.loaded)
+
+    def test_missingAttribute(self):
+        self.assertRaises(AttributeError, getattr, LazyModule("colorsys"), "noSuchFunction")
+
+
+class Test_optional(unittest.TestCase):
+
+    def test_installed(self):
+        self.assertIsInstance(lazyImport.optional("colorsys"), LazyModule)
+        self.assertTrue(lazyImport.isInstalled("colorsys"))
+
+    def test_notInstalled(self):
+        self.assertIsNone(lazyImport.optional("noSuchModuleForLazyImportTest"))
+        self.assertFalse(lazyImport.isInstalled("noSuchModuleForLazyImportTest"))
+
+
+if __name__ == "__main__":
+    unittest.main()
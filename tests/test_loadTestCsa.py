@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+Unit-tests for the parts of loadTestCsa.py that do not need a running tester.
+The load test itself is not run, as it needs pydvbcss, cherrypy and ws4py.
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+from loadTestCsa import FanOutTimer, summariseLatencies
+
+
+class Test_summariseLatencies(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertIsNone(summariseLatencies([]))
+
+    def test_percentiles(self):
+        summary = summariseLatencies([ i / 1000.0 for i in range(1, 101) ])
+        self.assertEqual(summary["count"], 100)
+        self.assertAlmostEqual(summary["p50"], 0.0505)
+        self.assertAlmostEqual(summary["max"], 0.100)
+        self.assertLess(summary["p95"], summary["p99"])
+
+
+class Test_FanOutTimer(unittest.TestCase):
+
+    def test_allReceived(self):
+        fanOut = FanOutTimer()
+        fanOut.begin([ 0, 1, 2 ], 1.0)
+        for clientId in [ 2, 0, 1 ]:
+            threading.Timer(0.01, fanOut.received, args=(clientId, 1.0)).start()
+        self.assertEqual(fanOut.end(timeoutSecs=2.0), 0)
+        self.assertEqual(len(fanOut.latencies), 3)
+        self.assertTrue(all(0.005 < secs < 1.0 for secs in fanOut.latencies))
+
+    def test_missedAndStaleIgnored(self):
+        fanOut = FanOutTimer()
+        fanOut.begin([ 0, 1 ], 0.0)
+        fanOut.received(0, 1.0)   # from an earlier update
+        fanOut.received(0, 0.0)
+        fanOut.received(0, 0.0)   # only counted once
+        fanOut.received(5, 0.0)   # not a client being waited for
+        started = time.time()
+        self.assertEqual(fanOut.end(timeoutSecs=0.1), 1)
+        self.assertGreaterEqual(time.time() - started, 0.09)
+        self.assertEqual(len(fanOut.latencies), 1)
+        self.assertEqual(fanOut.missed, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+Unit-tests for measurement campaigns, run against the emulated Arduino, and for
+the buffering of received Control Timestamps.
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import arduino
+from arduinoEmulator import ArduinoEmulator, EmulatorSocketServer
+from detect import TimelineReconstructor
+from measurer import Campaign, ControlTimestampBuffer, Measurer, repackageSamples
+from resultsStore import StoredRun
+
+
+def _irregularTimes(n):
+    # irregular intervals of 150 to 400 ms, so there is a unique best match
+    rand = random.Random(0)
+    t = 0.0
+    times = []
+    for i in range(0, n):
+        t += rand.uniform(0.15, 0.4)
+        times.append(round(t, 3))
+    return times
+
+METADATA = {
+    "durationSecs" : 60,
+    "eventCentreTimes" : [ t for t in _irregularTimes(300) if t < 59.9 ],
+    "approxBeepDurationSecs" : 0.06,
+    "approxFlashDurationSecs" : 0.06,
+}
+
+
+class NanosClock(object):
+    """Pretends to be a dvbcss clock object, with nanosecond ticks"""
+    @property
+    def ticks(self):
+        return int(time.time() * 1000000000)
+
+
+class DummyController(object):
+    pass
+
+
+class Test_ControlTimestampBuffer(unittest.TestCase):
+
+    def test_keptSortedWhenOutOfOrder(self):
+        buffer = ControlTimestampBuffer()
+        for when in [ 100, 300, 200, 400, 300 ]:
+            buffer.append( (when, (when, when * 10, 1.0)) )
+        self.assertEqual(buffer.whens, [ 100, 200, 300, 300, 400 ])
+        self.assertEqual(list(buffer)[1], (200, (200, 2000, 1.0)))
+
+    def test_pruneKeepsMostRecentBefore(self):
+        buffer = ControlTimestampBuffer()
+        for when in range(100, 1100, 100):
+            buffer.append( (when, (when, 0, 1.0)) )
+        buffer.prune(550)
+        self.assertEqual(buffer.whens, [ 500, 600, 700, 800, 900, 1000 ])
+        buffer.prune(550)
+        self.assertEqual(len(buffer), 6)
+
+    def test_retentionBoundsHistory(self):
+        buffer = ControlTimestampBuffer(retentionNanos=1000)
+        for when in range(0, 100000, 100):
+            buffer.append( (when, (when, 0, 1.0)) )
+        # everything within the last 1000, plus the most recent one before that
+        self.assertEqual(buffer.whens[0], 99900 - 1100)
+        self.assertEqual(len(buffer), 12)
+
+    def test_windowConvertsAsWholeHistory(self):
+        history = [ (when, (when, when * 2 + (when // 700), 1.0)) for when in range(0, 10000, 350) ]
+        buffer = ControlTimestampBuffer()
+        for entry in history:
+            buffer.append(entry)
+        view = buffer.window(3000, 5000, marginNanos=500)
+        self.assertEqual(view.whens[0], 2450)
+        self.assertEqual(view.whens[-1], 5600)
+
+        whole = TimelineReconstructor(history, 1000000000, 1000000000, True)
+        windowed = TimelineReconstructor(view, 1000000000, 1000000000, True)
+        for at in range(2500, 5500, 37):
+            self.assertEqual(windowed(at), whole(at))
+
+
+class Test_Campaign(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = ArduinoEmulator({ 0 : METADATA, 1 : METADATA }, offsetSecs=0.020, seed=1)
+        self.server = EmulatorSocketServer(self.emulator)
+        self.server.start()
+        self.measurer = self.makeMeasurer()
+
+    def makeMeasurer(self, **kwargs):
+        pins = [ "LIGHT_0", "AUDIO_0" ]
+        expected = dict((pin, METADATA["eventCentreTimes"]) for pin in pins)
+        durations = dict((pin, 0.06) for pin in pins)
+        measurer = Measurer("client", pins, expected, durations, 0, NanosClock(), None, 1000, 1000, 1000, 1, arduinoUrl=self.server.url, **kwargs)
+        measurer.setSyncTimeLinelockController(DummyController())
+        # sync timeline counts milliseconds since the emulated device started playing
+        videoStartNanos = int(self.emulator.videoStartTime * 1000000000)
+        measurer.timestampedReceivedControlTimeStamps.append( (videoStartNanos, (videoStartNanos, 0, 1.0)) )
+        return measurer
+
+    def tearDown(self):
+        self.measurer.session.close()
+        self.server.stop()
+
+    def assertDeviceWas20msEarly(self, record):
+        self.assertEqual(record["status"], "ok")
+        for result in record["results"]:
+            self.assertGreaterEqual(len(result["diffsAndErrors"]), 3)
+            for diff, err in result["diffsAndErrors"]:
+                self.assertAlmostEqual(diff * 1000, 20, delta=2 + err * 1000)
+
+    def test_capturesOverlapAnalysis(self):
+        records = self.measurer.runCampaign(3, lambda wc : 0)
+
+        self.assertEqual([ record["index"] for record in records ], [0, 1, 2])
+        for record in records:
+            self.assertEqual(record["status"], "ok")
+            self.assertEqual([ result["pinName"] for result in record["results"] ], [ "LIGHT_0", "AUDIO_0" ])
+            for result in record["results"]:
+                self.assertGreaterEqual(len(result["diffsAndErrors"]), 3)
+                for diff, err in result["diffsAndErrors"]:
+                    self.assertAlmostEqual(diff * 1000, 20, delta=2 + err * 1000)
+
+        # each capture is analysed while the next one is being taken
+        for record, nextRecord in zip(records, records[1:]):
+            self.assertLess(record["processingStarted"], nextRecord["captureFinished"])
+
+    def test_activatePinReadingArmsAgain(self):
+        self.measurer.capture()
+        self.measurer.activatePinReading()
+        self.measurer.capture()
+        self.assertDeviceWas20msEarly({ "status" : "ok", "results" : self.measurer.compareCaptureData(self.measurer.takeCaptureData(), lambda wc : 0) })
+
+    def test_samplesRepackagedOnWorker(self):
+        threads = []
+        def recordingRepackageSamples(*args):
+            threads.append(threading.current_thread())
+            return repackageSamples(*args)
+
+        with mock.patch("measurer.repackageSamples", recordingRepackageSamples):
+            records = self.measurer.runCampaign(2, lambda wc : 0)
+
+        self.assertEqual([ record["status"] for record in records ], [ "ok", "ok" ])
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_transferEncodingSetAgainAfterReset(self):
+        self.measurer.session.close()
+        self.measurer = self.makeMeasurer(transferEncoding=arduino.ENCODING_RLE)
+        self.assertEqual(self.measurer.transferEncoding, arduino.ENCODING_RLE)
+        self.assertDeviceWas20msEarly(self.measurer.runCampaign(1, lambda wc : 0)[0])
+
+        # the arduino is reset between captures, forgetting the encoding, and the port goes away under our feet
+        self.emulator.reset()
+        self.measurer.session.f.close()
+
+        self.measurer.armCapture()
+        self.assertEqual(self.emulator.transferEncoding, arduino.ENCODING_RLE)
+        self.assertDeviceWas20msEarly(self.measurer.runCampaign(1, lambda wc : 0)[0])
+
+    def test_accumulateStats(self):
+        accumulators = self.measurer.accumulateStats(toleranceSecs=0.1)
+        records = self.measurer.runCampaign(2, lambda wc : 0)
+
+        self.assertEqual(sorted(accumulators.keys()), [ "AUDIO_0", "LIGHT_0" ])
+        for result in records[0]["results"]:
+            snapshot = accumulators[result["pinName"]].snapshot()
+            self.assertEqual(snapshot["captures"], 2)
+            self.assertEqual(snapshot["count"], sum(len(record["results"][0]["diffsAndErrors"]) for record in records))
+            self.assertAlmostEqual(snapshot["meanOffsetSecs"], 0.020, delta=0.003)
+            self.assertEqual(snapshot["numExceeded"], 0)
+
+    def test_recordResults(self):
+        storedRun = StoredRun(":memory:", "test", device="emulator", toleranceSecs=0.1)
+        self.measurer.recordResults(storedRun, 0.1)
+        self.measurer.runCampaign(2, lambda wc : 0)
+        storedRun.finish()
+
+        [ run ] = storedRun.store.runs()
+        self.assertEqual(run["status"], "ok")
+        self.assertTrue(run["passed"])
+        self.assertEqual(sorted(channel["pinName"] for channel in run["channels"]), [ "AUDIO_0", "AUDIO_0", "LIGHT_0", "LIGHT_0" ])
+        for channel in run["channels"]:
+            self.assertAlmostEqual(channel["meanOffsetSecs"], 0.020, delta=0.003)
+            self.assertEqual(len(storedRun.store.diffsAndErrors(channel["id"])), channel["count"])
+        storedRun.close()
+
+    def test_cancel(self):
+        def onResult(record):
+            campaign.cancel()
+        campaign = Campaign(self.measurer, 5, lambda wc : 0, onResult=onResult)
+        records = campaign.run()
+
+        # the second capture was already under way when the first had been analysed
+        self.assertEqual([ record["status"] for record in records ], [ "ok", "cancelled" ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+Unit-tests for profiling the stages of a run of the testers.
+"""
+
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import profiling
+from profiling import StageProfiler
+
+
+def _busy(n):
+    return sum(i * i for i in range(0, n))
+
+def _inner():
+    return _busy(20000)
+
+def _outer():
+    return _busy(20000)
+
+
+class Test_profiling(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        profiling.finish()
+        shutil.rmtree(self.dir)
+
+    def test_nothingWhenDisabled(self):
+        with profiling.stage("capture"):
+            _busy(10)
+        self.assertIsNone(profiling.finish())
+
+    def test_profilePerStage(self):
+        outDir = os.path.join(self.dir, "profiles")
+        profiling.enable(outDir, topN=5)
+        for i in range(0, 2):
+            with profiling.stage("capture"):
+                _outer()
+        with profiling.stage("detect"):
+            _inner()
+        summaryFilename = profiling.finish()
+
+        self.assertEqual(summaryFilename, os.path.join(outDir, "summary.txt"))
+        with open(summaryFilename) as f:
+            summary = f.read()
+        self.assertIn("Stage: capture", summary)
+        self.assertIn("Stage: detect", summary)
+        self.assertLess(summary.index("Stage: capture"), summary.index("Stage: detect"))
+
+        names = [ func[2] for func in pstats.Stats(os.path.join(outDir, "capture.prof")).stats ]
+        self.assertEqual(names.count("_outer"), 1)
+        self.assertNotIn("_inner", names)
+        ncalls = [ stat[1] for func, stat in pstats.Stats(os.path.join(outDir, "capture.prof")).stats.items() if func[2] == "_outer" ]
+        self.assertEqual(ncalls, [2])
+
+    def test_nestedStagePausesOuter(self):
+        profiler = StageProfiler(self.dir)
+        with profiler.stage("outer"):
+            _outer()
+            with profiler.stage("inner"):
+                _inner()
+        profiler.write()
+
+        outerNames = [ func[2] for func in pstats.Stats(profiler.profileFilename("outer")).stats ]
+        innerNames = [ func[2] for func in pstats.Stats(profiler.profileFilename("inner")).stats ]
+        self.assertIn("_outer", outerNames)
+        self.assertNotIn("_inner", outerNames)
+        self.assertIn("_inner", innerNames)
+        self.assertNotIn("_outer", innerNames)
+
+    def test_stageNamesMadeSafeForFilenames(self):
+        profiler = StageProfiler(self.dir)
+        self.assertEqual(profiler.profileFilename("pin LIGHT_0/compare"), os.path.join(self.dir, "pin_LIGHT_0_compare.prof"))
+
+
+if __name__ == "__main__":
+    unittest.main()
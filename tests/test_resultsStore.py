@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+Unit-tests for the SQLite results store.
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+from resultsStore import ResultsStore, StoredRun, packValues, unpackValues
+
+DAY = 86400.0
+START = 1700000000.0
+
+
+def _diffsAndErrors(rand, meanSecs, n=50):
+    return [ (rand.gauss(meanSecs, 0.002), 0.001) for i in range(0, n) ]
+
+
+class Test_packing(unittest.TestCase):
+
+    def test_roundTrip(self):
+        values = [ 0.0, -0.0125, 1e-9, 3.5 ]
+        self.assertEqual(len(packValues(values)), 8 * len(values))
+        self.assertEqual(unpackValues(packValues(values)), values)
+        self.assertEqual(unpackValues(packValues([])), [])
+
+
+class Test_ResultsStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ResultsStore(":memory:")
+        rand = random.Random(0)
+        self.allDiffs = {}
+        for day in range(0, 3):
+            for firmware, meanSecs in [ ("1.0", 0.010), ("2.0", 0.030) ]:
+                runId = self.store.addRun("tv", device="tv-1", firmware=firmware, rig="rig-a", content="seq", toleranceSecs=0.02, started=START + day * DAY + 3600)
+                diffsAndErrors = _diffsAndErrors(rand, meanSecs)
+                self.allDiffs.setdefault(firmware, []).extend(d for d,e in diffsAndErrors)
+                self.channelId = self.store.addChannelResult(runId, "LIGHT_0", 3, [ 0.5 * i for i in range(0, 60) ], diffsAndErrors, 0.02)
+                self.store.finishRun(runId, finished=START + day * DAY + 3700)
+        otherRun = self.store.addRun("tv", device="tv-2", firmware="1.0", content="seq", started=START)
+        self.store.addChannelError(otherRun, "AUDIO_0", "poor data or no data")
+        self.store.finishRun(otherRun)
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_trendByFirmware(self):
+        trend = self.store.trend("firmware", device="tv-1")
+        self.assertEqual([ row["group"] for row in trend ], [ "1.0", "2.0" ])
+        for row in trend:
+            diffs = self.allDiffs[row["group"]]
+            mean = sum(diffs) / len(diffs)
+            std = (sum((d - mean) ** 2 for d in diffs) / len(diffs)) ** 0.5
+            self.assertEqual(row["runs"], 3)
+            self.assertEqual(row["count"], len(diffs))
+            self.assertAlmostEqual(row["meanOffsetSecs"], mean, places=9)
+            self.assertAlmostEqual(row["stdDevSecs"], std, places=9)
+            self.assertEqual(row["minOffsetSecs"], min(diffs))
+            self.assertEqual(row["maxOffsetSecs"], max(diffs))
+        self.assertEqual(trend[0]["passRate"], 1.0)
+        self.assertEqual(trend[1]["passRate"], 0.0)
+
+    def test_trendFilters(self):
+        self.assertEqual(len(self.store.trend("day")), 3)
+        trend = self.store.trend("day", firmware="2.0", since=START + DAY, until=START + 3 * DAY)
+        self.assertEqual([ row["runs"] for row in trend ], [ 1, 1 ])
+        self.assertEqual(self.store.trend("pinName", device="tv-2"), [])
+        self.assertRaises(ValueError, self.store.trend, "colour")
+
+    def test_runs(self):
+        runs = self.store.runs(limit=2, device="tv-1")
+        self.assertEqual(len(runs), 2)
+        self.assertGreaterEqual(runs[0]["started"], runs[1]["started"])
+        self.assertEqual(runs[0]["channels"][0]["pinName"], "LIGHT_0")
+
+        [ run ] = self.store.runs(device="tv-2")
+        self.assertIsNone(run["passed"])
+        self.assertEqual(run["channels"][0]["error"], "poor data or no data")
+        self.assertIsNone(run["channels"][0]["count"])
+
+    def test_diffsAndErrors(self):
+        diffsAndErrors = self.store.diffsAndErrors(self.channelId)
+        self.assertEqual(len(diffsAndErrors), 50)
+        self.assertEqual(diffsAndErrors[-1][0], self.allDiffs["2.0"][-1])
+        self.assertIsNone(self.store.diffsAndErrors(-1))
+
+
+class Test_StoredRun(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpDir, "results.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_abortedIfNotFinished(self):
+        run = StoredRun(self.filename, "csa", device="csa-1", toleranceSecs=0.02)
+        run.addChannelResult("LIGHT_0", 0, [ 0.0, 1.0 ], [ (0.001, 0.001), (0.002, 0.001) ], 0.02)
+        run.close()
+
+        store = ResultsStore(self.filename)
+        [ record ] = store.runs()
+        store.close()
+        self.assertEqual(record["status"], "aborted")
+        self.assertEqual(record["reason"], "Did not complete")
+        self.assertFalse(record["passed"])
+
+
+if __name__ == "__main__":
+    unittest.main()
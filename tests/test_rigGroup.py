@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+Unit-tests for capturing from several (emulated) Arduinos at once.
+"""
+
+import os
+import random
+import sys
+import time
+import unittest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import arduino
+from arduinoEmulator import ArduinoEmulator, EmulatorSocketServer
+from rigGroup import RigGroupMeasurer, namespacedPinName, splitPinName
+
+
+def _irregularTimes(n):
+    # irregular intervals of 150 to 400 ms, so there is a unique best match
+    rand = random.Random(0)
+    t = 0.0
+    times = []
+    for i in range(0, n):
+        t += rand.uniform(0.15, 0.4)
+        times.append(round(t, 3))
+    return times
+
+METADATA = {
+    "durationSecs" : 60,
+    "eventCentreTimes" : [ t for t in _irregularTimes(300) if t < 59.9 ],
+    "approxBeepDurationSecs" : 0.06,
+    "approxFlashDurationSecs" : 0.06,
+}
+
+
+PIN_NAMES = [ "tv:LIGHT_0", "companion:LIGHT_0", "companion:AUDIO_0" ]
+
+
+class NanosClock(object):
+    """Pretends to be a dvbcss clock object, with nanosecond ticks"""
+    @property
+    def ticks(self):
+        return int(time.time() * 1000000000)
+
+
+class DummyController(object):
+    pass
+
+
+class Test_pinNames(unittest.TestCase):
+
+    def test_roundTrip(self):
+        self.assertEqual(splitPinName(namespacedPinName("tv", "LIGHT_0")), ("tv", "LIGHT_0"))
+
+    def test_notNamespaced(self):
+        self.assertRaises(ValueError, splitPinName, "LIGHT_0")
+
+
+class Test_RigGroupMeasurer(unittest.TestCase):
+
+    def setUp(self):
+        videoStartTime = time.time()
+        self.servers = {}
+        for name, offsetSecs in [ ("tv", 0.010), ("companion", 0.030) ]:
+            emulator = ArduinoEmulator({ 0 : METADATA, 1 : METADATA }, offsetSecs=offsetSecs, videoStartTime=videoStartTime, seed=1)
+            server = EmulatorSocketServer(emulator)
+            server.start()
+            self.servers[name] = server
+        self.videoStartNanos = int(videoStartTime * 1000000000)
+
+    def tearDown(self):
+        for server in self.servers.values():
+            server.stop()
+
+    def makeMeasurer(self, **kwargs):
+        rigs = [
+            ("tv", self.servers["tv"].url, [ "LIGHT_0" ]),
+            ("companion", self.servers["companion"].url, [ "LIGHT_0", "AUDIO_0" ]),
+        ]
+        expected = dict((pin, METADATA["eventCentreTimes"]) for pin in PIN_NAMES)
+        durations = dict((pin, 0.06) for pin in PIN_NAMES)
+
+        measurer = RigGroupMeasurer("client", rigs, expected, durations, 0, NanosClock(), None, 1000, 1000, 1000, 1, syncBurstSize=3, **kwargs)
+        measurer.setSyncTimeLinelockController(DummyController())
+        # sync timeline counts milliseconds since the emulated devices started playing
+        measurer.timestampedReceivedControlTimeStamps.append( (self.videoStartNanos, (self.videoStartNanos, 0, 1.0)) )
+        return measurer
+
+    def assertOffsetsCorrect(self, pinName, diffsAndErrors):
+        offsetMillis = 10 if pinName.startswith("tv:") else 30
+        for diff, err in diffsAndErrors:
+            self.assertAlmostEqual(diff * 1000, offsetMillis, delta=2 + err * 1000)
+
+    def test_parallelCaptureAndDetection(self):
+        measurer = self.makeMeasurer()
+        try:
+            self.assertEqual(measurer.pinsToMeasure, PIN_NAMES)
+
+            start = time.time()
+            measurer.capture()
+            # both 1 second captures run at the same time
+            self.assertLess(time.time() - start, 1.8)
+
+            rigs = measurer.rigGroup.rigs
+            self.assertNotEqual(rigs[0].wcAcReqResp, rigs[1].wcAcReqResp)
+
+            measurer.detectBeepsAndFlashes(lambda wc : 0)
+            channels = measurer.getComparisonChannels()
+            self.assertEqual([ channel["pinName"] for channel in channels ], PIN_NAMES)
+
+            for channel in channels:
+                matchIndex, expectedSecs, diffsAndErrors = measurer.doComparison(channel)
+                self.assertOffsetsCorrect(channel["pinName"], diffsAndErrors)
+        finally:
+            measurer.close()
+
+    def test_captureTwice(self):
+        # each arduino forgets which pins are enabled once it has transferred the samples
+        measurer = self.makeMeasurer()
+        try:
+            for i in range(0, 2):
+                measurer.capture()
+                measurer.detectBeepsAndFlashes(lambda wc : 0)
+                for channel in measurer.getComparisonChannels():
+                    self.assertOffsetsCorrect(channel["pinName"], measurer.doComparison(channel)[2])
+        finally:
+            measurer.close()
+
+    def test_runLengthEncodedTransfer(self):
+        measurer = self.makeMeasurer(transferEncoding=arduino.ENCODING_RLE)
+        try:
+            self.assertEqual([ rig.transferEncoding for rig in measurer.rigGroup.rigs ], [ arduino.ENCODING_RLE ] * 2)
+            measurer.capture()
+            measurer.detectBeepsAndFlashes(lambda wc : 0)
+            for channel in measurer.getComparisonChannels():
+                self.assertOffsetsCorrect(channel["pinName"], measurer.doComparison(channel)[2])
+        finally:
+            measurer.close()
+
+    def test_campaign(self):
+        measurer = self.makeMeasurer()
+        try:
+            records = measurer.runCampaign(2, lambda wc : 0)
+        finally:
+            measurer.close()
+
+        self.assertEqual([ record["status"] for record in records ], [ "ok", "ok" ])
+        for record in records:
+            self.assertEqual(sorted(record["syncRttStats"].keys()), [ "companion", "tv" ])
+            self.assertEqual([ result["pinName"] for result in record["results"] ], PIN_NAMES)
+            for result in record["results"]:
+                self.assertOffsetsCorrect(result["pinName"], result["diffsAndErrors"])
+
+
+if __name__ == "__main__":
+    unittest.main()
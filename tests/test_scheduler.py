@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+Unit-tests for the measurement job scheduler, using fake backends and the simulated rig.
+"""
+
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import scheduler
+from scheduler import JobQueue, Scheduler, SimulatedRigBackend, expandMatrix, report
+
+
+def _irregularTimes(n):
+    # irregular intervals of 150 to 400 ms, so there is a unique best match
+    rand = random.Random(0)
+    t = 0.0
+    times = []
+    for i in range(0, n):
+        t += rand.uniform(0.15, 0.4)
+        times.append(round(t, 3))
+    return times
+
+METADATA = {
+    "durationSecs" : 60,
+    "eventCentreTimes" : [ t for t in _irregularTimes(300) if t < 59.9 ],
+    "approxBeepDurationSecs" : 0.06,
+    "approxFlashDurationSecs" : 0.06,
+}
+
+def _config(**kwargs):
+    config = { "tester" : "csa", "pins" : { "LIGHT_0" : "sequence.json" }, "contentId" : "urn:test", \
+               "timelineSelector" : "urn:dvb:css:timeline:pts", "unitsPerTick" : 1, "unitsPerSec" : 90000, "videoStartTicks" : 0 }
+    config.update(kwargs)
+    return config
+
+
+def _result(dubious=False):
+    channel = { "pinName" : "LIGHT_0", "error" : "poor data or no data" } if dubious else { "pinName" : "LIGHT_0", "meanOffsetSecs" : 0.0 }
+    return { "tester" : "csa", "status" : "ok", "reason" : None, "started" : 0, "finished" : 0, "channels" : [ channel ], "passed" : None }
+
+
+class FakeBackend(object):
+    """Runs each job for a fixed time, and reports dubious input for the first few attempts at some jobs"""
+
+    def __init__(self, runSecs=0.05, dubiousAttempts={}):
+        self.runSecs = runSecs
+        self.dubiousAttempts = dict(dubiousAttempts)
+        self.runs = []
+        self.lock = threading.Lock()
+
+    def run(self, rig, config):
+        time.sleep(self.runSecs)
+        with self.lock:
+            self.runs.append((rig["name"], config["contentId"], time.time()))
+            remaining = self.dubiousAttempts.get(config["contentId"], 0)
+            self.dubiousAttempts[config["contentId"]] = remaining - 1
+        return _result(dubious=remaining > 0)
+
+
+class Test_expandMatrix(unittest.TestCase):
+
+    def test_everyCombination(self):
+        configs = expandMatrix({ "base" : _config(), "matrix" : { "toleranceMillis" : [ 10, 20 ], "contentId" : [ "a", "b", "c" ] } })
+        self.assertEqual(len(configs), 6)
+        self.assertEqual([ (c["contentId"], c["toleranceMillis"]) for c in configs ], \
+                         [ ("a",10), ("a",20), ("b",10), ("b",20), ("c",10), ("c",20) ])
+        self.assertEqual(configs[0]["timelineSelector"], "urn:dvb:css:timeline:pts")
+
+    def test_emptyValues(self):
+        self.assertRaises(ValueError, expandMatrix, { "base" : _config(), "matrix" : { "contentId" : [] } })
+
+
+class Test_JobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "queue.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_invalidConfigsNotQueued(self):
+        queue = JobQueue(self.filename)
+        self.assertRaises(ValueError, queue.add, [ _config(), _config(tester="radio") ])
+        self.assertRaises(ValueError, queue.add, [ _config(tester="tv") ])
+        self.assertRaises(ValueError, queue.add, [ _config(pins={ "LIGHT_9" : "x.json" }) ])
+        self.assertRaises(ValueError, queue.add, [ _config(measureSecs=1.5) ])
+        self.assertRaises(ValueError, queue.add, [ _config(measureSecs="10") ])
+        self.assertEqual(queue.jobs(), [])
+
+    def test_rigRestrictions(self):
+        queue = JobQueue(self.filename)
+        queue.add([ _config(rigs=[ "b" ]), _config(pins={ "LIGHT_0" : "x.json", "AUDIO_1" : "y.json" }), _config() ])
+        rigA = { "name" : "a", "pins" : [ "LIGHT_0", "AUDIO_0" ] }
+        self.assertEqual(queue.take(rigA)["id"], 3)
+        self.assertIsNone(queue.take(rigA))
+        self.assertEqual(queue.take({ "name" : "b" })["id"], 1)
+
+    def test_persistedAcrossRestarts(self):
+        queue = JobQueue(self.filename)
+        queue.add([ _config(contentId="a"), _config(contentId="b") ])
+        job = queue.take({ "name" : "a" })
+        self.assertEqual(job["status"], "running")
+
+        # a restart while the job was running queues it again, once recovered
+        queue = JobQueue(self.filename)
+        self.assertEqual(queue.jobs()[0]["status"], "running")
+        self.assertEqual(queue.recover(), 1)
+        jobs = queue.jobs()
+        self.assertEqual([ j["status"] for j in jobs ], [ "queued", "queued" ])
+        self.assertEqual(jobs[0]["attempts"][0]["outcome"], scheduler.INTERRUPTED)
+        self.assertEqual(queue.add([ _config() ]), [ 3 ])
+
+    def test_addAndReportWhileRunning(self):
+        running = JobQueue(self.filename)
+        running.add([ _config(contentId="a") ])
+        job = running.take({ "name" : "a" })
+
+        # another process reports on the queue: it is not changed
+        with open(self.filename) as f:
+            before = f.read()
+        other = JobQueue(self.filename)
+        self.assertEqual([ j["status"] for j in other.jobs() ], [ "running" ])
+        self.assertEqual(report(other.jobs())["counts"], { "running" : 1 })
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), before)
+
+        # ... and adds jobs, which are kept when the scheduler next saves the queue
+        self.assertEqual(other.add([ _config(contentId="b"), _config(contentId="c") ]), [ 2, 3 ])
+        running.finishAttempt(job["id"], scheduler.OK)
+        self.assertEqual([ (j["config"]["contentId"], j["status"]) for j in running.jobs() ], \
+                         [ ("a", "done"), ("b", "queued"), ("c", "queued") ])
+        self.assertEqual(running.take({ "name" : "a" })["id"], 2)
+        self.assertEqual(other.add([ _config() ]), [ 4 ])
+
+    def test_readOnlyUntilChanged(self):
+        queue = JobQueue(self.filename)
+        self.assertEqual(queue.jobs(), [])
+        self.assertEqual(queue.recover(), 0)
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_notBefore(self):
+        queue = JobQueue(self.filename)
+        queue.add([ _config() ])
+        job = queue.take({ "name" : "a" }, now=100)
+        queue.finishAttempt(job["id"], scheduler.DUBIOUS, "x", retryAt=110, now=101)
+        self.assertIsNone(queue.take({ "name" : "a" }, now=109))
+        self.assertEqual(queue.pending({ "name" : "a" }), (1, 110))
+        self.assertEqual(queue.take({ "name" : "a" }, now=110)["id"], job["id"])
+
+
+class Test_Scheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.queue = JobQueue(os.path.join(self.dir, "queue.json"))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_spreadAcrossRigs(self):
+        self.queue.add(expandMatrix({ "base" : _config(), "matrix" : { "contentId" : [ str(i) for i in range(0, 8) ] } }))
+        backend = FakeBackend(runSecs=0.1)
+        rigs = [ { "name" : "a" }, { "name" : "b" } ]
+        Scheduler(self.queue, rigs, backend).run()
+
+        jobs = self.queue.jobs()
+        self.assertEqual([ job["status"] for job in jobs ], [ "done" ] * 8)
+        self.assertEqual(set(rig for rig, _, _ in backend.runs), set([ "a", "b" ]))
+
+        summary = report(jobs)
+        self.assertEqual(summary["counts"], { "done" : 8 })
+        self.assertEqual(sum(rig["attempts"] for rig in summary["rigs"].values()), 8)
+        for rig in summary["rigs"].values():
+            self.assertGreater(rig["utilisation"], 0.8)
+        self.assertLessEqual(summary["latencySecs"]["p50"], summary["latencySecs"]["max"])
+        self.assertTrue(all(job["latencySecs"] >= job["runSecs"] for job in summary["jobs"]))
+
+    def test_dubiousRetriedWithBackoff(self):
+        self.queue.add([ _config(contentId="flaky"), _config(contentId="broken") ])
+        backend = FakeBackend(runSecs=0.01, dubiousAttempts={ "flaky" : 1, "broken" : 10 })
+        sched = Scheduler(self.queue, [ { "name" : "a" } ], backend, maxAttempts=3, backoffSecs=0.2, backoffFactor=2)
+        sched.run()
+
+        flaky, broken = self.queue.jobs()
+        self.assertEqual(flaky["status"], "done")
+        self.assertEqual([ a["outcome"] for a in flaky["attempts"] ], [ scheduler.DUBIOUS, scheduler.OK ])
+        self.assertEqual(broken["status"], "failed")
+        self.assertEqual(len(broken["attempts"]), 3)
+        self.assertIn("LIGHT_0", broken["attempts"][-1]["reason"])
+
+        # waited at least 0.2 then 0.4 seconds between attempts
+        starts = [ a["started"] for a in broken["attempts"] ]
+        self.assertGreaterEqual(starts[1] - broken["attempts"][0]["finished"], 0.2)
+        self.assertGreaterEqual(starts[2] - broken["attempts"][1]["finished"], 0.4)
+
+    def test_backoffLimited(self):
+        sched = Scheduler(self.queue, [], None, backoffSecs=30, backoffFactor=2, maxBackoffSecs=100)
+        self.assertEqual([ sched.backoff(n) for n in range(1, 5) ], [ 30, 60, 100, 100 ])
+
+    def test_errorsNotRetried(self):
+        class FailingBackend(object):
+            def run(self, rig, config):
+                raise RuntimeError("Tester did not write a result")
+        self.queue.add([ _config() ])
+        Scheduler(self.queue, [ { "name" : "a" } ], FailingBackend()).run()
+        job = self.queue.jobs()[0]
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(job["attempts"][0]["outcome"], scheduler.ERROR)
+        self.assertEqual(job["attempts"][0]["reason"], "RuntimeError: Tester did not write a result")
+
+
+class Test_testerCommand(unittest.TestCase):
+
+    def test_tvCommand(self):
+        config = _config(tester="tv", tsUrl="ws://tv/ts", wcUrl="udp://tv:6677", toleranceMillis=20, measureSecs=5, args=[ "--saveSession", "s.zip" ])
+        rig = { "name" : "rig1", "arduinoUrl" : "/dev/ttyACM0" }
+        command = scheduler.testerCommand(config, rig, "headless.json", srcDir="src", python="python")
+        self.assertEqual(command[0:10], [ "python", os.path.join("src", "exampleTVTester.py"), "urn:test", "urn:dvb:css:timeline:pts", "1", "90000", "0", "ws://tv/ts", "udp://tv:6677", "--light0" ])
+        self.assertEqual(command[10:], [ "sequence.json", "--toleranceTest", "20", "--measureSecs", "5", "--arduino", "/dev/ttyACM0", \
+                                         "--rig", "rig1", "--headless", "headless.json", "--saveSession", "s.zip" ])
+
+
+class Test_SimulatedRigBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.metadataFilename = os.path.join(self.dir, "sequence.json")
+        with open(self.metadataFilename, "w") as f:
+            json.dump(METADATA, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_measuresOffset(self):
+        backend = SimulatedRigBackend(captureSecs=1, offsetSecs=0.020)
+        result = backend.run({ "name" : "a" }, _config(pins={ "LIGHT_0" : self.metadataFilename }, toleranceMillis=30))
+        self.assertEqual(scheduler.classifyResult(result), (scheduler.OK, None))
+        self.assertAlmostEqual(abs(result["channels"][0]["meanOffsetSecs"]), 0.020, delta=0.003)
+        self.assertTrue(result["passed"])
+
+    def test_sessionClosedWhenCaptureFails(self):
+        import arduinoSession
+        backend = SimulatedRigBackend(captureSecs=1)
+        with mock.patch("measurer.Measurer.capture", side_effect=RuntimeError("capture failed")), \
+             mock.patch.object(arduinoSession.ArduinoSession, "close", autospec=True) as close:
+            self.assertRaises(RuntimeError, backend.run, { "name" : "a" }, _config(pins={ "LIGHT_0" : self.metadataFilename }))
+        self.assertEqual(close.call_count, 1)
+
+    def test_unpluggedPinsAreRetried(self):
+        queue = JobQueue(os.path.join(self.dir, "queue.json"))
+        queue.add([ _config(pins={ "LIGHT_0" : self.metadataFilename, "AUDIO_0" : self.metadataFilename }) ])
+        backend = SimulatedRigBackend(captureSecs=1, dubiousRate=1.0)
+        Scheduler(queue, [ { "name" : "a" } ], backend, maxAttempts=2, backoffSecs=0.01).run()
+        job = queue.jobs()[0]
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual([ a["outcome"] for a in job["attempts"] ], [ scheduler.DUBIOUS, scheduler.DUBIOUS ])
+        self.assertEqual(set(channel["pinName"] for channel in job["result"]["channels"] if "error" in channel), set([ "LIGHT_0", "AUDIO_0" ]))
+        # no tolerance test was requested
+        self.assertIsNone(job["result"]["passed"])
+
+
+if __name__ == "__main__":
+    unittest.main()
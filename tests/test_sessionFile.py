@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+Unit-tests for stored measurement sessions.
+"""
+
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+import zipfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import numpy
+
+from arduinoEmulator import ArduinoEmulator, EmulatorSocketServer
+from measurer import Measurer
+from sessionFile import loadSession
+
+
+def _irregularTimes(n):
+    # irregular intervals of 150 to 400 ms, so there is a unique best match
+    rand = random.Random(0)
+    t = 0.0
+    times = []
+    for i in range(0, n):
+        t += rand.uniform(0.15, 0.4)
+        times.append(round(t, 3))
+    return times
+
+METADATA = {
+    "durationSecs" : 60,
+    "eventCentreTimes" : [ t for t in _irregularTimes(300) if t < 59.9 ],
+    "approxBeepDurationSecs" : 0.06,
+    "approxFlashDurationSecs" : 0.06,
+}
+
+
+class NanosClock(object):
+    """Pretends to be a dvbcss clock object, with nanosecond ticks"""
+    @property
+    def ticks(self):
+        return int(time.time() * 1000000000)
+
+
+class DummyController(object):
+    pass
+
+
+class Test_sessionFile(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+        emulator = ArduinoEmulator({ 0 : METADATA, 1 : METADATA }, offsetSecs=0.020, seed=1)
+        server = EmulatorSocketServer(emulator)
+        server.start()
+        try:
+            pins = [ "LIGHT_0", "AUDIO_0" ]
+            expected = dict((pin, METADATA["eventCentreTimes"]) for pin in pins)
+            durations = dict((pin, 0.06) for pin in pins)
+            cls.measurer = Measurer("client", pins, expected, durations, 0, NanosClock(), None, 1000, 1000, 1000, 1, arduinoUrl=server.url)
+            cls.measurer.setSyncTimeLinelockController(DummyController())
+            # sync timeline counts milliseconds since the emulated device started playing
+            videoStartNanos = int(emulator.videoStartTime * 1000000000)
+            cls.measurer.timestampedReceivedControlTimeStamps.append( (videoStartNanos, (videoStartNanos, 0, 1.0)) )
+            cls.measurer.capture()
+            cls.measurer.session.close()
+        finally:
+            server.stop()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir)
+
+    def test_replayMatchesLiveAnalysis(self):
+        filename = os.path.join(self.dir, "history.zip")
+        changeHistory = [ (0, 0, 0, 2000000, 0), (10, 0, 2000000, 1000000, 0) ]
+        self.measurer.saveSession(filename, changeHistory)
+
+        dispersionFunc = lambda wcTime : 1000000
+        live = self.measurer.compareCaptureData(self.measurer.takeCaptureData(), dispersionFunc)
+
+        session = loadSession(filename)
+        self.assertIsInstance(session.samples["LIGHT_0"], numpy.memmap)
+        self.assertEqual(session.samples["AUDIO_0"].shape, (2, 1000))
+        self.assertEqual(session.dispersionAt(5), 2000000)
+        self.assertEqual(session.dispersionAt(20), 1000000)
+
+        replayed = session.compare()
+        self.assertEqual(json.loads(json.dumps(live)), json.loads(json.dumps(replayed)))
+        for result in replayed:
+            for diff, err in result["diffsAndErrors"]:
+                self.assertAlmostEqual(diff * 1000, 20, delta=2 + err * 1000)
+
+    def test_replacementDispersion(self):
+        filename = os.path.join(self.dir, "constant.zip")
+        self.measurer.saveSession(filename, 500000)
+        session = loadSession(filename)
+        self.assertEqual(session.dispersionAt(12345), 500000)
+
+        errors = [ err for result in session.compare() for diff, err in result["diffsAndErrors"] ]
+        widerErrors = [ err for result in session.compare(lambda wcTime : 5000000) for diff, err in result["diffsAndErrors"] ]
+        for err, widerErr in zip(errors, widerErrors):
+            self.assertAlmostEqual(widerErr - err, 0.0045)
+
+    def test_rejectsUnknownVersion(self):
+        filename = os.path.join(self.dir, "future.zip")
+        with zipfile.ZipFile(filename, "w") as zf:
+            zf.writestr("header.json", json.dumps({ "formatVersion" : 99, "channels" : [] }))
+        self.assertRaises(ValueError, loadSession, filename)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -19,14 +19,19 @@
 Unit-tests for code that does statistics output
 """
 
+import csv
+import io
+import json
 import os
+import random
 import sys
 import unittest
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
 
 
-from stats import determineWithinTolerance, gapBetweenRanges
+import stats
+from stats import QuantileSketch, StreamingStats, computeStats, determineWithinTolerance, gapBetweenRanges, writeStatsCsv
 
 
 class Test_determineWithinTolerance(unittest.TestCase):
@@ -63,6 +68,148 @@ class Test_determineWithinTolerance(unittest.TestCase):
         self.assertEqual(exceeds, [-3,-7,0,0])
 
 
+class Test_computeStats(unittest.TestCase):
+
+    diffsAndErrors = [ (0.010, 0.002), (0.012, 0.002), (0.020, 0.001), (-0.004, 0.003), (0.012, 0.002) ]
+
+    def test_summary(self):
+        result = computeStats(1, [ 1.0, 2.0, 3.0 ], self.diffsAndErrors)
+        self.assertEqual(result["firstExpectedSecs"], 2.0)
+        self.assertEqual(result["count"], 5)
+        self.assertAlmostEqual(result["meanOffsetSecs"], 0.01)
+        self.assertAlmostEqual(result["stdDevSecs"], (0.000304/5) ** 0.5)
+        self.assertAlmostEqual(result["minOffsetSecs"], -0.004)
+        self.assertAlmostEqual(result["maxOffsetSecs"], 0.020)
+        self.assertAlmostEqual(result["offsetPercentilesSecs"]["50"], 0.012)
+        self.assertAlmostEqual(result["offsetPercentilesSecs"]["25"], 0.010)
+        self.assertAlmostEqual(result["offsetPercentilesSecs"]["95"], 0.0184)
+        self.assertAlmostEqual(result["meanErrorSecs"], 0.002)
+        self.assertAlmostEqual(result["minErrorSecs"], 0.001)
+        self.assertAlmostEqual(result["maxErrorSecs"], 0.003)
+        self.assertEqual(result["passed"], None)
+        self.assertEqual(result["exceeds"], None)
+        # must be serialisable
+        json.dumps(result)
+
+    def test_tolerance(self):
+        result = computeStats(0, [ 1.0 ], self.diffsAndErrors, toleranceSecs=0.015)
+        self.assertFalse(result["passed"])
+        self.assertEqual(result["numExceeded"], 1)
+        self.assertEqual([ round(e, 6) for e in result["exceeds"] ], [ 0, 0, 0.004, 0, 0 ])
+
+    def test_withoutNumpy(self):
+        withNumpy = computeStats(0, [ 1.0 ], self.diffsAndErrors, toleranceSecs=0.015)
+        savedNumpy = stats.numpy
+        stats.numpy = None
+        try:
+            withoutNumpy = computeStats(0, [ 1.0 ], self.diffsAndErrors, toleranceSecs=0.015)
+        finally:
+            stats.numpy = savedNumpy
+        self.assertEqual(sorted(withNumpy.keys()), sorted(withoutNumpy.keys()))
+        for key in [ "meanOffsetSecs", "stdDevSecs", "minOffsetSecs", "maxOffsetSecs", "meanErrorSecs" ]:
+            self.assertAlmostEqual(withNumpy[key], withoutNumpy[key])
+        for p in withNumpy["offsetPercentilesSecs"]:
+            self.assertAlmostEqual(withNumpy["offsetPercentilesSecs"][p], withoutNumpy["offsetPercentilesSecs"][p])
+        self.assertEqual(withNumpy["passed"], withoutNumpy["passed"])
+        self.assertEqual(withNumpy["numExceeded"], withoutNumpy["numExceeded"])
+
+    def test_noObservations(self):
+        self.assertRaises(ValueError, computeStats, 0, [ 1.0 ], [])
+
+    def test_writeCsv(self):
+        result = computeStats(0, [ 1.0 ], self.diffsAndErrors, toleranceSecs=0.015)
+        result["pinName"] = "LIGHT_0"
+        f = io.StringIO(newline="")
+        writeStatsCsv(f, [ result ])
+        rows = list(csv.DictReader(io.StringIO(f.getvalue())))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["pinName"], "LIGHT_0")
+        self.assertEqual(rows[0]["numExceeded"], "1")
+        self.assertAlmostEqual(float(rows[0]["offsetP50Secs"]), 0.012)
+        self.assertNotIn("exceeds", rows[0])
+
+
+class Test_QuantileSketch(unittest.TestCase):
+
+    def test_quantilesWithinResolution(self):
+        sketch = QuantileSketch(maxBins=1000, resolutionSecs=0.001)
+        sketch.addAll([ i / 1000.0 for i in range(0, 100) ])
+        self.assertEqual(sketch.count, 100)
+        self.assertAlmostEqual(sketch.quantile(0.5), 0.0495, delta=0.001)
+        self.assertAlmostEqual(sketch.quantile(1.0), 0.0995, delta=0.001)
+
+    def test_boundedBins(self):
+        sketch = QuantileSketch(maxBins=16, resolutionSecs=0.001)
+        for i in range(0, 1000):
+            sketch.add(i / 100.0)
+        self.assertLessEqual(len(sketch.bins), 16)
+        self.assertEqual(sketch.count, 1000)
+        self.assertAlmostEqual(sketch.quantile(0.5), 5.0, delta=sketch.binWidth)
+
+    def test_mergeDifferentLevels(self):
+        a = QuantileSketch(maxBins=8, resolutionSecs=0.001)
+        b = QuantileSketch(maxBins=8, resolutionSecs=0.001)
+        a.addAll([ i / 10.0 for i in range(0, 100) ])
+        b.addAll([ 0.0005, 0.0015 ])
+        a.merge(b)
+        self.assertEqual(a.count, 102)
+        self.assertLessEqual(len(a.bins), 8)
+        self.assertEqual(QuantileSketch.fromDict(a.toDict()).bins, a.bins)
+        self.assertRaises(ValueError, a.merge, QuantileSketch(resolutionSecs=0.01))
+
+
+class Test_StreamingStats(unittest.TestCase):
+
+    def setUp(self):
+        rand = random.Random(1)
+        self.diffsAndErrors = [ (rand.gauss(0.01, 0.003), rand.uniform(0.0005, 0.002)) for i in range(0, 2000) ]
+
+    def test_matchesComputeStats(self):
+        acc = StreamingStats(toleranceSecs=0.015)
+        for i in range(0, len(self.diffsAndErrors), 40):
+            acc.addComparison((0, [], self.diffsAndErrors[i:i+40]))
+        snapshot = acc.snapshot()
+        expected = computeStats(0, [ 0.0 ], self.diffsAndErrors, toleranceSecs=0.015)
+
+        self.assertEqual(snapshot["captures"], 50)
+        for key in [ "count", "numExceeded" ]:
+            self.assertEqual(snapshot[key], expected[key])
+        for key in [ "meanOffsetSecs", "stdDevSecs", "minOffsetSecs", "maxOffsetSecs", "meanErrorSecs", "minErrorSecs", "maxErrorSecs" ]:
+            self.assertAlmostEqual(snapshot[key], expected[key])
+        for p in expected["offsetPercentilesSecs"]:
+            self.assertAlmostEqual(snapshot["offsetPercentilesSecs"][p], expected["offsetPercentilesSecs"][p], delta=0.0002)
+        self.assertAlmostEqual(abs(snapshot["maxExceededBySecs"]), max(abs(e) for e in expected["exceeds"]))
+
+    def test_mergeAndSerialise(self):
+        whole = StreamingStats(toleranceSecs=0.015)
+        whole.addDiffsAndErrors(self.diffsAndErrors)
+
+        first, second = StreamingStats(toleranceSecs=0.015), StreamingStats(toleranceSecs=0.015)
+        first.addDiffsAndErrors(self.diffsAndErrors[:700])
+        for diff, err in self.diffsAndErrors[700:]:
+            second.add(diff, err)
+        # as if passed back from another process
+        first.merge(StreamingStats.fromDict(json.loads(json.dumps(second.toDict()))))
+
+        merged, expected = first.snapshot(), whole.snapshot()
+        for key in expected:
+            if key == "offsetPercentilesSecs":
+                self.assertEqual(merged[key], expected[key])
+            elif isinstance(expected[key], float):
+                self.assertAlmostEqual(merged[key], expected[key])
+            else:
+                self.assertEqual(merged[key], expected[key])
+
+        self.assertRaises(ValueError, first.merge, StreamingStats(toleranceSecs=0.01))
+
+    def test_empty(self):
+        snapshot = StreamingStats().snapshot()
+        self.assertEqual(snapshot["count"], 0)
+        self.assertEqual(snapshot["meanOffsetSecs"], None)
+        self.assertEqual(snapshot["offsetPercentilesSecs"]["50"], None)
+        self.assertEqual(snapshot["numExceeded"], None)
+
+
 class Test_gapBetweenRanges(unittest.TestCase):
 
     def test_gapBetweenRanges(self):
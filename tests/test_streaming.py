@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+Unit-tests for streaming captures, including against the emulated Arduino.
+"""
+
+import os
+import struct
+import sys
+import time
+import unittest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import arduino
+from arduinoEmulator import ArduinoEmulator, EmulatorSocketServer
+from measurer import PIN_MAP
+from streaming import ChannelSegmentAccumulator, streamCapture
+
+
+METADATA = {
+    "durationSecs" : 10,
+    "eventCentreTimes" : [ 0.25 * i for i in range(1, 40) ],
+    "approxBeepDurationSecs" : 0.06,
+    "approxFlashDurationSecs" : 0.06,
+}
+
+
+class NanosClock(object):
+    """Pretends to be a dvbcss clock object, with nanosecond ticks"""
+    @property
+    def ticks(self):
+        return int(time.time() * 1000000000)
+
+
+class Mock_StreamingSerial(object):
+    """Replays a scripted stream of bytes from an Arduino, regardless of what is written"""
+
+    def __init__(self, data):
+        self.data = data
+        self.written = b""
+
+    def write(self, data):
+        self.written += data
+
+    def read(self, n):
+        data, self.data = self.data[:n], self.data[n:]
+        return data
+
+
+def _record(seq, micros, samples):
+    return struct.pack(">II", seq, micros) + bytes(samples)
+
+
+class Test_streamCapture(unittest.TestCase):
+
+    def test_gapDetection(self):
+        # 1 pin, 2 millisecond blocks
+        data = struct.pack(">I", 500)              # reply to pin enable
+        data += struct.pack(">III", 900, 1, 2)     # reply to start streaming command
+        data += _record(0, 1000, [1, 0, 2, 0])
+        data += _record(1, 3000, [3, 0, 4, 0])
+        data += _record(3, 7000, [5, 0, 6, 0])     # seq 2 lost
+        data += _record(4, 12000, [7, 0, 8, 0])    # started 3 ms late
+        data += struct.pack(">III", arduino.STREAM_END, 14000, 5)
+        data += struct.pack(">I", 14100)           # reply to time only command
+
+        f = Mock_StreamingSerial(data)
+        consumer = ChannelSegmentAccumulator()
+        summary = streamCapture(f, NanosClock(), ["LIGHT_0"], PIN_MAP, consumer, nBlocks=5)
+
+        self.assertEqual(f.written, b"0C\x00\x05T")
+        self.assertEqual(summary["nBlocks"], 4)
+        self.assertEqual(summary["gaps"], [
+            { "afterSeq" : 1, "missingBlocks" : 1, "missingNanos" : 2000000 },
+            { "afterSeq" : 3, "missingBlocks" : 0, "missingNanos" : 3000000 },
+        ])
+        self.assertEqual((summary["startNanos"], summary["finishNanos"]), (1000000, 14000000))
+
+        self.assertEqual([ (s["startNanos"], s["finishNanos"]) for s in consumer.segments ],
+                         [ (1000000, 5000000), (7000000, 9000000), (12000000, 14000000) ])
+        self.assertEqual(consumer.segments[0]["channels"][0]["max"], [1, 2, 3, 4])
+
+    def test_arduinoClockWraps(self):
+        data = struct.pack(">I", 0xfffffe00)
+        data += struct.pack(">III", 0xffffff00, 1, 2)
+        data += _record(0, 0xfffff000 & 0xffffffff, [1, 0, 2, 0])
+        data += _record(1, (0xfffff000 + 2000) & 0xffffffff, [3, 0, 4, 0])
+        data += struct.pack(">III", arduino.STREAM_END, (0xfffff000 + 4000) & 0xffffffff, 2)
+        data += struct.pack(">I", (0xfffff000 + 4100) & 0xffffffff)
+
+        summary = streamCapture(Mock_StreamingSerial(data), NanosClock(), ["LIGHT_0"], PIN_MAP, ChannelSegmentAccumulator(), nBlocks=2)
+        self.assertEqual(summary["gaps"], [])
+        self.assertEqual(summary["finishNanos"] - summary["startNanos"], 4000000)
+        self.assertGreater(summary["timeDataPost"][2], summary["finishNanos"])
+
+
+class Test_streamingEmulator(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EmulatorSocketServer(ArduinoEmulator({ 0 : METADATA, 1 : METADATA }, seed=1))
+        self.server.start()
+        self.f = arduino.connect(self.server.url)
+        self.clock = NanosClock()
+
+    def tearDown(self):
+        self.f.close()
+        self.server.stop()
+
+    def test_fixedNumberOfBlocks(self):
+        consumer = ChannelSegmentAccumulator()
+        summary = streamCapture(self.f, self.clock, ["LIGHT_0", "AUDIO_0"], PIN_MAP, consumer, nBlocks=5)
+        self.assertEqual(summary["nBlocks"], 5)
+        self.assertEqual(summary["gaps"], [])
+        self.assertEqual(len(consumer.segments), 1)
+        self.assertEqual(len(consumer.segments[0]["channels"][0]["max"]), 500)
+        self.assertEqual(len(consumer.segments[0]["channels"][1]["min"]), 500)
+        self.assertAlmostEqual(summary["finishNanos"] - summary["startNanos"], 500000000, delta=20000000)
+        # flashes seen by the light sensor
+        self.assertEqual(max(consumer.segments[0]["channels"][0]["max"]), 220)
+
+    def test_stopOnLastBlock(self):
+        # asking to stop on the last of a fixed number of blocks must not leave a stray reply to be
+        # mistaken for the reply to the timing command afterwards
+        class StopOnLastBlock(ChannelSegmentAccumulator):
+            def block(self, seq, startNanos, channels):
+                super(StopOnLastBlock, self).block(seq, startNanos, channels)
+                return seq == 2
+
+        summary = streamCapture(self.f, self.clock, ["LIGHT_0"], PIN_MAP, StopOnLastBlock(), nBlocks=3)
+        self.assertEqual(summary["nBlocks"], 3)
+        # the post-capture round trip brackets a time just after the arduino finished
+        localBefore, arduinoNanos, _, localAfter = summary["timeDataPost"]
+        self.assertGreaterEqual(arduinoNanos, summary["finishNanos"])
+        self.assertLess(arduinoNanos - summary["finishNanos"], 100000000)
+        self.assertLess(localAfter - localBefore, 100000000)
+
+        # nothing is left unread, so the next command gets its own reply
+        time.sleep(0.1)
+        nActivePorts, nMilliBlocks, timeData = arduino.prepareToCapture(self.f, self.clock, 1)
+        self.assertEqual((nActivePorts, nMilliBlocks), (0, 0))
+
+    def test_stopEarlyDuringFixedNumberOfBlocks(self):
+        class StopAfterFirst(ChannelSegmentAccumulator):
+            def block(self, seq, startNanos, channels):
+                super(StopAfterFirst, self).block(seq, startNanos, channels)
+                return True
+
+        consumer = StopAfterFirst()
+        summary = streamCapture(self.f, self.clock, ["LIGHT_0"], PIN_MAP, consumer, nBlocks=3)
+        self.assertEqual(summary["nBlocks"], 1)
+        self.assertEqual(len(consumer.segments[0]["channels"][0]["max"]), 100)
+        nActivePorts, nMilliBlocks, timeData = arduino.prepareToCapture(self.f, self.clock, 1)
+        self.assertEqual((nActivePorts, nMilliBlocks), (0, 0))
+
+    def test_stopAfterDuration(self):
+        consumer = ChannelSegmentAccumulator()
+        summary = streamCapture(self.f, self.clock, ["LIGHT_0"], PIN_MAP, consumer, durationSecs=0.3)
+        self.assertGreaterEqual(summary["nBlocks"], 3)
+        self.assertLessEqual(summary["nBlocks"], 5)
+
+        # pins are cleared afterwards, and the arduino responds to commands again
+        nActivePorts, nMilliBlocks, timeData = arduino.prepareToCapture(self.f, self.clock, 1)
+        self.assertEqual(nActivePorts, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()